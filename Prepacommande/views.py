@@ -11,17 +11,24 @@ from django.db import transaction
 from django.core.paginator import Paginator
 
 import json
-from parametre.models import Operateur
+from parametre.models import Operateur, Ville
+from commande.exports import (
+    Feuille, colonnes_commandes_consolidees, colonnes_commandes_detaillees, feuille_resume, preparer_commandes,
+    reponse_csv, reponse_excel,
+)
 from commande.models import Commande, EtatCommande, EnumEtatCmd, Operation, Panier
+from commande.tarification import tarifer_panier
+from commande.transitions import changer_etat_commande
 from django.urls import reverse
 
 import barcode
 from barcode.writer import ImageWriter
 from io import BytesIO
 import base64
-import csv
 
 from article.models import Article, MouvementStock
+from article.mouvements import creer_mouvements_stock_bulk
+from article.disponibilite import matrices_disponibilite
 from commande.models import Envoi
 from .forms import ArticleForm, AjusterStockForm
 from .utils import creer_mouvement_stock
@@ -1186,25 +1193,13 @@ def traiter_commande_retournee_api(request, commande_id):
                 # Ne pas changer l'état de la commande, elle reste "Retournée"
                 # Seulement réincrémenter le stock si les produits sont en bon état
                 if etat_stock == "bon":
-                    for panier in commande.paniers.all():
-                        article = panier.article
-                        quantite = panier.quantite
-                        
-                        # Réincrémenter le stock disponible
-                        article.qte_disponible += quantite
-                        article.save()
-                        
-                        # Créer un mouvement de stock pour tracer
-                        from article.models import MouvementStock
-
-                        MouvementStock.objects.create(
-                            article=article,
-                            quantite=quantite,
-                            type_mouvement="entree",
-                            commentaire=f"Réincrémentation - Commande retournée {commande.id_yz} - Produits en bon état - {commentaire}",
-                            operateur=operateur_profile,
-                            qte_apres_mouvement=article.qte_disponible,
-                        )
+                    # Réincrémenter le stock de toutes les lignes en un lot (mouvements tracés)
+                    creer_mouvements_stock_bulk(
+                        commande.paniers.all(),
+                        "entree",
+                        operateur=operateur_profile,
+                        commentaire=f"Réincrémentation - Commande retournée {commande.id_yz} - Produits en bon état - {commentaire}",
+                    )
                 
                 message = f"Stock réincrémenté: {'Oui' if etat_stock == 'bon' else 'Non'}. Commande reste en état 'Retournée'."
                 
@@ -1575,7 +1570,7 @@ def detail_prepa(request, pk):
                 etat_collectee, created = EnumEtatCmd.objects.get_or_create(
                     libelle="Collectée"
                 )
-                EtatCommande.objects.create(
+                changer_etat_commande(
                     commande=commande,
                     enum_etat=etat_collectee,
                     operateur=operateur_profile,
@@ -1615,7 +1610,7 @@ def detail_prepa(request, pk):
                 etat_emballee, created = EnumEtatCmd.objects.get_or_create(
                     libelle="Emballée"
                 )
-                EtatCommande.objects.create(
+                changer_etat_commande(
                     commande=commande,
                     enum_etat=etat_emballee,
                     operateur=operateur_profile,
@@ -1672,7 +1667,7 @@ def detail_prepa(request, pk):
                     defaults={"ordre": 25, "couleur": "#D97706"},
                 )
                 
-                EtatCommande.objects.create(
+                changer_etat_commande(
                     commande=commande,
                     enum_etat=etat_retour_enum,
                     operateur=operateur_confirmation_origine,  # Affectation directe
@@ -3128,8 +3123,8 @@ def api_articles_disponibles_prepa(request):
     
     # Appliquer les filtres selon le type
     if filter_type == "disponible":
-        # Filtrer les articles qui ont au moins une variante avec stock > 0
-        articles = articles.filter(variantes__qte_disponible__gt=0, variantes__actif=True).distinct()
+        # Articles dont au moins une variante active est en stock
+        articles = articles.filter(stock_disponible__gt=0)
     elif filter_type == "upsell":
         articles = articles.filter(isUpsell=True)
     elif filter_type == "liquidation":
@@ -3142,33 +3137,29 @@ def api_articles_disponibles_prepa(request):
         articles = articles.filter(
             Q(nom__icontains=search_query)
             | Q(reference__icontains=search_query)
-            | Q(couleur__icontains=search_query)
-            | Q(pointure__icontains=search_query)
+            | Q(couleur_principale__icontains=search_query)
+            | Q(pointure_principale__icontains=search_query)
             | Q(description__icontains=search_query)
         )
     
-    # Compter les articles par type pour les statistiques
-    stats = {
-        "tous": Article.objects.filter(actif=True).count(),
-        "disponible": Article.objects.filter(actif=True, variantes__qte_disponible__gt=0, variantes__actif=True).distinct().count(),
-        "upsell": Article.objects.filter(actif=True, isUpsell=True).count(),
-        "liquidation": Article.objects.filter(actif=True, phase="LIQUIDATION").count(),
-        "test": Article.objects.filter(actif=True, phase="EN_TEST").count(),
-    }
-    
-    # Compter les articles en promotion en utilisant une approche différente
-    # Chercher les articles qui ont un prix actuel différent du prix unitaire
-    articles_promo_count = Article.objects.filter(
-        actif=True, prix_actuel__lt=F("prix_unitaire")
-    ).count()
-    stats["promo"] = articles_promo_count
+    # Compter les articles par type pour les statistiques (une seule agrégation)
+    # Articles en promotion : prix actuel inférieur au prix unitaire
+    stats = Article.objects.filter(actif=True).aggregate(
+        tous=Count("id"),
+        disponible=Count("id", filter=Q(stock_disponible__gt=0)),
+        upsell=Count("id", filter=Q(isUpsell=True)),
+        liquidation=Count("id", filter=Q(phase="LIQUIDATION")),
+        test=Count("id", filter=Q(phase="EN_TEST")),
+        promo=Count("id", filter=Q(prix_actuel__lt=F("prix_unitaire"))),
+    )
     
     # Filtrer les articles en promotion si nécessaire
     if filter_type == "promo":
         articles = articles.filter(prix_actuel__lt=F("prix_unitaire"))
     
-    # Limiter les résultats
-    articles = articles[:50]
+    # Limiter les résultats ; variantes actives lues dans les matrices de disponibilité en cache
+    articles = list(articles[:50])
+    matrices = matrices_disponibilite([article.id for article in articles])
     
     articles_data = []
     for article in articles:
@@ -3203,17 +3194,17 @@ def api_articles_disponibles_prepa(request):
 
         # Récupérer les variantes de l'article
         variantes_data = []
-        for variante in article.variantes.filter(actif=True):
+        for variante in matrices[article.id].cellules():
             variantes_data.append({
                 "id": variante.id,
-                "couleur": str(variante.couleur) if variante.couleur else "",
-                "pointure": str(variante.pointure) if variante.pointure else "",
-                "prix_actuel": float(variante.prix_actuel or variante.prix_unitaire),
-                "prix": float(variante.prix_unitaire),
+                "couleur": variante.couleur or "",
+                "pointure": variante.pointure or "",
+                "prix_actuel": prix_affichage,
+                "prix": prix_original,
                 "qte_disponible": variante.qte_disponible,
                 "stock": variante.qte_disponible,
                 "reference_variante": variante.reference_variante or "",
-                "actif": variante.actif,
+                "actif": True,
             })
 
         articles_data.append(
@@ -5462,86 +5453,19 @@ def export_commandes_consolidees_csv(request):
     ville_name = request.GET.get("ville")
     
     # Construire la requête de base - UNIQUEMENT les commandes PRÉPARÉES
-    commandes_query = (
-        Commande.objects.filter(
-            etats__enum_etat__libelle="Préparée", etats__date_fin__isnull=True
-        )
-        .select_related("client", "ville", "ville__region")
-        .prefetch_related("paniers__article")
-        .distinct()
-    )
-
-    commandes = commandes_query.order_by("-date_cmd")
-    
-    # Créer la réponse CSV
-    response = HttpResponse(content_type="text/csv; charset=utf-8")
-    filename = f"commandes_consolidees_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    response["Content-Disposition"] = f'attachment; filename="{filename}"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write("\ufeff")
-    
-    writer = csv.writer(response, delimiter=";")
-    
-    # En-têtes
-    headers = [
-        "N° Commande",
-        "Client",
-        "Téléphone",
-        "Ville",
-        "Région",
-        "Articles et Quantités",
-        "Prix Total (DH)",
-        "Adresse",
-        "État",
-    ]
-    writer.writerow(headers)
+    commandes_query = Commande.objects.filter(
+        etats__enum_etat__libelle="Préparée", etats__date_fin__isnull=True
+    ).distinct()
     
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = (
-            ", ".join(articles_list) if articles_list else "Aucun article"
-        )
-        
-        # État actuel de la commande
-        etat_actuel = (
-            commande.etat_actuel.enum_etat.libelle
-            if commande.etat_actuel
-            else "Non défini"
-        )
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}"
-            if commande.client
-            else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region
-            if commande.ville and commande.ville.region
-            else "N/A",
-            articles_consolides,
-            f"{commande.total_cmd:.2f}" if commande.total_cmd else "0.00",
-            commande.adresse or "N/A",
-            etat_actuel,
-        ]
-        writer.writerow(row)
+    # Appliquer les filtres
+    if region_name:
+        commandes_query = commandes_query.filter(ville__region__nom_region=region_name)
+    if ville_name:
+        commandes_query = commandes_query.filter(ville__nom=ville_name)
     
-    return response
+    commandes = preparer_commandes(commandes_query).order_by("-date_cmd")
+    filename = f"commandes_consolidees_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return reponse_csv(Feuille("Commandes Consolidées", commandes, colonnes_commandes_consolidees()), filename)
 
 
 @login_required
@@ -5561,14 +5485,9 @@ def export_commandes_consolidees_excel(request):
     ville_name = request.GET.get("ville")
     
     # Construire la requête de base - UNIQUEMENT les commandes PRÉPARÉES
-    commandes_query = (
-        Commande.objects.filter(
-            etats__enum_etat__libelle="Préparée", etats__date_fin__isnull=True
-        )
-        .select_related("client", "ville", "ville__region")
-        .prefetch_related("paniers__article")
-        .distinct()
-    )
+    commandes_query = Commande.objects.filter(
+        etats__enum_etat__libelle="Préparée", etats__date_fin__isnull=True
+    ).distinct()
     
     # Appliquer les filtres
     if region_name:
@@ -5576,116 +5495,9 @@ def export_commandes_consolidees_excel(request):
     if ville_name:
         commandes_query = commandes_query.filter(ville__nom=ville_name)
     
-    commandes = commandes_query.order_by("-date_cmd")
-    
-    # Créer le fichier Excel
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
-    from openpyxl.utils import get_column_letter
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Commandes Consolidées"
-    
-    # En-têtes
-    headers = [
-        "N° Commande",
-        "Client",
-        "Téléphone",
-        "Ville",
-        "Région",
-        "Articles et Quantités",
-        "Prix Total (DH)",
-        "Adresse",
-        "État",
-    ]
-    
-    # Ajouter les en-têtes
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(
-            start_color="366092", end_color="366092", fill_type="solid"
-        )
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-    
-    # Traiter chaque commande
-    for row, commande in enumerate(commandes, 2):
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = (
-            ", ".join(articles_list) if articles_list else "Aucun article"
-        )
-        
-        # État actuel de la commande
-        etat_actuel = (
-            commande.etat_actuel.enum_etat.libelle
-            if commande.etat_actuel
-            else "Non défini"
-        )
-        
-        # Ajouter les données
-        ws.cell(row=row, column=1, value=commande.id_yz or commande.num_cmd)
-        ws.cell(
-            row=row,
-            column=2,
-            value=f"{commande.client.prenom} {commande.client.nom}"
-            if commande.client
-            else "N/A",
-        )
-        ws.cell(
-            row=row,
-            column=3,
-            value=commande.client.numero_tel if commande.client else "N/A",
-        )
-        ws.cell(
-            row=row, column=4, value=commande.ville.nom if commande.ville else "N/A"
-        )
-        ws.cell(
-            row=row,
-            column=5,
-            value=commande.ville.region.nom_region
-            if commande.ville and commande.ville.region
-            else "N/A",
-        )
-        ws.cell(row=row, column=6, value=articles_consolides)
-        ws.cell(
-            row=row,
-            column=7,
-            value=float(commande.total_cmd) if commande.total_cmd else 0.00,
-        )
-        ws.cell(row=row, column=8, value=commande.adresse or "N/A")
-        ws.cell(row=row, column=9, value=etat_actuel)
-        
-        # Ajuster la hauteur de la ligne pour les articles
-        if len(articles_consolides) > 100:
-            ws.row_dimensions[row].height = 30
-    
-    # Ajuster la largeur des colonnes
-    column_widths = [15, 25, 15, 15, 15, 50, 15, 40, 15]
-    for col, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(col)].width = width
-    
-    # Créer la réponse
-    response = HttpResponse(
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    commandes = preparer_commandes(commandes_query).order_by("-date_cmd")
     filename = f"commandes_consolidees_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response["Content-Disposition"] = f'attachment; filename="{filename}"'
-    
-    wb.save(response)
-    return response
+    return reponse_excel([Feuille("Commandes Consolidées", commandes, colonnes_commandes_consolidees())], filename)
 
 
 @login_required
@@ -5701,93 +5513,23 @@ def export_region_consolidee_csv(request, region_name):
         return JsonResponse({"error": "Accès non autorisé"}, status=403)
     
     # Récupérer les commandes PRÉPARÉES de la région
-    commandes = (
-        Commande.objects.filter(
-            etats__enum_etat__libelle="Préparée",
+    commandes = Commande.objects.filter(
+        etats__enum_etat__libelle="Préparée",
         etats__date_fin__isnull=True,
-            ville__region__nom_region=region_name,
-        )
-        .select_related("client", "ville", "ville__region")
-        .prefetch_related("paniers__article")
-        .distinct()
-        .order_by("-date_cmd")
-    )
+        ville__region__nom_region=region_name,
+    ).distinct()
+    commandes = preparer_commandes(commandes).order_by("-date_cmd")
     
-    # Créer la réponse CSV
-    response = HttpResponse(content_type="text/csv; charset=utf-8")
     filename = f"region_{region_name.lower().replace(' ', '_')}_consolidee_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    response["Content-Disposition"] = f'attachment; filename="{filename}"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write("\ufeff")
-    
-    writer = csv.writer(response, delimiter=";")
-    
-    # En-têtes
-    headers = [
-        "N° Commande",
-        "Client",
-        "Téléphone",
-        "Ville",
-        "Région",
-        "Articles et Quantités",
-        "Prix Total (DH)",
-        "Adresse",
-        "État",
-    ]
-    writer.writerow(headers)
-    
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = (
-            ", ".join(articles_list) if articles_list else "Aucun article"
-        )
-        
-        # État actuel de la commande
-        etat_actuel = (
-            commande.etat_actuel.enum_etat.libelle
-            if commande.etat_actuel
-            else "Non défini"
-        )
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}"
-            if commande.client
-            else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region
-            if commande.ville and commande.ville.region
-            else "N/A",
-            articles_consolides,
-            f"{commande.total_cmd:.2f}" if commande.total_cmd else "0.00",
-            commande.adresse or "N/A",
-            etat_actuel,
-        ]
-        writer.writerow(row)
-    
-    return response
+    return reponse_csv(
+        Feuille(f"Région {region_name}", commandes, colonnes_commandes_consolidees()), filename
+    )
 
 
 @login_required
 def export_region_consolidee_excel(request, region_name):
     """
-    Export Excel consolidé pour une région spécifique
+    Export Excel consolidé pour une région spécifique, avec une feuille de résumé
     """
     try:
         operateur = Operateur.objects.get(
@@ -5797,148 +5539,34 @@ def export_region_consolidee_excel(request, region_name):
         return JsonResponse({"error": "Accès non autorisé"}, status=403)
     
     # Récupérer les commandes PRÉPARÉES de la région
-    commandes = (
-        Commande.objects.filter(
-            etats__enum_etat__libelle="Préparée",
+    commandes = Commande.objects.filter(
+        etats__enum_etat__libelle="Préparée",
         etats__date_fin__isnull=True,
-            ville__region__nom_region=region_name,
-        )
-        .select_related("client", "ville", "ville__region")
-        .prefetch_related("paniers__article")
-        .distinct()
-        .order_by("-date_cmd")
-    )
-    
-    # Créer le fichier Excel
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
-    from openpyxl.utils import get_column_letter
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Région {region_name}"
-    
-    # En-têtes
-    headers = [
-        "N° Commande",
-        "Client",
-        "Téléphone",
-        "Ville",
-        "Région",
-        "Articles et Quantités",
-        "Prix Total (DH)",
-        "Adresse",
-        "État",
-    ]
+        ville__region__nom_region=region_name,
+    ).distinct()
     
-    # Ajouter les en-têtes
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(
-            start_color="366092", end_color="366092", fill_type="solid"
-        )
-        cell.alignment = Alignment(horizontal="center", vertical="center")
+    # Statistiques de la région, agrégées en base
+    resume = Commande.objects.filter(pk__in=commandes.values("pk")).aggregate(
+        nombre=Count("pk"), montant=Sum("total_cmd")
+    )
     
-    # Traiter chaque commande
-    for row, commande in enumerate(commandes, 2):
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = (
-            ", ".join(articles_list) if articles_list else "Aucun article"
-        )
-        
-        # État actuel de la commande
-        etat_actuel = (
-            commande.etat_actuel.enum_etat.libelle
-            if commande.etat_actuel
-            else "Non défini"
-        )
-        
-        # Ajouter les données
-        ws.cell(row=row, column=1, value=commande.id_yz or commande.num_cmd)
-        ws.cell(
-            row=row,
-            column=2,
-            value=f"{commande.client.prenom} {commande.client.nom}"
-            if commande.client
-            else "N/A",
-        )
-        ws.cell(
-            row=row,
-            column=3,
-            value=commande.client.numero_tel if commande.client else "N/A",
-        )
-        ws.cell(
-            row=row, column=4, value=commande.ville.nom if commande.ville else "N/A"
-        )
-        ws.cell(
-            row=row,
-            column=5,
-            value=commande.ville.region.nom_region
-            if commande.ville and commande.ville.region
-            else "N/A",
-        )
-        ws.cell(row=row, column=6, value=articles_consolides)
-        ws.cell(
-            row=row,
-            column=7,
-            value=float(commande.total_cmd) if commande.total_cmd else 0.00,
-        )
-        ws.cell(row=row, column=8, value=commande.adresse or "N/A")
-        ws.cell(row=row, column=9, value=etat_actuel)
-        
-        # Ajuster la hauteur de la ligne pour les articles
-        if len(articles_consolides) > 100:
-            ws.row_dimensions[row].height = 30
-    
-    # Ajuster la largeur des colonnes
-    column_widths = [15, 25, 15, 15, 15, 50, 15, 40, 15]
-    for col, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(col)].width = width
-    
-    # Ajouter une feuille de résumé
-    ws_resume = wb.create_sheet("Résumé")
-    
-    # Statistiques de la région
-    total_commandes = commandes.count()
-    total_montant = sum(float(cmd.total_cmd) for cmd in commandes if cmd.total_cmd)
-    
-    resume_data = [
-        ["Région", region_name],
-        ["Nombre de commandes", total_commandes],
-        ["Montant total", f"{total_montant:.2f} DH"],
-        ["Date d'export", timezone.now().strftime("%d/%m/%Y %H:%M")],
+    feuilles = [
+        Feuille(
+            f"Région {region_name}",
+            preparer_commandes(commandes).order_by("-date_cmd"),
+            colonnes_commandes_consolidees(),
+        ),
+        feuille_resume(
+            [
+                ("Région", region_name),
+                ("Nombre de commandes", resume["nombre"]),
+                ("Montant total", f"{resume['montant'] or 0:.2f} DH"),
+                ("Date d'export", timezone.now().strftime("%d/%m/%Y %H:%M")),
+            ]
+        ),
     ]
-    
-    for row, (label, value) in enumerate(resume_data, 1):
-        ws_resume.cell(row=row, column=1, value=label).font = Font(bold=True)
-        ws_resume.cell(row=row, column=2, value=value)
-    
-    # Ajuster la largeur des colonnes du résumé
-    ws_resume.column_dimensions["A"].width = 25
-    ws_resume.column_dimensions["B"].width = 20
-    
-    # Créer la réponse
-    response = HttpResponse(
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
     filename = f"region_{region_name.lower().replace(' ', '_')}_consolidee_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response["Content-Disposition"] = f'attachment; filename="{filename}"'
-    
-    wb.save(response)
-    return response
+    return reponse_excel(feuilles, filename)
 
 
 @login_required
@@ -5960,89 +5588,17 @@ def export_ville_consolidee_csv(request, ville_id):
         return JsonResponse({"error": "Ville non trouvée"}, status=404)
     
     # Récupérer les commandes PRÉPARÉES de la ville
-    commandes = (
-        Commande.objects.filter(
-            etats__enum_etat__libelle="Préparée",
+    commandes = Commande.objects.filter(
+        etats__enum_etat__libelle="Préparée",
         etats__date_fin__isnull=True,
-            ville=ville,
-        )
-        .select_related("client", "ville", "ville__region")
-        .prefetch_related("paniers__article")
-        .distinct()
-        .order_by("-date_cmd")
-    )
+        ville=ville,
+    ).distinct()
+    commandes = preparer_commandes(commandes).order_by("-date_cmd")
     
-    # Créer la réponse CSV
-    response = HttpResponse(content_type="text/csv; charset=utf-8")
-    response[
-        "Content-Disposition"
-    ] = f'attachment; filename="ville_{ville.nom}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write("\ufeff")
-    
-    writer = csv.writer(response, delimiter=";")
-    
-    # En-têtes
-    writer.writerow(
-        [
-            "N° Commande",
-            "Client",
-            "Téléphone",
-            "Ville",
-            "Région",
-            "Articles et Quantités",
-            "Prix Total (DH)",
-            "Adresse",
-            "État",
-        ]
+    filename = f"ville_{ville.nom}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return reponse_csv(
+        Feuille(f"Ville {ville.nom}", commandes, colonnes_commandes_consolidees()), filename
     )
-    
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = (
-            ", ".join(articles_list) if articles_list else "Aucun article"
-        )
-        
-        # État actuel de la commande
-        etat_actuel = (
-            commande.etat_actuel.enum_etat.libelle
-            if commande.etat_actuel
-            else "Non défini"
-        )
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}"
-            if commande.client
-            else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region
-            if commande.ville and commande.ville.region
-            else "N/A",
-            articles_consolides,
-            float(commande.total_cmd) if commande.total_cmd else 0.00,
-            commande.adresse or "N/A",
-            etat_actuel,
-        ]
-        writer.writerow(row)
-    
-    return response
 
 
 @login_required
@@ -6054,25 +5610,14 @@ def export_ville_consolidee_excel(request, ville_id):
         ville = get_object_or_404(Ville, id=ville_id)
         
         # Récupérer toutes les commandes de cette ville
-        commandes = (
-            Commande.objects.filter(
+        commandes = Commande.objects.filter(
             ville=ville,
-                etat_actuel__enum_etat__libelle__in=[
-                    "Confirmée",
-                    "En préparation",
-                    "Prête",
-                    "Livrée",
-                ],
-            )
-            .select_related(
-                "client",
-                "ville",
-                "ville__region",
-                "etat_actuel",
-                "etat_actuel__enum_etat",
-            )
-            .prefetch_related("paniers__article")
-            .order_by("date_cmd")
+            etat_courant__libelle__in=[
+                "Confirmée",
+                "En préparation",
+                "Prête",
+                "Livrée",
+            ],
         )
         
         if not commandes.exists():
@@ -6080,120 +5625,13 @@ def export_ville_consolidee_excel(request, ville_id):
                 request, f"Aucune commande trouvée pour la ville {ville.nom}"
             )
             return redirect("Prepacommande:liste_prepa")
-    
-        # Créer le fichier Excel
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-        from openpyxl.utils import get_column_letter
-        from datetime import datetime
-    
-        wb = Workbook()
-        ws = wb.active
-        ws.title = f"Commandes {ville.nom}"
-        
-        # Styles
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(
-            start_color="366092", end_color="366092", fill_type="solid"
-        )
-        border = Border(
-            left=Side(style="thin"),
-            right=Side(style="thin"),
-            top=Side(style="thin"),
-            bottom=Side(style="thin"),
-        )
-    
-        # En-têtes
-        headers = [
-            "ID YZ",
-            "Numéro",
-            "Date",
-            "Client",
-            "Téléphone",
-            "Adresse",
-            "Ville",
-            "Région",
-            "État",
-            "Total Articles",
-            "Frais Livraison",
-            "Total Commande",
-            "Compteur Upsell",
-            "Articles",
-        ]
         
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.border = border
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-        
-        # Données
-        row = 2
-        for commande in commandes:
-            # Articles détaillés
-            articles_detail = []
-            for panier in commande.paniers.all():
-                article_info = f"{panier.article.nom} (Qté: {panier.quantite}, Prix: {panier.sous_total:.2f} DH)"
-                if panier.article.isUpsell:
-                    article_info += " [UPSELL]"
-                articles_detail.append(article_info)
-            
-            articles_text = "\n".join(articles_detail)
-            
-            ws.cell(row=row, column=1, value=commande.id_yz).border = border
-            ws.cell(row=row, column=2, value=commande.num_cmd).border = border
-            ws.cell(
-                row=row, column=3, value=commande.date_cmd.strftime("%d/%m/%Y")
-            ).border = border
-            ws.cell(
-                row=row,
-                column=4,
-                value=f"{commande.client.nom} {commande.client.prenom}",
-            ).border = border
-            ws.cell(row=row, column=5, value=commande.client.numero_tel).border = border
-            ws.cell(row=row, column=6, value=commande.adresse).border = border
-            ws.cell(row=row, column=7, value=commande.ville.nom).border = border
-            ws.cell(
-                row=row, column=8, value=commande.ville.region.nom_region
-            ).border = border
-            ws.cell(
-                row=row, column=9, value=commande.etat_actuel.enum_etat.libelle
-            ).border = border
-            ws.cell(
-                row=row, column=10, value=float(commande.sous_total_articles)
-            ).border = border
-            ws.cell(
-                row=row, column=11, value=float(commande.ville.frais_livraison or 0)
-            ).border = border
-            ws.cell(row=row, column=12, value=float(commande.total_cmd)).border = border
-            ws.cell(row=row, column=13, value=commande.compteur).border = border
-            ws.cell(row=row, column=14, value=articles_text).border = border
-            
-            # Ajuster la hauteur de ligne pour les articles
-            ws.row_dimensions[row].height = max(20, len(articles_detail) * 15)
-            
-            row += 1
-        
-        # Ajuster la largeur des colonnes
-        for col in range(1, len(headers) + 1):
-            ws.column_dimensions[get_column_letter(col)].width = 15
-        
-        # Largeur spéciale pour la colonne articles
-        ws.column_dimensions["N"].width = 40
-        
-        # Nom du fichier
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"commandes_consolidees_{ville.nom}_{timestamp}.xlsx"
-        
-        # Réponse
-        response = HttpResponse(
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        commandes = preparer_commandes(commandes).order_by("date_cmd")
+        filename = f"commandes_consolidees_{ville.nom}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        return reponse_excel(
+            [Feuille(f"Commandes {ville.nom}", commandes, colonnes_commandes_detaillees())],
+            filename,
         )
-        response["Content-Disposition"] = f'attachment; filename="{filename}"'
-        
-        wb.save(response)
-        return response
         
     except Exception as e:
         messages.error(request, f"Erreur lors de l'export: {str(e)}")
@@ -6229,77 +5667,40 @@ def api_prix_upsell_articles(request, commande_id):
                 {"error": "Cette commande ne vous est pas affectée."}, status=403
             )
         
-        # Récupérer tous les articles du panier avec leurs prix mis à jour
-        paniers = commande.paniers.select_related("article").all()
+        # Tarification de tout le panier en une passe (tarifs des articles en cache)
+        paniers = commande.paniers.values_list("id", "article_id", "quantite")
+        resultat = tarifer_panier(paniers, commande.compteur, commande.ville_id)
         prix_articles = {}
-        
-        for panier in paniers:
-            # Utiliser le filtre Django pour calculer le prix selon la logique upsell
-            from commande.templatetags.commande_filters import (
-                get_prix_upsell_avec_compteur,
-            )
-            
-            # Debug: Afficher les informations de l'article
-            print(f"🔍 Article {panier.article.id} ({panier.article.nom}):")
-            print(f"   - isUpsell: {panier.article.isUpsell}")
-            print(f"   - prix_actuel: {panier.article.prix_actuel}")
-            print(f"   - prix_unitaire: {panier.article.prix_unitaire}")
-            print(f"   - prix_upsell_1: {panier.article.prix_upsell_1}")
-            print(f"   - prix_upsell_2: {panier.article.prix_upsell_2}")
-            print(f"   - prix_upsell_3: {panier.article.prix_upsell_3}")
-            print(f"   - prix_upsell_4: {panier.article.prix_upsell_4}")
-            print(f"   - compteur: {commande.compteur}")
-            
-            prix_calcule = get_prix_upsell_avec_compteur(
-                panier.article, commande.compteur
-            )
-            print(f"   - prix_calcule: {prix_calcule}")
-            
+
+        for ligne in resultat.lignes:
             # Convertir en float pour éviter les problèmes de sérialisation JSON
-            prix_calcule = float(prix_calcule) if prix_calcule is not None else 0.0
-            
+            prix_calcule = float(ligne.prix_unitaire) if ligne.prix_unitaire is not None else 0.0
+
             # Déterminer le type de prix et les informations
-            if panier.article.isUpsell:
+            if ligne.is_upsell:
                 prix_type = "upsell"
-                
-                # Déterminer le niveau d'upsell affiché
-                if commande.compteur >= 4 and panier.article.prix_upsell_4 is not None:
-                    niveau_upsell = 4
-                elif (
-                    commande.compteur >= 3 and panier.article.prix_upsell_3 is not None
-                ):
-                    niveau_upsell = 3
-                elif (
-                    commande.compteur >= 2 and panier.article.prix_upsell_2 is not None
-                ):
-                    niveau_upsell = 2
-                elif (
-                    commande.compteur >= 1 and panier.article.prix_upsell_1 is not None
-                ):
-                    niveau_upsell = 1
-                else:
-                    niveau_upsell = 0
-                
+                niveau_upsell = ligne.niveau_upsell
+
                 if niveau_upsell > 0:
                     libelle = f"Upsell Niveau {niveau_upsell}"
                 else:
                     libelle = "Upsell (Prix normal)"
-                    
+
                 icone = "fas fa-arrow-up"
             else:
                 prix_type = "normal"
                 libelle = "Prix normal"
                 icone = "fas fa-tag"
                 niveau_upsell = 0
-            
-            prix_articles[panier.id] = {
+
+            prix_articles[ligne.panier_id] = {
                 "prix": prix_calcule,
                 "type": prix_type,
                 "libelle": libelle,
                 "icone": icone,
                 "niveau_upsell": niveau_upsell,
-                "is_upsell": panier.article.isUpsell,
-                "sous_total": float(prix_calcule * panier.quantite),
+                "is_upsell": ligne.is_upsell,
+                "sous_total": ligne.sous_total,
             }
 
         return JsonResponse(
@@ -6463,7 +5864,7 @@ def api_changer_etat_commande(request, commande_id):
             etat_actuel.save()
             
             # Créer le nouvel état
-            EtatCommande.objects.create(
+            changer_etat_commande(
                 commande=commande,
                 enum_etat=nouvel_etat_enum,
                 operateur=operateur,
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SuperpreparationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Superpreparation'
+
+    def ready(self):
+        # Exports en arrière-plan (commande.jobs)
+        from . import exports  # noqa: F401
@@ -9,7 +9,12 @@ import json
 
 from commande.models import Commande, EtatCommande, EnumEtatCmd
 from parametre.models import Region, Ville, Operateur
-from article.models import Article
+from recherche.moteur import recherche_globale
+
+URLS_RECHERCHE = {
+    'commande': lambda commande_id: reverse('Superpreparation:detail_prepa', kwargs={'pk': commande_id}),
+    'article': lambda article_id: reverse('Superpreparation:detail_article', kwargs={'article_id': article_id}),
+}
 
 @login_required
 def global_search_view(request):
@@ -41,21 +46,27 @@ def global_search_api(request):
     }
     
     try:
-        # Recherche dans les commandes (supervision)
-        if category in ['all', 'commandes']:
-            results['commandes'] = search_commandes_supervision(query, request)
+        # Commandes et articles : index de recherche, filtré selon le rôle
+        resultats_indexes, pagination = recherche_globale(
+            request, 'supervision',
+            categories={'commandes': 'commande', 'articles': 'article'},
+            urls=URLS_RECHERCHE,
+        )
+        results.update(resultats_indexes)
         
         # Recherche dans les opérateurs
         if category in ['all', 'operateurs']:
             results['operateurs'] = search_operateurs_supervision(query)
         
-        # Recherche dans les articles
-        if category in ['all', 'articles']:
-            results['articles'] = search_articles_supervision(query)
-        
-        # Recherche dans le stock
+        # Recherche dans le stock (mêmes articles, présentés côté stock)
         if category in ['all', 'stock']:
-            results['stock'] = search_stock_supervision(query)
+            if category == 'all':
+                articles = results['articles']
+            else:
+                articles = recherche_globale(
+                    request, 'supervision', categories={'stock': 'article'}, urls=URLS_RECHERCHE
+                )[0].get('stock', [])
+            results['stock'] = search_stock_supervision(query, articles)
         
         # Recherche dans les régions
         if category in ['all', 'regions']:
@@ -73,6 +84,7 @@ def global_search_api(request):
             'success': True,
             'query': query,
             'results': results,
+            'pagination': pagination,
             'total_results': sum(len(v) for v in results.values())
         })
         
@@ -84,104 +96,6 @@ def global_search_api(request):
         })
 
 
-def search_commandes_supervision(query, request=None):
-    """Recherche dans les commandes pour supervision"""
-    commandes = []
-    
-    # Recherche par ID numérique
-    if query.isdigit():
-        try:
-            cmd = Commande.objects.get(id=int(query))
-            commandes.append({
-                'id': cmd.id,
-                'type': 'commande',
-                'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-                'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-                'status': get_commande_status(cmd),
-                'url': reverse('Superpreparation:detail_prepa', kwargs={'pk': cmd.id}),
-                'icon': 'fas fa-shopping-cart',
-                'priority': 1
-            })
-        except Commande.DoesNotExist:
-            pass
-    
-    # Recherche par numéro externe
-    try:
-        cmd_externe = Commande.objects.get(num_cmd__icontains=query)
-        commandes.append({
-            'id': cmd_externe.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd_externe.id} ({cmd_externe.num_cmd})',
-            'subtitle': f'Client: {cmd_externe.client.nom if cmd_externe.client else "N/A"} - {cmd_externe.total_cmd} DH',
-            'status': get_commande_status(cmd_externe),
-            'url': reverse('Superpreparation:detail_prepa', kwargs={'pk': cmd_externe.id}),
-            'icon': 'fas fa-shopping-cart',
-            'priority': 1
-        })
-    except Commande.DoesNotExist:
-        pass
-    
-    # Recherche par client
-    commandes_client = Commande.objects.filter(
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    ).exclude(
-        num_cmd__icontains=query
-    )[:10]
-    
-    for cmd in commandes_client:
-        commandes.append({
-            'id': cmd.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-            'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-            'status': get_commande_status(cmd),
-            'url': reverse('Superpreparation:detail_prepa', kwargs={'pk': cmd.id}),
-            'icon': 'fas fa-shopping-cart',
-            'priority': 2
-        })
-    
-    # Recherche par région/ville
-    commandes_geo = Commande.objects.filter(
-        Q(ville__nom__icontains=query) |
-        Q(ville__region__nom_region__icontains=query) |
-        Q(ville_init__icontains=query)
-    ).exclude(
-        Q(num_cmd__icontains=query) |
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    )[:10]
-    
-    for cmd in commandes_geo:
-        ville_display = cmd.ville.nom if cmd.ville else "N/A"
-        if cmd.ville_init and cmd.ville_init != (cmd.ville.nom if cmd.ville else ""):
-            ville_display = f"{cmd.ville_init} → {ville_display}"
-        
-        commandes.append({
-            'id': cmd.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-            'subtitle': f'{ville_display} - {cmd.total_cmd} DH',
-            'status': get_commande_status(cmd),
-            'url': reverse('Superpreparation:detail_prepa', kwargs={'pk': cmd.id}),
-            'icon': 'fas fa-shopping-cart',
-            'priority': 3
-        })
-    
-    # Dédupliquer les résultats par ID de commande
-    commandes_uniques = []
-    ids_vus = set()
-    
-    for cmd in commandes:
-        if cmd['id'] not in ids_vus:
-            commandes_uniques.append(cmd)
-            ids_vus.add(cmd['id'])
-    
-    return commandes_uniques[:10]
-
-
 def search_operateurs_supervision(query):
     """Recherche dans les opérateurs pour supervision"""
     operateurs = []
@@ -197,10 +111,9 @@ def search_operateurs_supervision(query):
     for operateur in operateurs_match:
         # Compter les commandes où cet opérateur est intervenu récemment
         commandes_assignees = Commande.objects.filter(
-            etats__operateur=operateur,
-            etats__enum_etat__libelle__in=["Confirmée", "En préparation"],
-            etats__date_fin__isnull=True
-        ).distinct().count()
+            operateur_etat_courant=operateur,
+            etat_courant__libelle__in=["Confirmée", "En préparation"]
+        ).count()
         
         operateurs.append({
             'id': operateur.id,
@@ -216,51 +129,16 @@ def search_operateurs_supervision(query):
     return operateurs
 
 
-def search_articles_supervision(query):
-    """Recherche dans les articles pour supervision"""
-    articles = []
-    
-    articles_match = Article.objects.filter(
-        Q(nom__icontains=query) |
-        Q(reference__icontains=query) |
-        Q(description__icontains=query)
-    )[:8]
-    
-    for article in articles_match:
-        articles.append({
-            'id': article.id,
-            'type': 'article',
-            'title': article.nom,
-            'subtitle': f'Réf: {article.reference} - Stock: {article.qte_disponible}',
-            'status': 'En stock' if article.qte_disponible > 0 else 'Rupture',
-            'url': reverse('Superpreparation:detail_article', kwargs={'article_id': article.id}),
-            'icon': 'fas fa-box',
-            'priority': 1
-        })
-    
-    return articles
-
-
-def search_stock_supervision(query):
-    """Recherche dans le stock pour supervision"""
+def search_stock_supervision(query, articles):
+    """Recherche dans le stock pour supervision (articles trouvés par l'index de recherche)"""
     stock_items = []
     
-    # Recherche par nom d'article
-    articles_stock = Article.objects.filter(
-        Q(nom__icontains=query) |
-        Q(reference__icontains=query)
-    )[:5]
-    
-    for article in articles_stock:
+    for article in articles[:5]:
         stock_items.append({
-            'id': article.id,
+            **article,
             'type': 'stock',
-            'title': f'Stock {article.nom}',
-            'subtitle': f'Réf: {article.reference} - Quantité: {article.qte_disponible}',
-            'status': 'En stock' if article.qte_disponible > 0 else 'Rupture',
-            'url': reverse('Superpreparation:detail_article', kwargs={'article_id': article.id}),
+            'title': f"Stock {article['title']}",
             'icon': 'fas fa-warehouse',
-            'priority': 1
         })
     
     # Recherche par mots-clés stock
@@ -291,8 +169,7 @@ def search_regions_supervision(query, request=None):
         # Compter les commandes de cette région
         nb_commandes = Commande.objects.filter(
             ville__region=region,
-            etats__enum_etat__libelle__in=["Confirmée", "En préparation", "Préparée"],
-            etats__date_fin__isnull=True
+            etat_courant__libelle__in=["Confirmée", "En préparation", "Préparée"]
         ).count()
         
         regions.append({
@@ -322,8 +199,7 @@ def search_villes_supervision(query, request=None):
         # Compter les commandes de cette ville
         nb_commandes = Commande.objects.filter(
             ville=ville,
-            etats__enum_etat__libelle__in=["Confirmée", "En préparation", "Préparée"],
-            etats__date_fin__isnull=True
+            etat_courant__libelle__in=["Confirmée", "En préparation", "Préparée"]
         ).count()
         
         villes.append({
@@ -371,14 +247,6 @@ def search_statistiques_supervision(query):
     return statistiques
 
 
-def get_commande_status(commande):
-    """Obtenir le statut actuel d'une commande"""
-    etat_actuel = commande.etats.filter(date_fin__isnull=True).first()
-    if etat_actuel:
-        return etat_actuel.enum_etat.libelle
-    return "Nouvelle"
-
-
 @login_required
 def search_suggestions_api(request):
     """API pour les suggestions de recherche - Supervision"""
@@ -408,8 +276,7 @@ def search_suggestions_api(request):
     
     # Suggestions de commandes récentes
     recent_commandes = Commande.objects.filter(
-        etats__enum_etat__libelle="Confirmée",
-        etats__date_fin__isnull=True
+        etat_courant__libelle="Confirmée"
     ).order_by('-id')[:3]
     
     for cmd in recent_commandes:
@@ -0,0 +1,96 @@
+"""
+Export Excel des commandes d'un envoi, construit en arrière-plan (commande.jobs).
+"""
+from django.utils import timezone
+
+from commande.exports import Colonne, Feuille, nom_ville
+from commande.jobs import ContenuExport, export_differe
+from commande.models import Commande, Envoi
+from parametre.models import Operateur
+
+
+def equipe_preparation(user):
+    """Superviseurs, opérateurs de préparation et ADMIN (comme superviseur_preparation_required)"""
+    return Operateur.objects.filter(
+        user=user, actif=True, type_operateur__in=['SUPERVISEUR_PREPARATION', 'PREPARATION', 'ADMIN'],
+    ).exists()
+
+
+def commandes_envoi(envoi):
+    """
+    Commandes associées à l'envoi. Si aucune n'est encore liée, fallback : les
+    commandes "Préparée" de la région de l'envoi.
+    """
+    commandes = Commande.objects.filter(envoi=envoi)
+    if not commandes.exists():
+        commandes = Commande.objects.filter(
+            ville__region=envoi.region,
+            etats__enum_etat__libelle='Préparée',
+            etats__date_fin__isnull=True,
+        ).distinct()
+    return commandes.select_related('client', 'ville__region').prefetch_related(
+        'paniers__article',
+        'paniers__variante__couleur',
+        'paniers__variante__pointure',
+    ).order_by('pk')
+
+
+def panier_envoi(commande):
+    """Articles du panier, un par ligne : « 2x Nom (Couleur - Pointure) »"""
+    items_texts = []
+    for panier in commande.paniers.all():
+        article_nom = panier.article.nom if panier.article else "Article N/A"
+        variante_text = ""
+        if panier.variante:
+            couleur = getattr(panier.variante.couleur, 'nom', None)
+            pointure = getattr(panier.variante.pointure, 'pointure', None)
+            details = [v for v in [couleur, pointure] if v]
+            if details:
+                variante_text = f" ({' - '.join(details)})"
+        items_texts.append(f"{panier.quantite}x {article_nom}{variante_text}")
+    return "\n".join(items_texts)
+
+
+def colonnes_envoi(region_envoi):
+    return [
+        Colonne('N° Commande', lambda commande: commande.num_cmd),
+        Colonne(
+            'Client',
+            lambda commande: (
+                f"{(commande.client.prenom or '').strip()} {(commande.client.nom or '').strip()}".strip()
+                if commande.client else "N/A"
+            ),
+            25,
+        ),
+        Colonne('Téléphone', lambda commande: commande.client.numero_tel if commande.client else ''),
+        Colonne(
+            'Adresse',
+            lambda commande: commande.adresse or (commande.client.adresse if commande.client else '') or '',
+            40,
+        ),
+        Colonne('Ville', nom_ville),
+        Colonne(
+            'Région',
+            lambda commande: commande.ville.region.nom_region if commande.ville and commande.ville.region else region_envoi,
+        ),
+        Colonne('Total', lambda commande: commande.total_cmd or 0, 15, 'yz_montant'),
+        Colonne('Panier', panier_envoi, 40, 'yz_texte_long'),
+    ]
+
+
+@export_differe('commandes_envoi', autorise=equipe_preparation)
+def export_commandes_envoi(envoi_id):
+    envoi = Envoi.objects.select_related('region').get(id=envoi_id)
+    commandes = commandes_envoi(envoi)
+    region_envoi = envoi.region.nom_region if envoi.region else "N/A"
+    preambule = (
+        (f"EXPORT COMMANDES - ENVOI {envoi.numero_envoi}",),
+        (f"Région: {region_envoi}",),
+        (f"Date: {timezone.now().strftime('%d/%m/%Y %H:%M')}",),
+        (),
+    )
+    return ContenuExport(
+        f"Envoi_{envoi.numero_envoi}_Commandes.xlsx",
+        [Feuille(f"Envoi_{envoi.numero_envoi}", commandes, colonnes_envoi(region_envoi), preambule)],
+        commandes.count(),
+    )
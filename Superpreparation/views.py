@@ -13,16 +13,26 @@ from django.core.paginator import Paginator
 
 import json
 from parametre.models import Operateur, Ville
+from commande.exports import (
+    Feuille, colonnes_commandes_consolidees, colonnes_commandes_detaillees, feuille_resume, preparer_commandes,
+    reponse_csv, reponse_excel,
+)
 from commande.models import Commande, EtatCommande, EnumEtatCmd, Operation, Panier, Envoi
+from commande.tarification import tarifer_panier
+from commande.etats import EN_LIVRAISON
+from commande.transitions import changer_etat_commande
+from commande.jobs import lancer_export
 from django.urls import reverse
 
 import barcode
 from barcode.writer import ImageWriter
 from io import BytesIO
 import base64
-import csv
 
 from article.models import Article, MouvementStock, VarianteArticle
+from article.disponibilite import matrices_disponibilite
+from article.inventaire import fin_de_journee
+from article.mouvements import ajuster_stock_variante, creer_mouvements_stock_bulk
 from commande.models import Envoi
 from .forms import ArticleForm, AjusterStockForm
 from .utils import creer_mouvement_stock
@@ -260,12 +270,11 @@ def liste_prepa(request):
         # Filtrer les commandes qui ont été livrées partiellement et sont maintenant en préparation
         commandes_affectees = []
         commandes_base = Commande.objects.filter(
-            Q(etats__enum_etat__libelle='À imprimer') | Q(etats__enum_etat__libelle='En préparation'),
-            etats__date_fin__isnull=True
-        ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats').distinct()
+            etat_courant__libelle__in=['À imprimer', 'En préparation']
+        ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats__enum_etat')
         
         for commande in commandes_base:
-            etats_commande = commande.etats.all().order_by('date_debut')
+            etats_commande = sorted(commande.etats.all(), key=lambda etat: etat.date_debut)
             etat_prepa_actuel = None
             
             # Trouver l'état actuel de préparation
@@ -290,9 +299,8 @@ def liste_prepa(request):
         # Pour les commandes renvoyées par la logistique, ne pas exclure les états problématiques
         # car on veut inclure les commandes avec opération de renvoi même si elles ont des états ultérieurs
         commandes_affectees = Commande.objects.filter(
-            Q(etats__enum_etat__libelle='À imprimer') | Q(etats__enum_etat__libelle='En préparation'),
-            etats__date_fin__isnull=True  # État actif (en cours)
-        ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats').distinct()
+            etat_courant__libelle__in=['À imprimer', 'En préparation']  # État actif (en cours)
+        ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats__enum_etat')
     elif filter_type == 'retournees':
         # Obsolète: rediriger vers la page dédiée
         return redirect('Superpreparation:commandes_retournees')
@@ -301,16 +309,11 @@ def liste_prepa(request):
         # Pour "Toutes les commandes", afficher TOUTES les commandes en préparation (quel que soit leur état)
         commandes_affectees = []
         commandes_base = Commande.objects.filter(
-            Q(etats__enum_etat__libelle='À imprimer') | 
-            Q(etats__enum_etat__libelle='En préparation') |
-            Q(etats__enum_etat__libelle='Collectée') |
-            Q(etats__enum_etat__libelle='Emballée') |
-            Q(etats__enum_etat__libelle='Préparée'),
-            etats__date_fin__isnull=True
-        ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats').distinct()
+            etat_courant__libelle__in=['À imprimer', 'En préparation', 'Collectée', 'Emballée', 'Préparée']
+        ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats__enum_etat')
         
         for commande in commandes_base:
-            etats_commande = commande.etats.all().order_by('date_debut')
+            etats_commande = sorted(commande.etats.all(), key=lambda etat: etat.date_debut)
             etat_prepa_actuel = None
             
             # Trouver l'état actuel de préparation (peu importe l'état)
@@ -345,7 +348,7 @@ def liste_prepa(request):
             from commande.models import Operation
             
             # Vérifier que la commande n'a pas d'états ultérieurs problématiques
-            etats_commande = commande.etats.all().order_by('date_debut')
+            etats_commande = sorted(commande.etats.all(), key=lambda etat: etat.date_debut)
             etat_actuel = None
             
             # Trouver l'état actuel (En préparation)
@@ -413,7 +416,7 @@ def liste_prepa(request):
     # Pour chaque commande, ajouter l'état précédent pour comprendre d'où elle vient
     for commande in commandes_affectees:
         # Récupérer tous les états de la commande dans l'ordre chronologique
-        etats_commande = commande.etats.all().order_by('date_debut')
+        etats_commande = sorted(commande.etats.all(), key=lambda etat: etat.date_debut)
         
         # Trouver l'état actuel (tous les états de préparation)
         etat_actuel = None
@@ -470,7 +473,7 @@ def liste_prepa(request):
         # Pour chaque commande, ajouter l'état précédent pour comprendre d'où elle vient
         for commande in commandes_affectees:
             # Récupérer tous les états de la commande dans l'ordre chronologique
-            etats_commande = commande.etats.all().order_by('date_debut')
+            etats_commande = sorted(commande.etats.all(), key=lambda etat: etat.date_debut)
             
             # Trouver l'état actuel (tous les états de préparation)
             etat_actuel = None
@@ -532,9 +535,9 @@ def liste_prepa(request):
     
     # Tri par date d'affectation (plus récentes en premier)
     if isinstance(commandes_affectees, list):
-        commandes_affectees.sort(key=lambda x: x.etats.filter(date_fin__isnull=True).first().date_debut if x.etats.filter(date_fin__isnull=True).first() else timezone.now(), reverse=True)
+        commandes_affectees.sort(key=lambda x: x.date_etat_courant or timezone.now(), reverse=True)
     else:
-        commandes_affectees = commandes_affectees.order_by('-etats__date_debut')
+        commandes_affectees = commandes_affectees.order_by('-date_etat_courant')
 
     # Générer les codes-barres pour chaque commande et s'assurer que etat_actuel_preparation est défini
     code128 = barcode.get_barcode_class('code128')
@@ -583,9 +586,8 @@ def liste_prepa(request):
     # Recalculer les statistiques pour tous les types
     # D'abord, récupérer toutes les commandes en préparation (sans filtre d'opérateur)
     toutes_commandes = Commande.objects.filter(
-        Q(etats__enum_etat__libelle='À imprimer') | Q(etats__enum_etat__libelle='En préparation'),
-        etats__date_fin__isnull=True  # État actif (en cours)
-    ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats').distinct()
+        etat_courant__libelle__in=['À imprimer', 'En préparation']  # État actif (en cours)
+    ).select_related('client', 'ville', 'ville__region').prefetch_related('paniers__article', 'etats__enum_etat')
     
     for cmd in toutes_commandes:
         # Vérifier si c'est une commande renvoyée par la logistique
@@ -612,7 +614,7 @@ def liste_prepa(request):
                 continue
         
         # Vérifier l'état précédent
-        etats_commande = cmd.etats.all().order_by('date_debut')
+        etats_commande = sorted(cmd.etats.all(), key=lambda etat: etat.date_debut)
         etat_actuel = None
         
         # Trouver l'état actuel
@@ -648,9 +650,8 @@ def liste_prepa(request):
     # Chercher les commandes de renvoi créées lors de livraisons partielles
     commandes_renvoi_livraison_partielle = Commande.objects.filter(
         num_cmd__startswith='RENVOI-',
-        etats__enum_etat__libelle='En préparation',
-        etats__date_fin__isnull=True
-    ).distinct()
+        etat_courant__libelle='En préparation'
+    )
     
     livrees_partiellement_count = 0
     for commande_renvoi in commandes_renvoi_livraison_partielle:
@@ -1072,24 +1073,13 @@ def traiter_commande_retournee_api(request, commande_id):
                 # Ne pas changer l'état de la commande, elle reste "Retournée"
                 # Seulement réincrémenter le stock si les produits sont en bon état
                 if etat_stock == 'bon':
-                    for panier in commande.paniers.all():
-                        article = panier.article
-                        quantite = panier.quantite
-                        
-                        # Réincrémenter le stock disponible
-                        article.qte_disponible += quantite
-                        article.save()
-                        
-                        # Créer un mouvement de stock pour tracer
-                        from article.models import MouvementStock
-                        MouvementStock.objects.create(
-                            article=article,
-                            quantite=quantite,
-                            type_mouvement='entree',
-                            commentaire=f"Réincrémentation - Commande retournée {commande.id_yz} - Produits en bon état - {commentaire}",
-                            operateur=operateur_profile,
-                            qte_apres_mouvement=article.qte_disponible
-                        )
+                    # Réincrémenter le stock de toutes les lignes en un lot (mouvements tracés)
+                    creer_mouvements_stock_bulk(
+                        commande.paniers.all(),
+                        'entree',
+                        operateur=operateur_profile,
+                        commentaire=f"Réincrémentation - Commande retournée {commande.id_yz} - Produits en bon état - {commentaire}",
+                    )
                 
                 message = f"Stock réincrémenté: {'Oui' if etat_stock == 'bon' else 'Non'}. Commande reste en état 'Retournée'."
                 
@@ -1424,7 +1414,7 @@ def detail_prepa(request, pk):
                 
                 # Créer le nouvel état 'Préparée'
                 etat_preparee, created = EnumEtatCmd.objects.get_or_create(libelle='Préparée')
-                EtatCommande.objects.create(
+                changer_etat_commande(
                     commande=commande,
                     enum_etat=etat_preparee,
                     operateur=operateur_profile
@@ -1471,7 +1461,7 @@ def detail_prepa(request, pk):
                     defaults={'ordre': 25, 'couleur': '#D97706'}
                 )
                 
-                EtatCommande.objects.create(
+                changer_etat_commande(
                     commande=commande,
                     enum_etat=etat_retour_enum,
                     operateur=operateur_confirmation_origine, # Affectation directe
@@ -2853,8 +2843,8 @@ def api_articles_disponibles_prepa(request):
         
         # Appliquer les filtres selon le type
         if filter_type == 'disponible':
-            # Filtrer les articles qui ont au moins une variante avec stock > 0
-            articles = articles.filter(variantes__qte_disponible__gt=0, variantes__actif=True).distinct()
+            # Articles dont au moins une variante active est en stock
+            articles = articles.filter(stock_disponible__gt=0)
         elif filter_type == 'upsell':
             articles = articles.filter(isUpsell=True)
         elif filter_type == 'liquidation':
@@ -2867,8 +2857,8 @@ def api_articles_disponibles_prepa(request):
             articles = articles.filter(
                 Q(nom__icontains=search_query) |
                 Q(reference__icontains=search_query) |
-                Q(couleur__icontains=search_query) |
-                Q(pointure__icontains=search_query) |
+                Q(couleur_principale__icontains=search_query) |
+                Q(pointure_principale__icontains=search_query) |
                 Q(description__icontains=search_query)
             )
         
@@ -2880,21 +2870,22 @@ def api_articles_disponibles_prepa(request):
                 prix_actuel__lt=F('prix_unitaire')
             )
         
-        # Limiter les résultats
-        articles = articles[:50]
+        # Limiter les résultats (catégorie et genre chargés en lot)
+        articles = list(articles.select_related('categorie', 'genre')[:50])
+        
+        # Variantes actives : matrices de disponibilité en cache (une requête pour les absentes)
+        matrices = matrices_disponibilite([article.id for article in articles])
         
         articles_data = []
         for article in articles:
-            # Mettre à jour le prix actuel si nécessaire
-            if article.prix_actuel is None:
-                article.prix_actuel = article.prix_unitaire
-                article.save(update_fields=['prix_actuel'])
+            # Promotion en cours, tenue à jour par le moteur de tarification (article.promotions)
+            has_promo_active = article.promotion_appliquee_id is not None
             
-            # Récupérer toutes les variantes actives (inclet celles en rupture)
-            variantes_actives = article.variantes.filter(actif=True)
+            # Toutes les variantes actives (y compris celles en rupture)
+            variantes_actives = list(matrices[article.id].cellules())
             
             # Si pas de variantes, créer une entrée avec les propriétés de compatibilité
-            if not variantes_actives.exists():
+            if not variantes_actives:
                 # Propriétés de compatibilité du modèle Article
                 stock = article.qte_disponible
                 couleur = article.couleur
@@ -2913,7 +2904,7 @@ def api_articles_disponibles_prepa(request):
                         'qte_disponible': stock,
                         'isUpsell': bool(article.isUpsell),
                         'phase': article.phase or 'NORMAL',
-                        'has_promo_active': article.has_promo_active,
+                        'has_promo_active': has_promo_active,
                         'image_url': article.image.url if article.image else article.image_url,
                         'categorie': str(article.categorie) if article.categorie else '',
                         'genre': str(article.genre) if article.genre else '',
@@ -2924,8 +2915,8 @@ def api_articles_disponibles_prepa(request):
                         # Propriétés pour compatibilité avec le template
                         'prix': float(article.prix_actuel or article.prix_unitaire),
                         'prix_original': float(article.prix_unitaire),
-                        'has_reduction': article.has_promo_active,
-                        'reduction_pourcentage': round(((float(article.prix_unitaire) - float(article.prix_actuel or article.prix_unitaire)) / float(article.prix_unitaire)) * 100, 0) if article.has_promo_active else 0,
+                        'has_reduction': has_promo_active,
+                        'reduction_pourcentage': round(((float(article.prix_unitaire) - float(article.prix_actuel or article.prix_unitaire)) / float(article.prix_unitaire)) * 100, 0) if has_promo_active else 0,
                         'article_type': 'normal',
                         'type_icon': 'fas fa-box',
                         'type_color': 'text-gray-600',
@@ -2937,8 +2928,8 @@ def api_articles_disponibles_prepa(request):
                 for v in variantes_actives:
                     variantes_list.append({
                         'id': v.id,
-                        'couleur': v.couleur.nom if v.couleur else '',
-                        'pointure': v.pointure.pointure if v.pointure else '',
+                        'couleur': v.couleur or '',
+                        'pointure': v.pointure or '',
                         'qte_disponible': v.qte_disponible,
                         'reference_variante': v.reference_variante,
                     })
@@ -2964,7 +2955,7 @@ def api_articles_disponibles_prepa(request):
                         type_color = 'text-yellow-600'
                     
                     # Vérifier si l'article est en promotion
-                    if article.has_promo_active:
+                    if has_promo_active:
                         article_type = 'promo'
                         type_icon = 'fas fa-fire'
                         type_color = 'text-orange-600'
@@ -2973,20 +2964,20 @@ def api_articles_disponibles_prepa(request):
                         'id': article.id,
                         'nom': article.nom,
                         'reference': article.reference or '',
-                        'couleur': variante.couleur.nom if variante.couleur else '',
-                        'pointure': variante.pointure.pointure if variante.pointure else '',
+                        'couleur': variante.couleur or '',
+                        'pointure': variante.pointure or '',
                         'description': article.description or '',
                         'prix_unitaire': float(article.prix_unitaire),
                         'prix_actuel': float(article.prix_actuel or article.prix_unitaire),
                         'qte_disponible': variante.qte_disponible,
                         'isUpsell': bool(article.isUpsell),
                         'phase': article.phase or 'NORMAL',
-                        'has_promo_active': article.has_promo_active,
+                        'has_promo_active': has_promo_active,
                         'image_url': article.image.url if article.image else article.image_url,
                         'categorie': str(article.categorie) if article.categorie else '',
                         'genre': str(article.genre) if article.genre else '',
                         'modele': article.modele_complet(),
-                        'variantes_count': variantes_actives.count(),
+                        'variantes_count': len(variantes_actives),
                         'is_variante': True,
                         'variante_id': variante.id,
                         'reference_variante': variante.reference_variante,
@@ -2994,12 +2985,12 @@ def api_articles_disponibles_prepa(request):
                         # Propriétés pour compatibilité avec le template
                         'prix': float(article.prix_actuel or article.prix_unitaire),
                         'prix_original': float(article.prix_unitaire),
-                        'has_reduction': article.has_promo_active,
-                        'reduction_pourcentage': round(((float(article.prix_unitaire) - float(article.prix_actuel or article.prix_unitaire)) / float(article.prix_unitaire)) * 100, 0) if article.has_promo_active else 0,
+                        'has_reduction': has_promo_active,
+                        'reduction_pourcentage': round(((float(article.prix_unitaire) - float(article.prix_actuel or article.prix_unitaire)) / float(article.prix_unitaire)) * 100, 0) if has_promo_active else 0,
                         'article_type': article_type,
                         'type_icon': type_icon,
                         'type_color': type_color,
-                        'display_text': f"{article.nom} - {variante.couleur.nom if variante.couleur else ''} - {variante.pointure.pointure if variante.pointure else ''} ({float(article.prix_actuel or article.prix_unitaire):.2f} DH)"
+                        'display_text': f"{article.nom} - {variante.couleur or ''} - {variante.pointure or ''} ({float(article.prix_actuel or article.prix_unitaire):.2f} DH)"
                     })
         
         # Calculer les statistiques pour la réponse
@@ -3153,7 +3144,7 @@ def api_finaliser_commande(request, commande_id):
             
             # Créer le nouvel état 'Préparée' (final)
             etat_preparee, created = EnumEtatCmd.objects.get_or_create(libelle='Préparée')
-            EtatCommande.objects.create(
+            changer_etat_commande(
                 commande=commande,
                 enum_etat=etat_preparee,
                 operateur=operateur_profile
@@ -3476,11 +3467,10 @@ def liste_articles(request):
     
     # Imports locaux pour les annotations
     from django.db.models import Q, F, Sum, Count, Avg
-    from django.db.models.functions import Coalesce
 
     # Calcul des statistiques globales (avant tout filtrage)
     articles_qs = Article.objects.all().annotate(
-        total_qte_disponible=Coalesce(Sum('variantes__qte_disponible'), 0)
+        total_qte_disponible=F('stock_disponible')
     )
     articles_total = articles_qs.count()
     articles_actifs = articles_qs.filter(actif=True).count()
@@ -3493,7 +3483,7 @@ def liste_articles(request):
 
     # Récupération des articles pour la liste, filtrée
     articles_list = Article.objects.all().annotate(
-        total_qte_disponible=Coalesce(Sum('variantes__qte_disponible'), 0)
+        total_qte_disponible=F('stock_disponible')
     )
     
     # Filtres de recherche améliorés
@@ -3662,11 +3652,14 @@ def mouvements_stock(request):
                 type_mouvement__in=['ajustement_pos', 'ajustement_neg']
             )
     
-    # Filtre par date
+    # Filtre par date (intervalle de la journée : utilise l'index sur date_mouvement)
     if date_filter:
         try:
             date_obj = datetime.strptime(date_filter, '%Y-%m-%d').date()
-            mouvements_list = mouvements_list.filter(date_mouvement__date=date_obj)
+            mouvements_list = mouvements_list.filter(
+                date_mouvement__gte=fin_de_journee(date_obj - timedelta(days=1)),
+                date_mouvement__lt=fin_de_journee(date_obj),
+            )
         except ValueError:
             pass
     
@@ -3676,9 +3669,9 @@ def mouvements_stock(request):
     page_obj = paginator.get_page(page_number)
     
     # Statistiques rapides
-    total_mouvements = mouvements_list.count()
+    total_mouvements = paginator.count
     mouvements_aujourd_hui = MouvementStock.objects.filter(
-        date_mouvement__date=timezone.now().date()
+        date_mouvement__gte=fin_de_journee(timezone.localdate() - timedelta(days=1))
     ).count()
     
     context = {
@@ -3706,38 +3699,17 @@ def alertes_stock(request):
         messages.error(request, "Profil opérateur non trouvé.")
         return redirect('login')
     
-    from article.models import MouvementStock
-    
-    # Paramètres de seuils
-    SEUIL_RUPTURE = 0
-    SEUIL_STOCK_FAIBLE = 10
-    SEUIL_A_COMMANDER = 20
+    from article.alertes import articles_en_alerte, compteurs_alertes, seuils_defaut
     
-    # Récupération de tous les articles actifs avec annotation du stock total
-    from django.db.models import Q, Sum
-    from django.db.models.functions import Coalesce
+    # Seuils par défaut (des seuils propres à un article ou une catégorie peuvent s'appliquer)
+    seuils = seuils_defaut()
     
-    articles_actifs = Article.objects.filter(actif=True).annotate(
-        total_qte_disponible=Coalesce(Sum('variantes__qte_disponible'), 0)
-    )
-    
-    # Filtres par niveau d'alerte
+    # Articles en alerte, lus dans la table des alertes tenue à jour à chaque mouvement
     filtre_alerte = request.GET.get('filtre', 'tous')
-    
-    if filtre_alerte == 'rupture':
-        articles_alerte = articles_actifs.filter(total_qte_disponible__lte=SEUIL_RUPTURE)
-    elif filtre_alerte == 'faible':
-        articles_alerte = articles_actifs.filter(
-            total_qte_disponible__gt=SEUIL_RUPTURE,
-            total_qte_disponible__lte=SEUIL_STOCK_FAIBLE
-        )
-    elif filtre_alerte == 'a_commander':
-        articles_alerte = articles_actifs.filter(
-            total_qte_disponible__gt=SEUIL_STOCK_FAIBLE,
-            total_qte_disponible__lte=SEUIL_A_COMMANDER
-        )
-    else:
-        articles_alerte = articles_actifs.filter(total_qte_disponible__lte=SEUIL_A_COMMANDER)
+    niveau = filtre_alerte if filtre_alerte in ('rupture', 'faible', 'a_commander') else None
+    articles_alerte = articles_en_alerte(niveau).select_related('categorie').annotate(
+        total_qte_disponible=F('stock_disponible')
+    )
     
     # Tri des résultats
     tri = request.GET.get('tri', 'stock_asc')
@@ -3754,39 +3726,28 @@ def alertes_stock(request):
     else:
         articles_alerte = articles_alerte.order_by('total_qte_disponible')
     
-    # Statistiques détaillées
+    # Statistiques détaillées : une requête groupée sur les alertes
+    compteurs = compteurs_alertes()
+    total_articles = Article.objects.filter(actif=True).count()
     stats = {
-        'total_articles': articles_actifs.count(),
-        'rupture_stock': articles_actifs.filter(total_qte_disponible__lte=SEUIL_RUPTURE).count(),
-        'stock_faible': articles_actifs.filter(
-            total_qte_disponible__gt=SEUIL_RUPTURE,
-            total_qte_disponible__lte=SEUIL_STOCK_FAIBLE
-        ).count(),
-        'a_commander': articles_actifs.filter(
-            total_qte_disponible__gt=SEUIL_STOCK_FAIBLE,
-            total_qte_disponible__lte=SEUIL_A_COMMANDER
-        ).count(),
-        'stock_ok': articles_actifs.filter(total_qte_disponible__gt=SEUIL_A_COMMANDER).count(),
+        'total_articles': total_articles,
+        'rupture_stock': compteurs['rupture'],
+        'stock_faible': compteurs['faible'],
+        'a_commander': compteurs['a_commander'],
+        'stock_ok': total_articles - sum(compteurs.values()),
     }
     
     # Alertes critiques
-    alertes_critiques = articles_actifs.filter(total_qte_disponible__lte=SEUIL_RUPTURE).order_by('total_qte_disponible')[:5]
+    alertes_critiques = articles_en_alerte('rupture').order_by('stock_disponible')[:5]
     
-    # Analyse par catégorie
-    categories_alertes = articles_actifs.values('categorie').annotate(
+    # Analyse par catégorie des articles en alerte
+    categories_alertes = list(articles_en_alerte().values('categorie').annotate(
         total=Count('id'),
-        valeur_stock=Sum('variantes__qte_disponible')
-    ).exclude(categorie__isnull=True)
-    
-    # Calculer les statistiques par catégorie en Python
-    for cat in categories_alertes:
-        articles_cat = articles_actifs.filter(categorie=cat['categorie'])
-        cat['rupture'] = sum(1 for article in articles_cat if (article.total_qte_disponible or 0) <= SEUIL_RUPTURE)
-        cat['faible'] = sum(1 for article in articles_cat if SEUIL_RUPTURE < (article.total_qte_disponible or 0) <= SEUIL_STOCK_FAIBLE)
-        cat['a_commander'] = sum(1 for article in articles_cat if SEUIL_STOCK_FAIBLE < (article.total_qte_disponible or 0) <= SEUIL_A_COMMANDER)
-    
-    # Trier par rupture puis faible
-    categories_alertes = sorted(categories_alertes, key=lambda x: (x['rupture'], x['faible']), reverse=True)
+        valeur_stock=Sum('stock_disponible'),
+        rupture=Count('id', filter=Q(alerte_stock__niveau='rupture')),
+        faible=Count('id', filter=Q(alerte_stock__niveau='faible')),
+        a_commander=Count('id', filter=Q(alerte_stock__niveau='a_commander')),
+    ).exclude(categorie__isnull=True).order_by('-rupture', '-faible'))
     
     # Historique des mouvements récents
     mouvements_recents = MouvementStock.objects.filter(
@@ -3838,11 +3799,7 @@ def alertes_stock(request):
         'suggestions': suggestions,
         'filtre_actuel': filtre_alerte,
         'tri_actuel': tri,
-        'seuils': {
-            'rupture': SEUIL_RUPTURE,
-            'faible': SEUIL_STOCK_FAIBLE,
-            'a_commander': SEUIL_A_COMMANDER
-        },
+        'seuils': seuils,
         'page_title': 'Alertes Stock',
         'page_subtitle': 'Articles nécessitant une attention immédiate'
     }
@@ -3861,7 +3818,8 @@ def statistiques_stock(request):
         return redirect('login')
     
     from article.models import MouvementStock
-    from django.db.models import Q, F, Sum, Count, Avg
+    from article.inventaire import valeur_stock_par_categorie
+    from django.db.models import DecimalField, ExpressionWrapper, Value
     from django.db.models.functions import Coalesce
     
     # Paramètres de filtrage
@@ -3880,59 +3838,36 @@ def statistiques_stock(request):
     
     # Articles avec annotation du stock total
     articles_qs = articles_qs.annotate(
-        total_qte_disponible=Coalesce(Sum('variantes__qte_disponible'), 0)
+        total_qte_disponible=F('stock_disponible')
     )
     
-    # Valeur totale du stock
-    valeur_stock = sum(
-        (article.prix_unitaire or 0) * (article.total_qte_disponible or 0)
-        for article in articles_qs
-    )
-    
-    # Nombre total d'articles en stock
-    articles_en_stock = articles_qs.filter(total_qte_disponible__gt=0).count()
-    
-    # Articles par niveau de stock
+    # Valeur totale et niveaux de stock, agrégés en base
+    valeur_article = ExpressionWrapper(F('total_qte_disponible') * F('prix_unitaire'), output_field=DecimalField())
     stats_niveaux = articles_qs.aggregate(
-        total_articles=Count('id')
+        total_articles=Count('id'),
+        valeur_stock=Sum(valeur_article),
+        articles_en_stock=Count('id', filter=Q(total_qte_disponible__gt=0)),
+        rupture=Count('id', filter=Q(total_qte_disponible=0)),
+        stock_faible=Count('id', filter=Q(total_qte_disponible__gt=0, total_qte_disponible__lte=10)),
+        stock_normal=Count('id', filter=Q(total_qte_disponible__gt=10, total_qte_disponible__lte=50)),
+        stock_eleve=Count('id', filter=Q(total_qte_disponible__gt=50)),
     )
-    
-    # Calculer les statistiques en Python
-    rupture = sum(1 for article in articles_qs if (article.total_qte_disponible or 0) == 0)
-    stock_faible = sum(1 for article in articles_qs if 0 < (article.total_qte_disponible or 0) <= 10)
-    stock_normal = sum(1 for article in articles_qs if 10 < (article.total_qte_disponible or 0) <= 50)
-    stock_eleve = sum(1 for article in articles_qs if (article.total_qte_disponible or 0) > 50)
-    
-    stats_niveaux.update({
-        'rupture': rupture,
-        'stock_faible': stock_faible,
-        'stock_normal': stock_normal,
-        'stock_eleve': stock_eleve
-    })
+    valeur_stock = stats_niveaux.pop('valeur_stock') or 0
+    articles_en_stock = stats_niveaux.pop('articles_en_stock')
     
     # Taux de rupture
     taux_rupture = (stats_niveaux['rupture'] / stats_niveaux['total_articles'] * 100) if stats_niveaux['total_articles'] > 0 else 0
     
-    # Statistiques par catégorie
-    stats_categories = articles_qs.values('categorie').annotate(
+    # Statistiques par catégorie, en une requête groupée
+    stats_categories = list(articles_qs.values('categorie').annotate(
         total_articles=Count('id'),
-        stock_total=Coalesce(Sum('variantes__qte_disponible'), 0),
-        prix_moyen=Avg('prix_unitaire')
-    ).exclude(categorie__isnull=True)
-    
-    # Calculer la valeur totale, le stock moyen et les statistiques en Python
-    for cat in stats_categories:
-        articles_cat = articles_qs.filter(categorie=cat['categorie'])
-        cat['valeur_totale'] = sum(
-            (article.prix_unitaire or 0) * (article.total_qte_disponible or 0)
-            for article in articles_cat
-        )
-        cat['stock_moyen'] = sum(article.total_qte_disponible or 0 for article in articles_cat) / cat['total_articles'] if cat['total_articles'] > 0 else 0
-        cat['articles_rupture'] = sum(1 for article in articles_cat if (article.total_qte_disponible or 0) == 0)
-        cat['articles_faible'] = sum(1 for article in articles_cat if 0 < (article.total_qte_disponible or 0) <= 10)
-    
-    # Trier par valeur totale
-    stats_categories = sorted(stats_categories, key=lambda x: x['valeur_totale'], reverse=True)
+        stock_total=Sum('stock_disponible'),
+        prix_moyen=Avg('prix_unitaire'),
+        valeur_totale=Coalesce(Sum(valeur_article), Value(0), output_field=DecimalField()),
+        stock_moyen=Avg('stock_disponible'),
+        articles_rupture=Count('id', filter=Q(total_qte_disponible=0)),
+        articles_faible=Count('id', filter=Q(total_qte_disponible__gt=0, total_qte_disponible__lte=10)),
+    ).exclude(categorie__isnull=True).order_by('-valeur_totale'))
     
     # Top articles
     top_articles_valeur = articles_qs.annotate(
@@ -3945,7 +3880,7 @@ def statistiques_stock(request):
     mouvements_periode = MouvementStock.objects.filter(
         date_mouvement__gte=date_debut,
         article__in=articles_qs
-    ).select_related('article')
+    )
     
     mouvements_sortie = mouvements_periode.filter(
         type_mouvement__in=['sortie', 'ajustement_neg']
@@ -3953,23 +3888,19 @@ def statistiques_stock(request):
     
     rotation_stock = (mouvements_sortie / valeur_stock * 100) if valeur_stock > 0 else 0
     
-    # Évolution temporelle
-    evolution_donnees = []
+    # Évolution hebdomadaire de la valeur, lue dans les instantanés de clôture
     nb_semaines = min(periode // 7, 12)
-    
-    for i in range(nb_semaines):
-        date_fin = timezone.now() - timedelta(days=i*7)
-        valeur_semaine = sum(
-            (article.prix_unitaire or 0) * (article.total_qte_disponible or 0)
-            for article in articles_qs
+    aujourd_hui = timezone.localdate()
+    evolution_donnees = []
+    if nb_semaines:
+        valeurs = valeur_stock_par_categorie(
+            aujourd_hui - timedelta(days=(nb_semaines - 1) * 7), aujourd_hui, pas=7,
+            categorie=categorie_filter or None,
         )
-        
-        evolution_donnees.append({
-            'date': date_fin.strftime('%d/%m'),
-            'valeur': float(valeur_semaine)
-        })
-    
-    evolution_donnees.reverse()
+        evolution_donnees = [
+            {'date': jour.strftime('%d/%m'), 'valeur': float(sum(par_categorie.values()))}
+            for jour, par_categorie in valeurs.items()
+        ]
     
     # Alertes
     alertes = []
@@ -4223,7 +4154,7 @@ def creer_variantes_ajax(request):
                 variante.article = article
                 variante.couleur_id = couleur_id if couleur_id else None
                 variante.pointure_id = pointure_id if pointure_id else None
-                variante.qte_disponible = int(quantite) if quantite else 0
+                variante.qte_disponible = 0
                 variante.actif = True
                 
                 # Définir la référence de la variante
@@ -4233,7 +4164,14 @@ def creer_variantes_ajax(request):
                     # Générer automatiquement la référence
                     variante.reference_variante = variante.generer_reference_variante_automatique()
                 
-                variante.save()
+                with transaction.atomic():
+                    variante.save()
+                    # Stock initial en mouvement d'ajustement, comme toute variation de stock
+                    ajuster_stock_variante(
+                        variante, int(quantite) if quantite else 0,
+                        operateur=getattr(request.user, 'profil_operateur', None),
+                        commentaire="Stock initial de la variante",
+                    )
                 variantes_crees += 1
                 
             except Exception as e:
@@ -4886,7 +4824,7 @@ def cloturer_envoi(request):
                     .distinct()
                 )
             etat_enum, _ = EnumEtatCmd.objects.get_or_create(
-                libelle='En livraison',
+                libelle=EN_LIVRAISON,
                 defaults={'ordre': 17, 'couleur': '#8B5CF6'}
             )
 
@@ -4904,7 +4842,7 @@ def cloturer_envoi(request):
                         etat_actuel.save(update_fields=['date_fin'])
 
                     # Créer le nouvel état
-                    EtatCommande.objects.create(
+                    changer_etat_commande(
                         commande=commande,
                         enum_etat=etat_enum,
                         operateur=getattr(request.user, 'profil_operateur', None),
@@ -5702,72 +5640,17 @@ def export_region_consolidee_csv(request, region_name):
         etats__enum_etat__libelle='Préparée',
         etats__date_fin__isnull=True,
         ville__region__nom_region=region_name
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
+    ).distinct()
+    commandes = preparer_commandes(commandes).order_by('-date_cmd')
     
-    # Créer la réponse CSV
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
     filename = f"region_{region_name.lower().replace(' ', '_')}_consolidee_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write('\ufeff')
-    
-    writer = csv.writer(response, delimiter=';')
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (DH)', 'Adresse', 'État'
-    ]
-    writer.writerow(headers)
-    
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            f"{commande.total_cmd:.2f}" if commande.total_cmd else "0.00",
-            commande.adresse or "N/A",
-            etat_actuel
-        ]
-        writer.writerow(row)
-    
-    return response
+    return reponse_csv(Feuille(f"Région {region_name}", commandes, colonnes_commandes_consolidees()), filename)
 
 
 @superviseur_preparation_required
 def export_region_consolidee_excel(request, region_name):
     """
-    Export Excel consolidé pour une région spécifique
+    Export Excel consolidé pour une région spécifique, avec une feuille de résumé
     """
     try:
         operateur = Operateur.objects.get(user=request.user, type_operateur='PREPARATION')
@@ -5779,107 +5662,28 @@ def export_region_consolidee_excel(request, region_name):
         etats__enum_etat__libelle='Préparée',
         etats__date_fin__isnull=True,
         ville__region__nom_region=region_name
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer le fichier Excel
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
-    from openpyxl.utils import get_column_letter
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Région {region_name}"
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (DH)', 'Adresse', 'État'
-    ]
-    
-    # Ajouter les en-têtes
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color='FFFFFF')
-        cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Traiter chaque commande
-    for row, commande in enumerate(commandes, 2):
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Ajouter les données
-        ws.cell(row=row, column=1, value=commande.id_yz or commande.num_cmd)
-        ws.cell(row=row, column=2, value=f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A")
-        ws.cell(row=row, column=3, value=commande.client.numero_tel if commande.client else "N/A")
-        ws.cell(row=row, column=4, value=commande.ville.nom if commande.ville else "N/A")
-        ws.cell(row=row, column=5, value=commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A")
-        ws.cell(row=row, column=6, value=articles_consolides)
-        ws.cell(row=row, column=7, value=float(commande.total_cmd) if commande.total_cmd else 0.00)
-        ws.cell(row=row, column=8, value=commande.adresse or "N/A")
-        ws.cell(row=row, column=9, value=etat_actuel)
-        
-        # Ajuster la hauteur de la ligne pour les articles
-        if len(articles_consolides) > 100:
-            ws.row_dimensions[row].height = 30
-    
-    # Ajuster la largeur des colonnes
-    column_widths = [15, 25, 15, 15, 15, 50, 15, 40, 15]
-    for col, width in enumerate(column_widths, 1):
-        ws.column_dimensions[get_column_letter(col)].width = width
-    
-    # Ajouter une feuille de résumé
-    ws_resume = wb.create_sheet("Résumé")
-    
-    # Statistiques de la région
-    total_commandes = commandes.count()
-    total_montant = sum(float(cmd.total_cmd) for cmd in commandes if cmd.total_cmd)
-    
-    resume_data = [
-        ['Région', region_name],
-        ['Nombre de commandes', total_commandes],
-        ['Montant total', f"{total_montant:.2f} DH"],
-        ['Date d\'export', timezone.now().strftime('%d/%m/%Y %H:%M')]
-    ]
-    
-    for row, (label, value) in enumerate(resume_data, 1):
-        ws_resume.cell(row=row, column=1, value=label).font = Font(bold=True)
-        ws_resume.cell(row=row, column=2, value=value)
-    
-    # Ajuster la largeur des colonnes du résumé
-    ws_resume.column_dimensions['A'].width = 25
-    ws_resume.column_dimensions['B'].width = 20
+    ).distinct()
     
-    # Créer la réponse
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    # Statistiques de la région, agrégées en base
+    resume = Commande.objects.filter(pk__in=commandes.values('pk')).aggregate(
+        nombre=Count('pk'), montant=Sum('total_cmd')
     )
-    filename = f"region_{region_name.lower().replace(' ', '_')}_consolidee_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
     
-    wb.save(response)
-    return response
+    feuilles = [
+        Feuille(
+            f"Région {region_name}",
+            preparer_commandes(commandes).order_by('-date_cmd'),
+            colonnes_commandes_consolidees(),
+        ),
+        feuille_resume([
+            ('Région', region_name),
+            ('Nombre de commandes', resume['nombre']),
+            ('Montant total', f"{resume['montant'] or 0:.2f} DH"),
+            ('Date d\'export', timezone.now().strftime('%d/%m/%Y %H:%M')),
+        ]),
+    ]
+    filename = f"region_{region_name.lower().replace(' ', '_')}_consolidee_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    return reponse_excel(feuilles, filename)
 
 
 @superviseur_preparation_required
@@ -5903,64 +5707,11 @@ def export_ville_consolidee_csv(request, ville_id):
         etats__enum_etat__libelle='Préparée',
         etats__date_fin__isnull=True,
         ville=ville
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer la réponse CSV
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
-    response['Content-Disposition'] = f'attachment; filename="ville_{ville.nom}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write('\ufeff')
-    
-    writer = csv.writer(response, delimiter=';')
-    
-    # En-têtes
-    writer.writerow([
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (DH)', 'Adresse', 'État'
-    ])
-    
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            float(commande.total_cmd) if commande.total_cmd else 0.00,
-            commande.adresse or "N/A",
-            etat_actuel
-        ]
-        writer.writerow(row)
+    ).distinct()
+    commandes = preparer_commandes(commandes).order_by('-date_cmd')
     
-    return response
+    filename = f"ville_{ville.nom}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return reponse_csv(Feuille(f"Ville {ville.nom}", commandes, colonnes_commandes_consolidees()), filename)
 
 
 @superviseur_preparation_required
@@ -5974,101 +5725,16 @@ def export_ville_consolidee_excel(request, ville_id):
         # Récupérer toutes les commandes de cette ville
         commandes = Commande.objects.filter(
             ville=ville,
-            etat_actuel__enum_etat__libelle__in=['Confirmée', 'En préparation', 'Prête', 'Livrée']
-        ).select_related(
-            'client', 'ville', 'ville__region', 'etat_actuel', 'etat_actuel__enum_etat'
-        ).prefetch_related('paniers__article').order_by('date_cmd')
+            etat_courant__libelle__in=['Confirmée', 'En préparation', 'Prête', 'Livrée']
+        )
         
         if not commandes.exists():
             messages.warning(request, f"Aucune commande trouvée pour la ville {ville.nom}")
             return redirect('Superpreparation:liste_prepa')
-    
-        # Créer le fichier Excel
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-        from openpyxl.utils import get_column_letter
-        from datetime import datetime
-    
-        wb = Workbook()
-        ws = wb.active
-        ws.title = f"Commandes {ville.nom}"
-        
-        # Styles
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-    
-        # En-têtes
-        headers = [
-            'ID YZ', 'Numéro', 'Date', 'Client', 'Téléphone', 'Adresse', 
-            'Ville', 'Région', 'État', 'Total Articles', 'Frais Livraison', 
-            'Total Commande', 'Compteur Upsell', 'Articles'
-        ]
         
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.border = border
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-        
-        # Données
-        row = 2
-        for commande in commandes:
-            # Articles détaillés
-            articles_detail = []
-            for panier in commande.paniers.all():
-                article_info = f"{panier.article.nom} (Qté: {panier.quantite}, Prix: {panier.sous_total:.2f} DH)"
-                if panier.article.isUpsell:
-                    article_info += " [UPSELL]"
-                articles_detail.append(article_info)
-            
-            articles_text = "\n".join(articles_detail)
-            
-            ws.cell(row=row, column=1, value=commande.id_yz).border = border
-            ws.cell(row=row, column=2, value=commande.num_cmd).border = border
-            ws.cell(row=row, column=3, value=commande.date_cmd.strftime('%d/%m/%Y')).border = border
-            ws.cell(row=row, column=4, value=f"{commande.client.nom} {commande.client.prenom}").border = border
-            ws.cell(row=row, column=5, value=commande.client.numero_tel).border = border
-            ws.cell(row=row, column=6, value=commande.adresse).border = border
-            ws.cell(row=row, column=7, value=commande.ville.nom).border = border
-            ws.cell(row=row, column=8, value=commande.ville.region.nom_region).border = border
-            ws.cell(row=row, column=9, value=commande.etat_actuel.enum_etat.libelle).border = border
-            ws.cell(row=row, column=10, value=float(commande.sous_total_articles)).border = border
-            ws.cell(row=row, column=11, value=float(commande.ville.frais_livraison or 0)).border = border
-            ws.cell(row=row, column=12, value=float(commande.total_cmd)).border = border
-            ws.cell(row=row, column=13, value=commande.compteur).border = border
-            ws.cell(row=row, column=14, value=articles_text).border = border
-            
-            # Ajuster la hauteur de ligne pour les articles
-            ws.row_dimensions[row].height = max(20, len(articles_detail) * 15)
-            
-            row += 1
-        
-        # Ajuster la largeur des colonnes
-        for col in range(1, len(headers) + 1):
-            ws.column_dimensions[get_column_letter(col)].width = 15
-        
-        # Largeur spéciale pour la colonne articles
-        ws.column_dimensions['N'].width = 40
-        
-        # Nom du fichier
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"commandes_consolidees_{ville.nom}_{timestamp}.xlsx"
-        
-        # Réponse
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
-        wb.save(response)
-        return response
+        commandes = preparer_commandes(commandes).order_by('date_cmd')
+        filename = f"commandes_consolidees_{ville.nom}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        return reponse_excel([Feuille(f"Commandes {ville.nom}", commandes, colonnes_commandes_detaillees())], filename)
         
     except Exception as e:
         messages.error(request, f"Erreur lors de l'export: {str(e)}")
@@ -6097,69 +5763,42 @@ def api_prix_upsell_articles(request, commande_id):
         if not etat_preparation:
             return JsonResponse({'error': 'Cette commande ne vous est pas affectée.'}, status=403)
         
-        # Récupérer tous les articles du panier avec leurs prix mis à jour
-        paniers = commande.paniers.select_related('article').all()
+        # Tarification de tout le panier en une passe (tarifs des articles en cache)
+        paniers = commande.paniers.values_list('id', 'article_id', 'quantite')
+        resultat = tarifer_panier(paniers, commande.compteur, commande.ville_id)
         prix_articles = {}
-        
-        for panier in paniers:
-            # Utiliser le filtre Django pour calculer le prix selon la logique upsell
-            from commande.templatetags.commande_filters import get_prix_upsell_avec_compteur
-            
-            # Debug: Afficher les informations de l'article
-            print(f"🔍 Article {panier.article.id} ({panier.article.nom}):")
-            print(f"   - isUpsell: {panier.article.isUpsell}")
-            print(f"   - prix_actuel: {panier.article.prix_actuel}")
-            print(f"   - prix_unitaire: {panier.article.prix_unitaire}")
-            print(f"   - prix_upsell_1: {panier.article.prix_upsell_1}")
-            print(f"   - prix_upsell_2: {panier.article.prix_upsell_2}")
-            print(f"   - prix_upsell_3: {panier.article.prix_upsell_3}")
-            print(f"   - prix_upsell_4: {panier.article.prix_upsell_4}")
-            print(f"   - compteur: {commande.compteur}")
-            
-            prix_calcule = get_prix_upsell_avec_compteur(panier.article, commande.compteur)
-            print(f"   - prix_calcule: {prix_calcule}")
-            
+
+        for ligne in resultat.lignes:
             # Convertir en float pour éviter les problèmes de sérialisation JSON
-            prix_calcule = float(prix_calcule) if prix_calcule is not None else 0.0
-            
+            prix_calcule = float(ligne.prix_unitaire) if ligne.prix_unitaire is not None else 0.0
+
             # Déterminer le type de prix et les informations
-            if panier.article.isUpsell:
+            if ligne.is_upsell:
                 prix_type = "upsell"
-                
-                # Déterminer le niveau d'upsell affiché
-                if commande.compteur >= 4 and panier.article.prix_upsell_4 is not None:
-                    niveau_upsell = 4
-                elif commande.compteur >= 3 and panier.article.prix_upsell_3 is not None:
-                    niveau_upsell = 3
-                elif commande.compteur >= 2 and panier.article.prix_upsell_2 is not None:
-                    niveau_upsell = 2
-                elif commande.compteur >= 1 and panier.article.prix_upsell_1 is not None:
-                    niveau_upsell = 1
-                else:
-                    niveau_upsell = 0
-                
+                niveau_upsell = ligne.niveau_upsell
+
                 if niveau_upsell > 0:
                     libelle = f"Upsell Niveau {niveau_upsell}"
                 else:
                     libelle = "Upsell (Prix normal)"
-                    
+
                 icone = "fas fa-arrow-up"
             else:
                 prix_type = "normal"
                 libelle = "Prix normal"
                 icone = "fas fa-tag"
                 niveau_upsell = 0
-            
-            prix_articles[panier.id] = {
+
+            prix_articles[ligne.panier_id] = {
                 'prix': prix_calcule,
                 'type': prix_type,
                 'libelle': libelle,
                 'icone': icone,
                 'niveau_upsell': niveau_upsell,
-                'is_upsell': panier.article.isUpsell,
-                'sous_total': float(prix_calcule * panier.quantite)
+                'is_upsell': ligne.is_upsell,
+                'sous_total': ligne.sous_total,
             }
-        
+
         return JsonResponse({
             'success': True,
             'prix_articles': prix_articles,
@@ -6347,75 +5986,50 @@ def commandes_confirmees(request):
 def get_article_variants(request, article_id):
     """
     Récupère toutes les variantes disponibles d'un article donné
+    (matrice de disponibilité en cache et tarifs en cache : une requête pour l'article)
     """
     try:
-        from article.models import Article, VarianteArticle
-        
-        print(f"🔍 Recherche des variantes pour l'article ID: {article_id} (type: {type(article_id)})")
-        
-        # D'abord, vérifier si l'article existe (avec ou sans le filtre actif=True)
-        try:
-            article_test = Article.objects.get(id=article_id)
-            print(f"📋 Article trouvé mais actif={article_test.actif}")
-        except Article.DoesNotExist:
-            print(f"❌ Aucun article trouvé avec l'ID {article_id}")
-            # Lister quelques articles pour debug
-            articles_existants = Article.objects.all()[:5]
-            print("📚 Articles existants (premiers 5):")
-            for art in articles_existants:
-                print(f"   - ID: {art.id}, Nom: {art.nom}, Actif: {art.actif}")
+        from article.disponibilite import matrice_disponibilite
+        from article.tarifs import tarifs_articles
         
         # Vérifier que l'article existe ET est actif
-        article = get_object_or_404(Article, id=article_id, actif=True)
-        print(f"✅ Article trouvé: {article.nom}")
-        
-        # Récupérer toutes les variantes actives de cet article
-        variantes = VarianteArticle.objects.filter(
-            article=article,
-            actif=True
-        ).select_related('couleur', 'pointure').order_by('couleur__nom', 'pointure__ordre')
+        article = Article.objects.filter(id=article_id, actif=True).values('id', 'nom', 'reference').first()
+        if article is None:
+            return JsonResponse({
+                'success': False,
+                'error': 'Article non trouvé'
+            }, status=404)
         
-        print(f"📊 Nombre de variantes trouvées: {variantes.count()}")
+        tarif = tarifs_articles([article_id])[article_id]
         
-        # Construire la liste des variantes avec leurs informations
+        # Variantes actives, couleur par couleur puis pointure par pointure
         variants_data = []
-        for variante in variantes:
-            print(f"🔸 Variante: {variante.id} - Couleur: {variante.couleur} - Pointure: {variante.pointure} - Stock: {variante.qte_disponible}")
-            
-            variant_info = {
+        for variante in matrice_disponibilite(article_id).cellules():
+            variants_data.append({
                 'id': variante.id,
-                'couleur': variante.couleur.nom if variante.couleur else None,
-                'pointure': variante.pointure.pointure if variante.pointure else None,
+                'couleur': variante.couleur,
+                'pointure': variante.pointure,
                 'taille': None,  # À adapter selon votre modèle si vous avez des tailles
                 'stock': variante.qte_disponible,
                 'qte_disponible': variante.qte_disponible,
-                'prix_unitaire': float(variante.prix_unitaire),
-                'prix_actuel': float(variante.prix_actuel),
+                'prix_unitaire': float(tarif.prix_unitaire),
+                'prix_actuel': float(tarif.prix_normal),
                 'reference_variante': variante.reference_variante,
-                'est_disponible': variante.est_disponible
-            }
-            variants_data.append(variant_info)
+                'est_disponible': variante.qte_disponible > 0
+            })
         
         response_data = {
             'success': True,
             'variants': variants_data,
             'article': {
-                'id': article.id,
-                'nom': article.nom,
-                'reference': article.reference
+                'id': article['id'],
+                'nom': article['nom'],
+                'reference': article['reference']
             }
         }
         
-        print(f"📤 Réponse envoyée: {len(variants_data)} variantes")
         return JsonResponse(response_data)
         
-    except Article.DoesNotExist:
-        print(f"❌ Article {article_id} non trouvé")
-        return JsonResponse({
-            'success': False,
-            'error': 'Article non trouvé'
-        }, status=404)
-        
     except Exception as e:
         import traceback
         print(f"❌ Erreur dans get_article_variants: {str(e)}")
@@ -7039,12 +6653,11 @@ def api_finaliser_preparation(request, commande_id):
         etat_actuel.save()
         
         # Créer le nouvel état (Préparée)
-        nouvel_etat = EtatCommande.objects.create(
+        nouvel_etat = changer_etat_commande(
             commande=commande,
             enum_etat=etat_preparee,
             operateur=operateur,
-            date_debut=timezone.now(),
-            date_fin=None  # État actif
+            date_debut=timezone.now()
         )
         
         # Créer une opération pour tracer l'action
@@ -7078,178 +6691,14 @@ def api_finaliser_preparation(request, commande_id):
             'error': f'Erreur lors de la finalisation: {str(e)}'
         }, status=500)
 
+
 @csrf_exempt
 @login_required
 def export_commandes_envoi_excel(request, envoi_id):
-    """Exporter les commandes préparées d'un envoi en fichier Excel"""
-    from django.http import HttpResponse
-    from django.utils import timezone
-    
-    try:
-        print(f"🔍 DEBUG - Export Excel pour envoi ID: {envoi_id}")
-        
-        # Récupérer l'envoi
-        envoi = Envoi.objects.select_related('region').get(id=envoi_id)
-        print(f"🔍 DEBUG - Envoi trouvé: {envoi.numero_envoi}, Région: {envoi.region.nom_region}")
-        
-        # Importer openpyxl après avoir vérifié l'envoi
-        try:
-            import openpyxl
-            from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-            print("🔍 DEBUG - Imports openpyxl réussis")
-        except ImportError as import_error:
-            print(f"🚫 ERREUR - Import openpyxl échoué: {import_error}")
-            return JsonResponse({
-                'success': False,
-                'error': f'Erreur d\'import openpyxl: {import_error}'
-            }, status=500)
-        
-        # Récupérer les commandes associées à cet envoi. Si aucune n'est encore liée,
-        # fallback: prendre les commandes "Préparée" de la région de l'envoi.
-        commandes = (
-            Commande.objects.filter(envoi=envoi)
-            .select_related('client', 'ville', 'ville__region')
-            .prefetch_related(
-                'paniers__article',
-                'paniers__variante',
-                'paniers__variante__couleur',
-                'paniers__variante__pointure',
-            )
-            .distinct()
-        )
-
-        if not commandes.exists():
-            print("🔎 Aucun lien direct commande→envoi. Fallback sur commandes 'Préparée' de la région.")
-            commandes = (
-                Commande.objects.filter(
-                    ville__region=envoi.region,
-                    etats__enum_etat__libelle='Préparée',
-                    etats__date_fin__isnull=True,
-                )
-                .select_related('client', 'ville', 'ville__region')
-                .prefetch_related(
-                    'paniers__article',
-                    'paniers__variante',
-                    'paniers__variante__couleur',
-                    'paniers__variante__pointure',
-                )
-                .distinct()
-            )
-        
-        print(f"🔍 DEBUG - Nombre de commandes trouvées: {commandes.count()}")
-        
-        # Test: Créer un workbook simple d'abord
-        try:
-            wb = openpyxl.Workbook()
-            print("🔍 DEBUG - Workbook créé avec succès")
-            ws = wb.active
-            ws.title = f"Envoi_{envoi.numero_envoi}"[:31]  # Limiter à 31 caractères
-            print(f"🔍 DEBUG - Worksheet configuré: {ws.title}")
-        except Exception as wb_error:
-            print(f"🚫 ERREUR - Création workbook échouée: {wb_error}")
-            raise wb_error
-        
-        # TEST SIMPLE: Ajoutons juste quelques données de base
-        try:
-            # En-tête simple
-            ws['A1'] = f"EXPORT COMMANDES - ENVOI {envoi.numero_envoi}"
-            ws['A2'] = f"Région: {envoi.region.nom_region}"
-            ws['A3'] = f"Date: {timezone.now().strftime('%d/%m/%Y %H:%M')}"
-            
-            # En-têtes des colonnes
-            headers = ['N° Commande', 'Client', 'Téléphone', 'Adresse', 'Ville', 'Région', 'Total', 'Panier']
-            for col, header in enumerate(headers, 1):
-                ws.cell(row=5, column=col, value=header)
-            
-            print(f"🔍 DEBUG - En-têtes ajoutés")
-            
-            # Données simplifiées des commandes
-            row = 6
-            for commande in commandes:
-                try:
-                    # Données de base
-                    client_nom = (
-                        f"{(commande.client.prenom or '').strip()} {(commande.client.nom or '').strip()}".strip()
-                        if commande.client else "N/A"
-                    )
-                    adresse_livraison = commande.adresse or (commande.client.adresse if getattr(commande, 'client', None) else '') or ""
-                    ville_nom = commande.ville.nom if commande.ville else "N/A"
-                    region_nom = commande.ville.region.nom_region if getattr(commande, 'ville', None) and commande.ville.region else (
-                        envoi.region.nom_region if envoi and envoi.region else "N/A"
-                    )
-
-                    # Détails du panier (items)
-                    items_texts = []
-                    for p in commande.paniers.all():
-                        try:
-                            article_nom = p.article.nom if p.article else "Article N/A"
-                            variante_text = ""
-                            if p.variante:
-                                couleur = getattr(p.variante.couleur, 'nom', None)
-                                pointure = getattr(p.variante.pointure, 'pointure', None)
-                                details = [v for v in [couleur, pointure] if v]
-                                if details:
-                                    variante_text = f" ({' - '.join(details)})"
-                            items_texts.append(f"{p.quantite}x {article_nom}{variante_text}")
-                        except Exception as p_err:
-                            print(f"⚠️ ERREUR panier commande {commande.id}: {p_err}")
-                            continue
-                    panier_str = "\n".join(items_texts) if items_texts else ""
-
-                    # Ecrire la ligne
-                    ws.cell(row=row, column=1, value=commande.num_cmd)
-                    ws.cell(row=row, column=2, value=client_nom)
-                    ws.cell(row=row, column=3, value=getattr(commande.client, 'numero_tel', '') if commande.client else '')
-                    ws.cell(row=row, column=4, value=adresse_livraison)
-                    ws.cell(row=row, column=5, value=ville_nom)
-                    ws.cell(row=row, column=6, value=region_nom)
-                    # Total commande (montant total des articles)
-                    ws.cell(row=row, column=7, value=float(getattr(commande, 'total_cmd', 0) or 0))
-                    panier_cell = ws.cell(row=row, column=8, value=panier_str)
-                    panier_cell.alignment = Alignment(wrap_text=True, vertical='top')
-
-                    row += 1
-
-                except Exception as row_error:
-                    print(f"🚫 ERREUR - Ligne commande {commande.id}: {row_error}")
-                    continue
-            
-            print(f"🔍 DEBUG - {row-6} lignes de données ajoutées")
-            
-        except Exception as data_error:
-            print(f"🚫 ERREUR - Ajout des données: {data_error}")
-            raise data_error
-        
-        # Préparer la réponse HTTP
-        try:
-            print("🔍 DEBUG - Préparation de la réponse HTTP")
-            response = HttpResponse(
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-            response['Content-Disposition'] = f'attachment; filename="Envoi_{envoi.numero_envoi}_Commandes.xlsx"'
-            print(f"🔍 DEBUG - Headers HTTP configurés")
-            
-            # Sauvegarder le workbook dans la réponse
-            print("🔍 DEBUG - Sauvegarde du workbook...")
-            wb.save(response)
-            print("🔍 DEBUG - Workbook sauvegardé avec succès")
-            
-            return response
-            
-        except Exception as save_error:
-            print(f"🚫 ERREUR - Sauvegarde échouée: {save_error}")
-            raise save_error
-        
-    except Envoi.DoesNotExist:
+    """Exporter les commandes préparées d'un envoi en fichier Excel (construit en arrière-plan)"""
+    if not Envoi.objects.filter(id=envoi_id).exists():
         return JsonResponse({'success': False, 'error': 'Envoi non trouvé'}, status=404)
-    except Exception as e:
-        import traceback
-        print(f"Erreur dans export_commandes_envoi_excel: {str(e)}")
-        print(traceback.format_exc())
-        return JsonResponse({
-            'success': False,
-            'error': f'Erreur lors de la génération du fichier Excel: {str(e)}'
-        }, status=500)
+    return lancer_export(request, 'commandes_envoi', {'envoi_id': envoi_id})
 
 
 @superviseur_preparation_required
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Article, Promotion, Categorie, Genre, Pointure, Couleur, VarianteArticle, MouvementStock
+from .models import Article, Promotion, Categorie, Genre, Pointure, Couleur, VarianteArticle, MouvementStock, SeuilStock
 from django.db.models import Sum, Q
 from django.contrib import messages
 from django.http import HttpResponseRedirect
@@ -264,4 +264,12 @@ class PromotionAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         if not obj.cree_par:
             obj.cree_par = request.user
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        super().save_model(request, obj, form, change)
+
+
+@admin.register(SeuilStock)
+class SeuilStockAdmin(admin.ModelAdmin):
+    list_display = ('article', 'categorie', 'rupture', 'faible', 'a_commander')
+    list_editable = ('rupture', 'faible', 'a_commander')
+    search_fields = ('article__nom', 'article__reference', 'categorie__nom')
+    autocomplete_fields = ('article',)
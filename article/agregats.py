@@ -0,0 +1,86 @@
+"""
+Agrégats de stock stockés sur Article.
+
+stock_disponible, nb_variantes_actives, couleur_principale et pointure_principale
+résument les variantes actives de l'article. Ils sont recalculés par une seule
+requête UPDATE à chaque écriture de variante ou de mouvement de stock (voir
+article.signals), dans la transaction de l'écriture, afin que les listes
+d'articles n'agrègent plus les variantes ligne par ligne.
+
+Les écritures qui contournent les signaux (QuerySet.update, SQL brut) doivent
+appeler recalculer_agregats_articles ; la commande verifier_stocks_articles
+détecte et corrige les écarts restants. Chaque recalcul met aussi à jour les
+alertes de stock des articles (article.alertes) et invalide leurs matrices de
+disponibilité (article.disponibilite).
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .alertes import actualiser_alertes
+from .disponibilite import invalider_disponibilite
+from .models import Article, VarianteArticle
+
+CHAMPS_AGREGATS_STOCK = Article.CHAMPS_AGREGATS_STOCK
+
+TAILLE_LOT = 500
+
+
+def _variantes_actives():
+    return VarianteArticle.objects.filter(article=OuterRef('pk'), actif=True)
+
+
+def expressions_agregats():
+    """Expressions SQL des agrégats d'un article (sous-requêtes corrélées sur ses variantes actives)"""
+    par_article = _variantes_actives().order_by().values('article')
+    # Même ordre que VarianteArticle.Meta.ordering, utilisé par les anciennes propriétés couleur/pointure
+    premiere = _variantes_actives().order_by('couleur__nom', 'pointure__pointure', 'pk')
+    return {
+        'stock_disponible': Coalesce(
+            Subquery(par_article.annotate(total=Sum('qte_disponible')).values('total'), output_field=IntegerField()),
+            0,
+        ),
+        'nb_variantes_actives': Coalesce(
+            Subquery(par_article.annotate(nombre=Count('pk')).values('nombre'), output_field=IntegerField()),
+            0,
+        ),
+        'couleur_principale': Coalesce(Subquery(premiere.values('couleur__nom')[:1]), Value('')),
+        'pointure_principale': Coalesce(Subquery(premiere.values('pointure__pointure')[:1]), Value('')),
+    }
+
+
+def recalculer_agregats_articles(article_ids):
+    """Recalcule les agrégats des articles donnés (une requête UPDATE par lot), leurs alertes et leur disponibilité"""
+    article_ids = sorted({pk for pk in article_ids if pk})
+    nombre = 0
+    for debut in range(0, len(article_ids), TAILLE_LOT):
+        nombre += Article.objects.filter(pk__in=article_ids[debut:debut + TAILLE_LOT]).update(**expressions_agregats())
+    actualiser_alertes(article_ids)
+    invalider_disponibilite(article_ids)
+    return nombre
+
+
+def articles_incoherents(articles=None):
+    """
+    Articles dont les agrégats stockés diffèrent des variantes.
+
+    Returns:
+        list: dicts {id, nom, ecarts: {champ: (valeur stockée, valeur attendue)}}
+    """
+    articles = Article.objects.all() if articles is None else articles
+    attendus = {f'attendu_{champ}': expression for champ, expression in expressions_agregats().items()}
+    ecart = Q()
+    for champ in CHAMPS_AGREGATS_STOCK:
+        ecart |= ~Q(**{champ: F(f'attendu_{champ}')})
+
+    incoherents = []
+    valeurs = articles.annotate(**attendus).filter(ecart).values('id', 'nom', *CHAMPS_AGREGATS_STOCK, *attendus)
+    for ligne in valeurs.order_by('pk'):
+        incoherents.append({
+            'id': ligne['id'],
+            'nom': ligne['nom'],
+            'ecarts': {
+                champ: (ligne[champ], ligne[f'attendu_{champ}'])
+                for champ in CHAMPS_AGREGATS_STOCK if ligne[champ] != ligne[f'attendu_{champ}']
+            },
+        })
+    return incoherents
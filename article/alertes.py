@@ -0,0 +1,108 @@
+"""
+Alertes de stock.
+
+Chaque article actif est classé par rapport à ses seuils effectifs (SeuilStock
+de l'article, sinon de sa catégorie, sinon STOCK_SEUILS_ALERTE) : rupture,
+stock faible, à commander ou aucun niveau. Le classement est calculé en SQL,
+pour tous les articles d'un lot en une requête.
+
+AlerteStock ne contient que les articles en alerte. actualiser_alertes est
+appelé après chaque recalcul des agrégats de stock (article.agregats) et
+n'écrit que lorsqu'un article change de niveau : la page des alertes et les
+compteurs lisent cette table et ne parcourent plus le catalogue.
+
+Après un changement de STOCK_SEUILS_ALERTE, reconstruire la table avec la
+commande actualiser_alertes_stock.
+"""
+from django.conf import settings
+from django.db.models import Case, CharField, Count, F, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import AlerteStock, Article
+
+NIVEAUX = ('rupture', 'faible', 'a_commander')
+
+SEUILS_DEFAUT = {'rupture': 0, 'faible': 10, 'a_commander': 20}
+
+TAILLE_LOT = 500
+
+
+def seuils_defaut():
+    """Seuils appliqués aux articles sans SeuilStock (ni pour eux ni pour leur catégorie)"""
+    return {**SEUILS_DEFAUT, **getattr(settings, 'STOCK_SEUILS_ALERTE', {})}
+
+
+def annoter_seuils(articles):
+    """Ajoute seuil_rupture, seuil_faible, seuil_a_commander et niveau_calcule ('' hors alerte)"""
+    defaut = seuils_defaut()
+    articles = articles.annotate(**{
+        f'seuil_{niveau}': Coalesce(
+            F(f'seuil_stock__{niveau}'), F(f'categorie__seuil_stock__{niveau}'), Value(defaut[niveau]),
+        )
+        for niveau in NIVEAUX
+    })
+    return articles.annotate(niveau_calcule=Case(
+        *(When(stock_disponible__lte=F(f'seuil_{niveau}'), then=Value(niveau)) for niveau in NIVEAUX),
+        default=Value(''),
+        output_field=CharField(),
+    ))
+
+
+def _actualiser_lot(article_ids):
+    niveaux = dict(
+        annoter_seuils(Article.objects.filter(actif=True, pk__in=article_ids))
+        .exclude(niveau_calcule='').order_by().values_list('pk', 'niveau_calcule')
+    )
+    actuels = dict(AlerteStock.objects.filter(article_id__in=article_ids).values_list('article_id', 'niveau'))
+
+    sorties = [pk for pk in actuels if pk not in niveaux]
+    changements = [pk for pk, niveau in niveaux.items() if actuels.get(pk) != niveau]
+    if sorties:
+        AlerteStock.objects.filter(article_id__in=sorties).delete()
+    if changements:
+        maintenant = timezone.now()
+        AlerteStock.objects.bulk_create(
+            [AlerteStock(article_id=pk, niveau=niveaux[pk], date_alerte=maintenant) for pk in changements],
+            update_conflicts=True,
+            unique_fields=['article'],
+            update_fields=['niveau', 'date_alerte'],
+        )
+    return len(sorties) + len(changements)
+
+
+def actualiser_alertes(article_ids):
+    """
+    Met à jour les alertes des articles donnés (deux lectures par lot, écritures
+    seulement pour les articles qui changent de niveau).
+
+    Returns:
+        int: nombre d'articles entrés, sortis ou ayant changé de niveau
+    """
+    article_ids = sorted({pk for pk in article_ids if pk})
+    nombre = 0
+    for debut in range(0, len(article_ids), TAILLE_LOT):
+        nombre += _actualiser_lot(article_ids[debut:debut + TAILLE_LOT])
+    return nombre
+
+
+def reconstruire_alertes():
+    """Recalcule les alertes de tout le catalogue (articles inactifs compris, pour les retirer)"""
+    article_ids = set(Article.objects.values_list('pk', flat=True))
+    article_ids.update(AlerteStock.objects.values_list('article_id', flat=True))
+    return actualiser_alertes(article_ids)
+
+
+def compteurs_alertes():
+    """Nombre d'articles par niveau d'alerte, en une requête groupée sur la table des alertes"""
+    compteurs = dict.fromkeys(NIVEAUX, 0)
+    compteurs.update(AlerteStock.objects.order_by().values_list('niveau').annotate(nombre=Count('pk')))
+    return compteurs
+
+
+def articles_en_alerte(niveau=None):
+    """Articles en alerte (d'un niveau donné), annotés de niveau_alerte"""
+    articles = Article.objects.filter(alerte_stock__isnull=False)
+    if niveau:
+        articles = articles.filter(alerte_stock__niveau=niveau)
+    return articles.annotate(niveau_alerte=F('alerte_stock__niveau'))
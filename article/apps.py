@@ -1,4 +1,16 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
+
+
+def _processus_serveur():
+    """Processus qui sert les requêtes (et non une commande de gestion ou le superviseur de runserver)"""
+    commande = sys.argv[1] if len(sys.argv) > 1 else ''
+    if os.path.basename(sys.argv[0]) == 'manage.py' and commande != 'runserver':
+        return False
+    return commande != 'runserver' or os.environ.get('RUN_MAIN') == 'true'
 
 
 class ArticleConfig(AppConfig):
@@ -7,3 +19,7 @@ class ArticleConfig(AppConfig):
 
     def ready(self):
         import article.signals
+
+        if settings.PROMOTIONS_PLANIFICATEUR and _processus_serveur():
+            from article.planificateur import demarrer_planificateur
+            demarrer_planificateur()
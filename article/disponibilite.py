@@ -0,0 +1,139 @@
+"""
+Matrice de disponibilité des variantes d'un article.
+
+Pour chaque article : la liste des couleurs, la liste des pointures et, ligne
+par ligne (une ligne par couleur, une colonne par pointure), l'identifiant et
+la quantité disponible de chaque variante active, None si la combinaison
+n'existe pas. Les matrices manquantes d'un lot d'articles sont construites en
+une seule requête sur VarianteArticle jointe à Couleur et Pointure.
+
+Les matrices sont gardées dans le cache 'disponibilite' (Redis si configuré,
+sinon mémoire locale), une clé par article, et supprimées après le commit de
+toute écriture de stock : recalculer_agregats_articles (article.agregats), par
+lequel passent les mouvements, les variantes et les renommages de couleur ou
+de pointure, appelle invalider_disponibilite. La durée de vie des entrées est
+celle de l'alias (filet de sécurité pour les écritures SQL qui contourneraient
+l'invalidation, et pour les autres processus sans Redis).
+"""
+from typing import NamedTuple, Optional
+
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import VarianteArticle
+
+ALIAS_CACHE_DISPONIBILITE = 'disponibilite'
+
+CLE_MATRICE = 'disponibilite:{}'
+
+
+def _cache():
+    return caches[ALIAS_CACHE_DISPONIBILITE]
+
+
+class Cellule(NamedTuple):
+    """Variante active d'une matrice, avec ses libellés"""
+    id: int
+    couleur: Optional[str]
+    pointure: Optional[str]
+    qte_disponible: int
+    reference_variante: Optional[str]
+
+
+class MatriceDisponibilite(NamedTuple):
+    article_id: int
+    couleurs: tuple
+    pointures: tuple
+    variantes: tuple
+    quantites: tuple
+    references: tuple
+
+    def cellules(self):
+        """Variantes existantes, couleur par couleur puis pointure par pointure"""
+        largeur = len(self.pointures)
+        for index, variante_id in enumerate(self.variantes):
+            if variante_id is not None:
+                yield Cellule(
+                    variante_id,
+                    self.couleurs[index // largeur],
+                    self.pointures[index % largeur],
+                    self.quantites[index],
+                    self.references[index],
+                )
+
+    @property
+    def stock_total(self):
+        return sum(quantite for quantite in self.quantites if quantite)
+
+    def compacte(self):
+        """Forme JSON de l'API : tableaux plats, ligne par couleur (index = couleur * nb_pointures + pointure)"""
+        return {
+            'article': self.article_id,
+            'couleurs': self.couleurs,
+            'pointures': self.pointures,
+            'variantes': self.variantes,
+            'quantites': self.quantites,
+        }
+
+
+def _construire(article_ids):
+    lignes = (
+        VarianteArticle.objects.filter(article_id__in=article_ids, actif=True)
+        .order_by('couleur__nom', 'pointure__ordre', 'pointure__pointure', 'pk')
+        .values_list(
+            'article_id', 'pk', 'couleur__nom', 'pointure__pointure', 'pointure__ordre',
+            'qte_disponible', 'reference_variante',
+        )
+    )
+    par_article = {article_id: [] for article_id in article_ids}
+    for ligne in lignes:
+        par_article[ligne[0]].append(ligne)
+
+    matrices = {}
+    for article_id, variantes in par_article.items():
+        couleurs = list(dict.fromkeys(couleur for _, _, couleur, _, _, _, _ in variantes))
+        pointures = [
+            pointure for pointure, _ in sorted(
+                {(pointure, ordre) for _, _, _, pointure, ordre, _, _ in variantes},
+                key=lambda item: (item[1] if item[1] is not None else 0, item[0] or ''),
+            )
+        ]
+        index_couleur = {couleur: index for index, couleur in enumerate(couleurs)}
+        index_pointure = {pointure: index for index, pointure in enumerate(pointures)}
+
+        taille = len(couleurs) * len(pointures)
+        ids, quantites, references = [None] * taille, [None] * taille, [None] * taille
+        for _, variante_id, couleur, pointure, _, quantite, reference in variantes:
+            index = index_couleur[couleur] * len(pointures) + index_pointure[pointure]
+            ids[index], quantites[index], references[index] = variante_id, quantite, reference
+
+        matrices[article_id] = MatriceDisponibilite(
+            article_id, tuple(couleurs), tuple(pointures), tuple(ids), tuple(quantites), tuple(references),
+        )
+    return matrices
+
+
+def matrices_disponibilite(article_ids):
+    """Matrices des articles demandés : {article_id: MatriceDisponibilite} (une requête pour les absentes du cache)"""
+    article_ids = list(dict.fromkeys(article_ids))
+    cles = {CLE_MATRICE.format(article_id): article_id for article_id in article_ids}
+    en_cache = _cache().get_many(cles)
+    matrices = {cles[cle]: matrice for cle, matrice in en_cache.items()}
+
+    manquants = [article_id for article_id in article_ids if article_id not in matrices]
+    if manquants:
+        construites = _construire(manquants)
+        _cache().set_many({CLE_MATRICE.format(article_id): matrice for article_id, matrice in construites.items()})
+        matrices.update(construites)
+    return {article_id: matrices[article_id] for article_id in article_ids}
+
+
+def matrice_disponibilite(article_id):
+    return matrices_disponibilite([article_id])[article_id]
+
+
+def invalider_disponibilite(article_ids):
+    """Supprime les matrices des articles après le commit (les lectures d'ici là voient l'ancien stock)"""
+    cles = [CLE_MATRICE.format(article_id) for article_id in article_ids]
+    if cles:
+        transaction.on_commit(lambda: _cache().delete_many(cles))
@@ -0,0 +1,186 @@
+"""
+Journal de stock : instantanés de clôture et requêtes à date.
+
+cloturer_journee écrit chaque nuit, pour chaque variante active d'un article
+actif, la quantité et la valeur (au prix unitaire du moment) à la fin de la
+journée. Le stock de clôture se déduit du stock courant moins les mouvements
+postérieurs ; exécutée juste après minuit, la clôture ne lit que la queue de
+mouvements de la nuit.
+
+Les requêtes à date partent du dernier instantané disponible et n'appliquent
+que les mouvements qui le suivent (index variante / date_mouvement), au lieu de
+parcourir tout l'historique :
+
+- stock_variante_a(variante_id, instant) : quantité d'une variante à un instant ;
+- valeur_stock_par_categorie(debut, fin) : valeur du stock par catégorie à la
+  clôture de chaque jour de la période (valeur courante pour aujourd'hui).
+
+Les jours sans instantané (avant la première clôture) sont reconstitués en deux
+requêtes à partir du stock courant, au prix unitaire actuel.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import InstantaneStock, MouvementStock, VarianteArticle
+
+TAILLE_LOT = 500
+
+CHAMP_VALEUR = DecimalField(max_digits=14, decimal_places=2)
+
+
+def fin_de_journee(jour):
+    """Premier instant du lendemain, dans le fuseau du projet"""
+    return timezone.make_aware(datetime.combine(jour + timedelta(days=1), time.min))
+
+
+def _variantes_valorisees():
+    return VarianteArticle.objects.filter(actif=True, article__isnull=False, article__actif=True)
+
+
+def _mouvements_valorises():
+    return MouvementStock.objects.filter(variante__actif=True, article__actif=True)
+
+
+def cloturer_journee(jour=None):
+    """
+    Écrit (ou réécrit) les instantanés de clôture du jour donné (hier par défaut).
+
+    Returns:
+        int: nombre de variantes clôturées
+    """
+    if jour is None:
+        jour = timezone.localdate() - timedelta(days=1)
+
+    with transaction.atomic():
+        queue = dict(
+            _mouvements_valorises()
+            .filter(date_mouvement__gte=fin_de_journee(jour))
+            .order_by().values('variante').annotate(total=Sum('quantite'))
+            .values_list('variante', 'total')
+        )
+        variantes = _variantes_valorisees().order_by('pk').values_list(
+            'pk', 'article_id', 'article__categorie_id', 'article__prix_unitaire', 'qte_disponible',
+        )
+
+        instantanes = []
+        for variante_id, article_id, categorie_id, prix_unitaire, qte_disponible in variantes.iterator():
+            quantite = qte_disponible - queue.get(variante_id, 0)
+            instantanes.append(InstantaneStock(
+                variante_id=variante_id,
+                article_id=article_id,
+                categorie_id=categorie_id,
+                date=jour,
+                quantite=quantite,
+                valeur=(prix_unitaire or 0) * quantite,
+            ))
+
+        InstantaneStock.objects.bulk_create(
+            instantanes,
+            batch_size=TAILLE_LOT,
+            update_conflicts=True,
+            unique_fields=['variante', 'date'],
+            update_fields=['article', 'categorie', 'quantite', 'valeur'],
+        )
+    return len(instantanes)
+
+
+def stock_variante_a(variante_id, instant):
+    """
+    Quantité d'une variante à l'instant donné (mouvements de cet instant inclus).
+
+    Dernier instantané clôturé avant l'instant, plus les mouvements qui le
+    suivent ; sans instantané, stock courant moins les mouvements postérieurs.
+    """
+    instantane = (
+        InstantaneStock.objects.filter(variante_id=variante_id, date__lt=timezone.localdate(instant))
+        .order_by('-date').values_list('date', 'quantite').first()
+    )
+    mouvements = MouvementStock.objects.filter(variante_id=variante_id).order_by()
+    if instantane:
+        jour, quantite = instantane
+        queue = mouvements.filter(
+            date_mouvement__gte=fin_de_journee(jour), date_mouvement__lte=instant,
+        ).aggregate(total=Sum('quantite'))['total']
+        return quantite + (queue or 0)
+
+    courant = VarianteArticle.objects.filter(pk=variante_id).values_list('qte_disponible', flat=True).get()
+    posterieurs = mouvements.filter(date_mouvement__gt=instant).aggregate(total=Sum('quantite'))['total']
+    return courant - (posterieurs or 0)
+
+
+def _valeurs_reconstituees(jours, categorie=None):
+    """Valeur par catégorie à la clôture de jours sans instantané, depuis le stock courant"""
+    variantes = _variantes_valorisees()
+    mouvements = _mouvements_valorises().filter(date_mouvement__gte=fin_de_journee(min(jours)))
+    if categorie:
+        variantes = variantes.filter(article__categorie=categorie)
+        mouvements = mouvements.filter(article__categorie=categorie)
+
+    courantes = dict(
+        variantes.order_by().values('article__categorie').annotate(
+            valeur=Sum(ExpressionWrapper(F('qte_disponible') * F('article__prix_unitaire'), output_field=CHAMP_VALEUR)),
+        ).values_list('article__categorie', 'valeur')
+    )
+    # Variation de valeur par catégorie et par jour de mouvement
+    variations = defaultdict(list)
+    for categorie_id, jour, valeur in (
+        mouvements.annotate(jour=TruncDate('date_mouvement')).order_by()
+        .values('article__categorie', 'jour').annotate(
+            valeur=Sum(ExpressionWrapper(F('quantite') * F('article__prix_unitaire'), output_field=CHAMP_VALEUR)),
+        ).values_list('article__categorie', 'jour', 'valeur')
+    ):
+        variations[categorie_id].append((jour, valeur))
+
+    resultat = {}
+    for jour in jours:
+        resultat[jour] = {
+            categorie_id: valeur - sum((v for j, v in variations[categorie_id] if j > jour), Decimal('0'))
+            for categorie_id, valeur in courantes.items()
+        }
+    return resultat
+
+
+def valeur_stock_par_categorie(debut, fin, pas=1, categorie=None):
+    """
+    Valeur du stock par catégorie à la clôture de chaque jour de la période.
+
+    Args:
+        debut, fin: bornes incluses (dates)
+        pas: écart en jours entre deux points, en partant de `fin`
+        categorie: restreindre à une catégorie
+
+    Returns:
+        dict: {jour: {categorie_id: Decimal}}, jours croissants
+    """
+    jours = []
+    jour = fin
+    while jour >= debut:
+        jours.append(jour)
+        jour -= timedelta(days=pas)
+    jours.reverse()
+    if not jours:
+        return {}
+
+    aujourd_hui = timezone.localdate()
+    instantanes = InstantaneStock.objects.filter(date__in=[j for j in jours if j < aujourd_hui])
+    if categorie:
+        instantanes = instantanes.filter(categorie=categorie)
+    resultat = {jour: {} for jour in jours}
+    jours_clotures = set()
+    for jour, categorie_id, valeur in (
+        instantanes.order_by().values('date', 'categorie').annotate(valeur=Sum('valeur'))
+        .values_list('date', 'categorie', 'valeur')
+    ):
+        resultat[jour][categorie_id] = valeur
+        jours_clotures.add(jour)
+
+    manquants = [jour for jour in jours if jour not in jours_clotures]
+    if manquants:
+        resultat.update(_valeurs_reconstituees(manquants, categorie))
+    return resultat
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from article.alertes import compteurs_alertes, reconstruire_alertes
+
+
+class Command(BaseCommand):
+    help = 'Recalcule les alertes de stock de tout le catalogue (après un changement de STOCK_SEUILS_ALERTE)'
+
+    def handle(self, *args, **options):
+        self.stdout.write('🔄 Recalcul des alertes de stock...')
+        nombre = reconstruire_alertes()
+        compteurs = ', '.join(f'{niveau}: {valeur}' for niveau, valeur in compteurs_alertes().items())
+        self.stdout.write(self.style.SUCCESS(f'✨ Terminé! {nombre} article(s) mis à jour ({compteurs})'))
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from article.inventaire import cloturer_journee
+
+
+class Command(BaseCommand):
+    help = 'Écrit les instantanés de stock de clôture journaliers (la veille par défaut, à planifier chaque nuit)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--jours',
+            type=int,
+            default=1,
+            help='Clôturer les N derniers jours révolus (par défaut: la veille)'
+        )
+        parser.add_argument(
+            '--depuis',
+            help='Clôturer chaque jour à partir de cette date (AAAA-MM-JJ) jusqu\'à la veille'
+        )
+
+    def handle(self, *args, **options):
+        fin = timezone.localdate() - timedelta(days=1)
+        if options['depuis']:
+            try:
+                debut = datetime.strptime(options['depuis'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Format de date invalide pour --depuis (attendu: AAAA-MM-JJ)')
+        else:
+            if options['jours'] < 1:
+                raise CommandError('--jours doit être positif')
+            debut = fin - timedelta(days=options['jours'] - 1)
+
+        self.stdout.write(f'🔄 Clôture du stock du {debut} au {fin}...')
+        jour = debut
+        nb_jours = 0
+        while jour <= fin:
+            nb_variantes = cloturer_journee(jour)
+            nb_jours += 1
+            jour += timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(
+            f'✨ Terminé! {nb_jours} jour(s) clôturé(s)' + (f', {nb_variantes} variante(s) par jour' if nb_jours else '')
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from article.planificateur import demarrer_planificateur
+
+
+class Command(BaseCommand):
+    help = 'Lance le planificateur des promotions (processus dédié) : repricing à chaque début ou fin de promotion'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('⏱️ Planificateur des promotions démarré (Ctrl+C pour arrêter)'))
+        try:
+            demarrer_planificateur(bloquant=True)
+        except (KeyboardInterrupt, SystemExit):
+            self.stdout.write('Planificateur arrêté')
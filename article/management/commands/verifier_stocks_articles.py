@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from article.agregats import articles_incoherents, recalculer_agregats_articles
+
+
+class Command(BaseCommand):
+    help = 'Vérifie les agrégats de stock stockés sur les articles (stock, variantes actives, couleur/pointure principales)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--corriger',
+            action='store_true',
+            help='Recalculer les agrégats des articles incohérents'
+        )
+        parser.add_argument(
+            '--limite',
+            type=int,
+            default=20,
+            help='Nombre maximal d\'écarts détaillés dans le rapport (par défaut: 20)'
+        )
+
+    def handle(self, *args, **options):
+        incoherents = articles_incoherents()
+        if not incoherents:
+            self.stdout.write(self.style.SUCCESS('✅ Agrégats de stock cohérents'))
+            return
+
+        self.stdout.write(self.style.WARNING(f'⚠️ {len(incoherents)} article(s) incohérent(s)'))
+        for article in incoherents[:options['limite']]:
+            ecarts = ', '.join(
+                f'{champ}: {stocke!r} au lieu de {attendu!r}'
+                for champ, (stocke, attendu) in article['ecarts'].items()
+            )
+            self.stdout.write(f"   - #{article['id']} {article['nom']} : {ecarts}")
+
+        if options['corriger']:
+            nombre = recalculer_agregats_articles(article['id'] for article in incoherents)
+            self.stdout.write(self.style.SUCCESS(f'🔧 {nombre} article(s) recalculé(s)'))
@@ -3,6 +3,7 @@ from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.conf import settings
 from article.models import Article, Categorie, Genre, Pointure, Couleur, VarianteArticle, MouvementStock, Promotion
+from article.agregats import recalculer_agregats_articles
 from commande.models import Commande, Panier, EtatCommande, Operation, EnumEtatCmd
 from client.models import Client
 from parametre.models import Operateur, Ville, Region
@@ -254,6 +255,8 @@ class Command(BaseCommand):
             # Désactiver les variantes
             count = VarianteArticle.objects.filter(actif=True).update(actif=False)
             self.stdout.write(f'   - {count} variantes désactivées')
+            # update() ne déclenche pas les signaux : agrégats de stock recalculés explicitement
+            recalculer_agregats_articles(Article.objects.values_list('pk', flat=True))
             
             # Désactiver les catégories
             count = Categorie.objects.filter(actif=True).update(actif=False)
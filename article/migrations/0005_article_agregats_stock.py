@@ -0,0 +1,56 @@
+# Generated by Django 5.1.7 on 2025-08-29 09:15
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def remplir_agregats(apps, schema_editor):
+    """Calcule les agrégats de stock de tous les articles à partir de leurs variantes actives"""
+    Article = apps.get_model('article', 'Article')
+    VarianteArticle = apps.get_model('article', 'VarianteArticle')
+
+    variantes = VarianteArticle.objects.filter(article=OuterRef('pk'), actif=True)
+    par_article = variantes.order_by().values('article')
+    premiere = variantes.order_by('couleur__nom', 'pointure__pointure', 'pk')
+    Article.objects.update(
+        stock_disponible=Coalesce(
+            Subquery(par_article.annotate(total=Sum('qte_disponible')).values('total'), output_field=IntegerField()), 0
+        ),
+        nb_variantes_actives=Coalesce(
+            Subquery(par_article.annotate(nombre=Count('pk')).values('nombre'), output_field=IntegerField()), 0
+        ),
+        couleur_principale=Coalesce(Subquery(premiere.values('couleur__nom')[:1]), Value('')),
+        pointure_principale=Coalesce(Subquery(premiere.values('pointure__pointure')[:1]), Value('')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('article', '0004_alter_categorie_nom_alter_genre_nom'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='couleur_principale',
+            field=models.CharField(blank=True, default='', editable=False, max_length=50, verbose_name='Couleur principale'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='nb_variantes_actives',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Variantes actives'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='pointure_principale',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10, verbose_name='Pointure principale'),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='stock_disponible',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Stock disponible'),
+        ),
+        migrations.RunPython(remplir_agregats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2025-08-29 14:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+
+def remplir_promotion_appliquee(apps, schema_editor):
+    """Les prix actuels proviennent de la promotion en cours la plus forte de chaque article"""
+    Article = apps.get_model('article', 'Article')
+    Promotion = apps.get_model('article', 'Promotion')
+
+    maintenant = timezone.now()
+    gagnante = Promotion.objects.filter(
+        articles=OuterRef('pk'), active=True, date_debut__lte=maintenant, date_fin__gte=maintenant
+    ).order_by('-pourcentage_reduction', 'pk')
+    Article.objects.update(promotion_appliquee=Subquery(gagnante.values('pk')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('article', '0005_article_agregats_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='promotion_appliquee',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='article.promotion', verbose_name='Promotion appliquée'),
+        ),
+        migrations.RunPython(remplir_promotion_appliquee, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.7 on 2025-08-29 16:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('article', '0006_article_promotion_appliquee'),
+        ('commande', '0008_sequence_numerotation'),
+        ('parametre', '0003_flux_modifications_compteurs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstantaneStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='Jour clôturé : stock à la fin de cette journée')),
+                ('quantite', models.IntegerField()),
+                ('valeur', models.DecimalField(decimal_places=2, max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'Instantané de stock',
+                'verbose_name_plural': 'Instantanés de stock',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='mouvementstock',
+            index=models.Index(fields=['variante', 'date_mouvement'], name='mvt_stock_variante_date'),
+        ),
+        migrations.AddIndex(
+            model_name='mouvementstock',
+            index=models.Index(fields=['date_mouvement'], name='mvt_stock_date'),
+        ),
+        migrations.AddField(
+            model_name='instantanestock',
+            name='article',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='instantanes_stock', to='article.article'),
+        ),
+        migrations.AddField(
+            model_name='instantanestock',
+            name='categorie',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='article.categorie'),
+        ),
+        migrations.AddField(
+            model_name='instantanestock',
+            name='variante',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='instantanes', to='article.variantearticle'),
+        ),
+        migrations.AddIndex(
+            model_name='instantanestock',
+            index=models.Index(fields=['date', 'categorie'], name='instantane_stock_date_cat'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='instantanestock',
+            unique_together={('variante', 'date')},
+        ),
+    ]
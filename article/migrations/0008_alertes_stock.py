@@ -0,0 +1,62 @@
+# Generated by Django 5.1.7 on 2025-08-29 16:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, CharField, Value, When
+
+
+def remplir_alertes(apps, schema_editor):
+    """Alertes des articles actifs selon les seuils par défaut (aucun SeuilStock n'existe encore)"""
+    Article = apps.get_model('article', 'Article')
+    AlerteStock = apps.get_model('article', 'AlerteStock')
+
+    seuils = {'rupture': 0, 'faible': 10, 'a_commander': 20, **getattr(settings, 'STOCK_SEUILS_ALERTE', {})}
+    niveaux = Article.objects.filter(actif=True).annotate(niveau=Case(
+        *(When(stock_disponible__lte=seuils[niveau], then=Value(niveau)) for niveau in ('rupture', 'faible', 'a_commander')),
+        default=Value(''),
+        output_field=CharField(),
+    )).exclude(niveau='').values_list('pk', 'niveau')
+    AlerteStock.objects.bulk_create(
+        [AlerteStock(article_id=pk, niveau=niveau) for pk, niveau in niveaux.iterator()], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('article', '0007_instantanes_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlerteStock',
+            fields=[
+                ('article', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='alerte_stock', serialize=False, to='article.article')),
+                ('niveau', models.CharField(choices=[('rupture', 'Rupture'), ('faible', 'Stock faible'), ('a_commander', 'À commander')], db_index=True, max_length=20)),
+                ('date_alerte', models.DateTimeField(default=django.utils.timezone.now, help_text="Entrée dans le niveau d'alerte actuel")),
+            ],
+            options={
+                'verbose_name': 'Alerte de stock',
+                'verbose_name_plural': 'Alertes de stock',
+            },
+        ),
+        migrations.CreateModel(
+            name='SeuilStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rupture', models.IntegerField(verbose_name='Seuil de rupture')),
+                ('faible', models.IntegerField(verbose_name='Seuil de stock faible')),
+                ('a_commander', models.IntegerField(verbose_name='Seuil de réapprovisionnement')),
+                ('article', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='seuil_stock', to='article.article')),
+                ('categorie', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='seuil_stock', to='article.categorie')),
+            ],
+            options={
+                'verbose_name': "Seuil d'alerte de stock",
+                'verbose_name_plural': "Seuils d'alerte de stock",
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('article__isnull', False), ('categorie__isnull', True)), models.Q(('article__isnull', True), ('categorie__isnull', False)), _connector='OR'), name='seuil_stock_article_ou_categorie'), models.CheckConstraint(condition=models.Q(('faible__lte', models.F('a_commander')), ('rupture__lte', models.F('faible'))), name='seuil_stock_ordonne')],
+            },
+        ),
+        migrations.RunPython(remplir_alertes, migrations.RunPython.noop),
+    ]
@@ -3,7 +3,7 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 from decimal import Decimal, ROUND_HALF_UP
@@ -53,7 +53,7 @@ class Categorie(models.Model):
             categorie=self, 
             actif=True
         ).aggregate(
-            total=Sum('qte_disponible')
+            total=Sum('stock_disponible')
         ).get('total', 0) or 0
 
 class Genre(models.Model):
@@ -220,6 +220,11 @@ class MouvementStock(models.Model):
         verbose_name = "Mouvement de stock"
         verbose_name_plural = "Mouvements de stock"
         ordering = ['-date_mouvement']
+        indexes = [
+            # Historique d'une variante et queue de mouvements après un instantané (article.inventaire)
+            models.Index(fields=['variante', 'date_mouvement'], name='mvt_stock_variante_date'),
+            models.Index(fields=['date_mouvement'], name='mvt_stock_date'),
+        ]
     
     def __str__(self):
         if self.variante:
@@ -227,6 +232,85 @@ class MouvementStock(models.Model):
         return f"{self.article.nom} - {self.get_type_mouvement_display()} - {self.quantite}"
 
 
+class SeuilStock(models.Model):
+    """
+    Seuils d'alerte de stock propres à un article ou à une catégorie.
+    Les seuils de l'article priment sur ceux de sa catégorie, puis sur STOCK_SEUILS_ALERTE.
+    """
+    article = models.OneToOneField('Article', on_delete=models.CASCADE, null=True, blank=True, related_name='seuil_stock')
+    categorie = models.OneToOneField(Categorie, on_delete=models.CASCADE, null=True, blank=True, related_name='seuil_stock')
+    rupture = models.IntegerField(verbose_name="Seuil de rupture")
+    faible = models.IntegerField(verbose_name="Seuil de stock faible")
+    a_commander = models.IntegerField(verbose_name="Seuil de réapprovisionnement")
+
+    class Meta:
+        verbose_name = "Seuil d'alerte de stock"
+        verbose_name_plural = "Seuils d'alerte de stock"
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(article__isnull=False, categorie__isnull=True)
+                | models.Q(article__isnull=True, categorie__isnull=False),
+                name='seuil_stock_article_ou_categorie',
+            ),
+            models.CheckConstraint(
+                check=models.Q(rupture__lte=models.F('faible'), faible__lte=models.F('a_commander')),
+                name='seuil_stock_ordonne',
+            ),
+        ]
+
+    def __str__(self):
+        cible = self.article or self.categorie
+        return f"{cible} : {self.rupture} / {self.faible} / {self.a_commander}"
+
+
+class AlerteStock(models.Model):
+    """
+    Articles actifs dont le stock est sous un seuil d'alerte. Seuls les articles
+    en alerte ont une ligne ; tenue à jour par article.alertes.
+    """
+    NIVEAU_CHOICES = [
+        ('rupture', 'Rupture'),
+        ('faible', 'Stock faible'),
+        ('a_commander', 'À commander'),
+    ]
+
+    article = models.OneToOneField('Article', on_delete=models.CASCADE, primary_key=True, related_name='alerte_stock')
+    niveau = models.CharField(max_length=20, choices=NIVEAU_CHOICES, db_index=True)
+    date_alerte = models.DateTimeField(default=timezone.now, help_text="Entrée dans le niveau d'alerte actuel")
+
+    class Meta:
+        verbose_name = "Alerte de stock"
+        verbose_name_plural = "Alertes de stock"
+
+    def __str__(self):
+        return f"{self.article_id} - {self.get_niveau_display()}"
+
+
+class InstantaneStock(models.Model):
+    """
+    Stock de clôture journalier d'une variante (quantité et valeur au prix unitaire
+    du jour), écrit par article.inventaire.cloturer_journee
+    """
+    variante = models.ForeignKey(VarianteArticle, on_delete=models.CASCADE, related_name='instantanes')
+    article = models.ForeignKey('Article', on_delete=models.CASCADE, related_name='instantanes_stock')
+    categorie = models.ForeignKey(Categorie, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    date = models.DateField(help_text="Jour clôturé : stock à la fin de cette journée")
+    quantite = models.IntegerField()
+    valeur = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        verbose_name = "Instantané de stock"
+        verbose_name_plural = "Instantanés de stock"
+        ordering = ['-date']
+        unique_together = ['variante', 'date']
+        indexes = [
+            models.Index(fields=['date', 'categorie'], name='instantane_stock_date_cat'),
+        ]
+
+    def __str__(self):
+        return f"{self.variante_id} - {self.date} - {self.quantite}"
+
+
 # Garder le modèle Article existant tel quel pour l'instant
 # Nous le modifierons plus tard avec une migration séparée
 class Article(models.Model):
@@ -272,6 +356,20 @@ class Article(models.Model):
     prix_upsell_3 = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Prix upsell 3")
     prix_upsell_4 = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Prix upsell 4")
     
+    # Agrégats des variantes actives, maintenus par article.signals (voir article.agregats)
+    stock_disponible = models.IntegerField(default=0, editable=False, verbose_name="Stock disponible")
+    nb_variantes_actives = models.IntegerField(default=0, editable=False, verbose_name="Variantes actives")
+    couleur_principale = models.CharField(max_length=50, blank=True, default='', editable=False, verbose_name="Couleur principale")
+    pointure_principale = models.CharField(max_length=10, blank=True, default='', editable=False, verbose_name="Pointure principale")
+    
+    # Promotion dont provient prix_actuel, tenue à jour par le moteur de tarification (voir article.promotions)
+    promotion_appliquee = models.ForeignKey(
+        'Promotion', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        related_name='+', verbose_name="Promotion appliquée"
+    )
+    
+    CHAMPS_AGREGATS_STOCK = ('stock_disponible', 'nb_variantes_actives', 'couleur_principale', 'pointure_principale')
+    
     class Meta:
         verbose_name = "Article"
         verbose_name_plural = "Articles"
@@ -341,6 +439,13 @@ class Article(models.Model):
         if self.isUpsell and self.should_disable_upsell():
             self.isUpsell = False
         
+        # Ne pas écraser les agrégats de stock avec des valeurs lues avant une écriture de variante
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.CHAMPS_AGREGATS_STOCK
+            ]
+        
         super().save(*args, **kwargs)
     
     @property
@@ -349,28 +454,10 @@ class Article(models.Model):
     
     def update_prix_actuel(self):
         """Met à jour le prix actuel en tenant compte des promotions actives"""
-        now = timezone.now()
-        promotion_active = self.promotions.filter(
-            date_debut__lte=now,
-            date_fin__gte=now,
-            active=True
-        ).order_by('-pourcentage_reduction').first()
-        
-        # Prix actuel = prix unitaire par défaut
-        if self.prix_actuel is None:
-            self.prix_actuel = self.prix_unitaire
+        from article.promotions import appliquer_tarifs
         
-        # Appliquer la réduction si une promotion est active
-        if promotion_active:
-            reduction = self.prix_unitaire * (promotion_active.pourcentage_reduction / 100)
-            nouveau_prix = self.prix_unitaire - reduction
-            # Arrondir à 2 décimales
-            self.prix_actuel = Decimal(str(nouveau_prix)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        else:
-            # Si pas de promotion, le prix actuel revient au prix unitaire
-            self.prix_actuel = self.prix_unitaire
-            
-        self.save(update_fields=['prix_actuel'])
+        appliquer_tarifs(articles=Article.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=['prix_actuel', 'isUpsell', 'promotion_appliquee'])
     
     def appliquer_promotion(self, promotion):
         """Applique une promotion spécifique à cet article"""
@@ -379,8 +466,10 @@ class Article(models.Model):
             nouveau_prix = self.prix_unitaire - reduction
             self.prix_actuel = Decimal(str(nouveau_prix)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
             
+            self.promotion_appliquee = promotion
+            
             # Désactiver l'upsell automatiquement lors de l'application d'une promotion
-            fields_to_update = ['prix_actuel']
+            fields_to_update = ['prix_actuel', 'promotion_appliquee']
             if self.isUpsell:
                 self.isUpsell = False
                 fields_to_update.append('isUpsell')
@@ -392,11 +481,12 @@ class Article(models.Model):
     def retirer_promotion(self):
         """Retire toutes les promotions et remet le prix actuel au prix unitaire"""
         self.prix_actuel = self.prix_unitaire
+        self.promotion_appliquee = None
         
         # Note: Ne pas réactiver automatiquement l'upsell car cela doit être fait manuellement
         # L'upsell reste désactivé après une promotion pour éviter les activations non désirées
         
-        self.save(update_fields=['prix_actuel'])
+        self.save(update_fields=['prix_actuel', 'promotion_appliquee'])
         return True
     
     def get_all_prices(self):
@@ -476,22 +566,18 @@ class Article(models.Model):
         return self.variantes.filter(actif=True, qte_disponible__gt=0)
     
     def get_total_qte_disponible(self):
-        """Calcule la quantité totale disponible en sommant toutes les variantes"""
-        return self.variantes.filter(actif=True).aggregate(
-            total=models.Sum('qte_disponible')
-        )['total'] or 0
+        """Quantité totale disponible des variantes actives (agrégat stocké)"""
+        return self.stock_disponible
     
     @property
     def couleur(self):
         """Propriété de compatibilité pour accéder à la couleur de la première variante"""
-        variante = self.variantes.filter(actif=True).first()
-        return variante.couleur.nom if variante and variante.couleur else ''
+        return self.couleur_principale
     
     @property
     def pointure(self):
         """Propriété de compatibilité pour accéder à la pointure de la première variante"""
-        variante = self.variantes.filter(actif=True).first()
-        return variante.pointure.pointure if variante and variante.pointure else ''
+        return self.pointure_principale
     
     @property
     def qte_disponible(self):
@@ -561,9 +647,9 @@ class Promotion(models.Model):
         # Utiliser update() pour éviter de déclencher le signal post_save
         Promotion.objects.filter(id=self.id).update(active=True)
         
-        # Appliquer la promotion à tous les articles associés
-        for article in self.articles.all():
-            article.appliquer_promotion(self)
+        # Recalculer en une passe les prix de tous les articles associés
+        from article.promotions import appliquer_tarifs
+        appliquer_tarifs(articles=self.articles.all())
         
         return True
     
@@ -573,20 +659,9 @@ class Promotion(models.Model):
         # Utiliser update() pour éviter de déclencher le signal post_save
         Promotion.objects.filter(id=self.id).update(active=False)
         
-        # Retirer la promotion de tous les articles associés
-        for article in self.articles.all():
-            # Vérifier si l'article n'a pas d'autres promotions actives
-            autres_promotions_actives = article.promotions.filter(
-                active=True,
-                date_debut__lte=timezone.now(),
-                date_fin__gte=timezone.now()
-            ).exclude(id=self.id).exists()
-            
-            if not autres_promotions_actives:
-                article.retirer_promotion()
-            else:
-                # Recalculer le prix avec les autres promotions actives
-                article.update_prix_actuel()
+        # Prix unitaire, ou prix d'une autre promotion active, pour tous les articles associés
+        from article.promotions import appliquer_tarifs
+        appliquer_tarifs(articles=self.articles.all())
         
         return True
     
@@ -672,29 +747,40 @@ def initialize_prix_actuel(sender, instance, created, **kwargs):
 def update_article_prices(sender, instance, created, **kwargs):
     """Met à jour les prix des articles quand une promotion est modifiée"""
     from django.utils import timezone
+    from article.promotions import appliquer_tarifs
     
     # Vérifier automatiquement si la promotion doit être active (seulement pour les nouvelles promotions)
     if created:
         now = timezone.now()
-        if instance.date_debut <= now <= instance.date_fin:
-            instance.activer_promotion()
-    
-    # Pour tous les articles associés à cette promotion
-    for article in instance.articles.all():
-        # Mettre à jour le prix actuel basé sur toutes les promotions actives
-        article.update_prix_actuel()
-
-# Signal pour mettre à jour la quantité totale de l'article quand une variante est modifiée
-@receiver(post_save, sender=VarianteArticle)
-def update_article_total_qte(sender, instance, **kwargs):
-    """Met à jour la quantité totale de l'article quand une variante est modifiée"""
-    # La quantité disponible est calculée dynamiquement via la propriété
-    # Pas besoin de sauvegarder car c'est une propriété calculée
-    pass
-
-@receiver(post_delete, sender=VarianteArticle)
-def update_article_total_qte_on_delete(sender, instance, **kwargs):
-    """Met à jour la quantité totale de l'article quand une variante est supprimée"""
-    # La quantité disponible est calculée dynamiquement via la propriété
-    # Pas besoin de sauvegarder car c'est une propriété calculée
-    pass
\ No newline at end of file
+        if instance.date_debut <= now <= instance.date_fin and not instance.active:
+            instance.active = True
+            Promotion.objects.filter(id=instance.id).update(active=True)
+    
+    # Une passe pour tous les articles associés (réduction, dates ou activation modifiées)
+    appliquer_tarifs(articles=instance.articles.all())
+
+@receiver(m2m_changed, sender=Promotion.articles.through)
+def update_prices_on_articles_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Recalcule les prix des articles ajoutés à une promotion ou retirés"""
+    from article.promotions import appliquer_tarifs
+    
+    if action == 'pre_clear':
+        # Mémoriser les articles concernés avant que les liens ne disparaissent
+        instance._articles_promotion_retires = (
+            [instance.pk] if reverse else list(instance.articles.values_list('pk', flat=True))
+        )
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if action == 'post_clear':
+            article_ids = getattr(instance, '_articles_promotion_retires', [])
+        else:
+            article_ids = [instance.pk] if reverse else list(pk_set or [])
+        if article_ids:
+            appliquer_tarifs(articles=Article.objects.filter(pk__in=article_ids))
+
+@receiver(pre_delete, sender=Promotion)
+def update_prices_on_promotion_delete(sender, instance, **kwargs):
+    """Avant suppression : les articles reviennent au prix unitaire ou à une autre promotion active"""
+    from article.promotions import appliquer_tarifs
+    
+    Promotion.objects.filter(id=instance.id).update(active=False)
+    appliquer_tarifs(articles=instance.articles.all())
@@ -0,0 +1,209 @@
+"""
+Mouvements de stock par lots.
+
+creer_mouvements_stock_bulk applique en une transaction toutes les lignes d'une
+commande (réservation à la préparation, retour, ajustement) :
+
+1. verrouillage en une requête de toutes les variantes concernées, dans l'ordre
+   des clés primaires, pour que deux lots simultanés ne s'interbloquent jamais ;
+2. calcul des nouvelles quantités en mémoire et vérification de la
+   disponibilité de toutes les lignes ensemble ;
+3. écriture : un bulk_update des variantes, un bulk_create des MouvementStock
+   (un par variante touchée, avec sa quantité après mouvement), puis le
+   recalcul des agrégats de stock des articles (article.agregats).
+
+Si une seule ligne ne peut pas être servie, ValidationError est levée avant
+toute écriture : toutes les lignes sont appliquées ou aucune.
+
+ajuster_stock_variante porte une variante à une quantité saisie (édition d'un
+article, stock initial d'une nouvelle variante) par un mouvement
+ajustement_pos / ajustement_neg de l'écart : le journal de stock
+(article.inventaire) reste la somme des mouvements.
+"""
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+
+from .agregats import recalculer_agregats_articles
+from .models import Couleur, MouvementStock, Pointure, VarianteArticle
+
+TYPES_ENTREE = ('entree', 'ajustement_pos', 'retour_client')
+TYPES_SORTIE = ('sortie', 'ajustement_neg')
+
+
+class LigneMouvement(NamedTuple):
+    """Ligne d'un lot de mouvements (un Panier convient aussi : article_id, quantite, variante_id)"""
+    article_id: int
+    quantite: int
+    variante_id: Optional[int] = None
+    commentaire: Optional[str] = None
+
+
+def quantite_signee(quantite, type_mouvement):
+    """Quantité positive pour une entrée, négative pour une sortie"""
+    if type_mouvement in TYPES_ENTREE:
+        return abs(int(quantite))
+    if type_mouvement in TYPES_SORTIE:
+        return -abs(int(quantite))
+    raise ValidationError(f"Type de mouvement inconnu : {type_mouvement}")
+
+
+def _variantes_par_defaut(article_ids):
+    """Variante Standard / Unique pour les articles sans variante active (comme creer_mouvement_stock)"""
+    couleur_defaut, _ = Couleur.objects.get_or_create(nom="Standard", defaults={'actif': True})
+    pointure_defaut, _ = Pointure.objects.get_or_create(pointure="Unique", defaults={'actif': True})
+    for article_id in article_ids:
+        VarianteArticle.objects.get_or_create(
+            article_id=article_id, couleur=couleur_defaut, pointure=pointure_defaut,
+            defaults={'qte_disponible': 0, 'actif': True},
+        )
+
+
+def _verrouiller(variante_ids, article_ids_globaux):
+    return list(
+        VarianteArticle.objects.select_for_update()
+        .filter(Q(pk__in=variante_ids) | Q(article_id__in=article_ids_globaux, actif=True))
+        .order_by('pk')
+    )
+
+
+def creer_mouvements_stock_bulk(lignes, type_mouvement, operateur=None, commande=None, commentaire=None):
+    """
+    Applique un lot de mouvements de stock, tout ou rien.
+
+    Args:
+        lignes: itérable d'objets ayant article_id, quantite et variante_id
+            (LigneMouvement, Panier). Sans variante, la quantité est répartie sur
+            les variantes actives de l'article, les plus stockées d'abord.
+        type_mouvement: un des types de MouvementStock (entrée ou sortie)
+
+    Returns:
+        list: les MouvementStock créés, dans l'ordre des lignes (une ligne répartie
+            sur plusieurs variantes en produit plusieurs)
+
+    Raises:
+        ValidationError: type inconnu, variante d'un autre article ou stock
+            insuffisant (toutes les lignes en défaut sont listées)
+    """
+    lignes = [
+        (ligne.article_id, quantite_signee(ligne.quantite, type_mouvement),
+         getattr(ligne, 'variante_id', None), getattr(ligne, 'commentaire', None))
+        for ligne in lignes
+    ]
+    if not lignes:
+        return []
+
+    variante_ids = {variante_id for _, _, variante_id, _ in lignes if variante_id}
+    article_ids_globaux = {article_id for article_id, _, variante_id, _ in lignes if not variante_id}
+
+    with transaction.atomic():
+        variantes = _verrouiller(variante_ids, article_ids_globaux)
+        actives_par_article = defaultdict(list)
+        for variante in variantes:
+            if variante.actif:
+                actives_par_article[variante.article_id].append(variante)
+
+        sans_variante = [article_id for article_id in article_ids_globaux if not actives_par_article[article_id]]
+        if sans_variante:
+            _variantes_par_defaut(sans_variante)
+            variantes = _verrouiller(variante_ids, article_ids_globaux)
+            actives_par_article = defaultdict(list)
+            for variante in variantes:
+                if variante.actif:
+                    actives_par_article[variante.article_id].append(variante)
+        par_id = {variante.pk: variante for variante in variantes}
+
+        erreurs = []
+        modifiees = {}
+        mouvements = []
+        for article_id, quantite, variante_id, commentaire_ligne in lignes:
+            if variante_id:
+                variante = par_id.get(variante_id)
+                if variante is None or variante.article_id != article_id:
+                    raise ValidationError(f"Variante {variante_id} introuvable pour l'article {article_id}")
+                cibles = [variante]
+            else:
+                # Les plus stockées d'abord, comme creer_mouvement_stock
+                cibles = sorted(actives_par_article[article_id], key=lambda v: -v.qte_disponible)
+
+            if quantite > 0:
+                deltas = [(cibles[0], quantite)]
+            else:
+                disponible = sum(cible.qte_disponible for cible in cibles)
+                if disponible < -quantite:
+                    erreurs.append(
+                        f"Article {article_id} : impossible de retirer {-quantite} unités "
+                        f"(stock disponible : {disponible})"
+                    )
+                    continue
+                deltas = []
+                restant = -quantite
+                for cible in cibles:
+                    if not restant:
+                        break
+                    retrait = min(cible.qte_disponible, restant)
+                    if retrait:
+                        deltas.append((cible, -retrait))
+                        restant -= retrait
+
+            # Un mouvement par variante touchée : l'historique de chaque variante est complet
+            for cible, delta in deltas:
+                cible.qte_disponible += delta
+                modifiees[cible.pk] = cible
+                mouvements.append(MouvementStock(
+                    article_id=article_id,
+                    variante=cible,
+                    type_mouvement=type_mouvement,
+                    quantite=delta,
+                    qte_apres_mouvement=cible.qte_disponible,
+                    commentaire=commentaire_ligne or commentaire,
+                    commande_associee=commande,
+                    operateur=operateur,
+                ))
+
+        if erreurs:
+            raise ValidationError(["Stock insuffisant"] + erreurs)
+
+        VarianteArticle.objects.bulk_update(modifiees.values(), ['qte_disponible'])
+        MouvementStock.objects.bulk_create(mouvements)
+        # bulk_update / bulk_create n'émettent pas post_save : agrégats recalculés ici
+        recalculer_agregats_articles({article_id for article_id, _, _, _ in lignes})
+
+    return mouvements
+
+
+def ajuster_stock_variante(variante, quantite, operateur=None, commentaire=None):
+    """
+    Porte le stock d'une variante à la quantité donnée par un mouvement d'ajustement.
+
+    Returns:
+        MouvementStock | None: le mouvement créé, None si le stock était déjà à
+            cette quantité
+
+    Raises:
+        ValidationError: quantité négative
+    """
+    quantite = int(quantite)
+    if quantite < 0:
+        raise ValidationError(f"Quantité invalide : {quantite}")
+
+    with transaction.atomic():
+        actuelle = (
+            VarianteArticle.objects.select_for_update()
+            .values_list('qte_disponible', flat=True).get(pk=variante.pk)
+        )
+        ecart = quantite - actuelle
+        mouvement = None
+        if ecart:
+            mouvement, = creer_mouvements_stock_bulk(
+                [LigneMouvement(variante.article_id, abs(ecart), variante.pk)],
+                'ajustement_pos' if ecart > 0 else 'ajustement_neg',
+                operateur=operateur,
+                commentaire=commentaire,
+            )
+
+    variante.qte_disponible = quantite
+    return mouvement
@@ -0,0 +1,170 @@
+"""
+Planification des passes de tarification des promotions (APScheduler).
+
+Au lieu d'un déclenchement manuel (bouton « gérer automatiquement », commande
+gerer_promotions), une tâche unique est programmée à la prochaine borne
+date_debut / date_fin des promotions actives ; après chaque passe, elle se
+reprogramme sur la borne suivante. Une passe a lieu au moins toutes les
+INTERVALLE_MAX, pour rattraper une écriture non signalée.
+
+Toute création, modification ou suppression de promotion (voir article.signals)
+écrit une nouvelle version dans le cache partagé (cache par défaut, en base) :
+le planificateur la relit toutes les PROMOTIONS_INTERVALLE_VERIFICATION secondes
+et lance une passe dès qu'elle change, y compris quand les promotions sont
+modifiées depuis un autre processus que le sien.
+
+Deux modes de lancement :
+- dans le processus web, au démarrage de l'application, si le réglage
+  PROMOTIONS_PLANIFICATEUR est actif ;
+- dans un processus dédié : manage.py planificateur_promotions (recommandé
+  avec plusieurs workers, pour ne lancer qu'un planificateur).
+"""
+import logging
+import threading
+import uuid
+from datetime import timedelta
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import Promotion
+from .promotions import synchroniser_promotions
+
+logger = logging.getLogger(__name__)
+
+ID_TACHE = 'promotions:prochaine-echeance'
+ID_VERIFICATION = 'promotions:verification'
+
+# Version des promotions dans le cache partagé, changée à chaque écriture
+CLE_VERSION = 'promotions:version'
+
+# Une promotion est en cours jusqu'à date_fin incluse : la passe de fin a lieu juste après
+MARGE_FIN = timedelta(seconds=1)
+
+INTERVALLE_MAX = timedelta(hours=1)
+
+_planificateur = None
+_verrou = threading.Lock()
+# Dernière version lue par le planificateur de ce processus
+_version_vue = None
+
+
+def prochaine_echeance(instant=None):
+    """Prochaine borne de promotion active après `instant` (au plus tard instant + INTERVALLE_MAX)"""
+    instant = instant or timezone.now()
+    bornes = Promotion.objects.filter(active=True).aggregate(
+        debut=Min('date_debut', filter=Q(date_debut__gt=instant)),
+        fin=Min('date_fin', filter=Q(date_fin__gte=instant)),
+    )
+    candidates = [instant + INTERVALLE_MAX]
+    if bornes['debut']:
+        candidates.append(bornes['debut'])
+    if bornes['fin']:
+        candidates.append(bornes['fin'] + MARGE_FIN)
+    return min(candidates)
+
+
+def executer_passe():
+    """Tâche planifiée : passe de tarification puis programmation de la borne suivante"""
+    close_old_connections()
+    try:
+        resultat = synchroniser_promotions()
+        if resultat['deactivated'] or resultat['articles_updated']:
+            logger.info(
+                "Promotions : %s désactivée(s), %s article(s) repricé(s)",
+                resultat['deactivated'], resultat['articles_updated'],
+            )
+    except Exception:
+        logger.exception("Échec de la passe de tarification des promotions")
+    finally:
+        try:
+            replanifier()
+        finally:
+            close_old_connections()
+
+
+def replanifier(immediat=False):
+    """
+    (Re)programme la tâche sur la prochaine borne (ou tout de suite) ;
+    sans effet si aucun planificateur ne tourne dans ce processus.
+    """
+    planificateur = _planificateur
+    if planificateur is None:
+        return None
+    echeance = timezone.now() if immediat else prochaine_echeance()
+    planificateur.add_job(
+        executer_passe,
+        trigger='date',
+        run_date=echeance,
+        id=ID_TACHE,
+        replace_existing=True,
+        coalesce=True,
+        misfire_grace_time=None,
+    )
+    return echeance
+
+
+def signaler_modification():
+    """Promotion écrite (après le commit) : nouvelle version pour le planificateur, où qu'il tourne"""
+    cache.set(CLE_VERSION, uuid.uuid4().hex, None)
+    replanifier()
+
+
+def verifier_modifications():
+    """
+    Tâche périodique : programme une passe immédiate si la version des
+    promotions a changé depuis la dernière lecture.
+
+    Returns:
+        bool: True si une modification a été détectée
+    """
+    global _version_vue
+    version = cache.get(CLE_VERSION)
+    if version == _version_vue:
+        return False
+    _version_vue = version
+    replanifier(immediat=True)
+    return True
+
+
+def demarrer_planificateur(bloquant=False):
+    """
+    Démarre le planificateur (une seule fois par processus) avec une passe immédiate.
+
+    Args:
+        bloquant: True pour un processus dédié (BlockingScheduler, ne rend pas la main)
+    """
+    global _planificateur, _version_vue
+    with _verrou:
+        if _planificateur is not None:
+            return _planificateur
+        classe = BlockingScheduler if bloquant else BackgroundScheduler
+        _planificateur = classe(timezone=settings.TIME_ZONE)
+        # Rattrape les bornes franchies pendant que le planificateur était arrêté
+        # (et les modifications antérieures à la version lue ici)
+        _version_vue = cache.get(CLE_VERSION)
+        _planificateur.add_job(executer_passe, trigger='date', run_date=timezone.now(), id=ID_TACHE, misfire_grace_time=None)
+        _planificateur.add_job(
+            verifier_modifications,
+            trigger='interval',
+            seconds=getattr(settings, 'PROMOTIONS_INTERVALLE_VERIFICATION', 30),
+            id=ID_VERIFICATION,
+            coalesce=True,
+            max_instances=1,
+        )
+    logger.info("Planificateur des promotions démarré")
+    _planificateur.start()
+    return _planificateur
+
+
+def arreter_planificateur():
+    global _planificateur
+    with _verrou:
+        if _planificateur is not None and _planificateur.running:
+            _planificateur.shutdown(wait=False)
+        _planificateur = None
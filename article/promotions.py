@@ -0,0 +1,103 @@
+"""
+Moteur de tarification des promotions.
+
+Pour un instant donné, la promotion gagnante de chaque article (active, en
+cours, plus forte réduction) est déterminée en une requête ; seuls les articles
+dont le prix, l'upsell ou la promotion appliquée changent sont écrits, par
+bulk_update. Le lancement d'une promotion sur tout le catalogue est ainsi une
+seule passe au lieu d'une sauvegarde par article et par promotion.
+
+Article.promotion_appliquee mémorise la promotion dont provient prix_actuel :
+un article sans promotion gagnante n'est remis au prix unitaire que s'il en
+avait une, ce qui préserve les prix de liquidation fixés à la main.
+
+Le passage des bornes date_debut / date_fin est déclenché par
+article.planificateur.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .models import Article, Promotion
+from .tarifs import invalider_tarifs
+
+CHAMPS_TARIFICATION = ['prix_actuel', 'isUpsell', 'promotion_appliquee']
+
+TAILLE_LOT = 500
+
+
+def prix_promotionnel(prix_unitaire, pourcentage_reduction):
+    """Prix réduit arrondi au centime (même calcul que Article.appliquer_promotion)"""
+    reduction = prix_unitaire * (pourcentage_reduction / 100)
+    return Decimal(str(prix_unitaire - reduction)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def promotions_en_cours(instant):
+    return Promotion.objects.filter(active=True, date_debut__lte=instant, date_fin__gte=instant)
+
+
+def calculer_tarifs(instant=None, articles=None):
+    """
+    Articles dont la tarification doit changer à `instant`, déjà modifiés en mémoire.
+
+    Args:
+        articles: queryset restreignant les articles examinés (par défaut tout le catalogue)
+
+    Returns:
+        list: articles à enregistrer (champs CHAMPS_TARIFICATION)
+    """
+    instant = instant or timezone.now()
+    gagnante = promotions_en_cours(instant).filter(articles=OuterRef('pk')).order_by('-pourcentage_reduction', 'pk')
+    articles = (Article.objects.all() if articles is None else articles).annotate(
+        promotion_gagnante=Subquery(gagnante.values('pk')[:1]),
+        reduction_gagnante=Subquery(gagnante.values('pourcentage_reduction')[:1]),
+    ).filter(
+        # Articles en promotion maintenant ou avant : les autres gardent leur prix (liquidation comprise)
+        Q(promotion_gagnante__isnull=False) | Q(promotion_appliquee__isnull=False)
+    ).only('pk', 'prix_unitaire', 'prix_actuel', 'isUpsell', 'promotion_appliquee')
+
+    modifies = []
+    for article in articles:
+        if article.promotion_gagnante:
+            prix = prix_promotionnel(article.prix_unitaire, article.reduction_gagnante)
+            # Un article en promotion ne peut pas être upsell
+            upsell = False
+        else:
+            prix = article.prix_unitaire
+            upsell = article.isUpsell
+        nouveau = (prix, upsell, article.promotion_gagnante)
+        if nouveau != (article.prix_actuel, article.isUpsell, article.promotion_appliquee_id):
+            article.prix_actuel, article.isUpsell, article.promotion_appliquee_id = nouveau
+            modifies.append(article)
+    return modifies
+
+
+def appliquer_tarifs(instant=None, articles=None):
+    """Calcule et enregistre les tarifs promotionnels ; renvoie les articles modifiés"""
+    with transaction.atomic():
+        modifies = calculer_tarifs(instant, articles)
+        if modifies:
+            Article.objects.bulk_update(modifies, CHAMPS_TARIFICATION, batch_size=TAILLE_LOT)
+            invalider_tarifs()
+    return modifies
+
+
+def synchroniser_promotions(instant=None, simulation=False):
+    """
+    Passe de tarification complète : désactive les promotions expirées et reprice le catalogue.
+
+    Returns:
+        dict: deactivated (promotions expirées désactivées), articles_updated, articles (modifiés)
+    """
+    instant = instant or timezone.now()
+    expirees = Promotion.objects.filter(active=True, date_fin__lt=instant)
+    if simulation:
+        articles = calculer_tarifs(instant)
+        return {'deactivated': expirees.count(), 'articles_updated': len(articles), 'articles': articles}
+
+    with transaction.atomic():
+        desactivees = expirees.update(active=False)
+        articles = appliquer_tarifs(instant)
+    return {'deactivated': desactivees, 'articles_updated': len(articles), 'articles': articles}
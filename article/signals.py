@@ -1,6 +1,13 @@
-from django.db.models.signals import post_migrate
+from django.db.models.signals import post_migrate, post_save, post_delete
 from django.dispatch import receiver
 from django.apps import apps
+from django.db import transaction
+
+from article.agregats import recalculer_agregats_articles
+from article.alertes import actualiser_alertes
+from article.models import Article, Couleur, MouvementStock, Pointure, Promotion, SeuilStock, VarianteArticle
+from article.planificateur import signaler_modification
+from article.tarifs import invalider_tarifs
 
 @receiver(post_migrate)
 def create_default_genres(sender, **kwargs):
@@ -9,3 +16,70 @@ def create_default_genres(sender, **kwargs):
         Genre = apps.get_model('articles', 'Genre')
         for nom in ['HOMME', 'FEMME', 'FILLE', 'GARCON']:
             Genre.objects.get_or_create(nom=nom)
+
+
+# Agrégats de stock de l'article, recalculés dans la transaction de l'écriture
+
+@receiver(post_save, sender=VarianteArticle)
+@receiver(post_delete, sender=VarianteArticle)
+def recalculer_stock_article_variante(sender, instance, **kwargs):
+    """Variante créée, modifiée (quantité, activation) ou supprimée"""
+    recalculer_agregats_articles([instance.article_id])
+
+
+@receiver(post_save, sender=MouvementStock)
+def recalculer_stock_article_mouvement(sender, instance, created, **kwargs):
+    """Mouvement de stock enregistré (la variante est en général sauvegardée juste avant)"""
+    if created:
+        recalculer_agregats_articles([instance.article_id])
+
+
+@receiver(post_save, sender=Couleur)
+def recalculer_couleur_articles(sender, instance, created, **kwargs):
+    """Couleur renommée : libellé principal des articles qui l'utilisent"""
+    if not created:
+        recalculer_agregats_articles(
+            VarianteArticle.objects.filter(couleur=instance).values_list('article_id', flat=True).distinct()
+        )
+
+
+@receiver(post_save, sender=Pointure)
+def recalculer_pointure_articles(sender, instance, created, **kwargs):
+    """Pointure renommée : libellé principal des articles qui l'utilisent"""
+    if not created:
+        recalculer_agregats_articles(
+            VarianteArticle.objects.filter(pointure=instance).values_list('article_id', flat=True).distinct()
+        )
+
+
+# Promotion modifiée : le planificateur (dans ce processus ou dédié) lance une passe de tarification
+
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+def signaler_modification_promotions(sender, instance, **kwargs):
+    transaction.on_commit(signaler_modification)
+
+
+# Table des tarifs en cache (article.tarifs) : les écritures par lots des promotions invalident dans appliquer_tarifs
+
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+def invalider_tarifs_article(sender, instance, **kwargs):
+    invalider_tarifs()
+
+
+# Alertes de stock (article.alertes) : le stock est suivi par recalculer_agregats_articles,
+# restent l'activation / la catégorie de l'article et les seuils
+
+@receiver(post_save, sender=Article)
+def actualiser_alerte_article(sender, instance, **kwargs):
+    actualiser_alertes([instance.pk])
+
+
+@receiver(post_save, sender=SeuilStock)
+@receiver(post_delete, sender=SeuilStock)
+def actualiser_alertes_seuil(sender, instance, **kwargs):
+    if instance.article_id:
+        actualiser_alertes([instance.article_id])
+    elif instance.categorie_id:
+        actualiser_alertes(Article.objects.filter(categorie_id=instance.categorie_id).values_list('pk', flat=True))
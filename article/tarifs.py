@@ -0,0 +1,172 @@
+"""
+Table des tarifs des articles, en cache dans le processus.
+
+Chaque article est résumé par un TarifArticle immuable (prix unitaire, prix
+actuel, prix upsell 1 à 4, upsell, promotion) chargé en une requête pour tous
+les articles manquants d'un panier. Les recalculs de panier pendant les appels
+ne relisent ainsi plus chaque Article ligne par ligne.
+
+Invalidation versionnée : toute écriture d'Article ou de Promotion (voir
+article.signals, et appliquer_tarifs pour les écritures par lots) vide la table
+du processus et remplace, après le commit, le jeton de génération partagé dans
+le cache 'tarifs' (Redis si configuré) ; les autres processus vident leur table
+dès qu'ils lisent un jeton différent. Le jeton est aléatoire : une clé expulsée
+ou un cache vidé donne un nouveau jeton, jamais un ancien.
+
+Une table est aussi rechargée au-delà de TARIFS_DUREE_MAX_TABLE secondes, ce
+qui borne le retard d'un processus qui ne verrait pas le jeton changer (cache
+en mémoire locale, écriture SQL hors signaux).
+"""
+import threading
+import time
+import uuid
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import Article
+
+ALIAS_CACHE_TARIFS = 'tarifs'
+
+CLE_GENERATION = 'tarifs:generation'
+
+_tables = []
+
+
+def _cache():
+    return caches[ALIAS_CACHE_TARIFS]
+
+
+def generation_courante():
+    """Jeton de génération partagé entre les processus (créé à la première lecture)"""
+    cache = _cache()
+    generation = cache.get(CLE_GENERATION)
+    if generation is None:
+        cache.add(CLE_GENERATION, uuid.uuid4().hex, None)
+        generation = cache.get(CLE_GENERATION)
+    return generation
+
+
+def _changer_generation():
+    _cache().set(CLE_GENERATION, uuid.uuid4().hex, None)
+
+
+def invalider_tarifs():
+    """Vide les tables du processus maintenant et celles des autres processus après le commit"""
+    for table in _tables:
+        table.vider()
+    transaction.on_commit(_changer_generation)
+
+
+class TableEnCache:
+    """
+    Dictionnaire clé → valeur immuable, chargé à la demande par lots et vidé à
+    chaque changement de génération ou après TARIFS_DUREE_MAX_TABLE secondes.
+
+    Args:
+        charger: fonction recevant la liste des clés manquantes et renvoyant un dict
+    """
+
+    def __init__(self, charger):
+        self._charger = charger
+        self._valeurs = {}
+        self._generation = None
+        self._debut = 0
+        self._verrou = threading.Lock()
+        _tables.append(self)
+
+    def vider(self):
+        with self._verrou:
+            self._valeurs = {}
+            self._generation = None
+
+    def lire(self, cles):
+        """Valeurs des clés demandées (les clés inconnues en base sont absentes du résultat)"""
+        cles = set(cles)
+        generation = generation_courante()
+        maintenant = time.monotonic()
+        with self._verrou:
+            if (
+                generation is None or self._generation != generation
+                or maintenant - self._debut >= getattr(settings, 'TARIFS_DUREE_MAX_TABLE', 60)
+            ):
+                self._valeurs = {}
+                self._generation = generation
+                self._debut = maintenant
+            valeurs = self._valeurs
+            manquantes = [cle for cle in cles if cle not in valeurs]
+
+        if manquantes:
+            chargees = self._charger(manquantes)
+            with self._verrou:
+                # Une invalidation pendant le chargement remplace le dict : rien n'y est ajouté
+                valeurs.update(chargees)
+            valeurs = {**valeurs, **chargees}
+        return {cle: valeurs[cle] for cle in cles if cle in valeurs}
+
+
+class TarifArticle(NamedTuple):
+    """Tarification d'un article, indépendante de l'instance Article"""
+    article_id: int
+    prix_unitaire: object
+    prix_actuel: object
+    prix_upsell: tuple
+    is_upsell: bool
+    en_promotion: bool
+
+    @classmethod
+    def depuis_article(cls, article):
+        return cls(
+            article.pk,
+            article.prix_unitaire,
+            article.prix_actuel,
+            (article.prix_upsell_1, article.prix_upsell_2, article.prix_upsell_3, article.prix_upsell_4),
+            article.isUpsell,
+            article.promotion_appliquee_id is not None,
+        )
+
+    @property
+    def prix_normal(self):
+        return self.prix_actuel if self.prix_actuel is not None else self.prix_unitaire
+
+    def prix_pour_compteur(self, compteur):
+        """
+        Prix unitaire selon le compteur upsell de la commande :
+        compteur 1, 2, 3 → prix upsell du même niveau, 4 et plus → prix upsell 4,
+        prix normal si l'article n'est pas upsell ou si le prix du niveau n'est pas défini.
+        """
+        if not self.is_upsell or compteur <= 0:
+            return self.prix_normal
+        prix = self.prix_upsell[min(compteur, 4) - 1]
+        return prix if prix else self.prix_normal
+
+    def niveau_upsell(self, compteur):
+        """Niveau upsell affiché : le plus haut niveau atteint par le compteur dont le prix est défini"""
+        if not self.is_upsell:
+            return 0
+        for niveau in range(4, 0, -1):
+            if compteur >= niveau and self.prix_upsell[niveau - 1] is not None:
+                return niveau
+        return 0
+
+
+def _charger_tarifs(article_ids):
+    lignes = Article.objects.filter(pk__in=article_ids).order_by().values_list(
+        'pk', 'prix_unitaire', 'prix_actuel',
+        'prix_upsell_1', 'prix_upsell_2', 'prix_upsell_3', 'prix_upsell_4',
+        'isUpsell', 'promotion_appliquee',
+    )
+    return {
+        pk: TarifArticle(pk, unitaire, actuel, (upsell_1, upsell_2, upsell_3, upsell_4), is_upsell, promotion is not None)
+        for pk, unitaire, actuel, upsell_1, upsell_2, upsell_3, upsell_4, is_upsell, promotion in lignes
+    }
+
+
+_tarifs = TableEnCache(_charger_tarifs)
+
+
+def tarifs_articles(article_ids):
+    """Tarifs des articles demandés : {article_id: TarifArticle}"""
+    return _tarifs.lire(article_ids)
@@ -0,0 +1,9 @@
+from celery import shared_task
+
+from .inventaire import cloturer_journee
+
+
+@shared_task(name='article.cloturer_stock')
+def cloturer_stock():
+    """Tâche Celery planifiée chaque nuit : instantanés de stock de la veille"""
+    return cloturer_journee()
@@ -1,3 +1,444 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from article.agregats import articles_incoherents
+from article.alertes import actualiser_alertes, compteurs_alertes
+from article.disponibilite import matrice_disponibilite
+from article.inventaire import cloturer_journee, fin_de_journee, stock_variante_a, valeur_stock_par_categorie
+from article.mouvements import LigneMouvement, ajuster_stock_variante, creer_mouvements_stock_bulk
+from article.models import (
+    AlerteStock, Article, Categorie, Couleur, InstantaneStock, MouvementStock, Pointure, Promotion, SeuilStock,
+    VarianteArticle,
+)
+from article import planificateur
+from article.planificateur import MARGE_FIN, prochaine_echeance
+from article.promotions import synchroniser_promotions
+from parametre.models import Operateur
+
+
+class AgregatsStockArticleTest(TestCase):
+
+    def setUp(self):
+        categorie = Categorie.objects.create(nom='SANDALES')
+        self.article = Article.objects.create(nom='Sandale Tressée', reference='SAN-1', prix_unitaire=199, categorie=categorie)
+        self.noir = Couleur.objects.create(nom='Noir')
+        self.beige = Couleur.objects.create(nom='Beige')
+        self.p38 = Pointure.objects.create(pointure='38')
+        self.p39 = Pointure.objects.create(pointure='39')
+
+    def _variante(self, couleur, pointure, quantite, actif=True):
+        return VarianteArticle.objects.create(
+            article=self.article, couleur=couleur, pointure=pointure, qte_disponible=quantite, actif=actif
+        )
+
+    def test_agregats_suivent_les_variantes(self):
+        noir = self._variante(self.noir, self.p39, 5)
+        self._variante(self.beige, self.p38, 3)
+        self._variante(self.beige, self.p39, 40, actif=False)
+
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.stock_disponible, 8)
+        self.assertEqual(self.article.nb_variantes_actives, 2)
+        self.assertEqual((self.article.couleur, self.article.pointure), ('Beige', '38'))
+
+        noir.qte_disponible = 1
+        noir.save()
+        MouvementStock.objects.create(article=self.article, variante=noir, type_mouvement='sortie', quantite=-4, qte_apres_mouvement=1)
+        self.beige.nom = 'Camel'
+        self.beige.save()
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.qte_disponible, 4)
+        self.assertEqual(self.article.couleur, 'Camel')
+
+        noir.delete()
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.get_total_qte_disponible(), 3)
+        self.assertEqual(self.article.nb_variantes_actives, 1)
+
+    def test_sauvegarde_article_ne_reecrit_pas_les_agregats(self):
+        article_lu = Article.objects.get(pk=self.article.pk)
+        self._variante(self.noir, self.p38, 6)
+
+        article_lu.nom = 'Sandale Tressée Cuir'
+        article_lu.save()
+
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.nom, 'Sandale Tressée Cuir')
+        self.assertEqual(self.article.stock_disponible, 6)
+
+    def test_liste_sans_requete_par_article(self):
+        self._variante(self.noir, self.p38, 2)
+        articles = list(Article.objects.all())
+
+        with self.assertNumQueries(0):
+            valeurs = [(a.qte_disponible, a.couleur, a.pointure, a.est_disponible) for a in articles]
+        self.assertEqual(valeurs, [(2, 'Noir', '38', True)])
+
+    def test_verification_et_correction(self):
+        self._variante(self.noir, self.p38, 7)
+        # Écriture hors signaux : l'agrégat dérive
+        VarianteArticle.objects.filter(article=self.article).update(qte_disponible=2)
+
+        self.assertEqual(articles_incoherents(), [
+            {'id': self.article.pk, 'nom': self.article.nom, 'ecarts': {'stock_disponible': (7, 2)}},
+        ])
+
+        sortie = StringIO()
+        call_command('verifier_stocks_articles', '--corriger', stdout=sortie)
+        self.assertIn('1 article(s) incohérent(s)', sortie.getvalue())
+        self.assertEqual(articles_incoherents(), [])
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.stock_disponible, 2)
+
+
+class MoteurPromotionsTest(TestCase):
+
+    def setUp(self):
+        self.categorie = Categorie.objects.create(nom='BASKET')
+        self.maintenant = timezone.now()
+        self.articles = [
+            Article.objects.create(nom=f'Basket {numero}', reference=f'BAS-{numero}', prix_unitaire=200, categorie=self.categorie)
+            for numero in range(3)
+        ]
+        self.articles[0].isUpsell = True
+        self.articles[0].save()
+
+    def _promotion(self, pourcentage, debut, fin, articles):
+        promotion = Promotion.objects.create(
+            nom=f'Promo {pourcentage}', pourcentage_reduction=pourcentage,
+            date_debut=self.maintenant + debut, date_fin=self.maintenant + fin,
+        )
+        promotion.articles.set(articles)
+        return promotion
+
+    def _prix(self):
+        return [(article.prix_actuel, article.isUpsell) for article in Article.objects.order_by('reference')]
+
+    def test_passes_aux_bornes_de_la_promotion(self):
+        promotion = self._promotion(25, timedelta(hours=1), timedelta(hours=3), self.articles[:2])
+        self.assertEqual(self._prix()[0], (Decimal('200.00'), True))
+
+        # Début : réduction appliquée, upsell retiré
+        synchroniser_promotions(self.maintenant + timedelta(hours=2))
+        self.assertEqual(self._prix(), [
+            (Decimal('150.00'), False), (Decimal('150.00'), False), (Decimal('200.00'), False),
+        ])
+
+        # Fin : retour au prix unitaire et promotion désactivée
+        resultat = synchroniser_promotions(self.maintenant + timedelta(hours=4))
+        self.assertEqual(resultat['deactivated'], 1)
+        self.assertEqual(resultat['articles_updated'], 2)
+        self.assertEqual([prix for prix, _ in self._prix()], [Decimal('200.00')] * 3)
+        promotion.refresh_from_db()
+        self.assertFalse(promotion.active)
+
+    def test_meilleure_promotion_et_liquidation_preservee(self):
+        self._promotion(10, -timedelta(hours=1), timedelta(hours=5), self.articles[:2])
+        self._promotion(30, -timedelta(hours=1), timedelta(hours=1), self.articles[1:2])
+        liquidation = self.articles[2]
+        liquidation.phase = 'LIQUIDATION'
+        liquidation.prix_actuel = Decimal('120.00')
+        liquidation.save()
+
+        synchroniser_promotions(self.maintenant)
+        self.assertEqual([prix for prix, _ in self._prix()], [Decimal('180.00'), Decimal('140.00'), Decimal('120.00')])
+
+        # La promotion à 30 % se termine : l'article garde celle à 10 %
+        synchroniser_promotions(self.maintenant + timedelta(hours=2))
+        self.assertEqual([prix for prix, _ in self._prix()], [Decimal('180.00'), Decimal('180.00'), Decimal('120.00')])
+
+    def test_lancement_catalogue_en_une_passe(self):
+        articles = [
+            Article(nom=f'Mule {numero}', reference=f'MUL-{numero}', prix_unitaire=100, prix_actuel=100, categorie=self.categorie)
+            for numero in range(40)
+        ]
+        Article.objects.bulk_create(articles)
+        Promotion.objects.create(
+            nom='Soldes', pourcentage_reduction=20,
+            date_debut=self.maintenant + timedelta(minutes=5), date_fin=self.maintenant + timedelta(days=2),
+        ).articles.set(Article.objects.all())
+
+        # Désactivation des expirées, sélection et bulk_update (un lot), plus les points de sauvegarde,
+        # quelle que soit la taille du catalogue
+        with self.assertNumQueries(7):
+            resultat = synchroniser_promotions(self.maintenant + timedelta(minutes=10))
+        self.assertEqual(resultat['articles_updated'], 43)
+        self.assertFalse(Article.objects.exclude(prix_actuel=F('prix_unitaire') * Decimal('0.8')).exists())
+
+    def test_prochaine_echeance(self):
+        promotion = self._promotion(15, timedelta(minutes=10), timedelta(minutes=40), self.articles[:1])
+        self.assertEqual(prochaine_echeance(self.maintenant), promotion.date_debut)
+        self.assertEqual(prochaine_echeance(self.maintenant + timedelta(minutes=20)), promotion.date_fin + MARGE_FIN)
+        self.assertEqual(prochaine_echeance(self.maintenant + timedelta(hours=2)), self.maintenant + timedelta(hours=3))
+
+    def test_planificateur_dedie_voit_les_modifications(self):
+        # Planificateur d'un autre processus : seul le cache partagé les relie
+        ordonnanceur = mock.Mock()
+        with mock.patch.object(planificateur, '_planificateur', ordonnanceur), \
+                mock.patch.object(planificateur, '_version_vue', planificateur.cache.get(planificateur.CLE_VERSION)):
+            self.assertFalse(planificateur.verifier_modifications())
+
+            with mock.patch.object(planificateur, '_planificateur', None), self.captureOnCommitCallbacks(execute=True):
+                self._promotion(15, timedelta(minutes=10), timedelta(minutes=40), self.articles[:1])
+
+            self.assertTrue(planificateur.verifier_modifications())
+            self.assertLessEqual(ordonnanceur.add_job.call_args.kwargs['run_date'], timezone.now())
+            self.assertFalse(planificateur.verifier_modifications())
+
+
+class MouvementsStockBulkTest(TestCase):
+
+    def setUp(self):
+        categorie = Categorie.objects.create(nom='SANDALES')
+        self.sandale = Article.objects.create(nom='Sandale', reference='SAN-1', prix_unitaire=199, categorie=categorie)
+        self.mule = Article.objects.create(nom='Mule', reference='MUL-1', prix_unitaire=249, categorie=categorie)
+        noir, beige = Couleur.objects.create(nom='Noir'), Couleur.objects.create(nom='Beige')
+        p38 = Pointure.objects.create(pointure='38')
+        self.sandale_noire = VarianteArticle.objects.create(article=self.sandale, couleur=noir, pointure=p38, qte_disponible=3)
+        self.sandale_beige = VarianteArticle.objects.create(article=self.sandale, couleur=beige, pointure=p38, qte_disponible=2)
+        self.mule_noire = VarianteArticle.objects.create(article=self.mule, couleur=noir, pointure=p38, qte_disponible=1)
+
+    def _stocks(self):
+        return [v.qte_disponible for v in VarianteArticle.objects.filter(pk__in=[
+            self.sandale_noire.pk, self.sandale_beige.pk, self.mule_noire.pk,
+        ]).order_by('pk')]
+
+    def test_lot_applique_en_une_passe(self):
+        lignes = [
+            LigneMouvement(self.sandale.pk, 4),
+            LigneMouvement(self.mule.pk, 1, self.mule_noire.pk, 'Ligne mule'),
+        ]
+        with self.assertNumQueries(9):
+            # Savepoint, verrouillage, bulk_update, bulk_create, recalcul des agrégats,
+            # lecture des niveaux et des alertes, écriture des alertes modifiées, release
+            mouvements = creer_mouvements_stock_bulk(lignes, 'sortie', commentaire='Préparation')
+
+        # Sans variante : les plus stockées d'abord
+        self.assertEqual(self._stocks(), [0, 1, 0])
+        self.assertEqual(
+            [(m.quantite, m.qte_apres_mouvement, m.variante_id, m.commentaire) for m in mouvements],
+            [
+                (-3, 0, self.sandale_noire.pk, 'Préparation'),
+                (-1, 1, self.sandale_beige.pk, 'Préparation'),
+                (-1, 0, self.mule_noire.pk, 'Ligne mule'),
+            ],
+        )
+        self.assertEqual(MouvementStock.objects.count(), 3)
+        self.sandale.refresh_from_db()
+        self.assertEqual(self.sandale.stock_disponible, 1)
+
+    def test_tout_ou_rien(self):
+        lignes = [LigneMouvement(self.sandale.pk, 2), LigneMouvement(self.mule.pk, 3)]
+        with self.assertRaises(ValidationError) as contexte:
+            creer_mouvements_stock_bulk(lignes, 'sortie')
+
+        self.assertIn('Article %s' % self.mule.pk, str(contexte.exception))
+        self.assertEqual(self._stocks(), [3, 2, 1])
+        self.assertFalse(MouvementStock.objects.exists())
+
+        # Retour : toutes les lignes réintègrent le stock
+        creer_mouvements_stock_bulk(lignes, 'retour_client')
+        self.assertEqual(self._stocks(), [5, 2, 4])
+
+
+class JournalStockTest(TestCase):
+
+    def setUp(self):
+        self.sandales = Categorie.objects.create(nom='SANDALES')
+        self.mules = Categorie.objects.create(nom='MULES')
+        sandale = Article.objects.create(nom='Sandale', reference='SAN-1', prix_unitaire=100, categorie=self.sandales)
+        mule = Article.objects.create(nom='Mule', reference='MUL-1', prix_unitaire=50, categorie=self.mules)
+        noir, p38 = Couleur.objects.create(nom='Noir'), Pointure.objects.create(pointure='38')
+        self.variante = VarianteArticle.objects.create(article=sandale, couleur=noir, pointure=p38, qte_disponible=5)
+        VarianteArticle.objects.create(article=mule, couleur=noir, pointure=p38, qte_disponible=1)
+
+        # Stock courant 5 : 10 → -4 avant-hier → +2 hier → -3 aujourd'hui
+        self.aujourd_hui = timezone.localdate()
+        self.hier = self.aujourd_hui - timedelta(days=1)
+        self.avant_hier = self.aujourd_hui - timedelta(days=2)
+        for quantite, instant in (
+            (-4, self._a(self.avant_hier, 12)),
+            (2, self._a(self.hier, 12)),
+            (-3, timezone.now()),
+        ):
+            mouvement = MouvementStock.objects.create(
+                article=sandale, variante=self.variante, type_mouvement='entree' if quantite > 0 else 'sortie',
+                quantite=quantite, qte_apres_mouvement=0,
+            )
+            MouvementStock.objects.filter(pk=mouvement.pk).update(date_mouvement=instant)
+
+    def _a(self, jour, heure):
+        return fin_de_journee(jour - timedelta(days=1)) + timedelta(hours=heure)
+
+    def test_cloture_journaliere(self):
+        self.assertEqual(cloturer_journee(self.avant_hier), 2)
+        self.assertEqual(cloturer_journee(), 2)
+        # Une nouvelle clôture réécrit les instantanés du jour
+        cloturer_journee()
+
+        instantane = InstantaneStock.objects.get(variante=self.variante, date=self.avant_hier)
+        self.assertEqual((instantane.quantite, instantane.valeur), (6, Decimal('600.00')))
+        self.assertEqual(InstantaneStock.objects.get(variante=self.variante, date=self.hier).quantite, 8)
+        self.assertEqual(InstantaneStock.objects.count(), 4)
+
+    def test_stock_a_date(self):
+        # Sans instantané : stock courant moins les mouvements postérieurs
+        self.assertEqual(stock_variante_a(self.variante.pk, self._a(self.avant_hier, 11)), 10)
+        self.assertEqual(stock_variante_a(self.variante.pk, self._a(self.avant_hier, 13)), 6)
+
+        cloturer_journee(self.avant_hier)
+        cloturer_journee()
+        with self.assertNumQueries(2):
+            # Dernier instantané, puis queue des mouvements qui le suivent
+            self.assertEqual(stock_variante_a(self.variante.pk, self._a(self.hier, 13)), 8)
+        self.assertEqual(stock_variante_a(self.variante.pk, timezone.now()), 5)
+
+    def test_valeur_par_categorie(self):
+        cloturer_journee()
+        InstantaneStock.objects.filter(variante=self.variante).update(valeur=Decimal('790.00'))
+
+        valeurs = valeur_stock_par_categorie(self.avant_hier, self.aujourd_hui)
+
+        self.assertEqual(list(valeurs), [self.avant_hier, self.hier, self.aujourd_hui])
+        # Avant-hier reconstitué, hier lu dans les instantanés, aujourd'hui au stock courant
+        self.assertEqual(valeurs[self.avant_hier], {self.sandales.pk: Decimal('600'), self.mules.pk: Decimal('50')})
+        self.assertEqual(valeurs[self.hier], {self.sandales.pk: Decimal('790'), self.mules.pk: Decimal('50')})
+        self.assertEqual(valeurs[self.aujourd_hui], {self.sandales.pk: Decimal('500'), self.mules.pk: Decimal('50')})
+
+        par_semaine = valeur_stock_par_categorie(self.avant_hier, self.aujourd_hui, pas=2, categorie=self.mules.pk)
+        self.assertEqual(par_semaine, {self.avant_hier: {self.mules.pk: Decimal('50')}, self.aujourd_hui: {self.mules.pk: Decimal('50')}})
+
+    def test_ajustements_traces_dans_le_journal(self):
+        debut = timezone.now()
+        mouvement = ajuster_stock_variante(self.variante, 2, commentaire='Inventaire')
+        self.assertEqual((mouvement.type_mouvement, mouvement.quantite, mouvement.qte_apres_mouvement), ('ajustement_neg', -3, 2))
+        self.assertIsNone(ajuster_stock_variante(self.variante, 2))
+
+        # Le stock à date reste cohérent de part et d'autre de l'ajustement
+        self.assertEqual(stock_variante_a(self.variante.pk, debut), 5)
+        self.assertEqual(stock_variante_a(self.variante.pk, timezone.now()), 2)
+        cloturer_journee(self.aujourd_hui)
+        self.assertEqual(InstantaneStock.objects.get(variante=self.variante, date=self.aujourd_hui).quantite, 2)
+
+    def test_stock_initial_d_une_nouvelle_variante(self):
+        self.client.force_login(User.objects.create_superuser('gestionnaire', password='x'))
+        reponse = self.client.post('/article/variantes/creer-ajax/', {
+            'article_id': self.variante.article_id,
+            'variantes': [{
+                'couleur_id': Couleur.objects.create(nom='Rouge').pk,
+                'pointure_id': Pointure.objects.create(pointure='40').pk,
+                'quantite': 4,
+            }],
+        }, content_type='application/json')
+
+        self.assertEqual(reponse.json()['nombre_crees'], 1)
+        variante = VarianteArticle.objects.get(pk=reponse.json()['variantes_crees'][0]['id'])
+        self.assertEqual(variante.qte_disponible, 4)
+        self.assertEqual(
+            list(variante.mouvements.values_list('type_mouvement', 'quantite')), [('ajustement_pos', 4)],
+        )
+
+
+class AlertesStockTest(TestCase):
+
+    def setUp(self):
+        self.categorie = Categorie.objects.create(nom='SANDALES')
+        self.article = Article.objects.create(nom='Sandale', reference='SAN-1', prix_unitaire=100, categorie=self.categorie)
+        self.variante = VarianteArticle.objects.create(
+            article=self.article, couleur=Couleur.objects.create(nom='Noir'),
+            pointure=Pointure.objects.create(pointure='38'), qte_disponible=15,
+        )
+
+    def _niveau(self):
+        return AlerteStock.objects.filter(article=self.article).values_list('niveau', flat=True).first()
+
+    def test_niveau_suit_les_mouvements(self):
+        # Seuils par défaut : rupture ≤ 0, faible ≤ 10, à commander ≤ 20
+        self.assertEqual(self._niveau(), 'a_commander')
+        creer_mouvements_stock_bulk([LigneMouvement(self.article.pk, 6)], 'sortie')
+        self.assertEqual(self._niveau(), 'faible')
+        creer_mouvements_stock_bulk([LigneMouvement(self.article.pk, 9)], 'sortie')
+        self.assertEqual(compteurs_alertes(), {'rupture': 1, 'faible': 0, 'a_commander': 0})
+
+        creer_mouvements_stock_bulk([LigneMouvement(self.article.pk, 30)], 'entree')
+        self.assertIsNone(self._niveau())
+
+    def test_ecriture_seulement_au_franchissement(self):
+        debut = AlerteStock.objects.get(article=self.article).date_alerte
+        with CaptureQueriesContext(connection) as requetes:
+            creer_mouvements_stock_bulk([LigneMouvement(self.article.pk, 1)], 'sortie')
+        self.assertFalse([r for r in requetes.captured_queries if 'article_alertestock' in r['sql'] and not r['sql'].startswith('SELECT')])
+        self.assertEqual(AlerteStock.objects.get(article=self.article).date_alerte, debut)
+
+    def test_seuils_article_puis_categorie(self):
+        SeuilStock.objects.create(categorie=self.categorie, rupture=0, faible=2, a_commander=5)
+        self.assertIsNone(self._niveau())
+
+        seuil_article = SeuilStock.objects.create(article=self.article, rupture=0, faible=20, a_commander=30)
+        self.assertEqual(self._niveau(), 'faible')
+        seuil_article.delete()
+        self.assertIsNone(self._niveau())
+
+        self.article.actif = False
+        self.article.save()
+        SeuilStock.objects.filter(categorie=self.categorie).update(a_commander=50)
+        actualiser_alertes([self.article.pk])
+        self.assertIsNone(self._niveau())
+
+
+class MatriceDisponibiliteTest(TestCase):
+
+    def setUp(self):
+        caches['disponibilite'].clear()
+        categorie = Categorie.objects.create(nom='SANDALES')
+        self.article = Article.objects.create(nom='Sandale', reference='SAN-1', prix_unitaire=100, categorie=categorie)
+        noir, beige = Couleur.objects.create(nom='Noir'), Couleur.objects.create(nom='Beige')
+        p40, p38 = Pointure.objects.create(pointure='40', ordre=2), Pointure.objects.create(pointure='38', ordre=1)
+        self.noir_38 = VarianteArticle.objects.create(article=self.article, couleur=noir, pointure=p38, qte_disponible=3)
+        self.noir_40 = VarianteArticle.objects.create(article=self.article, couleur=noir, pointure=p40, qte_disponible=0)
+        self.beige_38 = VarianteArticle.objects.create(article=self.article, couleur=beige, pointure=p38, qte_disponible=2)
+        VarianteArticle.objects.create(article=self.article, couleur=beige, pointure=p40, qte_disponible=9, actif=False)
+
+    def test_grille_couleurs_pointures(self):
+        with self.assertNumQueries(1):
+            matrice = matrice_disponibilite(self.article.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(matrice_disponibilite(self.article.pk), matrice)
+
+        self.assertEqual((matrice.couleurs, matrice.pointures), (('Beige', 'Noir'), ('38', '40')))
+        self.assertEqual(matrice.variantes, (self.beige_38.pk, None, self.noir_38.pk, self.noir_40.pk))
+        self.assertEqual(matrice.quantites, (2, None, 3, 0))
+        self.assertEqual(matrice.stock_total, 5)
+        self.assertEqual([(c.couleur, c.pointure) for c in matrice.cellules()], [('Beige', '38'), ('Noir', '38'), ('Noir', '40')])
+
+    def test_invalidation_au_commit(self):
+        matrice_disponibilite(self.article.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            creer_mouvements_stock_bulk([LigneMouvement(self.article.pk, 1, self.noir_38.pk)], 'sortie')
+        self.assertEqual(matrice_disponibilite(self.article.pk).quantites, (2, None, 2, 0))
 
-# Create your tests here.
+    def test_api_compacte(self):
+        utilisateur = User.objects.create_user('operateur', password='x')
+        Operateur.objects.create(user=utilisateur, nom='Idrissi', prenom='Nora', mail='n@yz.ma', type_operateur='CONFIRMATION')
+        self.client.force_login(utilisateur)
+        reponse = self.client.get('/article/api/disponibilite/', {'articles': f'{self.article.pk}'})
+        self.assertEqual(reponse.json(), {'success': True, 'matrices': [{
+            'article': self.article.pk,
+            'couleurs': ['Beige', 'Noir'],
+            'pointures': ['38', '40'],
+            'variantes': [self.beige_38.pk, None, self.noir_38.pk, self.noir_40.pk],
+            'quantites': [2, None, 3, 0],
+        }]})
+        self.assertEqual(self.client.get('/article/api/disponibilite/', {'articles': 'x'}).status_code, 400)
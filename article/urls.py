@@ -30,6 +30,7 @@ urlpatterns = [
     # Gestion du stock
     path('stock-faible/', views.stock_faible, name='stock_faible'),
     path('rupture-stock/', views.rupture_stock, name='rupture_stock'),
+    path('api/disponibilite/', views.api_disponibilite, name='api_disponibilite'),
     
     # Gestion des promotions
     path('promotions/', views.liste_promotions, name='liste_promotions'),
@@ -3,12 +3,19 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.core.paginator import Paginator
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import Q, Count, Avg, Sum, Min, Max
 from .models import Article, Promotion, VarianteArticle, Categorie, Genre, Couleur, Pointure
 from django.urls import reverse
+from django.views.decorators.gzip import gzip_page
 from django.views.decorators.http import require_POST
 from django.utils import timezone
 from .forms import PromotionForm
+from .promotions import synchroniser_promotions
+from .alertes import articles_en_alerte
+from .disponibilite import matrices_disponibilite
+from .mouvements import ajuster_stock_variante
 from decimal import Decimal
 import json
 
@@ -110,9 +117,9 @@ def liste_articles(request):
     
     # Filtrage par stock
     if filtre_stock == 'disponible':
-        articles = articles.filter(variantes__qte_disponible__gt=0, variantes__actif=True).distinct()
+        articles = articles.filter(stock_disponible__gt=0)
     elif filtre_stock == 'rupture':
-        articles = articles.exclude(variantes__qte_disponible__gt=0, variantes__actif=True).distinct()
+        articles = articles.filter(stock_disponible=0)
     elif filtre_stock == 'stock_faible':
         articles = articles.filter(
             variantes__qte_disponible__gt=0, 
@@ -193,7 +200,7 @@ def liste_articles(request):
     all_articles = Article.objects.all().filter(actif=True)
     stats = {
         'total_articles': all_articles.count(),
-        'articles_disponibles': all_articles.filter(variantes__qte_disponible__gt=0, variantes__actif=True).distinct().count(),
+        'articles_disponibles': all_articles.filter(stock_disponible__gt=0).count(),
         'articles_en_cours': all_articles.filter(phase='EN_COURS').count(),
         'articles_liquidation': all_articles.filter(phase='LIQUIDATION').count(),
         'articles_test': all_articles.filter(phase='EN_TEST').count(),
@@ -202,7 +209,7 @@ def liste_articles(request):
             promotions__date_debut__lte=now,
             promotions__date_fin__gte=now
         ).distinct().count(),
-        'articles_rupture': all_articles.exclude(variantes__qte_disponible__gt=0, variantes__actif=True).distinct().count(),
+        'articles_rupture': all_articles.filter(stock_disponible=0).count(),
         'articles_stock_faible': all_articles.filter(
             variantes__qte_disponible__gt=0, 
             variantes__qte_disponible__lt=5, 
@@ -742,15 +749,19 @@ def modifier_article(request, id):
                         # Mettre à jour la variante
                         variante = VarianteArticle.objects.get(id=variante_id, article=article)
                         ancienne_quantite = variante.qte_disponible
-                        variante.qte_disponible = int(nouvelle_quantite) if nouvelle_quantite else 0
-                        variante.save()
+                        # Ajustement tracé : le journal de stock reste la somme des mouvements
+                        ajuster_stock_variante(
+                            variante, int(nouvelle_quantite) if nouvelle_quantite else 0,
+                            operateur=getattr(request.user, 'profil_operateur', None),
+                            commentaire=f"Modification de l'article {article.reference}",
+                        )
                         
                         variantes_mises_a_jour += 1
                         couleur_nom = variante.couleur.nom if variante.couleur else "Aucune couleur"
                         pointure_nom = variante.pointure.pointure if variante.pointure else "Aucune pointure"
                         messages.success(request, f"Quantité mise à jour pour {couleur_nom} / {pointure_nom} : {ancienne_quantite} → {variante.qte_disponible}")
                         
-                    except (ValueError, VarianteArticle.DoesNotExist) as e:
+                    except (ValueError, ValidationError, VarianteArticle.DoesNotExist) as e:
                         messages.error(request, f"Erreur lors de la mise à jour de la variante {variante_id}: {str(e)}")
             
             # Traiter les nouvelles variantes ajoutées via le modal
@@ -796,7 +807,7 @@ def modifier_article(request, id):
                     variante.article = article
                     variante.couleur_id = couleur_id_variante if couleur_id_variante else None
                     variante.pointure_id = pointure_id_variante if pointure_id_variante else None
-                    variante.qte_disponible = int(quantite) if quantite else 0
+                    variante.qte_disponible = 0
                     variante.prix_unitaire = prix_unitaire
                     variante.prix_achat = article.prix_achat
                     variante.prix_actuel = prix_unitaire
@@ -810,7 +821,14 @@ def modifier_article(request, id):
                         variante.reference_variante = variante.generer_reference_variante_automatique()
                     variante.reference_variante = variante.generer_reference_variante_automatique()
                     
-                    variante.save()
+                    with transaction.atomic():
+                        variante.save()
+                        # Stock initial en mouvement d'ajustement, comme toute variation de stock
+                        ajuster_stock_variante(
+                            variante, int(quantite) if quantite else 0,
+                            operateur=getattr(request.user, 'profil_operateur', None),
+                            commentaire="Stock initial de la variante",
+                        )
                     variantes_crees += 1
                     
                     # Message de succès pour chaque variante créée
@@ -981,13 +999,8 @@ def articles_par_categorie(request, categorie):
 
 @login_required
 def stock_faible(request):
-    """Articles avec stock faible (moins de 5 unités)"""
-    articles = Article.objects.filter(
-        variantes__qte_disponible__lt=5,
-        variantes__qte_disponible__gt=0,
-        variantes__actif=True,
-        actif=True
-    ).order_by('variantes__qte_disponible', 'nom')
+    """Articles avec stock faible (sous leur seuil d'alerte, voir article.alertes)"""
+    articles = articles_en_alerte('faible').order_by('stock_disponible', 'nom')
     
     # Pagination
     paginator = Paginator(articles, 20)
@@ -996,18 +1009,14 @@ def stock_faible(request):
     
     context = {
         'page_obj': page_obj,
-        'total_articles': articles.count(),
+        'total_articles': paginator.count,
     }
     return render(request, 'article/stock_faible.html', context)
 
 @login_required
 def rupture_stock(request):
-    """Articles en rupture de stock"""
-    articles = Article.objects.filter(
-        variantes__qte_disponible=0,
-        variantes__actif=True,
-        actif=True
-    ).order_by('nom', 'variantes__couleur__nom', 'variantes__pointure__pointure')
+    """Articles en rupture de stock (voir article.alertes)"""
+    articles = articles_en_alerte('rupture').order_by('nom')
     
     # Pagination
     paginator = Paginator(articles, 20)
@@ -1016,7 +1025,7 @@ def rupture_stock(request):
     
     context = {
         'page_obj': page_obj,
-        'total_articles': articles.count(),
+        'total_articles': paginator.count,
     }
     return render(request, 'article/rupture_stock.html', context)
 
@@ -1231,52 +1240,14 @@ def modifier_promotion(request, id):
     promotion = get_object_or_404(Promotion, id=id)
     
     if request.method == 'POST':
-        # Conserver les anciens articles pour comparaison
-        anciens_articles = list(promotion.articles.all())
-        
         form = PromotionForm(request.POST, instance=promotion)
         if form.is_valid():
+            # Les prix des articles ajoutés, retirés ou conservés sont recalculés
+            # par les signaux de Promotion (post_save et m2m_changed)
             promotion_modifiee = form.save()
             
-            # Récupérer les nouveaux articles
-            nouveaux_articles = list(promotion_modifiee.articles.all())
-            
-            # Vérifier si la promotion doit être active
-            now = timezone.now()
-            if promotion_modifiee.active and promotion_modifiee.date_debut <= now <= promotion_modifiee.date_fin:
-                # Retirer la promotion des anciens articles qui ne sont plus dans la promotion
-                for article in anciens_articles:
-                    if article not in nouveaux_articles:
-                        # Vérifier si l'article n'a pas d'autres promotions actives
-                        autres_promotions_actives = article.promotions.filter(
-                            active=True,
-                            date_debut__lte=now,
-                            date_fin__gte=now
-                        ).exclude(id=promotion_modifiee.id).exists()
-                        
-                        if not autres_promotions_actives:
-                            article.retirer_promotion()
-                        else:
-                            article.update_prix_actuel()
-                
-                # Appliquer la promotion aux nouveaux articles
-                for article in nouveaux_articles:
-                    article.appliquer_promotion(promotion_modifiee)
-                
+            if promotion_modifiee.est_active:
                 messages.success(request, f"La promotion '{promotion.nom}' a été modifiée avec succès. Les prix ont été mis à jour.")
-            else:
-                # Si la promotion n'est pas active, retirer la promotion de tous les anciens articles
-                for article in anciens_articles:
-                    autres_promotions_actives = article.promotions.filter(
-                        active=True,
-                        date_debut__lte=now,
-                        date_fin__gte=now
-                    ).exclude(id=promotion_modifiee.id).exists()
-                    
-                    if not autres_promotions_actives:
-                        article.retirer_promotion()
-                    else:
-                        article.update_prix_actuel()
                 
             messages.success(request, f"La promotion '{promotion.nom}' a été modifiée avec succès.")
             
@@ -1439,32 +1410,12 @@ def gerer_promotions_automatiquement(request):
 
     
     """Gère automatiquement toutes les promotions selon leur date et statut"""
-    now = timezone.now()
-    
-    # Statistiques
-    stats = {
-        'activated': 0,
-        'deactivated': 0,
-        'articles_updated': 0
-    }
-    
-    # Récupérer toutes les promotions
-    all_promotions = Promotion.objects.all()
-    
-    for promotion in all_promotions:
-        result = promotion.verifier_et_appliquer_automatiquement()
-        
-        if result == "activated":
-            stats['activated'] += 1
-            stats['articles_updated'] += promotion.articles.count()
-        elif result == "deactivated":
-            stats['deactivated'] += 1
-            stats['articles_updated'] += promotion.articles.count()
+    # Une passe : promotions expirées désactivées, prix recalculés pour tout le catalogue
+    # (exécutée aussi automatiquement à chaque début ou fin de promotion, voir article.planificateur)
+    stats = synchroniser_promotions()
     
     # Messages de feedback
     messages_list = []
-    if stats['activated'] > 0:
-        messages_list.append(f"{stats['activated']} promotion(s) activée(s)")
     if stats['deactivated'] > 0:
         messages_list.append(f"{stats['deactivated']} promotion(s) désactivée(s)")
     if stats['articles_updated'] > 0:
@@ -1723,17 +1674,24 @@ def creer_variantes_ajax(request):
                 variante.article = article
                 variante.couleur_id = couleur_id if couleur_id else None
                 variante.pointure_id = pointure_id if pointure_id else None
-                variante.qte_disponible = int(quantite) if quantite else 0
-                
-                # Définir la référence
-                if reference:
-                    variante.reference_variante = reference
-                else:
-                    # Générer automatiquement
-                    variante.save()  # Sauvegarder d'abord pour avoir l'ID
-                    variante.reference_variante = variante.generer_reference_variante_automatique()
+                variante.qte_disponible = 0
                 
-                variante.save()
+                with transaction.atomic():
+                    # Définir la référence
+                    if reference:
+                        variante.reference_variante = reference
+                    else:
+                        # Générer automatiquement
+                        variante.save()  # Sauvegarder d'abord pour avoir l'ID
+                        variante.reference_variante = variante.generer_reference_variante_automatique()
+                    
+                    variante.save()
+                    # Stock initial en mouvement d'ajustement, comme toute variation de stock
+                    ajuster_stock_variante(
+                        variante, int(quantite) if quantite else 0,
+                        operateur=getattr(request.user, 'profil_operateur', None),
+                        commentaire="Stock initial de la variante",
+                    )
                 
                 # Préparer les données de réponse
                 variante_info = {
@@ -1802,3 +1760,31 @@ def supprimer_variante(request, id):
             return JsonResponse({'success': False, 'error': f'Erreur lors de la suppression : {str(e)}'}, content_type='application/json')
         messages.error(request, f'Erreur lors de la suppression : {str(e)}')
         return redirect('article:liste')
+
+
+MAX_ARTICLES_DISPONIBILITE = 100
+
+
+@login_required
+@gzip_page
+def api_disponibilite(request):
+    """
+    Matrices de disponibilité couleur × pointure des articles (voir article.disponibilite).
+
+    GET ?articles=12,15,18 (au plus MAX_ARTICLES_DISPONIBILITE identifiants)
+    """
+    try:
+        article_ids = [int(pk) for pk in request.GET.get('articles', '').split(',') if pk.strip()]
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Identifiants d\'articles invalides'}, status=400)
+    if not article_ids or len(article_ids) > MAX_ARTICLES_DISPONIBILITE:
+        return JsonResponse({
+            'success': False,
+            'error': f'Entre 1 et {MAX_ARTICLES_DISPONIBILITE} articles attendus'
+        }, status=400)
+
+    matrices = matrices_disponibilite(article_ids)
+    return JsonResponse(
+        {'success': True, 'matrices': [matrice.compacte() for matrice in matrices.values()]},
+        json_dumps_params={'separators': (',', ':')},
+    )
@@ -8,7 +8,10 @@ class ClientAdmin(admin.ModelAdmin):
     # list_filter = ('is_active', 'date_creation')
     search_fields = ('numero_tel', 'nom', 'prenom', 'email', 'adresse')
     ordering = ('-date_creation',)
-    readonly_fields = ('date_creation', 'date_modification')
+    readonly_fields = (
+        'date_creation', 'date_modification', 'nb_commandes', 'date_derniere_commande',
+        'ville_derniere_commande', 'valeur_totale', 'nb_livrees', 'nb_retournees',
+    )
     
     fieldsets = (
         ('Informations personnelles', {
@@ -17,4 +20,10 @@ class ClientAdmin(admin.ModelAdmin):
         ('Statut', {
             'fields': ('is_active', 'date_creation')
         }),
+        ('Statistiques de commandes', {
+            'fields': (
+                'nb_commandes', 'date_derniere_commande', 'ville_derniere_commande',
+                'valeur_totale', 'nb_livrees', 'nb_retournees',
+            )
+        }),
     )
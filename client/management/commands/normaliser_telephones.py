@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from client.models import Client
+from client.telephone import normaliser_telephones
+
+
+class Command(BaseCommand):
+    help = 'Recalcule les formes indexées des numéros de téléphone clients (normalisée et inversée)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--taille-lot',
+            type=int,
+            default=1000,
+            help='Nombre de clients mis à jour par requête (par défaut: 1000)'
+        )
+        parser.add_argument(
+            '--tout',
+            action='store_true',
+            help='Réécrire tous les clients, y compris ceux déjà à jour'
+        )
+
+    def handle(self, *args, **options):
+        nombre = normaliser_telephones(
+            Client.objects.all(),
+            taille_lot=options['taille_lot'],
+            seulement_modifies=not options['tout'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'📞 {nombre} client(s) mis à jour'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from client.models import Client
+from client.statistiques import TAILLE_LOT, recalculer_statistiques
+
+
+class Command(BaseCommand):
+    help = 'Recalcule les statistiques de commandes dénormalisées et le texte de recherche des clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--taille-lot',
+            type=int,
+            default=TAILLE_LOT,
+            help=f'Nombre de clients recalculés par requête (par défaut: {TAILLE_LOT})'
+        )
+
+    def handle(self, *args, **options):
+        nombre = recalculer_statistiques(Client.objects.all(), taille_lot=options['taille_lot'])
+        self.stdout.write(self.style.SUCCESS(f'📊 {nombre} client(s) mis à jour'))
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.7 on 2025-08-27 10:42
+
+import re
+
+from django.db import migrations, models
+
+
+def telephone_canonique(numero):
+    """Forme canonique au moment de la migration (copie figée de client.telephone)"""
+    telephone = re.sub(r'[\s\-\.\(\)\+]', '', str(numero or '').strip())[:30]
+    chiffres = re.sub(r'\D', '', telephone)
+    if chiffres.startswith('00'):
+        chiffres = chiffres[2:]
+    elif chiffres.startswith('0') and len(chiffres) == 10:
+        chiffres = '212' + chiffres[1:]
+    return chiffres[:30]
+
+
+def remplir_telephones(apps, schema_editor):
+    Client = apps.get_model('client', 'Client')
+    champs = ['telephone_normalise', 'telephone_inverse']
+    lot = []
+    for client in Client.objects.only('pk', 'numero_tel', *champs).order_by('pk').iterator(chunk_size=1000):
+        client.telephone_normalise = telephone_canonique(client.numero_tel)
+        client.telephone_inverse = client.telephone_normalise[::-1]
+        lot.append(client)
+        if len(lot) >= 1000:
+            Client.objects.bulk_update(lot, champs)
+            lot = []
+    if lot:
+        Client.objects.bulk_update(lot, champs)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='telephone_inverse',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=30, verbose_name='Téléphone inversé'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='telephone_normalise',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=30, verbose_name='Téléphone normalisé'),
+        ),
+        migrations.RunPython(remplir_telephones, migrations.RunPython.noop),
+    ]
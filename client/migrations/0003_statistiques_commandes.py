@@ -0,0 +1,128 @@
+# Generated by Django 5.1.7 on 2025-08-29 17:10
+
+import unicodedata
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+# Copie figée des règles de client.statistiques au moment de la migration
+TAILLE_LOT = 500
+ETATS_LIVRES = ('Livrée', 'Livrée Partiellement')
+ETATS_RETOURNES = ('Retournée',)
+ETATS_SANS_VALEUR = ('Annulée', 'Doublon', 'Erronée')
+
+
+def creer_index_recherche(apps, schema_editor):
+    """Index GIN trigrammes (PostgreSQL) : recherche par sous-chaîne sans parcours complet des clients"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS client_recherche_trgm '
+        'ON client_client USING gin (recherche gin_trgm_ops)'
+    )
+
+
+def supprimer_index_recherche(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS client_recherche_trgm')
+
+
+def normaliser(texte):
+    """Minuscules, sans accents, espaces simples"""
+    texte = unicodedata.normalize('NFKD', str(texte or ''))
+    texte = ''.join(caractere for caractere in texte if not unicodedata.combining(caractere))
+    return ' '.join(texte.lower().split())
+
+
+def remplir_statistiques(apps, schema_editor):
+    Client = apps.get_model('client', 'Client')
+    Commande = apps.get_model('commande', 'Commande')
+    derniere = Commande.objects.filter(client_id=OuterRef('pk')).order_by('-date_creation', '-pk')
+    champs = [
+        'nb_commandes', 'date_derniere_commande', 'ville_derniere_commande',
+        'valeur_totale', 'nb_livrees', 'nb_retournees', 'recherche',
+    ]
+
+    ids = list(Client.objects.order_by('pk').values_list('pk', flat=True))
+    for debut in range(0, len(ids), TAILLE_LOT):
+        lot = list(Client.objects.filter(pk__in=ids[debut:debut + TAILLE_LOT]).annotate(
+            _nb_commandes=Count('commandes'),
+            _date_derniere=Max('commandes__date_creation'),
+            _valeur=Coalesce(
+                Sum('commandes__total_cmd', filter=~Q(commandes__etat_courant__libelle__in=ETATS_SANS_VALEUR)),
+                Value(0.0),
+            ),
+            _nb_livrees=Count('commandes', filter=Q(commandes__etat_courant__libelle__in=ETATS_LIVRES)),
+            _nb_retournees=Count('commandes', filter=Q(commandes__etat_courant__libelle__in=ETATS_RETOURNES)),
+            _ville_init=Subquery(derniere.values('ville_init')[:1]),
+            _ville_nom=Subquery(derniere.values('ville__nom')[:1]),
+            _region=Subquery(derniere.values('ville__region__nom_region')[:1]),
+        ).order_by('pk'))
+        for client in lot:
+            client.nb_commandes = client._nb_commandes
+            client.date_derniere_commande = client._date_derniere
+            client.ville_derniere_commande = (client._ville_init or '')[:100]
+            client.valeur_totale = client._valeur
+            client.nb_livrees = client._nb_livrees
+            client.nb_retournees = client._nb_retournees
+            valeurs = [
+                client.pk, client.nom, client.prenom, client.numero_tel, client.telephone_normalise,
+                client.email, client.adresse, client.ville_derniere_commande, client._ville_nom, client._region,
+            ]
+            client.recherche = normaliser(' '.join(str(valeur) for valeur in valeurs if valeur not in (None, '')))
+        Client.objects.bulk_update(lot, champs)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0002_client_telephone_normalise_inverse'),
+        ('commande', '0008_sequence_numerotation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='date_derniere_commande',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Date de la dernière commande'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='nb_commandes',
+            field=models.PositiveIntegerField(default=0, verbose_name='Nombre de commandes'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='nb_livrees',
+            field=models.PositiveIntegerField(default=0, verbose_name='Commandes livrées'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='nb_retournees',
+            field=models.PositiveIntegerField(default=0, verbose_name='Commandes retournées'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='recherche',
+            field=models.TextField(blank=True, default='', verbose_name='Texte de recherche'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='valeur_totale',
+            field=models.FloatField(default=0, verbose_name='Valeur cumulée des commandes'),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='ville_derniere_commande',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='Ville de la dernière commande'),
+        ),
+        migrations.RunPython(creer_index_recherche, supprimer_index_recherche),
+        migrations.RunPython(remplir_statistiques, migrations.RunPython.noop),
+    ]
@@ -5,6 +5,8 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.translation import gettext_lazy as _
 from parametre.models import Operateur, Ville
 
+from .telephone import telephone_canonique
+
 # Create your models here.
 
 class Client(models.Model):
@@ -20,10 +22,34 @@ class Client(models.Model):
     date_modification = models.DateTimeField(auto_now=True, verbose_name="Dernière modification")
     note = models.TextField(blank=True, null=True, verbose_name="Note")
     is_active = models.BooleanField(default=True, verbose_name="Actif")
+    # Formes dérivées de numero_tel, indexées pour la recherche par début / fin de numéro (voir client.telephone)
+    telephone_normalise = models.CharField(max_length=30, blank=True, default='', db_index=True, verbose_name="Téléphone normalisé")
+    telephone_inverse = models.CharField(max_length=30, blank=True, default='', db_index=True, verbose_name="Téléphone inversé")
+    # Statistiques de commandes dénormalisées, tenues à jour au commit des écritures de commandes (voir client.statistiques)
+    nb_commandes = models.PositiveIntegerField(default=0, verbose_name="Nombre de commandes")
+    date_derniere_commande = models.DateTimeField(blank=True, null=True, verbose_name="Date de la dernière commande")
+    ville_derniere_commande = models.CharField(max_length=100, blank=True, default='', verbose_name="Ville de la dernière commande")
+    valeur_totale = models.FloatField(default=0, verbose_name="Valeur cumulée des commandes")
+    nb_livrees = models.PositiveIntegerField(default=0, verbose_name="Commandes livrées")
+    nb_retournees = models.PositiveIntegerField(default=0, verbose_name="Commandes retournées")
+    # Texte normalisé de la recherche de clients (index trigrammes sous PostgreSQL)
+    recherche = models.TextField(blank=True, default='', verbose_name="Texte de recherche")
     
     def __str__(self):
         return f"{self.prenom} {self.nom} ({self.numero_tel})"
 
+    def normaliser_telephone(self):
+        """Recalcule les formes indexées du numéro (appelé par save, et avant un bulk_create)"""
+        self.telephone_normalise = telephone_canonique(self.numero_tel)[:30]
+        self.telephone_inverse = self.telephone_normalise[::-1]
+
+    def save(self, *args, **kwargs):
+        self.normaliser_telephone()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'numero_tel' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'telephone_normalise', 'telephone_inverse'}
+        super().save(*args, **kwargs)
+
     @property
     def get_full_name(self):
         return f"{self.prenom} {self.nom}".strip()
@@ -0,0 +1,44 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from commande.models import Commande
+from commande.signals import commandes_modifiees, creations_en_masse
+
+from .models import Client
+from .statistiques import planifier_statistiques
+
+# Champs de la commande dont dépendent les statistiques de son client
+CHAMPS_STATISTIQUES_COMMANDE = ('client_id', 'total_cmd', 'etat_courant_id', 'ville_id', 'ville_init')
+
+
+@receiver(post_save, sender=Commande)
+def statistiques_commande_enregistree(sender, instance, **kwargs):
+    """Une commande changée de client modifie aussi les statistiques de l'ancien client"""
+    if not instance.champs_modifies(CHAMPS_STATISTIQUES_COMMANDE):
+        return
+    planifier_statistiques([instance.client_id, getattr(instance, '_old_client_id', None)])
+
+
+@receiver(post_delete, sender=Commande)
+def statistiques_commande_supprimee(sender, instance, **kwargs):
+    planifier_statistiques([instance.client_id])
+
+
+@receiver(commandes_modifiees)
+def statistiques_commandes_modifiees(sender, commande_ids=(), **kwargs):
+    """Transitions d'état (livrée, retournée) et écritures par lots"""
+    planifier_statistiques(commande_ids=commande_ids)
+
+
+@receiver(creations_en_masse)
+def statistiques_creations_en_masse(sender, instances=(), **kwargs):
+    if sender is Client:
+        planifier_statistiques([client.pk for client in instances])
+    elif sender is Commande:
+        planifier_statistiques([commande.client_id for commande in instances])
+
+
+@receiver(post_save, sender=Client)
+def statistiques_client_enregistre(sender, instance, **kwargs):
+    """Le nom, le téléphone et l'adresse font partie du texte de recherche"""
+    planifier_statistiques([instance.pk])
@@ -0,0 +1,170 @@
+"""
+Statistiques de commandes dénormalisées sur le client.
+
+Chaque client porte son nombre de commandes, la date et la ville (ville_init)
+de sa dernière commande, la valeur cumulée de ses commandes, ses nombres de
+commandes livrées et retournées, et un texte de recherche normalisé (identité,
+téléphone, adresse et ville de la dernière commande) indexé en trigrammes sous
+PostgreSQL. La liste des clients lit et filtre ces colonnes (filtrer_clients)
+au lieu de joindre l'historique des commandes.
+
+Les statistiques sont recalculées au commit des écritures de commandes
+(save, bulk_create, transitions d'état via le signal commandes_modifiees) :
+planifier_statistiques regroupe les clients d'une transaction et les recalcule
+en une requête agrégée par lot. Rattrapage : commande recalculer_statistiques_clients.
+"""
+import threading
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .telephone import est_saisie_telephone, filtre_telephone
+
+TAILLE_LOT = 500
+
+ETATS_LIVRES = ('Livrée', 'Livrée Partiellement')
+ETATS_RETOURNES = ('Retournée',)
+# Commandes sans valeur pour le client (non comptées dans valeur_totale)
+ETATS_SANS_VALEUR = ('Annulée', 'Doublon', 'Erronée')
+
+CHAMPS_STATISTIQUES = [
+    'nb_commandes', 'date_derniere_commande', 'ville_derniere_commande',
+    'valeur_totale', 'nb_livrees', 'nb_retournees', 'recherche',
+]
+
+
+def texte_recherche(client, ville_nom=None, region=None):
+    """Texte normalisé (minuscules, sans accents) sur lequel porte la recherche de clients"""
+    from recherche.indexation import normaliser
+
+    valeurs = [
+        client.pk, client.nom, client.prenom, client.numero_tel, client.telephone_normalise,
+        client.email, client.adresse, client.ville_derniere_commande, ville_nom, region,
+    ]
+    return normaliser(' '.join(str(valeur) for valeur in valeurs if valeur not in (None, '')))
+
+
+def filtrer_clients(clients, saisie):
+    """
+    Clients correspondant à une saisie de recherche : numéro exact d'une de leurs
+    commandes, ou numéro de téléphone (index téléphone), sinon tous les mots dans
+    le texte de recherche.
+    """
+    from commande.models import Commande
+    from recherche.indexation import normaliser
+
+    saisie = (saisie or '').strip()
+    if not saisie:
+        return clients
+    # Numéro de commande ou ID YZ (un seul mot) : index uniques des commandes, sans jointure
+    par_commande = Q()
+    if len(saisie.split()) == 1:
+        commandes = Q(num_cmd__in={saisie, saisie.upper()})
+        if saisie.isdigit() and len(saisie) <= 9:
+            commandes |= Q(id_yz=int(saisie))
+        par_commande = Q(pk__in=Commande.objects.filter(commandes).values('client_id'))
+
+    if est_saisie_telephone(saisie):
+        return clients.filter(filtre_telephone(saisie) | par_commande)
+
+    correspondance = Q()
+    for mot in normaliser(saisie).split():
+        correspondance &= Q(recherche__contains=mot)
+    correspondance |= par_commande
+    return clients.filter(correspondance)
+
+
+def _annoter(clients):
+    Commande = clients.model._meta.get_field('commandes').related_model
+    derniere = Commande.objects.filter(client_id=OuterRef('pk')).order_by('-date_creation', '-pk')
+    return clients.annotate(
+        _nb_commandes=Count('commandes'),
+        _date_derniere=Max('commandes__date_creation'),
+        _valeur=Coalesce(
+            Sum('commandes__total_cmd', filter=~Q(commandes__etat_courant__libelle__in=ETATS_SANS_VALEUR)),
+            Value(0.0),
+        ),
+        _nb_livrees=Count('commandes', filter=Q(commandes__etat_courant__libelle__in=ETATS_LIVRES)),
+        _nb_retournees=Count('commandes', filter=Q(commandes__etat_courant__libelle__in=ETATS_RETOURNES)),
+        _ville_init=Subquery(derniere.values('ville_init')[:1]),
+        _ville_nom=Subquery(derniere.values('ville__nom')[:1]),
+        _region=Subquery(derniere.values('ville__region__nom_region')[:1]),
+    )
+
+
+def recalculer_statistiques(clients, taille_lot=TAILLE_LOT):
+    """
+    Recalcule les statistiques dénormalisées des clients, une requête agrégée
+    et un bulk_update par lot.
+
+    Args:
+        clients: queryset de clients (modèle courant ou modèle historique d'une migration)
+
+    Returns:
+        int: nombre de clients mis à jour
+    """
+    ids = list(clients.order_by('pk').values_list('pk', flat=True))
+    nombre = 0
+    for debut in range(0, len(ids), taille_lot):
+        lot = list(_annoter(clients.model.objects.filter(pk__in=ids[debut:debut + taille_lot])).order_by('pk'))
+        for client in lot:
+            client.nb_commandes = client._nb_commandes
+            client.date_derniere_commande = client._date_derniere
+            client.ville_derniere_commande = (client._ville_init or '')[:100]
+            client.valeur_totale = client._valeur
+            client.nb_livrees = client._nb_livrees
+            client.nb_retournees = client._nb_retournees
+            client.recherche = texte_recherche(client, client._ville_nom, client._region)
+        nombre += clients.model.objects.bulk_update(lot, CHAMPS_STATISTIQUES)
+    return nombre
+
+
+def recalculer_statistiques_clients(client_ids):
+    from .models import Client
+
+    client_ids = {pk for pk in client_ids if pk}
+    if not client_ids:
+        return 0
+    return recalculer_statistiques(Client.objects.filter(pk__in=client_ids))
+
+
+_local = threading.local()
+
+
+def _en_attente():
+    if not hasattr(_local, 'clients'):
+        _local.clients, _local.commandes = set(), set()
+    return _local.clients, _local.commandes
+
+
+def _executer():
+    from commande.models import Commande
+
+    clients, commandes = _en_attente()
+    client_ids, commande_ids = set(clients), set(commandes)
+    clients.clear()
+    commandes.clear()
+    if commande_ids:
+        client_ids.update(Commande.objects.filter(pk__in=commande_ids).values_list('client_id', flat=True))
+    recalculer_statistiques_clients(client_ids)
+
+
+def planifier_statistiques(client_ids=(), commande_ids=()):
+    """
+    Recalcule au commit (immédiatement hors transaction) les statistiques des
+    clients donnés et des clients des commandes données.
+
+    Toutes les planifications d'une transaction sont traitées ensemble par le
+    premier rappel exécuté. Un rappel est enregistré à chaque appel pour
+    qu'une planification annulée par un rollback ne bloque pas les suivantes.
+    """
+    clients, commandes = _en_attente()
+    if not connection.in_atomic_block:
+        # Hors transaction, les entrées restantes viennent de transactions annulées
+        clients.clear()
+        commandes.clear()
+    clients.update(pk for pk in client_ids if pk)
+    commandes.update(pk for pk in commande_ids if pk)
+    if clients or commandes:
+        transaction.on_commit(_executer)
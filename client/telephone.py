@@ -0,0 +1,139 @@
+"""
+Normalisation et recherche des numéros de téléphone clients.
+
+Chaque client porte deux colonnes indexées dérivées de numero_tel :
+- telephone_normalise : forme canonique façon E.164 sans « + » (212612345678),
+- telephone_inverse : les mêmes chiffres à l'envers (876543216212).
+
+Une recherche par début de numéro devient un LIKE 'x%' sur la première,
+une recherche par fin de numéro un LIKE 'x%' sur la seconde : deux parcours
+d'index, là où numero_tel__icontains parcourait toute la table.
+"""
+import re
+
+from django.db.models import Q
+
+INDICATIF_PAYS = '212'
+
+# Nombre de chiffres d'un numéro national marocain (0 + 9 chiffres)
+LONGUEUR_NATIONALE = 10
+
+# Saisie minimale pour une recherche par téléphone
+CHIFFRES_MIN_RECHERCHE = 3
+
+# Saisie considérée comme un numéro dans les recherches multi-champs
+CHIFFRES_MIN_SAISIE_TELEPHONE = 6
+
+_CARACTERES_TELEPHONE = re.compile(r'^[\d\s\-\.\(\)\+/]+$')
+
+
+def nettoyer_telephone(numero):
+    """Nettoie un numéro saisi ou importé (logique de la synchronisation Google Sheets)"""
+    if not numero:
+        return ''
+
+    # Convertir en string et nettoyer
+    telephone = str(numero).strip()
+
+    # Supprimer les caractères non numériques courants (espaces, tirets, points, parenthèses)
+    telephone = re.sub(r'[\s\-\.\(\)\+]', '', telephone)
+
+    # Limiter à 30 caractères maximum (limite du modèle Client)
+    return telephone[:30]
+
+
+def telephone_canonique(numero):
+    """
+    Forme canonique d'un numéro : chiffres seuls avec l'indicatif pays.
+    0612345678, +212 6 12 34 56 78 et 00212612345678 donnent 212612345678.
+    """
+    chiffres = re.sub(r'\D', '', nettoyer_telephone(numero))
+    if chiffres.startswith('00'):
+        chiffres = chiffres[2:]
+    elif chiffres.startswith('0') and len(chiffres) == LONGUEUR_NATIONALE:
+        chiffres = INDICATIF_PAYS + chiffres[1:]
+    return chiffres
+
+
+def est_saisie_telephone(saisie):
+    """La saisie ressemble-t-elle à un numéro (et non à un nom ou un identifiant court) ?"""
+    saisie = (saisie or '').strip()
+    return bool(_CARACTERES_TELEPHONE.match(saisie)) and len(re.sub(r'\D', '', saisie)) >= CHIFFRES_MIN_SAISIE_TELEPHONE
+
+
+def _prefixes_canoniques(chiffres):
+    """Débuts de forme canonique possibles pour un début de numéro saisi"""
+    if chiffres.startswith('00'):
+        return {chiffres[2:]}
+    if chiffres.startswith('0'):
+        # Début d'un numéro national : 0612 -> 212612
+        return {INDICATIF_PAYS + chiffres[1:]}
+    if chiffres.startswith(INDICATIF_PAYS):
+        return {chiffres}
+    # Numéro saisi sans 0 ni indicatif (612...), ou numéro étranger
+    return {chiffres, INDICATIF_PAYS + chiffres}
+
+
+def filtre_telephone(saisie, prefixe='', avec_suffixe=True):
+    """
+    Filtre Q par début ou fin de numéro (index telephone_normalise / telephone_inverse).
+
+    Args:
+        saisie: numéro complet ou partiel, dans n'importe quel format
+        prefixe: chemin vers le client (ex: 'client__' depuis Commande)
+        avec_suffixe: chercher aussi les numéros qui se terminent par la saisie
+
+    Returns:
+        Q: filtre vide (aucun résultat) si la saisie compte moins de CHIFFRES_MIN_RECHERCHE chiffres
+    """
+    chiffres = re.sub(r'\D', '', saisie or '')
+    if len(chiffres) < CHIFFRES_MIN_RECHERCHE:
+        return Q(pk__in=[])
+
+    filtre = Q()
+    for debut in _prefixes_canoniques(chiffres):
+        filtre |= Q(**{f'{prefixe}telephone_normalise__startswith': debut})
+    if avec_suffixe:
+        filtre |= Q(**{f'{prefixe}telephone_inverse__startswith': chiffres[::-1]})
+    return filtre
+
+
+def rechercher_clients_par_telephone(saisie, limite=10):
+    """Clients dont le numéro commence ou se termine par la saisie, numéro exact en premier"""
+    from client.models import Client
+
+    exact = telephone_canonique(saisie)
+    clients = Client.objects.filter(filtre_telephone(saisie))
+    return sorted(
+        clients.order_by('prenom', 'nom')[:limite],
+        key=lambda client: client.telephone_normalise != exact,
+    )
+
+
+def normaliser_telephones(clients, taille_lot=1000, seulement_modifies=True):
+    """
+    Recalcule telephone_normalise / telephone_inverse par lots (backfill, rattrapage).
+
+    Args:
+        clients: queryset de clients (modèle courant ou modèle historique d'une migration)
+        seulement_modifies: n'écrire que les clients dont les formes indexées ont changé
+
+    Returns:
+        int: nombre de clients mis à jour
+    """
+    nombre = 0
+    lot = []
+    champs = ['telephone_normalise', 'telephone_inverse']
+    for client in clients.only('pk', 'numero_tel', *champs).order_by('pk').iterator(chunk_size=taille_lot):
+        normalise = telephone_canonique(client.numero_tel)[:30]
+        if seulement_modifies and (client.telephone_normalise, client.telephone_inverse) == (normalise, normalise[::-1]):
+            continue
+        client.telephone_normalise = normalise
+        client.telephone_inverse = normalise[::-1]
+        lot.append(client)
+        if len(lot) >= taille_lot:
+            nombre += clients.model.objects.bulk_update(lot, champs)
+            lot = []
+    if lot:
+        nombre += clients.model.objects.bulk_update(lot, champs)
+    return nombre
@@ -1,3 +1,128 @@
 from django.test import TestCase
 
-# Create your tests here.
+from client.models import Client
+from client.statistiques import filtrer_clients, recalculer_statistiques
+from client.telephone import normaliser_telephones, rechercher_clients_par_telephone, telephone_canonique
+from commande.models import Commande, EnumEtatCmd
+from commande.transitions import changer_etat_commande
+from parametre.models import Region, Ville
+from synchronisation.google_sheet_sync import GoogleSheetSync
+
+
+class RechercheTelephoneTest(TestCase):
+
+    def setUp(self):
+        self.karim = Client.objects.create(nom='Bennani', prenom='Karim', numero_tel='06 12 34 56 78')
+        self.salma = Client.objects.create(nom='Idrissi', prenom='Salma', numero_tel='+212 7 00 11 22 33')
+        self.paul = Client.objects.create(nom='Martin', prenom='Paul', numero_tel='0033612345678')
+
+    def _ids(self, saisie):
+        return [client.pk for client in rechercher_clients_par_telephone(saisie)]
+
+    def test_forme_canonique(self):
+        self.assertEqual(telephone_canonique('06.12.34.56.78'), '212612345678')
+        self.assertEqual(telephone_canonique('00212612345678'), '212612345678')
+        self.assertEqual(telephone_canonique('+212 612-345-678'), '212612345678')
+        self.assertEqual(self.karim.telephone_normalise, '212612345678')
+        self.assertEqual(self.karim.telephone_inverse, '876543216212')
+        self.assertEqual(self.paul.telephone_normalise, '33612345678')
+
+    def test_recherche_par_debut_et_fin(self):
+        # Début de numéro, quel que soit le format saisi
+        self.assertEqual(self._ids('0612'), [self.karim.pk])
+        self.assertEqual(self._ids('+212 700'), [self.salma.pk])
+        self.assertEqual(self._ids('700 11'), [self.salma.pk])
+        # Derniers chiffres
+        self.assertEqual(self._ids('2233'), [self.salma.pk])
+        self.assertEqual(set(self._ids('45678')), {self.karim.pk, self.paul.pk})
+        # Numéro complet : correspondance exacte en premier
+        self.assertEqual(self._ids('0033 6 12 34 56 78')[0], self.paul.pk)
+        self.assertEqual(self._ids('12'), [])
+
+    def test_numero_modifie_et_backfill(self):
+        self.karim.numero_tel = '0698765432'
+        self.karim.save(update_fields=['numero_tel'])
+        self.karim.refresh_from_db()
+        self.assertEqual(self.karim.telephone_normalise, '212698765432')
+
+        Client.objects.update(telephone_normalise='', telephone_inverse='')
+        self.assertEqual(normaliser_telephones(Client.objects.all(), taille_lot=2), 3)
+        self.assertEqual(normaliser_telephones(Client.objects.all()), 0)
+        self.assertEqual(self._ids('5432'), [self.karim.pk])
+
+    def test_synchronisation_rapproche_les_formats(self):
+        client_obj, created = GoogleSheetSync._get_or_create_client('212612345678', {'nom': 'Bennani'})
+        self.assertFalse(created)
+        self.assertEqual(client_obj.pk, self.karim.pk)
+
+
+class StatistiquesClientTest(TestCase):
+
+    def setUp(self):
+        region = Region.objects.create(nom_region='Fès-Meknès')
+        self.ville = Ville.objects.create(nom='Fès', frais_livraison=30, frequence_livraison='Quotidienne', region=region)
+        for libelle in ('Livrée', 'Retournée', 'Annulée'):
+            EnumEtatCmd.objects.get_or_create(libelle=libelle)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_cmd = Client.objects.create(nom='Tazi', prenom='Hind', numero_tel='0611223344')
+            self.autre = Client.objects.create(nom='Alami', prenom='Omar', numero_tel='0655667788')
+            self.commandes = [
+                Commande.objects.create(
+                    num_cmd=f'STA-{numero}', client=self.client_cmd, total_cmd=100 * numero,
+                    ville=self.ville, ville_init=ville_init,
+                )
+                for numero, ville_init in ((1, 'Meknès'), (2, 'Fès'), (3, 'Fès'))
+            ]
+
+    def test_statistiques_tenues_a_jour(self):
+        self.client_cmd.refresh_from_db()
+        self.assertEqual((self.client_cmd.nb_commandes, self.client_cmd.valeur_totale), (3, 600))
+        self.assertEqual(self.client_cmd.ville_derniere_commande, 'Fès')
+        self.assertEqual(self.client_cmd.date_derniere_commande, self.commandes[-1].date_creation)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            changer_etat_commande(self.commandes[0], 'Livrée')
+            changer_etat_commande(self.commandes[1], 'Retournée')
+            changer_etat_commande(self.commandes[2], 'Annulée')
+        self.client_cmd.refresh_from_db()
+        self.assertEqual((self.client_cmd.nb_livrees, self.client_cmd.nb_retournees), (1, 1))
+        self.assertEqual(self.client_cmd.valeur_totale, 300)
+
+        # Commande transférée à un autre client : les deux clients sont recalculés
+        with self.captureOnCommitCallbacks(execute=True):
+            self.commandes[0].client = self.autre
+            self.commandes[0].save()
+        self.client_cmd.refresh_from_db()
+        self.autre.refresh_from_db()
+        self.assertEqual((self.client_cmd.nb_commandes, self.client_cmd.nb_livrees), (2, 0))
+        self.assertEqual((self.autre.nb_commandes, self.autre.nb_livrees, self.autre.valeur_totale), (1, 1, 100))
+
+    def test_modification_sans_effet_sur_les_statistiques(self):
+        commande = Commande.objects.get(pk=self.commandes[0].pk)
+        commande.adresse = '5 derb Sidi Ahmed'
+
+        # Adresse seule : ni statistiques du client, ni réindexation, ni entrée au flux 360
+        with self.assertNumQueries(1), self.captureOnCommitCallbacks(execute=True):
+            commande.save()
+
+    def test_recherche_sans_historique(self):
+        def ids(saisie):
+            return list(filtrer_clients(Client.objects.all(), saisie).values_list('pk', flat=True))
+
+        # Mots dans n'importe quel ordre, sans accents ni majuscules
+        self.assertEqual(ids('hind TAZI'), [self.client_cmd.pk])
+        self.assertEqual(ids('fes'), [self.client_cmd.pk])
+        self.assertEqual(ids('omar fes'), [])
+        # Numéro de commande ou ID YZ exact
+        self.assertEqual(ids('sta-2'), [self.client_cmd.pk])
+        self.assertEqual(ids(str(self.commandes[0].id_yz)), [self.client_cmd.pk])
+
+        sql = str(filtrer_clients(Client.objects.all(), 'hind tazi').query)
+        self.assertNotIn('commande_commande', sql)
+
+    def test_backfill(self):
+        Client.objects.update(nb_commandes=0, valeur_totale=0, ville_derniere_commande='', recherche='')
+        self.assertEqual(recalculer_statistiques(Client.objects.all(), taille_lot=1), 2)
+        self.client_cmd.refresh_from_db()
+        self.assertEqual((self.client_cmd.nb_commandes, self.client_cmd.ville_derniere_commande), (3, 'Fès'))
+        self.assertIn('hind', self.client_cmd.recherche)
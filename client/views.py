@@ -1,12 +1,13 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Count, OuterRef, Subquery
+from django.db.models import Q, Count
 from django.core.paginator import Paginator
 from django.views.decorators.http import require_POST
 from django.http import JsonResponse
 from django.template.loader import render_to_string
 from .models import Client
+from .statistiques import filtrer_clients
 from commande.models import Commande
 
 # Create your views here.
@@ -15,82 +16,9 @@ from commande.models import Commande
 def liste_clients(request):
     from synchronisation.models import SyncLog
     
-    # Sous-requête pour trouver la 'ville_init' de la dernière commande de chaque client
-    latest_commande_ville_init = Commande.objects.filter(
-        client=OuterRef('pk')
-    ).order_by('-date_creation').values('ville_init')[:1]
-
-    # Annoter les clients avec la ville de leur dernière commande
-    clients = Client.objects.annotate(
-        nombre_commandes=Count('commandes', distinct=True),
-        derniere_ville_init=Subquery(latest_commande_ville_init)
-    ).all()
+    clients = Client.objects.all()
     search_query = request.GET.get('search', '')
-
-    if search_query:
-        # Recherche flexible et variée
-        search_terms = search_query.strip().split()
-        
-        # Construction de la requête de recherche
-        search_conditions = Q()
-        
-        # Vérifier si la recherche correspond exactement à une ville_init
-        exact_ville_init_match = Commande.objects.filter(
-            ville_init__iexact=search_query
-        ).exists()
-        
-        if exact_ville_init_match:
-            # Si la recherche correspond exactement à une ville_init, on filtre directement
-            search_conditions = Q(derniere_ville_init__iexact=search_query)
-        else:
-            # Sinon, on utilise la recherche normale par termes
-            term_conditions = Q()
-            for term in search_terms:
-                term_conditions |= (
-                    # Recherche dans les données du client
-                    Q(nom__icontains=term) |
-                    Q(prenom__icontains=term) |
-                    Q(numero_tel__icontains=term) |
-                    Q(email__icontains=term) |
-                    Q(adresse__icontains=term) |
-                    Q(id__icontains=term) |  # Recherche par ID client
-                    Q(derniere_ville_init__icontains=term) |
-                    
-                    # Recherche dans les commandes associées
-                    Q(commandes__id_yz__icontains=term) |
-                    Q(commandes__num_cmd__icontains=term) |
-                    Q(commandes__total_cmd__icontains=term) |
-                    
-                    # Recherche dans les villes des commandes
-                    Q(commandes__ville__nom__icontains=term) |
-                    Q(commandes__ville_init__icontains=term) |
-                    Q(commandes__ville__region__nom_region__icontains=term) |
-                    
-                    # Recherche dans les états des commandes
-                    Q(commandes__etats__enum_etat__libelle__icontains=term) |
-                    
-                    # Recherche dans les produits des commandes
-                    Q(commandes__produit_init__icontains=term)
-                )
-            search_conditions &= term_conditions
-        
-        # Recherche globale si un seul terme (pour retrouver "Dupont Jean" avec "Jean Dupont")
-        if not exact_ville_init_match and len(search_terms) == 1:
-            global_term = search_query.strip()
-            search_conditions |= (
-                Q(nom__icontains=global_term) |
-                Q(prenom__icontains=global_term) |
-                Q(numero_tel__icontains=global_term) |
-                Q(email__icontains=global_term) |
-                Q(adresse__icontains=global_term) |
-                Q(commandes__id_yz__icontains=global_term) |
-                Q(commandes__num_cmd__icontains=global_term) |
-                Q(commandes__ville__nom__icontains=global_term) |
-                Q(commandes__ville_init__icontains=global_term) |
-                Q(commandes__etats__enum_etat__libelle__icontains=global_term)
-            )
-        
-        clients = clients.filter(search_conditions).distinct()
+    clients = filtrer_clients(clients, search_query)
 
     # Triez par date de création par défaut
     clients = clients.order_by('-date_creation')
@@ -139,21 +67,19 @@ def liste_clients(request):
 
     # Statistiques vérifiées
     total_clients = Client.objects.count()
-    clients_avec_commandes = Client.objects.filter(commandes__isnull=False).distinct().count()
+    clients_avec_commandes = Client.objects.filter(nb_commandes__gt=0).count()
     clients_sans_commandes = total_clients - clients_avec_commandes
     
     # NOUVELLES STATISTIQUES POUR LES COMMANDES
-    # Compter les clients distincts avec des commandes erronées (état actuel)
-    clients_avec_cmd_erronees = Client.objects.filter(
-        commandes__etats__enum_etat__libelle__iexact='Erronée',
-        commandes__etats__date_fin__isnull=True
-    ).distinct().count()
+    # Compter les clients distincts avec des commandes erronées (état courant dénormalisé)
+    clients_avec_cmd_erronees = Commande.objects.filter(
+        etat_courant__libelle__iexact='Erronée'
+    ).order_by().values('client_id').distinct().count()
 
-    # Compter les clients distincts avec des commandes doublons (état actuel)
-    clients_avec_cmd_doublons = Client.objects.filter(
-        commandes__etats__enum_etat__libelle__iexact='Doublon',
-        commandes__etats__date_fin__isnull=True
-    ).distinct().count()
+    # Compter les clients distincts avec des commandes doublons (état courant dénormalisé)
+    clients_avec_cmd_doublons = Commande.objects.filter(
+        etat_courant__libelle__iexact='Doublon'
+    ).order_by().values('client_id').distinct().count()
 
     # Vérifier les doublons potentiels de clients (basé sur le numéro de tel)
     doublons_detectes = Client.objects.values('numero_tel').annotate(
@@ -523,81 +449,7 @@ def recherche_clients_ajax(request):
     search_query = request.GET.get('search', '')
     page = request.GET.get('page', 1)
     
-    # Sous-requête pour trouver la 'ville_init' de la dernière commande de chaque client
-    latest_commande_ville_init = Commande.objects.filter(
-        client=OuterRef('pk')
-    ).order_by('-date_creation').values('ville_init')[:1]
-
-    # Annoter les clients avec la ville de leur dernière commande
-    clients = Client.objects.annotate(
-        nombre_commandes=Count('commandes', distinct=True),
-        derniere_ville_init=Subquery(latest_commande_ville_init)
-    ).all()
-
-    if search_query:
-        # Recherche flexible et variée
-        search_terms = search_query.strip().split()
-        
-        # Construction de la requête de recherche
-        search_conditions = Q()
-        
-        # Vérifier si la recherche correspond exactement à une ville_init
-        exact_ville_init_match = Commande.objects.filter(
-            ville_init__iexact=search_query
-        ).exists()
-        
-        if exact_ville_init_match:
-            # Si la recherche correspond exactement à une ville_init, on filtre directement
-            search_conditions = Q(derniere_ville_init__iexact=search_query)
-        else:
-            # Sinon, on utilise la recherche normale par termes
-            term_conditions = Q()
-            for term in search_terms:
-                term_conditions |= (
-                    # Recherche dans les données du client
-                    Q(nom__icontains=term) |
-                    Q(prenom__icontains=term) |
-                    Q(numero_tel__icontains=term) |
-                    Q(email__icontains=term) |
-                    Q(adresse__icontains=term) |
-                    Q(id__icontains=term) |  # Recherche par ID client
-                    Q(derniere_ville_init__icontains=term) |
-                    
-                    # Recherche dans les commandes associées
-                    Q(commandes__id_yz__icontains=term) |
-                    Q(commandes__num_cmd__icontains=term) |
-                    Q(commandes__total_cmd__icontains=term) |
-                    
-                    # Recherche dans les villes des commandes
-                    Q(commandes__ville__nom__icontains=term) |
-                    Q(commandes__ville_init__icontains=term) |
-                    Q(commandes__ville__region__nom_region__icontains=term) |
-                    
-                    # Recherche dans les états des commandes
-                    Q(commandes__etats__enum_etat__libelle__icontains=term) |
-                    
-                    # Recherche dans les produits des commandes
-                    Q(commandes__produit_init__icontains=term)
-                )
-            search_conditions &= term_conditions
-        
-        # Recherche globale si un seul terme (pour retrouver "Dupont Jean" avec "Jean Dupont")
-        if not exact_ville_init_match and len(search_terms) == 1:
-            global_term = search_query.strip()
-            search_conditions |= (
-                Q(nom__icontains=global_term) |
-                Q(prenom__icontains=global_term) |
-                Q(numero_tel__icontains=global_term) |
-                Q(email__icontains=global_term) |
-                Q(adresse__icontains=global_term) |
-                Q(commandes__id_yz__icontains=global_term) |
-                Q(commandes__num_cmd__icontains=global_term) |
-                Q(commandes__ville__nom__icontains=global_term) |
-                Q(commandes__ville_init__icontains=global_term) |
-                Q(commandes__etats__enum_etat__libelle__icontains=global_term)
-            )
-        
-        clients = clients.filter(search_conditions).distinct()
+    clients = filtrer_clients(Client.objects.all(), search_query)
 
     # Triez par date de création par défaut
     clients = clients.order_by('-date_creation')
@@ -0,0 +1,50 @@
+"""
+Libellés des états de commande (EnumEtatCmd.libelle) écrits par l'application.
+
+Les écritures (transitions, répartition, envois, SAV) et les lectures par
+étape du traitement (profils de la recherche globale) utilisent ces
+constantes, pour qu'un état écrit quelque part soit retrouvé ailleurs.
+"""
+
+# --- Confirmation ---
+NON_AFFECTEE = 'Non affectée'
+AFFECTEE = 'Affectée'
+EN_COURS_CONFIRMATION = 'En cours de confirmation'
+CONFIRMEE = 'Confirmée'
+ANNULEE = 'Annulée'
+DOUBLON = 'Doublon'
+ERRONEE = 'Erronée'
+RETOUR_CONFIRMATION = 'Retour Confirmation'
+
+# --- Préparation ---
+A_IMPRIMER = 'À imprimer'
+EN_PREPARATION = 'En préparation'
+COLLECTEE = 'Collectée'
+EMBALLEE = 'Emballée'
+VALIDEE = 'Validée'
+PRETE = 'Prête'
+PREPAREE = 'Préparée'
+
+# --- Livraison et service après-vente ---
+# Affectation à un opérateur logistique (une commande ou répartition en masse)
+EN_COURS_LIVRAISON = 'En cours de livraison'
+# Clôture d'un envoi régional (Superpreparation)
+EN_LIVRAISON = 'En livraison'
+LIVREE = 'Livrée'
+LIVREE_PARTIELLEMENT = 'Livrée Partiellement'
+LIVREE_AVEC_CHANGEMENT = 'Livrée avec changement'
+REPORTEE = 'Reportée'
+RETOURNEE = 'Retournée'
+ANNULEE_SAV = 'Annulée (SAV)'
+
+# États courants par étape du traitement
+ETATS_CONFIRMATION = (
+    NON_AFFECTEE, AFFECTEE, EN_COURS_CONFIRMATION, CONFIRMEE, ANNULEE, DOUBLON, ERRONEE, RETOUR_CONFIRMATION,
+)
+ETATS_PREPARATION = (
+    CONFIRMEE, A_IMPRIMER, EN_PREPARATION, COLLECTEE, EMBALLEE, VALIDEE, PRETE, PREPAREE,
+)
+ETATS_LOGISTIQUE = (
+    CONFIRMEE, PREPAREE, PRETE, EN_COURS_LIVRAISON, EN_LIVRAISON, LIVREE, LIVREE_PARTIELLEMENT,
+    LIVREE_AVEC_CHANGEMENT, REPORTEE, RETOURNEE, ANNULEE, ANNULEE_SAV,
+)
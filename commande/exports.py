@@ -0,0 +1,293 @@
+"""
+Moteur des exports CSV et Excel.
+
+Un export est déclaré par une liste de colonnes (Colonne : titre, fonction qui
+lit la valeur sur une ligne, largeur et style Excel) et une ou plusieurs
+feuilles (Feuille : titre, lignes, colonnes). Les querysets sont lus avec
+iterator(chunk_size=TAILLE_LOT) : les prefetch_related sont résolus lot par
+lot et la mémoire ne dépend pas du nombre de lignes exportées.
+
+- reponse_csv : StreamingHttpResponse (BOM et séparateur ';' pour Excel), le
+  navigateur reçoit les premiers octets avant la lecture des lignes ;
+- reponse_excel : classeur openpyxl en écriture seule, lignes écrites au fil
+  de la lecture avec des styles nommés partagés. Le format xlsx étant une
+  archive zip finalisée à l'enregistrement, le fichier est construit dans un
+  fichier temporaire puis envoyé par morceaux (FileResponse) ;
+- ecrire_csv / ecrire_excel : écriture dans un fichier, utilisée par les
+  exports en arrière-plan (commande.jobs) qui suivent l'avancement par le
+  rappel progression(nombre de lignes écrites), appelé à chaque lot.
+"""
+import csv
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, NamedTuple
+
+from django.db.models import QuerySet
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle, PatternFill
+from openpyxl.utils import get_column_letter
+
+TAILLE_LOT = 500
+
+TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+FORMAT_DATE = '%d/%m/%Y %H:%M'
+
+
+class Colonne(NamedTuple):
+    titre: str
+    valeur: Callable
+    largeur: int = 15
+    # Style nommé Excel (voir _styles)
+    style: str = 'yz_texte'
+
+
+class Feuille(NamedTuple):
+    titre: str
+    lignes: object
+    colonnes: list
+    # Lignes libres écrites avant les en-têtes (titre, filtres, date d'export)
+    preambule: tuple = ()
+
+
+def _styles():
+    entete = NamedStyle('yz_entete')
+    entete.font = Font(bold=True, color='FFFFFF')
+    entete.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
+    entete.alignment = Alignment(horizontal='center', vertical='center')
+
+    libelle = NamedStyle('yz_libelle')
+    libelle.font = Font(bold=True)
+
+    texte_long = NamedStyle('yz_texte_long')
+    texte_long.alignment = Alignment(wrap_text=True, vertical='top')
+
+    montant = NamedStyle('yz_montant')
+    montant.number_format = '0.00'
+
+    horodatage = NamedStyle('yz_date')
+    horodatage.number_format = 'DD/MM/YYYY HH:MM'
+
+    jour = NamedStyle('yz_jour')
+    jour.number_format = 'DD/MM/YYYY'
+
+    return [entete, libelle, NamedStyle('yz_texte'), texte_long, montant, horodatage, jour]
+
+
+def valeurs(lignes, colonnes, taille_lot=TAILLE_LOT):
+    """Valeurs de chaque ligne, colonne par colonne (querysets lus par lots)"""
+    if isinstance(lignes, QuerySet):
+        lignes = lignes.iterator(chunk_size=taille_lot)
+    for ligne in lignes:
+        yield [colonne.valeur(ligne) for colonne in colonnes]
+
+
+def _texte_csv(valeur):
+    if valeur is None:
+        return ''
+    if isinstance(valeur, (float, Decimal)):
+        return f"{valeur:.2f}"
+    if isinstance(valeur, datetime):
+        return (timezone.localtime(valeur) if timezone.is_aware(valeur) else valeur).strftime(FORMAT_DATE)
+    if isinstance(valeur, date):
+        return valeur.strftime('%d/%m/%Y')
+    return valeur
+
+
+def _valeur_excel(valeur):
+    if isinstance(valeur, datetime) and timezone.is_aware(valeur):
+        # openpyxl n'accepte que des dates naïves
+        return timezone.localtime(valeur).replace(tzinfo=None)
+    if isinstance(valeur, Decimal):
+        return float(valeur)
+    return valeur
+
+
+class _Tampon:
+    """Pseudo-fichier pour csv.writer : writerow renvoie la ligne au lieu de l'écrire"""
+
+    def write(self, valeur):
+        return valeur
+
+
+def flux_csv(feuille, taille_lot=TAILLE_LOT):
+    ecrivain = csv.writer(_Tampon(), delimiter=';')
+    yield '\ufeff'
+    for ligne in feuille.preambule:
+        yield ecrivain.writerow(ligne)
+    yield ecrivain.writerow([colonne.titre for colonne in feuille.colonnes])
+    for ligne in valeurs(feuille.lignes, feuille.colonnes, taille_lot):
+        yield ecrivain.writerow([_texte_csv(valeur) for valeur in ligne])
+
+
+def ecrire_csv(fichier, feuille, taille_lot=TAILLE_LOT, progression=None):
+    """Écrit la feuille en CSV (UTF-8) dans un fichier binaire ouvert"""
+    # Morceaux qui précèdent les lignes : BOM, préambule et en-têtes
+    entetes = len(feuille.preambule) + 2
+    ecrites = 0
+    for index, morceau in enumerate(flux_csv(feuille, taille_lot), 1):
+        fichier.write(morceau.encode('utf-8'))
+        ecrites = max(0, index - entetes)
+        if progression and ecrites and ecrites % taille_lot == 0:
+            progression(ecrites)
+    if progression:
+        progression(ecrites)
+
+
+def reponse_csv(feuille, nom_fichier, taille_lot=TAILLE_LOT):
+    response = StreamingHttpResponse(flux_csv(feuille, taille_lot), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nom_fichier}"'
+    return response
+
+
+def ecrire_excel(fichier, feuilles, taille_lot=TAILLE_LOT, progression=None):
+    """Écrit les feuilles dans un classeur en écriture seule (fichier : chemin ou objet fichier)"""
+    ecrites = 0
+    classeur = Workbook(write_only=True)
+    for style in _styles():
+        classeur.add_named_style(style)
+
+    for feuille in feuilles:
+        ws = classeur.create_sheet(feuille.titre[:31])
+        # Les largeurs doivent être posées avant la première ligne
+        for index, colonne in enumerate(feuille.colonnes, 1):
+            ws.column_dimensions[get_column_letter(index)].width = colonne.largeur
+
+        for ligne in feuille.preambule:
+            ws.append(list(ligne))
+
+        entetes = []
+        for colonne in feuille.colonnes:
+            cellule = WriteOnlyCell(ws, value=colonne.titre)
+            cellule.style = 'yz_entete'
+            entetes.append(cellule)
+        ws.append(entetes)
+
+        for ligne in valeurs(feuille.lignes, feuille.colonnes, taille_lot):
+            cellules = []
+            for colonne, valeur in zip(feuille.colonnes, ligne):
+                cellule = WriteOnlyCell(ws, value=_valeur_excel(valeur))
+                cellule.style = colonne.style
+                cellules.append(cellule)
+            ws.append(cellules)
+            ecrites += 1
+            if progression and ecrites % taille_lot == 0:
+                progression(ecrites)
+
+    classeur.save(fichier)
+    if progression:
+        progression(ecrites)
+
+
+def reponse_excel(feuilles, nom_fichier, taille_lot=TAILLE_LOT):
+    fichier = tempfile.TemporaryFile()
+    ecrire_excel(fichier, feuilles, taille_lot)
+    fichier.seek(0)
+    return FileResponse(fichier, as_attachment=True, filename=nom_fichier, content_type=TYPE_XLSX)
+
+
+COLONNES_RESUME = [
+    Colonne('Indicateur', lambda ligne: ligne[0], 25, 'yz_libelle'),
+    Colonne('Valeur', lambda ligne: ligne[1], 20),
+]
+
+
+def feuille_resume(lignes, titre='Résumé'):
+    """Feuille libellé / valeur accompagnant un export"""
+    return Feuille(titre, lignes, COLONNES_RESUME)
+
+
+# Colonnes communes des exports de commandes
+
+def preparer_commandes(commandes):
+    """Charge les relations lues par les colonnes de commandes (jointures, paniers lot par lot)"""
+    return commandes.select_related('client', 'ville__region', 'etat_courant').prefetch_related('paniers__article')
+
+
+def numero_commande(commande):
+    return commande.id_yz or commande.num_cmd
+
+
+def nom_client(commande):
+    return f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A"
+
+
+def telephone_client(commande):
+    return commande.client.numero_tel if commande.client else "N/A"
+
+
+def nom_ville(commande):
+    return commande.ville.nom if commande.ville else "N/A"
+
+
+def nom_region(commande):
+    return commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A"
+
+
+def articles_consolides(commande):
+    """Articles du panier sur une ligne : « nom couleur pointure xquantité », séparés par des virgules"""
+    articles = []
+    for panier in commande.paniers.all():
+        article_info = f"{panier.article.nom}"
+        if panier.article.couleur:
+            article_info += f" {panier.article.couleur}"
+        if panier.article.pointure:
+            article_info += f" {panier.article.pointure}"
+        if panier.quantite > 1:
+            article_info += f" x{panier.quantite}"
+        articles.append(article_info)
+    return ", ".join(articles) if articles else "Aucun article"
+
+
+def articles_detailles(commande):
+    """Un article par ligne, avec quantité et sous-total, upsells marqués"""
+    articles = []
+    for panier in commande.paniers.all():
+        article_info = f"{panier.article.nom} (Qté: {panier.quantite}, Prix: {panier.sous_total:.2f} DH)"
+        if panier.article.isUpsell:
+            article_info += " [UPSELL]"
+        articles.append(article_info)
+    return "\n".join(articles)
+
+
+def etat_commande(commande):
+    return commande.etat_courant.libelle if commande.etat_courant_id else "Non défini"
+
+
+def colonnes_commandes_consolidees(devise='DH'):
+    """Une ligne par commande, articles regroupés (exports des régions, villes et opérateurs)"""
+    return [
+        Colonne('N° Commande', numero_commande),
+        Colonne('Client', nom_client, 25),
+        Colonne('Téléphone', telephone_client),
+        Colonne('Ville', nom_ville),
+        Colonne('Région', nom_region),
+        Colonne('Articles et Quantités', articles_consolides, 50, 'yz_texte_long'),
+        Colonne(f'Prix Total ({devise})', lambda commande: commande.total_cmd or 0.0, 15, 'yz_montant'),
+        Colonne('Adresse', lambda commande: commande.adresse or "N/A", 40),
+        Colonne('État', etat_commande),
+    ]
+
+
+def colonnes_commandes_detaillees():
+    """Une ligne par commande avec le détail des montants et des articles (exports d'une ville)"""
+    return [
+        Colonne('ID YZ', lambda commande: commande.id_yz),
+        Colonne('Numéro', lambda commande: commande.num_cmd),
+        Colonne('Date', lambda commande: commande.date_cmd, 12, 'yz_jour'),
+        Colonne('Client', lambda commande: f"{commande.client.nom} {commande.client.prenom}" if commande.client else "N/A", 25),
+        Colonne('Téléphone', telephone_client),
+        Colonne('Adresse', lambda commande: commande.adresse, 40),
+        Colonne('Ville', nom_ville),
+        Colonne('Région', nom_region),
+        Colonne('État', etat_commande),
+        Colonne('Total Articles', lambda commande: commande.sous_total_articles, 15, 'yz_montant'),
+        Colonne('Frais Livraison', lambda commande: float(commande.ville.frais_livraison or 0) if commande.ville else 0.0, 15, 'yz_montant'),
+        Colonne('Total Commande', lambda commande: commande.total_cmd, 15, 'yz_montant'),
+        Colonne('Compteur Upsell', lambda commande: commande.compteur),
+        Colonne('Articles', articles_detailles, 40, 'yz_texte_long'),
+    ]
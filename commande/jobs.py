@@ -0,0 +1,257 @@
+"""
+Exports exécutés en arrière-plan.
+
+Les exports volumineux (vue 360, performances des opérateurs, commandes d'un
+envoi) ne sont plus construits pendant la requête : la vue crée une
+TacheExport et rend la main. Le fichier est écrit par Celery quand un broker
+est configuré (CELERY_BROKER_URL), sinon par un pool de threads du processus
+web, comme les synchronisations (synchronisation.jobs), puis enregistré dans
+le stockage par défaut (exports/). La tâche publie le nombre de lignes écrites
+à chaque lot ; le navigateur l'interroge puis télécharge le fichier.
+
+Chaque type d'export est déclaré par @export_differe(nom) sur une fonction qui
+reçoit les paramètres de la demande et renvoie un ContenuExport. Les modules
+qui les déclarent sont importés par le ready() de leur application, ce qui
+les rend disponibles aux workers Celery.
+
+Une demande identique (même type, mêmes paramètres) à une tâche en cours ou
+terminée depuis moins de DUREES['reutilisation'] reprend cette tâche. Les
+fichiers sont supprimés après DUREES['conservation'] par nettoyer_exports
+(tâche Celery planifiée ou commande nettoyer_exports).
+"""
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from tempfile import TemporaryFile
+from typing import Callable, NamedTuple, Optional
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Q
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.urls import reverse
+from django.utils import timezone
+
+from .exports import TAILLE_LOT, ecrire_csv, ecrire_excel
+from .models import TacheExport
+
+logger = logging.getLogger(__name__)
+
+# Durées en secondes, surchargées par settings.EXPORTS_DUREES
+DUREES_DEFAUT = {
+    # Une demande identique reprend le fichier d'une tâche terminée depuis moins de 10 minutes
+    'reutilisation': 10 * 60,
+    # Conservation des fichiers (et des tâches en erreur) avant nettoyage
+    'conservation': 24 * 60 * 60,
+    # Au-delà, une tâche non terminée est considérée comme abandonnée (worker arrêté)
+    'execution': 60 * 60,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ContenuExport(NamedTuple):
+    # Extension .csv : première feuille en CSV, sinon classeur xlsx
+    nom_fichier: str
+    feuilles: list
+    # Nombre de lignes attendu, pour la progression (None si inconnu)
+    total: Optional[int] = None
+
+
+class DefinitionExport(NamedTuple):
+    construire: Callable
+    # autorise(user) : droit de lancer, suivre et télécharger l'export
+    autorise: Callable
+
+
+EXPORTS = {}
+
+
+def export_differe(nom, autorise=lambda user: user.is_staff):
+    """Déclare un type d'export exécutable en arrière-plan"""
+    def decorateur(construire):
+        EXPORTS[nom] = DefinitionExport(construire, autorise)
+        return construire
+    return decorateur
+
+
+def duree(nom):
+    durees = {**DUREES_DEFAUT, **getattr(settings, 'EXPORTS_DUREES', {})}
+    return timedelta(seconds=durees[nom])
+
+
+def cle_export(type_export, parametres):
+    contenu = json.dumps([type_export, parametres], sort_keys=True, default=str)
+    return hashlib.sha256(contenu.encode('utf-8')).hexdigest()
+
+
+def peut_acceder(user, type_export):
+    definition = EXPORTS.get(type_export)
+    return bool(user.is_authenticated and definition and (user.is_superuser or definition.autorise(user)))
+
+
+def demander_export(type_export, parametres, user=None):
+    """
+    Crée la tâche d'un export et planifie son exécution après le commit, ou
+    reprend une tâche identique en cours ou terminée récemment.
+
+    Args:
+        parametres: dict sérialisable en JSON, passé à la fonction de l'export (valeurs vides ignorées)
+
+    Returns:
+        TacheExport
+    """
+    if type_export not in EXPORTS:
+        raise ValueError(f"Export inconnu : {type_export}")
+    parametres = {nom: valeur for nom, valeur in parametres.items() if valeur not in (None, '')}
+    cle = cle_export(type_export, parametres)
+
+    maintenant = timezone.now()
+    existante = TacheExport.objects.filter(cle=cle).filter(
+        Q(statut__in=('en_attente', 'en_cours'), date_creation__gte=maintenant - duree('execution')) |
+        Q(statut='terminee', date_fin__gte=maintenant - duree('reutilisation'), date_expiration__gt=maintenant)
+    ).order_by('-date_creation').first()
+    if existante:
+        return existante
+
+    tache = TacheExport.objects.create(
+        type_export=type_export,
+        parametres=parametres,
+        cle=cle,
+        demandeur=user if user is not None and user.is_authenticated else None,
+    )
+    # Ne démarrer le worker qu'une fois la tâche visible par sa connexion
+    transaction.on_commit(lambda: _demarrer(tache.pk))
+    return tache
+
+
+def executer_export(tache_id):
+    """
+    Construit le fichier d'une tâche en attente et l'enregistre dans le stockage.
+
+    Returns:
+        str | None: chemin du fichier, None si la tâche n'était plus en attente ou a échoué
+    """
+    # Un seul worker fait passer la tâche en cours
+    if not TacheExport.objects.filter(pk=tache_id, statut='en_attente').update(
+        statut='en_cours', date_debut=timezone.now()
+    ):
+        return None
+    taches = TacheExport.objects.filter(pk=tache_id)
+
+    try:
+        tache = taches.get()
+        contenu = EXPORTS[tache.type_export].construire(**tache.parametres)
+        taches.update(nom_fichier=contenu.nom_fichier, lignes_total=contenu.total)
+
+        def progression(lignes):
+            taches.update(lignes_ecrites=lignes)
+
+        with TemporaryFile() as fichier:
+            if contenu.nom_fichier.endswith('.csv'):
+                ecrire_csv(fichier, contenu.feuilles[0], TAILLE_LOT, progression)
+            else:
+                ecrire_excel(fichier, contenu.feuilles, TAILLE_LOT, progression)
+            fichier.seek(0)
+            chemin = default_storage.save(f'exports/{tache_id}/{contenu.nom_fichier}', File(fichier))
+    except Exception as e:
+        logger.exception("Erreur lors de l'export %s", tache_id)
+        taches.update(statut='erreur', erreur=f"Erreur lors de l'export: {str(e)}", date_fin=timezone.now())
+        return None
+
+    maintenant = timezone.now()
+    taches.update(
+        statut='terminee', fichier=chemin, date_fin=maintenant,
+        date_expiration=maintenant + duree('conservation'),
+    )
+    return chemin
+
+
+def _executer_dans_thread(tache_id):
+    """Point d'entrée du pool de threads : chaque thread utilise puis ferme sa propre connexion"""
+    try:
+        executer_export(tache_id)
+    finally:
+        connection.close()
+
+
+def _get_executor():
+    """Pool de threads partagé du processus (créé à la première utilisation)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'EXPORT_MAX_WORKERS', 2),
+                thread_name_prefix='export'
+            )
+        return _executor
+
+
+def _demarrer(tache_id):
+    from synchronisation.jobs import celery_disponible
+
+    if celery_disponible():
+        from .tasks import executer_export_differe
+        executer_export_differe.delay(tache_id)
+    else:
+        _get_executor().submit(_executer_dans_thread, tache_id)
+
+
+def etat_tache(tache):
+    """Avancement d'une tâche, pour le suivi côté navigateur"""
+    return {
+        'id': tache.pk,
+        'type_export': tache.type_export,
+        'statut': tache.statut,
+        'statut_display': tache.get_statut_display(),
+        'termine': tache.terminee,
+        'lignes_ecrites': tache.lignes_ecrites,
+        'lignes_total': tache.lignes_total,
+        'pourcentage': tache.pourcentage,
+        'nom_fichier': tache.nom_fichier,
+        'erreur': tache.erreur,
+        'url_etat': reverse('commande:etat_export', args=[tache.pk]),
+        'url_telechargement': (
+            reverse('commande:telecharger_export', args=[tache.pk]) if tache.statut == 'terminee' else None
+        ),
+    }
+
+
+def lancer_export(request, type_export, parametres):
+    """
+    Réponse des vues qui déclenchent un export : l'état de la tâche en JSON pour
+    les appels AJAX, sinon la page de suivi qui télécharge le fichier une fois prêt.
+    """
+    tache = demander_export(type_export, parametres, request.user)
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'success': True, 'tache': etat_tache(tache)}, status=202)
+    return redirect('commande:suivi_export', tache_id=tache.pk)
+
+
+def nettoyer_exports():
+    """
+    Supprime les fichiers et tâches expirés, et passe en erreur les tâches abandonnées.
+
+    Returns:
+        int: nombre de tâches supprimées
+    """
+    maintenant = timezone.now()
+    TacheExport.objects.filter(
+        statut__in=('en_attente', 'en_cours'), date_creation__lt=maintenant - duree('execution'),
+    ).update(statut='erreur', erreur="Export interrompu", date_fin=maintenant)
+
+    expirees = TacheExport.objects.filter(
+        Q(date_expiration__lte=maintenant) |
+        Q(statut='erreur', date_fin__lt=maintenant - duree('conservation'))
+    )
+    for chemin in expirees.exclude(fichier='').values_list('fichier', flat=True):
+        default_storage.delete(chemin)
+    nombre, _ = expirees.delete()
+    return nombre
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from commande.jobs import nettoyer_exports
+
+
+class Command(BaseCommand):
+    help = 'Supprime les fichiers d\'export expirés et marque en erreur les exports interrompus'
+
+    def handle(self, *args, **options):
+        nombre = nettoyer_exports()
+        self.stdout.write(self.style.SUCCESS(f'🧹 {nombre} export(s) expiré(s) supprimé(s)'))
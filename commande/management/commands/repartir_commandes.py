@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from commande.repartition import PROFILS, repartir_commandes
+
+
+class Command(BaseCommand):
+    help = 'Répartit les commandes en attente entre les opérateurs actifs, selon leur charge et leurs villes habituelles'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'profil',
+            choices=sorted(PROFILS),
+            help='Commandes à répartir : non affectées (confirmation) ou préparées (logistique)'
+        )
+        parser.add_argument(
+            '--apercu',
+            action='store_true',
+            help='Afficher le plan sans rien modifier'
+        )
+        parser.add_argument(
+            '--limite',
+            type=int,
+            help='Nombre maximal de commandes à répartir (les plus anciennes)'
+        )
+
+    def handle(self, *args, **options):
+        plan, nb_affectees = repartir_commandes(options['profil'], apercu=options['apercu'], limite=options['limite'])
+
+        for operateur_id, ligne in plan.operateurs.items():
+            nombre = len(plan.affectations.get(operateur_id, ()))
+            self.stdout.write(
+                f'  - {ligne.operateur.nom_complet} : +{nombre} '
+                f'(charge {ligne.charge} → {plan.charge_projetee(operateur_id)} / {ligne.capacite})'
+            )
+        if plan.en_attente:
+            self.stdout.write(self.style.WARNING(f'⚠️  {len(plan.en_attente)} commande(s) en attente : capacité atteinte'))
+
+        if options['apercu']:
+            self.stdout.write(f'👀 Aperçu : {plan.nb_affectees} commande(s) seraient réparties')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'✨ {nb_affectees} commande(s) réparties'))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from commande.models import Commande
+from commande.transitions import synchroniser_etats_courants, commandes_desynchronisees
+
+
+class Command(BaseCommand):
+    help = 'Remplit ou vérifie l\'état courant dénormalisé des commandes (etat_courant) à partir de l\'historique EtatCommande'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verifier',
+            action='store_true',
+            help='Vérifier uniquement la cohérence sans rien modifier'
+        )
+        parser.add_argument(
+            '--corriger',
+            action='store_true',
+            help='Ne recalculer que les commandes incohérentes'
+        )
+
+    def handle(self, *args, **options):
+        if options['verifier'] or options['corriger']:
+            incoherentes = commandes_desynchronisees()
+            nb_incoherentes = incoherentes.count()
+
+            if nb_incoherentes == 0:
+                self.stdout.write(self.style.SUCCESS('✅ Tous les états courants sont cohérents'))
+                return
+
+            self.stdout.write(self.style.WARNING(f'⚠️  {nb_incoherentes} commande(s) avec un état courant incohérent'))
+            for commande in incoherentes.select_related('etat_courant')[:20]:
+                etat = commande.etat_courant.libelle if commande.etat_courant else 'Aucun'
+                self.stdout.write(f'  - {commande.num_cmd} (état dénormalisé: {etat})')
+
+            if options['verifier']:
+                return
+
+            nb_corrigees = synchroniser_etats_courants(incoherentes)
+            self.stdout.write(self.style.SUCCESS(f'✨ {nb_corrigees} commande(s) corrigée(s)'))
+            return
+
+        total = Commande.objects.count()
+        self.stdout.write(f'🔄 Recalcul de l\'état courant pour {total} commande(s)...')
+        nb_mises_a_jour = synchroniser_etats_courants()
+        self.stdout.write(self.style.SUCCESS(f'✨ Terminé! {nb_mises_a_jour} commande(s) mises à jour'))
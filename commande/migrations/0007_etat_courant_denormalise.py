@@ -0,0 +1,62 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def remplir_etat_courant(apps, schema_editor):
+    Commande = apps.get_model('commande', 'Commande')
+    EtatCommande = apps.get_model('commande', 'EtatCommande')
+
+    def etat_ouvert(champ):
+        etats_ouverts = EtatCommande.objects.filter(
+            commande=OuterRef('pk'), date_fin__isnull=True
+        ).order_by('-date_debut', '-pk')
+        return Subquery(etats_ouverts.values(champ)[:1])
+
+    Commande.objects.update(
+        etat_courant_id=etat_ouvert('enum_etat_id'),
+        date_etat_courant=etat_ouvert('date_debut'),
+        operateur_etat_courant_id=etat_ouvert('operateur_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client', '0001_initial'),
+        ('commande', '0006_alter_envoi_status'),
+        ('parametre', '0002_region_actif'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commande',
+            name='date_etat_courant',
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Date d'entrée dans l'état courant"),
+        ),
+        migrations.AddField(
+            model_name='commande',
+            name='etat_courant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='commandes_etat_courant', to='commande.enumetatcmd', verbose_name='État courant'),
+        ),
+        migrations.AddField(
+            model_name='commande',
+            name='operateur_etat_courant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='commandes_etat_courant', to='parametre.operateur', verbose_name="Opérateur de l'état courant"),
+        ),
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(fields=['etat_courant', 'date_etat_courant'], name='commande_co_etat_co_1664d9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commande',
+            index=models.Index(fields=['operateur_etat_courant', 'etat_courant'], name='commande_co_operate_cba4ad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='etatcommande',
+            index=models.Index(fields=['commande', 'date_fin'], name='commande_et_command_c24c3f_idx'),
+        ),
+        migrations.RunPython(remplir_etat_courant, migrations.RunPython.noop),
+    ]
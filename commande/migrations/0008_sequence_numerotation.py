@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2025-08-29 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commande', '0007_etat_courant_denormalise'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequenceNumerotation',
+            fields=[
+                ('nom', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('valeur', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Séquence de numérotation',
+                'verbose_name_plural': 'Séquences de numérotation',
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2025-08-29 15:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commande', '0008_sequence_numerotation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TacheExport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_export', models.CharField(max_length=50)),
+                ('parametres', models.JSONField(blank=True, default=dict)),
+                ('cle', models.CharField(db_index=True, max_length=64)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('terminee', 'Terminée'), ('erreur', 'Erreur')], default='en_attente', max_length=12)),
+                ('lignes_ecrites', models.PositiveIntegerField(default=0)),
+                ('lignes_total', models.PositiveIntegerField(blank=True, null=True)),
+                ('fichier', models.FileField(blank=True, max_length=255, upload_to='exports/')),
+                ('nom_fichier', models.CharField(blank=True, max_length=200)),
+                ('erreur', models.TextField(blank=True)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('date_debut', models.DateTimeField(blank=True, null=True)),
+                ('date_fin', models.DateTimeField(blank=True, null=True)),
+                ('date_expiration', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('demandeur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='taches_export', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': "Tâche d'export",
+                'verbose_name_plural': "Tâches d'export",
+                'ordering': ['-date_creation'],
+            },
+        ),
+    ]
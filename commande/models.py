@@ -71,6 +71,25 @@ class Commande(models.Model):
     ville = models.ForeignKey(Ville, on_delete=models.CASCADE, null=True, blank=True, related_name='commandes')
     produit_init = models.TextField(blank=True, null=True)
     compteur = models.IntegerField(default=0, verbose_name="Compteur d'utilisation")
+
+    # État courant dénormalisé, maintenu par commande.transitions (ne pas modifier directement)
+    etat_courant = models.ForeignKey(
+        EnumEtatCmd,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='commandes_etat_courant',
+        verbose_name="État courant"
+    )
+    date_etat_courant = models.DateTimeField(null=True, blank=True, verbose_name="Date d'entrée dans l'état courant")
+    operateur_etat_courant = models.ForeignKey(
+        Operateur,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='commandes_etat_courant',
+        verbose_name="Opérateur de l'état courant"
+    )
   
     # Relation avec Envoi pour les exports journaliers
     envoi = models.ForeignKey('Envoi', on_delete=models.SET_NULL, null=True, blank=True, related_name='commandes_associees')
@@ -83,54 +102,74 @@ class Commande(models.Model):
         constraints = [
             models.CheckConstraint(check=models.Q(total_cmd__gte=0), name='total_cmd_positif'),
         ]
+        indexes = [
+            models.Index(fields=['etat_courant', 'date_etat_courant']),
+            models.Index(fields=['operateur_etat_courant', 'etat_courant']),
+        ]
     
     # Point de départ souhaité pour id_yz
     START_ID_YZ = 211971
 
+    # Champs dont la dernière valeur lue ou enregistrée est mémorisée sur l'instance :
+    # les signaux détectent leurs changements sans relire la commande en base
+    CHAMPS_SUIVIS = (
+        'compteur', 'total_cmd', 'client_id', 'date_cmd', 'ville_id', 'ville_init', 'num_cmd', 'id_yz',
+        'etat_courant_id', 'operateur_etat_courant_id', 'is_upsell',
+    )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.memoriser_valeurs()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self.memoriser_valeurs(fields)
+
+    def memoriser_valeurs(self, champs=None):
+        """Mémorise les valeurs chargées des CHAMPS_SUIVIS (les champs différés sont ignorés)"""
+        valeurs = self.__dict__.setdefault('_valeurs_memorisees', {})
+        for champ in self.CHAMPS_SUIVIS:
+            if (champs is None or champ in champs) and champ in self.__dict__:
+                valeurs[champ] = self.__dict__[champ]
+
+    @property
+    def valeurs_memorisees(self):
+        """Valeurs des CHAMPS_SUIVIS telles qu'en base au chargement ou au dernier save()"""
+        return self.__dict__.get('_valeurs_memorisees', {})
+
+    def champs_modifies(self, champs):
+        """
+        Champs (parmi les CHAMPS_SUIVIS) modifiés par le dernier save(), tous pour une création.
+        À appeler depuis un receveur post_save : compare aux valeurs exposées par le pre_save.
+        """
+        avant = getattr(self, '_valeurs_avant_save', None)
+        if not avant:
+            return set(champs)
+        return {champ for champ in champs if champ not in avant or avant[champ] != getattr(self, champ)}
+
     def save(self, *args, **kwargs):
+        from .numerotation import allouer_id_yz, allouer_num_cmd, avancer_id_yz
+
         # Générer l'ID YZ automatiquement si ce n'est pas encore fait
         if self.id_yz is None:
-            last_id_yz = Commande.objects.aggregate(max_id=models.Max('id_yz'))['max_id']
-            base = self.START_ID_YZ - 1
-            # Si aucune commande, commencer à 211971; sinon continuer après le max existant
-            self.id_yz = max(last_id_yz or base, base) + 1
+            self.id_yz = allouer_id_yz()
+        elif self._state.adding:
+            # ID YZ imposé : la séquence ne doit jamais le réattribuer
+            avancer_id_yz(self.id_yz)
         
         # Générer le numéro de commande selon l'origine si ce n'est pas déjà fait
         if not self.num_cmd:
-            if self.origine == 'OC':
-                # Format pour les opérateurs de confirmation: OC-00001
-                prefix = 'OC-'
-                last_oc = Commande.objects.filter(
-                    num_cmd__startswith=prefix
-                ).order_by('-num_cmd').first()
-                
-                if last_oc:
-                    last_number = int(last_oc.num_cmd.split('-')[1])
-                    new_number = last_number + 1
-                else:
-                    new_number = 1
-                
-                self.num_cmd = f"{prefix}{new_number:05d}"
-                
-            elif self.origine == 'ADMIN':
-                # Format pour les administrateurs: ADMIN-00001
-                prefix = 'ADMIN-'
-                last_admin = Commande.objects.filter(
-                    num_cmd__startswith=prefix
-                ).order_by('-num_cmd').first()
-                
-                if last_admin:
-                    last_number = int(last_admin.num_cmd.split('-')[1])
-                    new_number = last_number + 1
-                else:
-                    new_number = 1
-                
-                self.num_cmd = f"{prefix}{new_number:05d}"
+            if self.origine in ('OC', 'ADMIN'):
+                # Format OC-00001 (opérateurs de confirmation) ou ADMIN-00001 (administrateurs)
+                self.num_cmd = allouer_num_cmd(self.origine)
             else:
                 # Pour les commandes synchronisées, utiliser l'ID YZ comme avant
                 self.num_cmd = str(self.id_yz)
         
         super().save(*args, **kwargs)
+        self.memoriser_valeurs(kwargs.get('update_fields'))
     
     def __str__(self):
         return f"Commande {self.id_yz or self.num_cmd} - {self.client}"
@@ -138,7 +177,17 @@ class Commande(models.Model):
     @property
     def etat_actuel(self):
         """Retourne l'état actuel de la commande"""
+        # Réutiliser les états préchargés (prefetch_related('etats')) pour éviter une requête par commande
+        etats_precharges = getattr(self, '_prefetched_objects_cache', {}).get('etats')
+        if etats_precharges is not None:
+            etats_ouverts = [etat for etat in etats_precharges if etat.date_fin is None]
+            return max(etats_ouverts, key=lambda etat: etat.date_debut, default=None)
         return self.etats.filter(date_fin__isnull=True).first()
+
+    def changer_etat(self, enum_etat, operateur=None, commentaire=None, **kwargs):
+        """Raccourci vers commande.transitions.changer_etat_commande"""
+        from .transitions import changer_etat_commande
+        return changer_etat_commande(self, enum_etat, operateur=operateur, commentaire=commentaire, **kwargs)
     
     @property
     def historique_etats(self):
@@ -148,37 +197,12 @@ class Commande(models.Model):
     def recalculer_totaux_upsell(self):
         """
         Recalcule automatiquement les totaux de la commande selon le compteur upsell.
-        Tous les articles de la commande prennent le prix upsell correspondant au compteur.
+        Tous les articles de la commande prennent le prix upsell correspondant au compteur
+        (voir commande.tarification : une passe sur le panier, un bulk_update).
         """
-        from commande.templatetags.commande_filters import get_prix_upsell_avec_compteur
-        
-        print(f"🔄 recalculer_totaux_upsell - Compteur actuel: {self.compteur}")
-        
-        nouveau_total = 0
-        
-        # Recalculer chaque panier selon le compteur upsell
-        for panier in self.paniers.all():
-            # Calculer le prix selon le compteur de la commande
-            prix_unitaire = get_prix_upsell_avec_compteur(panier.article, self.compteur)
-            nouveau_sous_total = prix_unitaire * panier.quantite
-            
-            print(f"   📦 {panier.article.nom} (upsell: {panier.article.isUpsell}): qté={panier.quantite}, prix={prix_unitaire}, sous_total={nouveau_sous_total}")
-            
-            # Mettre à jour le sous-total du panier si nécessaire
-            if panier.sous_total != nouveau_sous_total:
-                panier.sous_total = float(nouveau_sous_total)
-                panier.save()
-            
-            nouveau_total += nouveau_sous_total
-        
-        # Ajouter les frais de livraison au total
-        frais_livraison = self.ville.frais_livraison if self.ville else 0
-        nouveau_total_avec_frais = float(nouveau_total) + float(frais_livraison)
-        
-        # Mettre à jour le total de la commande si nécessaire
-        if self.total_cmd != nouveau_total_avec_frais:
-            self.total_cmd = nouveau_total_avec_frais
-            self.save(update_fields=['total_cmd'])
+        from commande.tarification import recalculer_commande
+
+        recalculer_commande(self)
     
     @property
     def sous_total_articles(self):
@@ -235,6 +259,9 @@ class EtatCommande(models.Model):
                 name='date_debut_avant_date_fin'
             ),
         ]
+        indexes = [
+            models.Index(fields=['commande', 'date_fin']),
+        ]
     
     def __str__(self):
         return f"{self.commande.num_cmd} - {self.enum_etat.libelle}"
@@ -350,10 +377,8 @@ class Envoi(models.Model):
     def save(self, *args, **kwargs):
         # Générer automatiquement le numéro d'envoi si pas défini
         if not self.numero_envoi:
-            from django.utils import timezone
-            today = timezone.now().date()
-            count = Envoi.objects.filter(date_creation__date=today).count() + 1
-            self.numero_envoi = f"ENV-{today.strftime('%Y%m%d')}-{count:04d}"
+            from .numerotation import allouer_numero_envoi
+            self.numero_envoi = allouer_numero_envoi(timezone.now().date())
         
         super().save(*args, **kwargs)
 
@@ -393,3 +418,61 @@ class EtatArticleRenvoye(models.Model):
     def __str__(self):
         return f"{self.article} ({self.etat}) dans {self.commande}"
 
+
+class SequenceNumerotation(models.Model):
+    """Dernière valeur attribuée d'une séquence de numérotation (voir commande.numerotation)"""
+    nom = models.CharField(max_length=50, primary_key=True)
+    valeur = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Séquence de numérotation"
+        verbose_name_plural = "Séquences de numérotation"
+
+    def __str__(self):
+        return f"{self.nom} = {self.valeur}"
+
+
+class TacheExport(models.Model):
+    """Export exécuté en arrière-plan (voir commande.jobs), fichier conservé jusqu'à date_expiration"""
+    STATUTS = [
+        ('en_attente', 'En attente'),
+        ('en_cours', 'En cours'),
+        ('terminee', 'Terminée'),
+        ('erreur', 'Erreur'),
+    ]
+
+    type_export = models.CharField(max_length=50)
+    parametres = models.JSONField(default=dict, blank=True)
+    # Empreinte du type et des paramètres : deux demandes identiques partagent le même fichier
+    cle = models.CharField(max_length=64, db_index=True)
+    statut = models.CharField(max_length=12, choices=STATUTS, default='en_attente')
+    lignes_ecrites = models.PositiveIntegerField(default=0)
+    lignes_total = models.PositiveIntegerField(null=True, blank=True)
+    fichier = models.FileField(upload_to='exports/', max_length=255, blank=True)
+    nom_fichier = models.CharField(max_length=200, blank=True)
+    erreur = models.TextField(blank=True)
+    demandeur = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='taches_export')
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_debut = models.DateTimeField(null=True, blank=True)
+    date_fin = models.DateTimeField(null=True, blank=True)
+    date_expiration = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Tâche d'export"
+        verbose_name_plural = "Tâches d'export"
+        ordering = ['-date_creation']
+
+    def __str__(self):
+        return f"Export {self.type_export} #{self.pk} ({self.get_statut_display()})"
+
+    @property
+    def terminee(self):
+        return self.statut in ('terminee', 'erreur')
+
+    @property
+    def pourcentage(self):
+        if self.statut == 'terminee':
+            return 100
+        if not self.lignes_total:
+            return None
+        return min(99, self.lignes_ecrites * 100 // self.lignes_total)
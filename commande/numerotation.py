@@ -0,0 +1,120 @@
+"""
+Attribution des numéros de commande et d'envoi.
+
+Chaque séquence (id_yz, num_cmd OC-/ADMIN-, numéro d'envoi du jour) est une
+ligne de SequenceNumerotation incrémentée par une seule requête UPDATE. La
+ligne reste verrouillée jusqu'à la fin de la transaction de l'appelant : deux
+créations simultanées (opérateurs de confirmation, synchronisation) obtiennent
+des numéros distincts, et un rollback rend les siens sans laisser de trou.
+Sous PostgreSQL l'incrément et la lecture tiennent en un UPDATE ... RETURNING ;
+ailleurs (SQLite), l'UPDATE pose le verrou d'écriture de la base avant la lecture.
+
+Une séquence est créée à sa première utilisation à partir des numéros déjà en
+base (une seule lecture complète, au lieu d'un Max() ou d'un tri à chaque
+création). reserver(nom, nombre) réserve un bloc de numéros consécutifs pour les
+imports par lots.
+"""
+import re
+
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F
+
+from .models import Commande, Envoi, SequenceNumerotation
+
+SEQUENCE_ID_YZ = 'id_yz'
+
+
+def _incrementer(nom, nombre):
+    """Ajoute `nombre` à la séquence et renvoie sa nouvelle valeur (None si elle n'existe pas)"""
+    if connection.vendor == 'postgresql':
+        table = connection.ops.quote_name(SequenceNumerotation._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET valeur = valeur + %s WHERE nom = %s RETURNING valeur', [nombre, nom]
+            )
+            ligne = cursor.fetchone()
+        return ligne[0] if ligne else None
+
+    if not SequenceNumerotation.objects.filter(nom=nom).update(valeur=F('valeur') + nombre):
+        return None
+    return SequenceNumerotation.objects.filter(nom=nom).values_list('valeur', flat=True).get()
+
+
+def _creer(nom, valeur_initiale):
+    try:
+        with transaction.atomic():
+            SequenceNumerotation.objects.create(nom=nom, valeur=valeur_initiale() if valeur_initiale else 0)
+    except IntegrityError:
+        # Créée entre-temps par une autre transaction
+        pass
+
+
+def reserver(nom, nombre=1, valeur_initiale=None):
+    """
+    Réserve `nombre` valeurs consécutives de la séquence `nom`.
+
+    Args:
+        valeur_initiale: fonction renvoyant la dernière valeur déjà utilisée,
+            appelée uniquement à la création de la séquence
+
+    Returns:
+        int: la première valeur réservée
+    """
+    if nombre < 1:
+        raise ValueError("Le nombre de valeurs à réserver doit être positif")
+    with transaction.atomic():
+        valeur = _incrementer(nom, nombre)
+        if valeur is None:
+            _creer(nom, valeur_initiale)
+            valeur = _incrementer(nom, nombre)
+    return valeur - nombre + 1
+
+
+def avancer(nom, valeur):
+    """Garantit que la séquence n'attribuera plus `valeur` (numéro imposé par l'appelant)"""
+    SequenceNumerotation.objects.filter(nom=nom, valeur__lt=valeur).update(valeur=valeur)
+
+
+def _dernier_numero(valeurs, motif):
+    numeros = (motif.fullmatch(valeur) for valeur in valeurs)
+    return max((int(numero.group(1)) for numero in numeros if numero), default=0)
+
+
+# ID YZ
+
+def _dernier_id_yz():
+    dernier = Commande.objects.aggregate(max_id=models.Max('id_yz'))['max_id']
+    return max(dernier or 0, Commande.START_ID_YZ - 1)
+
+
+def allouer_id_yz(nombre=1):
+    """Premier ID YZ d'un bloc de `nombre` identifiants consécutifs"""
+    return reserver(SEQUENCE_ID_YZ, nombre, _dernier_id_yz)
+
+
+def avancer_id_yz(id_yz):
+    avancer(SEQUENCE_ID_YZ, id_yz)
+
+
+# Numéros de commande OC-00001 / ADMIN-00001
+
+def allouer_num_cmd(origine):
+    prefixe = f'{origine}-'
+
+    def dernier():
+        valeurs = Commande.objects.filter(num_cmd__startswith=prefixe).values_list('num_cmd', flat=True)
+        return _dernier_numero(valeurs, re.compile(re.escape(prefixe) + r'(\d+)'))
+
+    return f'{prefixe}{reserver(f"num_cmd:{origine}", 1, dernier):05d}'
+
+
+# Numéros d'envoi ENV-AAAAMMJJ-0001 (séquence par jour)
+
+def allouer_numero_envoi(jour):
+    prefixe = f'ENV-{jour.strftime("%Y%m%d")}-'
+
+    def dernier():
+        valeurs = Envoi.objects.filter(numero_envoi__startswith=prefixe).values_list('numero_envoi', flat=True)
+        return _dernier_numero(valeurs, re.compile(re.escape(prefixe) + r'(\d+)'))
+
+    return f'{prefixe}{reserver(f"envoi:{jour.isoformat()}", 1, dernier):04d}'
@@ -0,0 +1,247 @@
+"""
+Répartition automatique des commandes entre opérateurs.
+
+Un plan est calculé en mémoire à partir de trois lectures :
+
+1. les opérateurs actifs du profil, avec leur charge (commandes ouvertes dans
+   un état du profil) comptée en une requête groupée ;
+2. les commandes à répartir (état courant dénormalisé), avec ville et région ;
+3. l'affinité de chaque opérateur pour les villes et régions, comptée sur ses
+   EtatCommande passés dans l'état cible.
+
+Chaque commande, de la plus ancienne à la plus récente, va à l'opérateur dont
+la charge projetée est la plus faible, diminuée d'un bonus s'il a déjà servi
+la ville (ou la région) de la commande. Un opérateur qui atteint sa capacité
+(REPARTITION_CAPACITES) ne reçoit plus rien ; les commandes restantes sont
+laissées en attente.
+
+Le même plan sert l'aperçu (sans écriture) et l'exécution : une transition
+par lot (commande.transitions.changer_etat_commandes) par opérateur servi.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from parametre.models import Operateur
+
+from .etats import AFFECTEE, EN_COURS_CONFIRMATION, EN_COURS_LIVRAISON, LIVREE, NON_AFFECTEE, PREPAREE, RETOURNEE
+from .models import Commande, EnumEtatCmd, EtatCommande
+from .transitions import changer_etat_commandes
+
+
+class Profil(NamedTuple):
+    type_operateur: str
+    etats_a_repartir: tuple
+    etat_cible: str
+    # États courants comptés dans la charge d'un opérateur
+    etats_ouverts: tuple
+    # Commandes déjà passées par un de ces états : exclues de la répartition
+    etats_exclus: tuple = ()
+
+
+PROFILS = {
+    'confirmation': Profil(
+        type_operateur='CONFIRMATION',
+        etats_a_repartir=(NON_AFFECTEE,),
+        etat_cible=AFFECTEE,
+        etats_ouverts=(AFFECTEE, EN_COURS_CONFIRMATION),
+    ),
+    'logistique': Profil(
+        type_operateur='LOGISTIQUE',
+        etats_a_repartir=(PREPAREE,),
+        etat_cible=EN_COURS_LIVRAISON,
+        etats_ouverts=(EN_COURS_LIVRAISON,),
+        etats_exclus=(EN_COURS_LIVRAISON, LIVREE, RETOURNEE),
+    ),
+}
+
+CAPACITES_DEFAUT = {'CONFIRMATION': 60, 'LOGISTIQUE': 250}
+
+# Bonus d'affinité, en nombre de commandes de charge : un opérateur qui connaît
+# la ville reste préféré tant que sa charge ne dépasse pas celle des autres de plus de 3
+BONUS_VILLE = 3
+BONUS_REGION = 1
+
+# Historique pris en compte pour l'affinité
+JOURS_AFFINITE = 90
+
+
+class CommandeARepartir(NamedTuple):
+    id: int
+    id_yz: int
+    ville_id: int
+    region_id: int
+    region: str
+
+
+class ChargeOperateur(NamedTuple):
+    operateur: Operateur
+    charge: int
+    capacite: int
+
+
+class PlanRepartition(NamedTuple):
+    profil: Profil
+    operateurs: dict
+    commandes: dict
+    affectations: dict
+    en_attente: list
+
+    @property
+    def nb_affectees(self):
+        return sum(len(commande_ids) for commande_ids in self.affectations.values())
+
+    def charge_projetee(self, operateur_id):
+        return self.operateurs[operateur_id].charge + len(self.affectations.get(operateur_id, ()))
+
+    def apercu(self, nb_exemples=5):
+        """
+        Aperçu par opérateur, sans écriture : {operateur_id: {...}} avec le nom,
+        la charge actuelle et projetée, les régions et les premières commandes.
+        """
+        exemples_ids = [
+            commande_id for commande_ids in self.affectations.values() for commande_id in commande_ids[:nb_exemples]
+        ]
+        exemples = Commande.objects.select_related('client', 'ville').in_bulk(exemples_ids)
+        apercu = {}
+        for operateur_id, ligne in self.operateurs.items():
+            commande_ids = self.affectations.get(operateur_id, [])
+            apercu[operateur_id] = {
+                'nom_operateur': ligne.operateur.nom_complet,
+                'charge_actuelle': ligne.charge,
+                'charge_projetee': self.charge_projetee(operateur_id),
+                'capacite': ligne.capacite,
+                'nb_commandes': len(commande_ids),
+                'regions': sorted({self.commandes[pk].region for pk in commande_ids if self.commandes[pk].region}),
+                'commandes': [exemples[pk] for pk in commande_ids[:nb_exemples] if pk in exemples],
+            }
+        return apercu
+
+
+def capacite(type_operateur):
+    capacites = {**CAPACITES_DEFAUT, **getattr(settings, 'REPARTITION_CAPACITES', {})}
+    return capacites[type_operateur]
+
+
+def _charges(profil):
+    operateurs = Operateur.objects.filter(type_operateur=profil.type_operateur, actif=True).annotate(
+        charge=Count(
+            'commandes_etat_courant',
+            filter=Q(commandes_etat_courant__etat_courant__libelle__in=profil.etats_ouverts),
+        )
+    ).order_by('pk')
+    plafond = capacite(profil.type_operateur)
+    return {operateur.pk: ChargeOperateur(operateur, operateur.charge, plafond) for operateur in operateurs}
+
+
+def _commandes(profil, limite=None):
+    commandes = Commande.objects.filter(etat_courant__libelle__in=profil.etats_a_repartir)
+    if profil.etats_exclus:
+        commandes = commandes.exclude(Exists(EtatCommande.objects.filter(
+            commande=OuterRef('pk'), enum_etat__libelle__in=profil.etats_exclus,
+        )))
+    commandes = commandes.order_by('date_etat_courant', 'pk').values_list(
+        'pk', 'id_yz', 'ville_id', 'ville__region_id', 'ville__region__nom_region',
+    )
+    if limite:
+        commandes = commandes[:limite]
+    return {ligne[0]: CommandeARepartir(*ligne) for ligne in commandes}
+
+
+def _affinites(profil, operateur_ids):
+    """{operateur_id: ({ville_id}, {region_id})} d'après ses passages récents dans l'état cible"""
+    villes, regions = defaultdict(set), defaultdict(set)
+    lignes = (
+        EtatCommande.objects.filter(
+            operateur_id__in=operateur_ids,
+            enum_etat__libelle=profil.etat_cible,
+            date_debut__gte=timezone.now() - timedelta(days=JOURS_AFFINITE),
+            commande__ville__isnull=False,
+        )
+        .order_by().values_list('operateur_id', 'commande__ville_id', 'commande__ville__region_id').distinct()
+    )
+    for operateur_id, ville_id, region_id in lignes:
+        villes[operateur_id].add(ville_id)
+        regions[operateur_id].add(region_id)
+    return villes, regions
+
+
+def planifier_repartition(nom_profil, limite=None):
+    """
+    Calcule le plan de répartition d'un profil ('confirmation' ou 'logistique'), sans écriture.
+
+    Args:
+        limite: nombre maximal de commandes à répartir (les plus anciennes)
+
+    Returns:
+        PlanRepartition
+    """
+    profil = PROFILS[nom_profil]
+    operateurs = _charges(profil)
+    commandes = _commandes(profil, limite)
+    villes, regions = _affinites(profil, list(operateurs)) if operateurs and commandes else ({}, {})
+
+    charges = {operateur_id: ligne.charge for operateur_id, ligne in operateurs.items()}
+    affectations = defaultdict(list)
+    en_attente = []
+    for commande in commandes.values():
+        meilleur, meilleur_cout = None, None
+        for operateur_id, ligne in operateurs.items():
+            if charges[operateur_id] >= ligne.capacite:
+                continue
+            cout = charges[operateur_id]
+            if commande.ville_id in villes.get(operateur_id, ()):
+                cout -= BONUS_VILLE
+            elif commande.region_id in regions.get(operateur_id, ()):
+                cout -= BONUS_REGION
+            if meilleur_cout is None or cout < meilleur_cout:
+                meilleur, meilleur_cout = operateur_id, cout
+        if meilleur is None:
+            en_attente.append(commande.id)
+            continue
+        affectations[meilleur].append(commande.id)
+        charges[meilleur] += 1
+
+    return PlanRepartition(profil, operateurs, commandes, dict(affectations), en_attente)
+
+
+def executer_repartition(plan):
+    """
+    Applique un plan en une transaction, un changement d'état par lot par opérateur.
+    Les commandes qui ont changé d'état depuis le calcul du plan sont ignorées.
+
+    Returns:
+        int: nombre de commandes affectées
+    """
+    enum_etat, _ = EnumEtatCmd.objects.get_or_create(libelle=plan.profil.etat_cible)
+    nombre = 0
+    with transaction.atomic():
+        for operateur_id, commande_ids in plan.affectations.items():
+            operateur = plan.operateurs[operateur_id].operateur
+            resultat = changer_etat_commandes(
+                commande_ids,
+                enum_etat,
+                operateur=operateur,
+                commentaire=f"Affectation automatique à {operateur.nom_complet}",
+                etats_source=plan.profil.etats_a_repartir,
+            )
+            nombre += len(resultat.modifiees)
+    return nombre
+
+
+def repartir_commandes(nom_profil, apercu=False, limite=None):
+    """
+    Calcule le plan et l'applique (sauf en aperçu).
+
+    Returns:
+        tuple: (PlanRepartition, nombre de commandes affectées)
+    """
+    plan = planifier_repartition(nom_profil, limite)
+    if apercu or not plan.affectations:
+        return plan, 0
+    return plan, executer_repartition(plan)
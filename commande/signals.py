@@ -1,58 +1,71 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.db.models.signals import post_migrate
-from django.dispatch import receiver
-from .models import Commande, EnumEtatCmd
+from django.dispatch import Signal, receiver
+from article.tarifs import invalider_tarifs
+from parametre.models import Ville
+
+from .models import Commande, EnumEtatCmd, EtatCommande
+
+# Envoyé après une écriture de commandes qui ne passe pas par save() (transitions d'état,
+# synchronisation par lots). Arguments : dates, les jours de commande (date_cmd) concernés,
+# et commande_ids, les identifiants des commandes modifiées.
+commandes_modifiees = Signal()
+
+# Envoyé après un bulk_create (qui n'émet pas post_save). sender : le modèle,
+# arguments : nombre, et instances, les objets créés (clés primaires renseignées).
+creations_en_masse = Signal()
 
 
 @receiver(pre_save, sender=Commande)
 def detect_compteur_change(sender, instance, **kwargs):
     """
-    Détecte les changements du compteur avant la sauvegarde
-    et stocke l'ancienne valeur pour comparaison
+    Expose l'ancienne valeur du compteur (du total et du client) et des autres
+    CHAMPS_SUIVIS avant la sauvegarde, à partir des valeurs mémorisées au
+    chargement de l'instance (sans requête)
     """
-    if instance.pk:
-        try:
-            old_instance = Commande.objects.get(pk=instance.pk)
-            instance._old_compteur = old_instance.compteur
-        except Commande.DoesNotExist:
-            instance._old_compteur = 0
-    else:
+    if instance._state.adding:
         instance._old_compteur = 0
+        instance._old_total_cmd = None
+        instance._old_client_id = None
+        instance._valeurs_avant_save = {}
+        return
+
+    valeurs = instance.valeurs_memorisees
+    if any(champ not in valeurs for champ in Commande.CHAMPS_SUIVIS):
+        # Instance issue d'un bulk_create ou chargée avec des champs différés : relecture
+        valeurs = Commande.objects.filter(pk=instance.pk).values(*Commande.CHAMPS_SUIVIS).first() or {}
+    instance._valeurs_avant_save = dict(valeurs)
+    instance._old_compteur = valeurs.get('compteur', 0)
+    instance._old_total_cmd = valeurs.get('total_cmd')
+    instance._old_client_id = valeurs.get('client_id')
 
 
 @receiver(post_save, sender=Commande)
 def auto_recalcul_totaux_upsell(sender, instance, created, **kwargs):
     """
-    Recalcule automatiquement les totaux selon la nouvelle logique upsell
-    quand le compteur change d'état (différent de zéro)
+    Recalcule les totaux selon la logique upsell quand le compteur change
+    (vers une valeur différente de zéro). Le recalcul a lieu au commit :
+    plusieurs changements du compteur dans une transaction n'en déclenchent qu'un.
     """
-    # Éviter la récursion infinie
-    if hasattr(instance, '_recalcul_en_cours'):
+    from .tarification import planifier_recalcul
+
+    if instance._old_compteur != instance.compteur and instance.compteur != 0:
+        planifier_recalcul(instance)
+
+
+@receiver(post_save, sender=EtatCommande)
+@receiver(post_delete, sender=EtatCommande)
+def synchroniser_etat_courant_commande(sender, instance, **kwargs):
+    """
+    Filet de sécurité : garde l'état courant dénormalisé de la commande à jour
+    quand un EtatCommande est écrit hors de commande.transitions.changer_etat_commande
+    (ex: terminer_etat(), scripts de maintenance).
+    """
+    if getattr(instance, '_etat_courant_synchronise', False):
         return
-    
-    # Vérifier si le compteur a changé
-    old_compteur = getattr(instance, '_old_compteur', 0)
-    nouveau_compteur = instance.compteur
-    
-    # Déclencher le recalcul si :
-    # 1. Le compteur a changé ET
-    # 2. Le nouveau compteur n'est pas zéro
-    if old_compteur != nouveau_compteur and nouveau_compteur != 0:
-        # Marquer pour éviter la récursion
-        instance._recalcul_en_cours = True
-        
-        try:
-            # Déclencher le recalcul automatique
-            instance.recalculer_totaux_upsell()
-            
-            # Log pour le debugging (optionnel)
-            print(f"🔄 Recalcul automatique déclenché pour commande {instance.id_yz}")
-            print(f"   Compteur: {old_compteur} → {nouveau_compteur}")
-            print(f"   Nouveau total: {instance.total_cmd:.2f} DH")
-            
-        finally:
-            # Nettoyer le flag
-            delattr(instance, '_recalcul_en_cours') 
+
+    from .transitions import synchroniser_etats_courants
+    synchroniser_etats_courants(Commande.objects.filter(pk=instance.commande_id))
 
 
 @receiver(post_migrate)
@@ -85,4 +98,11 @@ def ensure_default_enum_etats(sender, app_config, **kwargs):
         EnumEtatCmd.objects.get_or_create(
             libelle=state['libelle'],
             defaults={'ordre': state['ordre'], 'couleur': state['couleur']}
-        )
\ No newline at end of file
+        )
+
+
+@receiver(post_save, sender=Ville)
+@receiver(post_delete, sender=Ville)
+def invalider_frais_livraison(sender, instance, **kwargs):
+    """Frais de livraison en cache pour la tarification des paniers (commande.tarification)"""
+    invalider_tarifs()
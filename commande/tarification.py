@@ -0,0 +1,158 @@
+"""
+Tarification des paniers d'une commande selon le compteur upsell.
+
+tarifer_panier calcule en une fois toutes les lignes d'un panier pour un
+compteur donné, à partir de la table des tarifs en cache (article.tarifs) et
+des frais de livraison des villes (même cache versionné). recalculer_commande
+enregistre le résultat : un bulk_update pour les sous-totaux modifiés et une
+sauvegarde du total de la commande s'il change.
+
+Appelé à chaque modification de panier pendant les appels (ajout, suppression,
+changement de quantité), via Commande.recalculer_totaux_upsell, et au commit
+après un changement du compteur (planifier_recalcul).
+"""
+import threading
+
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.db import connection, transaction
+
+from article.tarifs import TableEnCache, tarifs_articles
+from parametre.models import Ville
+
+from .models import Commande, Panier
+from .signals import commandes_modifiees
+
+
+class LigneTarifee(NamedTuple):
+    panier_id: int
+    article_id: int
+    quantite: int
+    prix_unitaire: object
+    sous_total: float
+    is_upsell: bool
+    niveau_upsell: int
+
+
+class PanierTarife(NamedTuple):
+    compteur: int
+    lignes: tuple
+    total_articles: Decimal
+    frais_livraison: float
+    total: float
+
+    def par_panier(self):
+        return {ligne.panier_id: ligne for ligne in self.lignes}
+
+
+def _charger_frais(ville_ids):
+    return dict(Ville.objects.filter(pk__in=ville_ids).order_by().values_list('pk', 'frais_livraison'))
+
+
+_frais = TableEnCache(_charger_frais)
+
+
+def frais_livraison(ville_id):
+    if not ville_id:
+        return 0
+    return _frais.lire([ville_id]).get(ville_id, 0)
+
+
+def tarifer_panier(lignes, compteur, ville_id=None):
+    """
+    Prix de toutes les lignes d'un panier pour le compteur donné, sans écriture.
+
+    Args:
+        lignes: itérable de (panier_id, article_id, quantite)
+        compteur: compteur upsell de la commande
+        ville_id: ville de livraison (frais ajoutés au total)
+
+    Returns:
+        PanierTarife
+    """
+    lignes = list(lignes)
+    tarifs = tarifs_articles(article_id for _, article_id, _ in lignes)
+
+    tarifees = []
+    total_articles = Decimal('0')
+    for panier_id, article_id, quantite in lignes:
+        tarif = tarifs[article_id]
+        prix = tarif.prix_pour_compteur(compteur)
+        montant = prix * quantite
+        total_articles += montant
+        tarifees.append(LigneTarifee(
+            panier_id, article_id, quantite, prix, float(montant), tarif.is_upsell, tarif.niveau_upsell(compteur),
+        ))
+
+    frais = float(frais_livraison(ville_id))
+    return PanierTarife(compteur, tuple(tarifees), total_articles, frais, float(total_articles) + frais)
+
+
+def recalculer_commande(commande, compteur=None):
+    """
+    Recalcule et enregistre les sous-totaux des paniers et le total de la commande.
+
+    Returns:
+        PanierTarife
+    """
+    # Un recalcul planifié pour cette commande devient inutile
+    _en_attente().pop(commande.pk, None)
+    compteur = commande.compteur if compteur is None else compteur
+    paniers = list(Panier.objects.filter(commande=commande).only('id', 'article_id', 'quantite', 'sous_total'))
+    resultat = tarifer_panier(
+        ((panier.pk, panier.article_id, panier.quantite) for panier in paniers), compteur, commande.ville_id,
+    )
+
+    lignes = resultat.par_panier()
+    modifies = []
+    for panier in paniers:
+        sous_total = lignes[panier.pk].sous_total
+        if panier.sous_total != sous_total:
+            panier.sous_total = sous_total
+            modifies.append(panier)
+
+    with transaction.atomic():
+        if modifies:
+            Panier.objects.bulk_update(modifies, ['sous_total'])
+        if commande.total_cmd != resultat.total:
+            commande.total_cmd = resultat.total
+            commande.save(update_fields=['total_cmd'])
+        elif modifies:
+            # bulk_update n'émet pas post_save : sans sauvegarde de la commande, KPIs, index
+            # de recherche et flux 360 sont prévenus ici
+            commandes_modifiees.send(sender=Commande, dates=[commande.date_cmd], commande_ids=[commande.pk])
+    return resultat
+
+
+_local = threading.local()
+
+
+def _en_attente():
+    if not hasattr(_local, 'commandes'):
+        _local.commandes = {}
+    return _local.commandes
+
+
+def _executer_recalcul(commande_id):
+    commande = _en_attente().pop(commande_id, None)
+    if commande is not None:
+        recalculer_commande(commande)
+
+
+def planifier_recalcul(commande):
+    """
+    Recalcule la commande au commit de la transaction courante (immédiatement hors transaction).
+
+    Seul le premier rappel exécuté pour une commande recalcule : les planifications
+    suivantes dans la transaction, ou un recalcul explicite entre-temps, ne
+    provoquent pas de recalcul supplémentaire. Un rappel est enregistré à chaque
+    appel pour qu'une planification annulée par un rollback ne bloque pas les suivantes.
+    """
+    en_attente = _en_attente()
+    if not connection.in_atomic_block:
+        # Hors transaction, les entrées restantes viennent de transactions annulées
+        en_attente.clear()
+    en_attente[commande.pk] = commande
+    commande_id = commande.pk
+    transaction.on_commit(lambda: _executer_recalcul(commande_id))
@@ -0,0 +1,15 @@
+from celery import shared_task
+
+from .jobs import executer_export, nettoyer_exports
+
+
+@shared_task(name='commande.executer_export')
+def executer_export_differe(tache_id):
+    """Tâche Celery : construit le fichier d'une TacheExport"""
+    return executer_export(tache_id)
+
+
+@shared_task(name='commande.nettoyer_exports')
+def nettoyer_exports_expires():
+    """Tâche Celery planifiée : suppression des exports expirés"""
+    return nettoyer_exports()
@@ -2,6 +2,8 @@ from django import template
 from datetime import timedelta
 from django.db.models import Q
 
+from article.tarifs import TarifArticle
+
 register = template.Library()
 
 @register.filter
@@ -113,30 +115,10 @@ def get_prix_upsell_avec_compteur(article, compteur):
     Note: Les unités incluent les quantités (ex: 1 article qté 2 = 2 unités)
     Seuls les articles avec isUpsell=True utilisent les prix upsell.
     Les autres articles gardent leur prix normal.
+
+    Calcul partagé avec la tarification des paniers (article.tarifs.TarifArticle).
     """
-    # Si l'article n'est pas upsell, toujours retourner le prix normal
-    if not article.isUpsell:
-        return article.prix_actuel if article.prix_actuel is not None else article.prix_unitaire
-    
-    # Pour les articles upsell, appliquer le prix selon le compteur
-    if compteur == 0:
-        # 0-1 articles upsell → prix normal
-        return article.prix_actuel if article.prix_actuel is not None else article.prix_unitaire
-    elif compteur == 1 and article.prix_upsell_1:
-        # 2 articles upsell → prix upsell 1
-        return article.prix_upsell_1
-    elif compteur == 2 and article.prix_upsell_2:
-        # 3 articles upsell → prix upsell 2
-        return article.prix_upsell_2
-    elif compteur == 3 and article.prix_upsell_3:
-        # 4 articles upsell → prix upsell 3
-        return article.prix_upsell_3
-    elif compteur >= 4 and article.prix_upsell_4:
-        # 5+ articles upsell → prix upsell 4
-        return article.prix_upsell_4
-    else:
-        # Si pas de prix upsell défini pour ce niveau, utiliser le prix actuel
-        return article.prix_actuel if article.prix_actuel is not None else article.prix_unitaire
+    return TarifArticle.depuis_article(article).prix_pour_compteur(compteur)
 
 @register.filter
 def get_prix_upsell_supplement(article, quantite):
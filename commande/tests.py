@@ -1,3 +1,470 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from article.models import Article, Categorie
+from article.tarifs import CLE_GENERATION, tarifs_articles
+from client.models import Client
+from commande.exports import (
+    Feuille, colonnes_commandes_consolidees, feuille_resume, preparer_commandes, reponse_csv, reponse_excel,
+)
+from commande.jobs import demander_export, executer_export, nettoyer_exports
+from commande.models import Commande, EnumEtatCmd, Envoi, EtatCommande, Panier, TacheExport
+from commande.numerotation import allouer_id_yz
+from commande.repartition import planifier_repartition, repartir_commandes
+from commande.tarification import recalculer_commande, tarifer_panier
+from commande.transitions import (
+    changer_etat_commande, changer_etat_commandes, commandes_desynchronisees, synchroniser_etats_courants,
+)
+from parametre.models import Operateur, Region, Ville
+
+
+class TarificationPanierTest(TestCase):
+
+    def setUp(self):
+        region = Region.objects.create(nom_region='Casablanca-Settat')
+        self.ville = Ville.objects.create(nom='Casablanca', frais_livraison=25, frequence_livraison='Quotidienne', region=region)
+        categorie = Categorie.objects.create(nom='SANDALES')
+        self.upsell = Article.objects.create(
+            nom='Sandale Été', reference='SAN-1', prix_unitaire=200, categorie=categorie, isUpsell=True,
+            prix_upsell_1=180, prix_upsell_2=160, prix_upsell_4=120,
+        )
+        self.normal = Article.objects.create(nom='Mule Cuir', reference='MUL-1', prix_unitaire=150, categorie=categorie)
+        client = Client.objects.create(nom='Alaoui', prenom='Sara', numero_tel='0611000001')
+        self.commande = Commande.objects.create(
+            num_cmd='TAR-1', id_yz=910001, client=client, ville=self.ville, total_cmd=0,
+        )
+        self.panier_upsell = Panier.objects.create(commande=self.commande, article=self.upsell, quantite=3, sous_total=600)
+        self.panier_normal = Panier.objects.create(commande=self.commande, article=self.normal, quantite=1, sous_total=150)
+
+    def _lignes(self):
+        return [(self.panier_upsell.pk, self.upsell.pk, 3), (self.panier_normal.pk, self.normal.pk, 1)]
+
+    def test_prix_selon_compteur(self):
+        attendus = {0: (200, 0), 1: (180, 1), 2: (160, 2), 3: (200, 2), 5: (120, 4)}
+        for compteur, (prix, niveau) in attendus.items():
+            resultat = tarifer_panier(self._lignes(), compteur, self.ville.pk)
+            ligne_upsell, ligne_normale = resultat.lignes
+            self.assertEqual((ligne_upsell.prix_unitaire, ligne_upsell.niveau_upsell), (prix, niveau), compteur)
+            self.assertEqual(ligne_normale.prix_unitaire, 150)
+            self.assertEqual(resultat.total, prix * 3 + 150 + 25.0)
+
+    def test_recalcul_en_une_passe(self):
+        Commande.objects.filter(pk=self.commande.pk).update(compteur=2)
+        self.commande.refresh_from_db()
+        tarifs_articles([self.upsell.pk, self.normal.pk])
+
+        with CaptureQueriesContext(connection) as requetes:
+            resultat = recalculer_commande(self.commande)
+
+        # Tarifs servis par la table en cache, un seul UPDATE pour les paniers
+        sql = [requete['sql'] for requete in requetes.captured_queries]
+        self.assertFalse([requete for requete in sql if '"article_article"' in requete])
+        self.assertEqual(len([requete for requete in sql if requete.startswith('UPDATE "commande_panier"')]), 1)
+
+        self.assertEqual(resultat.total, 160 * 3 + 150 + 25.0)
+        self.panier_upsell.refresh_from_db()
+        self.assertEqual(self.panier_upsell.sous_total, 480.0)
+        self.commande.refresh_from_db()
+        self.assertEqual(self.commande.total_cmd, 655.0)
+
+    def test_invalidation_sur_modification(self):
+        self.assertEqual(tarifs_articles([self.normal.pk])[self.normal.pk].prix_normal, Decimal('150.00'))
+
+        self.normal.prix_unitaire = Decimal('170.00')
+        self.normal.prix_actuel = None
+        self.normal.save()
+        self.ville.frais_livraison = 30
+        self.ville.save()
+
+        resultat = tarifer_panier(self._lignes(), 0, self.ville.pk)
+        self.assertEqual(resultat.lignes[1].prix_unitaire, Decimal('170.00'))
+        self.assertEqual(resultat.frais_livraison, 30.0)
+
+    def test_generation_perdue_et_age_maximal(self):
+        tarifs_articles([self.normal.pk])
+        with self.assertNumQueries(0):
+            tarifs_articles([self.normal.pk])
+
+        # Écriture vue par un autre processus : la table locale n'est pas vidée
+        Article.objects.filter(pk=self.normal.pk).update(prix_unitaire=Decimal('170.00'))
+        # Une clé expulsée donne un nouveau jeton, jamais l'ancien
+        caches['tarifs'].delete(CLE_GENERATION)
+        self.assertEqual(tarifs_articles([self.normal.pk])[self.normal.pk].prix_unitaire, Decimal('170.00'))
+
+        Article.objects.filter(pk=self.normal.pk).update(prix_unitaire=Decimal('180.00'))
+        self.assertEqual(tarifs_articles([self.normal.pk])[self.normal.pk].prix_unitaire, Decimal('170.00'))
+        with override_settings(TARIFS_DUREE_MAX_TABLE=0):
+            self.assertEqual(tarifs_articles([self.normal.pk])[self.normal.pk].prix_unitaire, Decimal('180.00'))
+
+
+class SuiviModificationsCommandeTest(TestCase):
+
+    def setUp(self):
+        categorie = Categorie.objects.create(nom='SANDALES')
+        self.article = Article.objects.create(
+            nom='Sandale Été', reference='SAN-1', prix_unitaire=200, categorie=categorie, isUpsell=True,
+            prix_upsell_1=180, prix_upsell_2=160,
+        )
+        client = Client.objects.create(nom='Alaoui', prenom='Sara', numero_tel='0611000001')
+        commande = Commande.objects.create(num_cmd='SUI-1', id_yz=920001, client=client, total_cmd=600)
+        self.panier = Panier.objects.create(commande=commande, article=self.article, quantite=3, sous_total=600)
+        self.commande = Commande.objects.get(pk=commande.pk)
+
+    def test_sauvegarde_sans_relecture(self):
+        self.commande.adresse = 'Rue 12, Agdal'
+        with CaptureQueriesContext(connection) as requetes:
+            self.commande.save()
+
+        selects = [r['sql'] for r in requetes.captured_queries if r['sql'].startswith('SELECT') and '"commande_commande"' in r['sql']]
+        self.assertEqual(selects, [])
+        self.assertEqual((self.commande._old_compteur, self.commande._old_total_cmd), (0, 600))
+
+    def test_recalcul_unique_au_commit(self):
+        with CaptureQueriesContext(connection) as requetes:
+            with self.captureOnCommitCallbacks(execute=True):
+                for compteur in (1, 2):
+                    self.commande.compteur = compteur
+                    self.commande.save()
+                self.panier.refresh_from_db()
+                # Rien n'est recalculé avant le commit
+                self.assertEqual(self.panier.sous_total, 600)
+
+        mises_a_jour = [r for r in requetes.captured_queries if r['sql'].startswith('UPDATE "commande_panier"')]
+        self.assertEqual(len(mises_a_jour), 1)
+        self.panier.refresh_from_db()
+        self.assertEqual(self.panier.sous_total, 480)
+        self.commande.refresh_from_db()
+        self.assertEqual(self.commande.total_cmd, 480)
+
+
+class ChangementEtatParLotTest(TestCase):
+
+    def setUp(self):
+        self.client_commande = Client.objects.create(nom='Alaoui', prenom='Sara', numero_tel='0611000001')
+        self.affectee = EnumEtatCmd.objects.get_or_create(libelle='Affectée')[0]
+        self.en_cours = EnumEtatCmd.objects.get_or_create(libelle='En cours de confirmation')[0]
+        self.operateur = Operateur.objects.create(
+            user=User.objects.create_user('conf1'), nom='Idrissi', prenom='Nora',
+            mail='conf1@yz.ma', type_operateur='CONFIRMATION',
+        )
+        self.autre = Operateur.objects.create(
+            user=User.objects.create_user('conf2'), nom='Bennani', prenom='Ali',
+            mail='conf2@yz.ma', type_operateur='CONFIRMATION',
+        )
+        self.commandes = [
+            Commande.objects.create(num_cmd=f'LOT-{numero}', client=self.client_commande, total_cmd=100)
+            for numero in range(6)
+        ]
+
+    def test_lot_en_requetes_constantes(self):
+        for commande in self.commandes[:4]:
+            changer_etat_commande(commande, self.affectee, operateur=self.operateur)
+        changer_etat_commande(self.commandes[4], self.affectee, operateur=self.autre)
+        ids = [commande.pk for commande in self.commandes] + [0, 'abc']
+
+        with CaptureQueriesContext(connection) as requetes:
+            resultat = changer_etat_commandes(
+                ids, self.en_cours, operateur=self.operateur, commentaire='Lot',
+                etats_source=('Affectée',), operateur_source=self.operateur,
+            )
+
+        self.assertEqual(resultat.modifiees, [commande.pk for commande in self.commandes[:4]])
+        self.assertEqual(resultat.rejets[self.commandes[4].pk], 'affectée à un autre opérateur')
+        self.assertEqual(resultat.rejets[self.commandes[5].pk], 'état actuel : aucun')
+        self.assertEqual((resultat.rejets[0], resultat.rejets['abc']), ('commande introuvable', 'identifiant invalide'))
+        # Lecture verrouillée, clôture, insertion, état courant (+ savepoint et marquage des KPIs)
+        ecritures = [r['sql'] for r in requetes.captured_queries if r['sql'].split()[0] in ('SELECT', 'UPDATE', 'INSERT')]
+        self.assertLessEqual(len(ecritures), 6)
+
+        self.assertEqual(Commande.objects.filter(etat_courant=self.en_cours).count(), 4)
+        self.assertEqual(
+            EtatCommande.objects.filter(commande__in=self.commandes[:4], date_fin__isnull=True).count(), 4
+        )
+
+        # Relancé : les commandes déjà dans l'état cible chez le même opérateur sont inchangées
+        resultat = changer_etat_commandes(ids[:4], self.en_cours, operateur=self.operateur)
+        self.assertEqual((resultat.modifiees, len(resultat.inchangees)), ([], 4))
+        self.assertEqual(EtatCommande.objects.filter(enum_etat=self.en_cours).count(), 4)
+
+    def test_operateur_desynchronise_detecte_et_corrige(self):
+        commande = self.commandes[0]
+        changer_etat_commande(commande, self.affectee, operateur=self.operateur)
+        self.assertFalse(commandes_desynchronisees().exists())
+
+        # Réaffectation écrite directement dans l'historique, sans passer par les signaux
+        EtatCommande.objects.filter(commande=commande, date_fin__isnull=True).update(operateur=self.autre)
+        self.assertEqual(list(commandes_desynchronisees()), [commande])
+
+        synchroniser_etats_courants(commandes_desynchronisees())
+        commande.refresh_from_db()
+        self.assertEqual(commande.operateur_etat_courant, self.autre)
+        self.assertFalse(commandes_desynchronisees().exists())
+
+
+class RepartitionAutomatiqueTest(TestCase):
+
+    def setUp(self):
+        client_commande = Client.objects.create(nom='Alaoui', prenom='Sara', numero_tel='0611000001')
+        self.rabat = Ville.objects.create(
+            nom='Rabat', frais_livraison=20, frequence_livraison='Quotidienne',
+            region=Region.objects.create(nom_region='Rabat-Salé-Kénitra'),
+        )
+        self.oujda = Ville.objects.create(
+            nom='Oujda', frais_livraison=35, frequence_livraison='Quotidienne',
+            region=Region.objects.create(nom_region="L'Oriental"),
+        )
+        EnumEtatCmd.objects.get_or_create(libelle='Préparée')
+        EnumEtatCmd.objects.get_or_create(libelle='En cours de livraison')
+        self.livreur_rabat, self.livreur = [
+            Operateur.objects.create(
+                user=User.objects.create_user(f'log{numero}'), nom=f'Livreur {numero}', prenom='Y',
+                mail=f'log{numero}@yz.ma', type_operateur='LOGISTIQUE',
+            )
+            for numero in (1, 2)
+        ]
+
+        def commande(numero, ville):
+            return Commande.objects.create(num_cmd=f'REP-{numero}', client=client_commande, total_cmd=100, ville=ville)
+
+        # Deux livraisons en cours à Rabat : charge 2 et affinité pour la ville
+        for numero in (1, 2):
+            changer_etat_commande(commande(numero, self.rabat), 'En cours de livraison', operateur=self.livreur_rabat)
+        self.preparees = []
+        for numero, ville in enumerate([self.rabat, self.oujda] * 3, start=3):
+            self.preparees.append(commande(numero, ville))
+            changer_etat_commande(self.preparees[-1], 'Préparée')
+
+    def test_plan_equilibre_par_affinite(self):
+        with CaptureQueriesContext(connection) as requetes:
+            plan = planifier_repartition('logistique')
+        self.assertEqual(len(requetes.captured_queries), 3)
+
+        self.assertEqual(plan.affectations[self.livreur_rabat.pk], [c.pk for c in self.preparees[0::2]])
+        self.assertEqual(plan.affectations[self.livreur.pk], [c.pk for c in self.preparees[1::2]])
+        self.assertEqual((plan.charge_projetee(self.livreur_rabat.pk), plan.charge_projetee(self.livreur.pk)), (5, 3))
+        self.assertEqual(plan.apercu()[self.livreur.pk]['regions'], ["L'Oriental"])
+
+        # Le plan de l'aperçu est celui qui est appliqué
+        _, nombre = repartir_commandes('logistique')
+        self.assertEqual(nombre, 6)
+        self.assertEqual(
+            sorted(Commande.objects.filter(operateur_etat_courant=self.livreur).values_list('pk', flat=True)),
+            plan.affectations[self.livreur.pk],
+        )
+        self.assertEqual(planifier_repartition('logistique').commandes, {})
+
+    @override_settings(REPARTITION_CAPACITES={'LOGISTIQUE': 3})
+    def test_capacite(self):
+        plan, nombre = repartir_commandes('logistique', apercu=True)
+        self.assertEqual(nombre, 0)
+        self.assertEqual(plan.en_attente, [c.pk for c in self.preparees[4:]])
+        self.assertEqual(plan.charge_projetee(self.livreur.pk), 3)
+        self.assertEqual(Commande.objects.filter(etat_courant__libelle='Préparée').count(), 6)
+
+
+class ExportsTest(TestCase):
+
+    def setUp(self):
+        self.ville = Ville.objects.create(
+            nom='Fès', frais_livraison=30, frequence_livraison='Quotidienne',
+            region=Region.objects.create(nom_region='Fès-Meknès'),
+        )
+        article = Article.objects.create(
+            nom='Babouche', reference='BAB-1', prix_unitaire=120, categorie=Categorie.objects.create(nom='BABOUCHES'),
+        )
+        client_commande = Client.objects.create(nom='Alaoui', prenom='Sara', numero_tel='0611000001')
+        for numero in range(5):
+            commande = Commande.objects.create(
+                num_cmd=f'EXP-{numero}', id_yz=920000 + numero, client=client_commande, ville=self.ville, total_cmd=240,
+            )
+            Panier.objects.create(commande=commande, article=article, quantite=2, sous_total=240)
+            changer_etat_commande(commande, 'Préparée')
+
+    def _commandes(self):
+        return preparer_commandes(Commande.objects.filter(ville=self.ville)).order_by('id_yz')
+
+    def test_csv_en_flux_par_lots(self):
+        response = reponse_csv(Feuille('Fès', self._commandes(), colonnes_commandes_consolidees()), 'fes.csv', taille_lot=2)
+        flux = iter(response.streaming_content)
+        # Le BOM part avant toute lecture en base
+        with self.assertNumQueries(0):
+            self.assertEqual(next(flux).decode('utf-8'), '\ufeff')
+
+        # Un curseur serveur pour les commandes, puis paniers et articles par lot de deux commandes
+        with self.assertNumQueries(1 + 2 * 3):
+            lignes = b''.join(flux).decode('utf-8').splitlines()
+        self.assertEqual(lignes[0].split(';')[0], 'N° Commande')
+        self.assertEqual(len(lignes), 6)
+        self.assertEqual(
+            lignes[1].split(';'),
+            ['920000', 'Sara Alaoui', '0611000001', 'Fès', 'Fès-Meknès', 'Babouche x2', '240.00', 'N/A', 'Préparée'],
+        )
+
+    def test_csv_total_nul_au_format_montant(self):
+        Commande.objects.filter(id_yz=920000).update(total_cmd=0)
+        response = reponse_csv(Feuille('Fès', self._commandes(), colonnes_commandes_consolidees()), 'fes.csv')
+        lignes = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(lignes[1].split(';')[6], '0.00')
+
+    def test_excel_en_ecriture_seule(self):
+        response = reponse_excel(
+            [
+                Feuille('Fès', self._commandes(), colonnes_commandes_consolidees()),
+                feuille_resume([('Nombre de commandes', 5)]),
+            ],
+            'fes.xlsx',
+        )
+        classeur = load_workbook(BytesIO(b''.join(response.streaming_content)))
+
+        feuille = classeur['Fès']
+        self.assertEqual(feuille.max_row, 6)
+        self.assertEqual(feuille['A1'].style, 'yz_entete')
+        self.assertEqual([feuille['A2'].value, feuille['G2'].value], [920000, 240])
+        self.assertEqual(feuille['G2'].style, 'yz_montant')
+        self.assertEqual(feuille.column_dimensions['F'].width, 50)
+        self.assertEqual(classeur['Résumé']['B2'].value, 5)
+
+
+class ExportsDifferesTest(TestCase):
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        reglages = override_settings(MEDIA_ROOT=media)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+        self.admin = User.objects.create_user('admin_export', password='x', is_staff=True)
+        Operateur.objects.create(
+            user=self.admin, nom='Tazi', prenom='Omar', mail='admin@yz.ma', type_operateur='ADMIN',
+        )
+        article = Article.objects.create(
+            nom='Babouche', reference='BAB-1', prix_unitaire=120, categorie=Categorie.objects.create(nom='BABOUCHES'),
+        )
+        client_commande = Client.objects.create(nom='Alaoui', prenom='Sara', numero_tel='0611000001')
+        for numero in range(3):
+            commande = Commande.objects.create(
+                num_cmd=f'360-{numero}', id_yz=930000 + numero, client=client_commande, total_cmd=360,
+            )
+            if numero:
+                Panier.objects.create(commande=commande, article=article, quantite=1, sous_total=120)
+                Panier.objects.create(commande=commande, article=article, quantite=2, sous_total=240)
+
+    def test_demande_identique_reprend_la_tache(self):
+        with self.captureOnCommitCallbacks() as demarrages:
+            tache = demander_export('commandes_360', {'search': '360', 'date_fin': ''}, self.admin)
+            self.assertEqual(demander_export('commandes_360', {'search': '360'}, self.admin), tache)
+        # Un seul worker démarré pour les deux demandes
+        self.assertEqual(len(demarrages), 1)
+        self.assertNotEqual(demander_export('commandes_360', {'search': '361'}, self.admin), tache)
+
+        executer_export(tache.pk)
+        self.assertEqual(demander_export('commandes_360', {'search': '360'}, self.admin), tache)
+        TacheExport.objects.filter(pk=tache.pk).update(date_fin=timezone.now() - timedelta(hours=1))
+        self.assertNotEqual(demander_export('commandes_360', {'search': '360'}, self.admin), tache)
+
+    def test_execution_suivi_et_telechargement(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('app_admin:export_all_data_excel'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 202)
+        tache = TacheExport.objects.get(pk=response.json()['tache']['id'])
+
+        self.assertIsNotNone(executer_export(tache.pk))
+        etat = self.client.get(reverse('commande:etat_export', args=[tache.pk])).json()['tache']
+        # Une ligne par article, plus la commande sans panier
+        self.assertEqual([etat['statut'], etat['lignes_ecrites'], etat['lignes_total']], ['terminee', 5, 5])
+
+        response = self.client.get(etat['url_telechargement'])
+        self.assertEqual(response.status_code, 200)
+        feuille = load_workbook(BytesIO(b''.join(response.streaming_content)))['Commandes avec Paniers']
+        self.assertEqual([feuille['A1'].value, feuille['AE1'].value], ['N°', 'OBSERVATION LIVRAISON'])
+        self.assertEqual(feuille.max_row, 6)
+
+        # Hors AJAX, le lien mène à la page de suivi
+        response = self.client.get(reverse('app_admin:export_all_data_excel'))
+        self.assertRedirects(response, reverse('commande:suivi_export', args=[tache.pk]))
+
+        self.client.force_login(User.objects.create_user('operateur_export', password='x'))
+        self.assertEqual(self.client.get(reverse('commande:etat_export', args=[tache.pk])).status_code, 403)
+
+    def test_nettoyage_des_exports_expires(self):
+        tache = demander_export('commandes_360', {}, self.admin)
+        chemin = executer_export(tache.pk)
+        tache.refresh_from_db()
+        self.assertTrue(tache.fichier.storage.exists(chemin))
+
+        abandonnee = demander_export('commandes_360', {'search': '360'}, self.admin)
+        TacheExport.objects.filter(pk=abandonnee.pk).update(date_creation=timezone.now() - timedelta(hours=2))
+        self.assertEqual(nettoyer_exports(), 0)
+        TacheExport.objects.filter(pk=tache.pk).update(date_expiration=timezone.now())
+        self.assertEqual(nettoyer_exports(), 1)
+
+        self.assertFalse(tache.fichier.storage.exists(chemin))
+        self.assertEqual(TacheExport.objects.get().statut, 'erreur')
+
+
+class NumerotationConcurrenteTest(TransactionTestCase):
+
+    NB_THREADS = 8
+    COMMANDES_PAR_THREAD = 5
+
+    def setUp(self):
+        self.client_commande = Client.objects.create(nom='Alaoui', prenom='Sara', numero_tel='0611000001')
+
+    def _creer_en_parallele(self, creer):
+        depart = threading.Barrier(self.NB_THREADS)
+        erreurs = []
+
+        def travail():
+            try:
+                depart.wait()
+                for _ in range(self.COMMANDES_PAR_THREAD):
+                    creer()
+            except Exception as erreur:
+                erreurs.append(erreur)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=travail) for _ in range(self.NB_THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(erreurs, [])
+
+    def test_commandes_simultanees_sans_doublon_ni_trou(self):
+        def creer():
+            with transaction.atomic():
+                Commande.objects.create(origine='OC', client=self.client_commande, total_cmd=0, adresse='Rabat')
+
+        self._creer_en_parallele(creer)
+
+        total = self.NB_THREADS * self.COMMANDES_PAR_THREAD
+        ids_yz = sorted(Commande.objects.values_list('id_yz', flat=True))
+        self.assertEqual(ids_yz, list(range(Commande.START_ID_YZ, Commande.START_ID_YZ + total)))
+        numeros = sorted(Commande.objects.values_list('num_cmd', flat=True))
+        self.assertEqual(numeros, [f'OC-{numero:05d}' for numero in range(1, total + 1)])
+
+    def test_envois_et_reservation_par_bloc(self):
+        self._creer_en_parallele(lambda: Envoi.objects.create(date_livraison_prevue='2025-09-01'))
+        numeros = list(Envoi.objects.values_list('numero_envoi', flat=True))
+        self.assertEqual(len(set(numeros)), self.NB_THREADS * self.COMMANDES_PAR_THREAD)
+
+        # Un ID imposé est sauté, un bloc réservé suit sans chevauchement
+        premier = allouer_id_yz()
+        Commande.objects.create(id_yz=premier + 10, num_cmd='IMPOSE', client=self.client_commande, total_cmd=0, adresse='')
+        self.assertEqual(allouer_id_yz(3), premier + 11)
+        self.assertEqual(allouer_id_yz(), premier + 14)
@@ -0,0 +1,283 @@
+"""
+Transitions d'état des commandes.
+
+Point d'entrée unique pour faire passer une commande d'un état à un autre :
+clôture des états ouverts, création du nouvel EtatCommande et mise à jour
+de l'état courant dénormalisé sur Commande (etat_courant, date_etat_courant,
+operateur_etat_courant), le tout dans une même transaction.
+
+changer_etat_commandes fait de même pour un lot (affectations et changements
+de statut en masse) : validation de toutes les commandes en une lecture, puis
+un UPDATE de clôture, un bulk_create des nouveaux états et un UPDATE de l'état
+courant, quel que soit le nombre de commandes.
+"""
+from typing import NamedTuple
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .models import Commande, EnumEtatCmd, EtatCommande
+from .signals import commandes_modifiees
+
+
+def _resoudre_enum_etat(enum_etat):
+    """Accepte une instance EnumEtatCmd ou un libellé"""
+    if isinstance(enum_etat, EnumEtatCmd):
+        return enum_etat
+    return EnumEtatCmd.objects.get(libelle=enum_etat)
+
+
+def changer_etat_commande(commande, enum_etat, operateur=None, commentaire=None,
+                          operateur_cloture=None, date_debut=None, cloturer_etats_ouverts=True):
+    """
+    Fait passer une commande dans un nouvel état de manière atomique.
+
+    Args:
+        commande: instance Commande
+        enum_etat: instance EnumEtatCmd ou libellé de l'état cible
+        operateur: opérateur associé au nouvel état
+        commentaire: commentaire du nouvel état
+        operateur_cloture: si fourni, opérateur enregistré sur les états clôturés
+            (équivalent de l'ancien terminer_etat(operateur))
+        date_debut: date d'entrée dans le nouvel état (par défaut: maintenant)
+        cloturer_etats_ouverts: clôturer les états encore ouverts de la commande
+
+    Returns:
+        EtatCommande: le nouvel état créé
+    """
+    enum_etat = _resoudre_enum_etat(enum_etat)
+    maintenant = timezone.now()
+    date_debut = date_debut or maintenant
+
+    with transaction.atomic():
+        if cloturer_etats_ouverts:
+            champs_cloture = {'date_fin': maintenant}
+            if operateur_cloture:
+                champs_cloture['operateur'] = operateur_cloture
+            EtatCommande.objects.filter(
+                commande_id=commande.pk,
+                date_fin__isnull=True
+            ).update(**champs_cloture)
+
+        nouvel_etat = EtatCommande(
+            commande=commande,
+            enum_etat=enum_etat,
+            operateur=operateur,
+            commentaire=commentaire,
+            date_debut=date_debut,
+        )
+        # L'état courant est mis à jour ci-dessous, inutile de le recalculer dans le signal
+        nouvel_etat._etat_courant_synchronise = True
+        nouvel_etat.save()
+
+        Commande.objects.filter(pk=commande.pk).update(
+            etat_courant=enum_etat,
+            date_etat_courant=date_debut,
+            operateur_etat_courant=operateur,
+        )
+        commandes_modifiees.send(sender=Commande, dates=[commande.date_cmd], commande_ids=[commande.pk])
+
+    commande.etat_courant = enum_etat
+    commande.date_etat_courant = date_debut
+    commande.operateur_etat_courant = operateur
+    # Invalider les états préchargés, devenus obsolètes
+    getattr(commande, '_prefetched_objects_cache', {}).pop('etats', None)
+    return nouvel_etat
+
+
+def cloturer_etat_courant(commande, operateur_cloture=None):
+    """Clôture les états ouverts d'une commande sans en ouvrir de nouveau"""
+    champs_cloture = {'date_fin': timezone.now()}
+    if operateur_cloture:
+        champs_cloture['operateur'] = operateur_cloture
+
+    with transaction.atomic():
+        EtatCommande.objects.filter(
+            commande_id=commande.pk,
+            date_fin__isnull=True
+        ).update(**champs_cloture)
+        Commande.objects.filter(pk=commande.pk).update(
+            etat_courant=None,
+            date_etat_courant=None,
+            operateur_etat_courant=None,
+        )
+        commandes_modifiees.send(sender=Commande, dates=[commande.date_cmd], commande_ids=[commande.pk])
+
+    commande.etat_courant = None
+    commande.date_etat_courant = None
+    commande.operateur_etat_courant = None
+    getattr(commande, '_prefetched_objects_cache', {}).pop('etats', None)
+
+
+class ResultatTransitions(NamedTuple):
+    """Résultat d'un changement d'état par lot, commande par commande"""
+    modifiees: list
+    inchangees: list
+    rejets: dict
+
+    @property
+    def acceptees(self):
+        """Commandes dans l'état cible après le lot (modifiées ou qui y étaient déjà)"""
+        return self.modifiees + self.inchangees
+
+    def par_commande(self):
+        """{commande_id: 'modifiee' | 'inchangee' | motif du rejet}, pour les réponses JSON"""
+        resultats = dict.fromkeys(self.modifiees, 'modifiee')
+        resultats.update(dict.fromkeys(self.inchangees, 'inchangee'))
+        resultats.update(self.rejets)
+        return resultats
+
+
+def _identifiants(commande_ids):
+    ids, rejets = [], {}
+    for commande_id in commande_ids:
+        try:
+            ids.append(int(commande_id))
+        except (TypeError, ValueError):
+            rejets[commande_id] = 'identifiant invalide'
+    return list(dict.fromkeys(ids)), rejets
+
+
+def changer_etat_commandes(commande_ids, enum_etat, operateur=None, commentaire=None,
+                           operateur_cloture=None, etats_source=None, operateur_source=None,
+                           date_debut=None):
+    """
+    Fait passer un lot de commandes dans un nouvel état, en une transaction.
+
+    Les commandes sont verrouillées et validées en une seule lecture. Une
+    commande déjà dans l'état cible chez le même opérateur est laissée telle
+    quelle (inchangée) ; les autres sont écrites ensemble : clôture des états
+    ouverts (un UPDATE), nouveaux EtatCommande (un bulk_create), état courant
+    dénormalisé (un UPDATE), puis un seul envoi de commandes_modifiees.
+
+    Args:
+        commande_ids: identifiants des commandes (entiers ou chaînes)
+        enum_etat: instance EnumEtatCmd ou libellé de l'état cible
+        operateur, operateur_cloture, date_debut: comme changer_etat_commande
+        commentaire: texte du nouvel état, ou fonction recevant le libellé de
+            l'état actuel de la commande (None sans état) et renvoyant le texte
+        etats_source: libellés des états actuels autorisés (par défaut : tous)
+        operateur_source: opérateur auquel l'état actuel doit appartenir
+
+    Returns:
+        ResultatTransitions
+    """
+    enum_etat = _resoudre_enum_etat(enum_etat)
+    ids, rejets = _identifiants(commande_ids)
+    maintenant = timezone.now()
+    date_debut = date_debut or maintenant
+    operateur_id = operateur.pk if operateur else None
+
+    with transaction.atomic():
+        lignes = {
+            ligne[0]: ligne for ligne in
+            Commande.objects.select_for_update(of=('self',)).filter(pk__in=ids).order_by('pk')
+            .values_list('pk', 'date_cmd', 'etat_courant_id', 'etat_courant__libelle', 'operateur_etat_courant_id')
+        }
+
+        modifiees, inchangees, libelles = [], [], {}
+        for commande_id in ids:
+            if commande_id not in lignes:
+                rejets[commande_id] = 'commande introuvable'
+                continue
+            _, _, etat_id, libelle, operateur_actuel_id = lignes[commande_id]
+            if etat_id == enum_etat.pk and operateur_actuel_id == operateur_id:
+                inchangees.append(commande_id)
+            elif etats_source is not None and libelle not in etats_source:
+                rejets[commande_id] = f"état actuel : {libelle or 'aucun'}"
+            elif operateur_source is not None and operateur_actuel_id != operateur_source.pk:
+                rejets[commande_id] = 'affectée à un autre opérateur'
+            else:
+                modifiees.append(commande_id)
+                libelles[commande_id] = libelle
+
+        if modifiees:
+            champs_cloture = {'date_fin': maintenant}
+            if operateur_cloture:
+                champs_cloture['operateur'] = operateur_cloture
+            EtatCommande.objects.filter(commande_id__in=modifiees, date_fin__isnull=True).update(**champs_cloture)
+
+            EtatCommande.objects.bulk_create([
+                EtatCommande(
+                    commande_id=commande_id,
+                    enum_etat=enum_etat,
+                    operateur=operateur,
+                    commentaire=commentaire(libelles[commande_id]) if callable(commentaire) else commentaire,
+                    date_debut=date_debut,
+                )
+                for commande_id in modifiees
+            ])
+            Commande.objects.filter(pk__in=modifiees).update(
+                etat_courant=enum_etat,
+                date_etat_courant=date_debut,
+                operateur_etat_courant=operateur,
+            )
+            commandes_modifiees.send(
+                sender=Commande,
+                dates={lignes[commande_id][1] for commande_id in modifiees},
+                commande_ids=modifiees,
+            )
+
+    return ResultatTransitions(modifiees, inchangees, rejets)
+
+
+def _sous_requete_etat_ouvert(champ):
+    """Sous-requête renvoyant un champ de l'état ouvert le plus récent de la commande"""
+    etats_ouverts = EtatCommande.objects.filter(
+        commande=OuterRef('pk'),
+        date_fin__isnull=True
+    ).order_by('-date_debut', '-pk')
+    return Subquery(etats_ouverts.values(champ)[:1])
+
+
+def synchroniser_etats_courants(commandes=None):
+    """
+    Recalcule l'état courant dénormalisé à partir de l'historique EtatCommande.
+
+    Une seule requête UPDATE ensembliste, utilisée pour le backfill et comme
+    filet de sécurité quand un EtatCommande est écrit hors de changer_etat_commande.
+
+    Args:
+        commandes: QuerySet de Commande (par défaut: toutes les commandes)
+
+    Returns:
+        int: nombre de commandes mises à jour
+    """
+    if commandes is None:
+        commandes = Commande.objects.all()
+    with transaction.atomic():
+        nb_mises_a_jour = commandes.order_by().update(
+            etat_courant_id=_sous_requete_etat_ouvert('enum_etat_id'),
+            date_etat_courant=_sous_requete_etat_ouvert('date_debut'),
+            operateur_etat_courant_id=_sous_requete_etat_ouvert('operateur_id'),
+        )
+        if nb_mises_a_jour:
+            commandes_modifiees.send(
+                sender=Commande,
+                dates=commandes.order_by().values_list('date_cmd', flat=True).distinct(),
+                commande_ids=commandes.order_by().values_list('pk', flat=True),
+            )
+    return nb_mises_a_jour
+
+
+def commandes_desynchronisees(commandes=None):
+    """
+    Retourne les commandes dont l'état courant dénormalisé (état, date ou
+    opérateur) ne correspond pas à l'état ouvert le plus récent de leur historique.
+    """
+    if commandes is None:
+        commandes = Commande.objects.all()
+    commandes = commandes.annotate(
+        _etat_reel_id=_sous_requete_etat_ouvert('enum_etat_id'),
+        _date_reelle=_sous_requete_etat_ouvert('date_debut'),
+        _operateur_reel_id=_sous_requete_etat_ouvert('operateur_id'),
+    )
+    ids_incoherents = []
+    for commande_id, etat_id, date_etat, operateur_id, etat_reel_id, date_reelle, operateur_reel_id in commandes.values_list(
+        'pk', 'etat_courant_id', 'date_etat_courant', 'operateur_etat_courant_id',
+        '_etat_reel_id', '_date_reelle', '_operateur_reel_id',
+    ).iterator(chunk_size=2000):
+        if (etat_id, date_etat, operateur_id) != (etat_reel_id, date_reelle, operateur_reel_id):
+            ids_incoherents.append(commande_id)
+    return Commande.objects.filter(pk__in=ids_incoherents)
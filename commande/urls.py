@@ -45,4 +45,8 @@ urlpatterns = [
     path('paniers/', views.liste_paniers, name='paniers'),
     # API
     path('api/commande/<int:commande_id>/panier/', views.api_panier_commande, name='api_panier_commande'),
+    # Exports en arrière-plan
+    path('exports/<int:tache_id>/', views.etat_export, name='etat_export'),
+    path('exports/<int:tache_id>/suivi/', views.suivi_export, name='suivi_export'),
+    path('exports/<int:tache_id>/telecharger/', views.telecharger_export, name='telecharger_export'),
 ]
\ No newline at end of file
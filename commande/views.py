@@ -8,9 +8,12 @@ from django.db import models, transaction
 from django.core.paginator import Paginator
 from django.contrib import messages
 from django.core import serializers
-from django.http import JsonResponse, HttpResponse # Import HttpResponse for partial rendering
+from django.http import FileResponse, JsonResponse, HttpResponse # Import HttpResponse for partial rendering
 import json
-from .models import Commande, Panier, EnumEtatCmd, Operation
+from .models import Commande, Panier, EnumEtatCmd, EtatCommande, Operation, TacheExport
+from .etats import EN_COURS_LIVRAISON, PREPAREE
+from .jobs import etat_tache, peut_acceder
+from .transitions import changer_etat_commande, changer_etat_commandes
 from client.models import Client
 from parametre.models import Ville, Operateur, Region # Import Region
 from article.models import Article
@@ -1419,33 +1422,19 @@ def affecter_commandes(request):
             defaults={'ordre': 20, 'couleur': '#3B82F6'}
         )
         
-        commandes_affectees = 0
-        for commande_id in commande_ids:
-            try:
-                commande = Commande.objects.get(id=commande_id)
-                
-                # Terminer l'état actuel s'il existe
-                etat_actuel = commande.etat_actuel
-                if etat_actuel:
-                    etat_actuel.terminer_etat(operateur)
-                
-                # Créer le nouvel état "Affectée"
-                from .models import EtatCommande
-                EtatCommande.objects.create(
-                    commande=commande,
-                    enum_etat=etat_affectee,
-                    operateur=operateur,
-                    commentaire=f"Commande affectée à {operateur.get_full_name()}"
-                )
-                
-                commandes_affectees += 1
-                
-            except Commande.DoesNotExist:
-                continue
+        # Clôturer les états actuels et passer à "Affectée", tout le lot en une transaction
+        resultat = changer_etat_commandes(
+            commande_ids,
+            etat_affectee,
+            operateur=operateur,
+            commentaire=f"Commande affectée à {operateur.get_full_name()}",
+            operateur_cloture=operateur
+        )
         
         return JsonResponse({
             'success': True, 
-            'message': f'{commandes_affectees} commande(s) affectée(s) à {operateur.get_full_name()}'
+            'message': f'{len(resultat.acceptees)} commande(s) affectée(s) à {operateur.get_full_name()}',
+            'resultats': resultat.par_commande()
         })
         
     except Exception as e:
@@ -1465,33 +1454,20 @@ def changer_statut_commandes(request):
         
         nouvel_etat = get_object_or_404(EnumEtatCmd, id=nouvel_etat_id)
         
-        commandes_modifiees = 0
-        for commande_id in commande_ids:
-            try:
-                commande = Commande.objects.get(id=commande_id)
-                
-                # Terminer l'état actuel s'il existe
-                etat_actuel = commande.etat_actuel
-                if etat_actuel:
-                    etat_actuel.terminer_etat(request.user.operateur if hasattr(request.user, 'operateur') else None)
-                
-                # Créer le nouvel état
-                from .models import EtatCommande
-                EtatCommande.objects.create(
-                    commande=commande,
-                    enum_etat=nouvel_etat,
-                    operateur=request.user.operateur if hasattr(request.user, 'operateur') else None,
-                    commentaire=commentaire or f"Statut changé vers {nouvel_etat.libelle}"
-                )
-                
-                commandes_modifiees += 1
-                
-            except Commande.DoesNotExist:
-                continue
+        # Clôturer les états actuels et créer le nouvel état, tout le lot en une transaction
+        operateur_courant = request.user.operateur if hasattr(request.user, 'operateur') else None
+        resultat = changer_etat_commandes(
+            commande_ids,
+            nouvel_etat,
+            operateur=operateur_courant,
+            commentaire=commentaire or f"Statut changé vers {nouvel_etat.libelle}",
+            operateur_cloture=operateur_courant
+        )
         
         return JsonResponse({
             'success': True, 
-            'message': f'{commandes_modifiees} commande(s) passée(s) au statut "{nouvel_etat.libelle}"'
+            'message': f'{len(resultat.acceptees)} commande(s) passée(s) au statut "{nouvel_etat.libelle}"',
+            'resultats': resultat.par_commande()
         })
         
     except Exception as e:
@@ -1535,18 +1511,14 @@ def changer_statut_commande_unique(request, commande_id):
         else:
             return JsonResponse({'success': False, 'message': 'Nouvel état requis'})
         
-        # Terminer l'état actuel s'il existe
-        etat_actuel = commande.etat_actuel
-        if etat_actuel:
-            etat_actuel.terminer_etat(request.user.operateur if hasattr(request.user, 'operateur') else None)
-        
-        # Créer le nouvel état
-        from .models import EtatCommande
-        EtatCommande.objects.create(
-            commande=commande,
-            enum_etat=nouvel_etat,
-            operateur=request.user.operateur if hasattr(request.user, 'operateur') else None,
-            commentaire=commentaire or f"Statut changé vers {nouvel_etat.libelle}"
+        # Clôturer l'état actuel et créer le nouvel état
+        operateur_courant = request.user.operateur if hasattr(request.user, 'operateur') else None
+        changer_etat_commande(
+            commande,
+            nouvel_etat,
+            operateur=operateur_courant,
+            commentaire=commentaire or f"Statut changé vers {nouvel_etat.libelle}",
+            operateur_cloture=operateur_courant
         )
         
         return JsonResponse({'success': True, 'message': f'Statut de la commande changé vers "{nouvel_etat.libelle}"'})
@@ -1581,16 +1553,14 @@ def desaffecter_commande_unique(request, commande_id):
             defaults={'ordre': 1, 'couleur': '#F59E0B'}
         )
         
-        # Terminer l'état actuel
-        etat_actuel.terminer_etat(request.user.operateur if hasattr(request.user, 'operateur') else None)
-        
-        # Créer le nouvel état "Non affectée"
-        from .models import EtatCommande
-        EtatCommande.objects.create(
-            commande=commande,
-            enum_etat=etat_non_affectee,
-            operateur=request.user.operateur if hasattr(request.user, 'operateur') else None,
-            commentaire=motif or "Commande désaffectée"
+        # Clôturer l'état actuel et repasser en "Non affectée"
+        operateur_courant = request.user.operateur if hasattr(request.user, 'operateur') else None
+        changer_etat_commande(
+            commande,
+            etat_non_affectee,
+            operateur=operateur_courant,
+            commentaire=motif or "Commande désaffectée",
+            operateur_cloture=operateur_courant
         )
         
         return JsonResponse({
@@ -1617,34 +1587,21 @@ def desaffecter_commandes(request):
             defaults={'ordre': 5, 'couleur': '#9CA3AF'}
         )
         
-        commandes_desaffectees = 0
-        for commande_id in commande_ids:
-            try:
-                commande = Commande.objects.get(id=commande_id)
-                
-                # Vérifier si la commande est actuellement affectée
-                etat_actuel = commande.etat_actuel
-                if etat_actuel and etat_actuel.enum_etat.libelle == 'Affectée':
-                    # Terminer l'état actuel
-                    etat_actuel.terminer_etat(request.user.operateur if hasattr(request.user, 'operateur') else None)
-                    
-                    # Créer le nouvel état "En attente"
-                    from .models import EtatCommande
-                    EtatCommande.objects.create(
-                        commande=commande,
-                        enum_etat=etat_en_attente,
-                        operateur=request.user.operateur if hasattr(request.user, 'operateur') else None,
-                        commentaire="Commande désaffectée - remise en attente"
-                    )
-                    
-                    commandes_desaffectees += 1
-                
-            except Commande.DoesNotExist:
-                continue
+        # Seules les commandes actuellement affectées sont remises en attente
+        operateur_courant = request.user.operateur if hasattr(request.user, 'operateur') else None
+        resultat = changer_etat_commandes(
+            commande_ids,
+            etat_en_attente,
+            operateur=operateur_courant,
+            commentaire="Commande désaffectée - remise en attente",
+            operateur_cloture=operateur_courant,
+            etats_source=('Affectée',)
+        )
         
         return JsonResponse({
             'success': True, 
-            'message': f'{commandes_desaffectees} commande(s) désaffectée(s) avec succès'
+            'message': f'{len(resultat.modifiees)} commande(s) désaffectée(s) avec succès',
+            'resultats': resultat.par_commande()
         })
         
     except Exception as e:
@@ -1954,17 +1911,14 @@ def annuler_commande(request, pk):
             defaults={'ordre': 70, 'couleur': '#EF4444'}
         )
         
-        # Terminer l'état actuel
-        if etat_actuel:
-            etat_actuel.terminer_etat(request.user.operateur if hasattr(request.user, 'operateur') else None)
-        
-        # Créer le nouvel état "Annulée"
-        from .models import EtatCommande
-        EtatCommande.objects.create(
-            commande=commande,
-            enum_etat=etat_annulee,
-            operateur=request.user.operateur if hasattr(request.user, 'operateur') else None,
-            commentaire=f"Commande annulée - Motif: {motif}"
+        # Clôturer l'état actuel et passer à "Annulée"
+        operateur_courant = request.user.operateur if hasattr(request.user, 'operateur') else None
+        changer_etat_commande(
+            commande,
+            etat_annulee,
+            operateur=operateur_courant,
+            commentaire=f"Commande annulée - Motif: {motif}",
+            operateur_cloture=operateur_courant
         )
         
         # Sauvegarder le motif d'annulation dans la commande
@@ -1993,68 +1947,24 @@ def annuler_commande(request, pk):
 # Fonction utilitaire pour automatiser les changements d'état
 def repartition_automatique_commandes():
     """
-    Répartit automatiquement les commandes préparées aux opérateurs logistiques
-    selon un algorithme de répartition par ville/région
+    Répartit automatiquement les commandes préparées aux opérateurs logistiques,
+    en équilibrant leur charge et selon leurs villes/régions habituelles
+    (voir commande.repartition)
     """
-    from .models import EnumEtatCmd, EtatCommande
-    from parametre.models import Operateur
-    from django.db.models import Count
+    from .repartition import repartir_commandes
     
     try:
-        # Récupérer les commandes préparées non encore affectées pour la livraison
-        commandes_preparees = Commande.objects.filter(
-            etats__enum_etat__libelle='Préparée',
-            etats__date_fin__isnull=True  # État actif
-        ).exclude(
-            # Exclure celles qui ont déjà un état de livraison
-            etats__enum_etat__libelle__in=['En cours de livraison', 'Livrée', 'Retournée']
-        ).select_related('ville', 'ville__region').distinct()
-        
-        if not commandes_preparees.exists():
-            return 0, "Aucune commande préparée à répartir"
-        
-        # Récupérer les opérateurs logistiques actifs
-        operateurs_logistiques = Operateur.objects.filter(
-            type_operateur='LOGISTIQUE',
-            actif=True
-        )
+        plan, commandes_affectees = repartir_commandes('logistique')
         
-        if not operateurs_logistiques.exists():
+        if not plan.commandes:
+            return 0, "Aucune commande préparée à répartir"
+        if not plan.operateurs:
             return 0, "Aucun opérateur logistique actif disponible"
         
-        # Créer ou récupérer l'état "En cours de livraison"
-        etat_livraison, created = EnumEtatCmd.objects.get_or_create(
-            libelle='En cours de livraison',
-            defaults={'ordre': 60, 'couleur': '#F59E0B'}
-        )
-        
-        commandes_affectees = 0
-        
-        # Algorithme de répartition simple : round-robin par opérateur
-        operateurs_list = list(operateurs_logistiques)
-        operateur_index = 0
-        
-        for commande in commandes_preparees:
-            # Sélectionner l'opérateur suivant (round-robin)
-            operateur_selectionne = operateurs_list[operateur_index]
-            operateur_index = (operateur_index + 1) % len(operateurs_list)
-            
-            # Terminer l'état "Préparée"
-            etat_actuel = commande.etat_actuel
-            if etat_actuel and etat_actuel.enum_etat.libelle == 'Préparée':
-                etat_actuel.terminer_etat()
-            
-            # Créer l'état "En cours de livraison" avec l'opérateur affecté
-            EtatCommande.objects.create(
-                commande=commande,
-                enum_etat=etat_livraison,
-                operateur=operateur_selectionne,
-                commentaire=f"Affectation automatique à {operateur_selectionne.nom_complet} pour livraison"
-            )
-            
-            commandes_affectees += 1
-        
-        return commandes_affectees, f"{commandes_affectees} commandes réparties automatiquement"
+        message = f"{commandes_affectees} commandes réparties automatiquement"
+        if plan.en_attente:
+            message += f" ({len(plan.en_attente)} en attente : capacité des opérateurs atteinte)"
+        return commandes_affectees, message
         
     except Exception as e:
         return 0, f"Erreur lors de la répartition automatique: {str(e)}"
@@ -2080,9 +1990,9 @@ def gerer_changement_etat_automatique(commande, nouvel_etat_libelle, operateur=N
                 defaults={'ordre': 70, 'couleur': '#EF4444'}
             )
             redirect_url = reverse('commande:annulees')
-        elif nouvel_etat_libelle == 'En cours de livraison':
+        elif nouvel_etat_libelle == EN_COURS_LIVRAISON:
             nouvel_etat, created = EnumEtatCmd.objects.get_or_create(
-                libelle='En cours de livraison',
+                libelle=EN_COURS_LIVRAISON,
                 defaults={'ordre': 60, 'couleur': '#F59E0B'}
             )
             redirect_url = None
@@ -2106,18 +2016,13 @@ def gerer_changement_etat_automatique(commande, nouvel_etat_libelle, operateur=N
                 )
                 redirect_url = None
         
-        # Terminer l'état actuel
-        etat_actuel = commande.etat_actuel
-        if etat_actuel:
-            etat_actuel.terminer_etat(operateur)
-        
-        # Créer le nouvel état
-        from .models import EtatCommande
-        EtatCommande.objects.create(
-            commande=commande,
-            enum_etat=nouvel_etat,
+        # Clôturer l'état actuel et créer le nouvel état
+        changer_etat_commande(
+            commande,
+            nouvel_etat,
             operateur=operateur,
-            commentaire=commentaire or f"Changement automatique vers '{nouvel_etat.libelle}'"
+            commentaire=commentaire or f"Changement automatique vers '{nouvel_etat.libelle}'",
+            operateur_cloture=operateur
         )
         
         # Si la commande devient "Préparée", déclencher la répartition automatique après un délai
@@ -2696,17 +2601,13 @@ def affecter_preparation(request, commande_id):
             
             # Utiliser une transaction pour s'assurer de la cohérence
             with transaction.atomic():
-                # Terminer l'état actuel (Confirmée)
-                etat_actuel.terminer_etat(operateur=operateur_admin)
-                
-                # Créer le nouvel état "En préparation"
-                from .models import EtatCommande
-                nouvel_etat = EtatCommande.objects.create(
-                    commande=commande,
-                    enum_etat=etat_preparation,
+                # Clôturer l'état actuel (Confirmée) et passer à "En préparation"
+                nouvel_etat = changer_etat_commande(
+                    commande,
+                    etat_preparation,
                     operateur=operateur_preparation,
                     commentaire=f"Affectée à la préparation par {operateur_admin.nom_complet}. {commentaire}".strip(),
-                    date_debut=timezone.now()
+                    operateur_cloture=operateur_admin
                 )
                 
                 # Créer une opération d'affectation selon le type d'opérateur
@@ -2764,7 +2665,7 @@ def affecter_livraison(request, commande_id):
         # Utiliser la fonction centralisée pour changer l'état
         gerer_changement_etat_automatique(
             commande, 
-            'En cours de livraison', 
+            EN_COURS_LIVRAISON, 
             operateur=operateur,
             commentaire=commentaire
         )
@@ -2800,29 +2701,28 @@ def affecter_livraison_multiple(request):
             type_operateur__in=['LIVRAISON', 'LOGISTIQUE']
         )
         
-        commandes_affectees_yz = []
-        commandes_erreurs_yz = []
+        etat_livraison, created = EnumEtatCmd.objects.get_or_create(
+            libelle=EN_COURS_LIVRAISON,
+            defaults={'ordre': 60, 'couleur': '#F59E0B'}
+        )
 
-        with transaction.atomic():
-            commandes_a_traiter = Commande.objects.filter(id__in=commandes_ids)
-            for commande in commandes_a_traiter:
-                try:
-                    # Vérifier si la commande a un état "Préparée" actif.
-                    est_prete = commande.etats.filter(enum_etat__libelle='Préparée', date_fin__isnull=True).exists()
-
-                    if not est_prete:
-                        commandes_erreurs_yz.append(f"{commande.id_yz} (non prête)")
-                        continue
-
-                    gerer_changement_etat_automatique(
-                        commande, 
-                        'En cours de livraison', 
-                        operateur=operateur,
-                        commentaire=commentaire
-                    )
-                    commandes_affectees_yz.append(commande.id) # We'll use the command ID
-                except Exception as e:
-                    commandes_erreurs_yz.append(f"{commande.id_yz} ({str(e)})")
+        # Seules les commandes actuellement préparées partent en livraison
+        resultat = changer_etat_commandes(
+            commandes_ids,
+            etat_livraison,
+            operateur=operateur,
+            commentaire=commentaire or f"Changement automatique vers '{EN_COURS_LIVRAISON}'",
+            operateur_cloture=operateur,
+            etats_source=(PREPAREE,)
+        )
+        commandes_affectees_yz = resultat.acceptees
+        ids_yz = dict(
+            Commande.objects.filter(pk__in=[pk for pk in resultat.rejets if isinstance(pk, int)]).values_list('pk', 'id_yz')
+        )
+        commandes_erreurs_yz = [
+            f"{ids_yz.get(commande_id, commande_id)} ({'non prête' if motif.startswith('état actuel') else motif})"
+            for commande_id, motif in resultat.rejets.items()
+        ]
 
         message = f"{len(commandes_affectees_yz)} commande(s) affectée(s) avec succès."
         if commandes_erreurs_yz:
@@ -2831,7 +2731,8 @@ def affecter_livraison_multiple(request):
         return JsonResponse({
             'success': len(commandes_erreurs_yz) == 0, 
             'message': message,
-            'commandes_affectees_ids': commandes_affectees_yz
+            'commandes_affectees_ids': commandes_affectees_yz,
+            'resultats': resultat.par_commande()
         })
 
     except Exception as e:
@@ -2866,9 +2767,6 @@ def affecter_preparation_multiple(request):
             actif=True
         )
         
-        commandes_affectees_yz = []
-        commandes_erreurs_yz = []
-
         # Vérifier si un état "En préparation" existe
         try:
             etat_preparation, created = EnumEtatCmd.objects.get_or_create(
@@ -2878,88 +2776,49 @@ def affecter_preparation_multiple(request):
         except Exception as e:
             return JsonResponse({'success': False, 'message': f'Erreur lors de la récupération de l\'état: {str(e)}'})
 
+        # Si la commande est Confirmée (même si l'état est déjà clos) OU déjà en file de prépa, on permet l'affectation
+        ids_yz = dict(Commande.objects.filter(id__in=commandes_ids).values_list('id', 'id_yz'))
+        confirmees = set(
+            EtatCommande.objects.filter(commande_id__in=list(ids_yz), enum_etat__libelle='Confirmée')
+            .values_list('commande_id', flat=True)
+        )
+        resultats = {commande_id: 'non confirmée' for commande_id in ids_yz if commande_id not in confirmees}
+        commandes_erreurs_yz = [f"{ids_yz[commande_id]} (non confirmée)" for commande_id in resultats]
+
+        if operateur_admin.type_operateur == 'SUPERVISEUR_PREPARATION':
+            type_operation = 'AFFECTATION_SUPERVISION'
+            conclusion = f"Commande affectée à {operateur_preparation.nom_complet} par le superviseur de préparation. {commentaire}".strip()
+        else:
+            type_operation = 'AFFECTATION_ADMIN'
+            conclusion = f"Commande affectée à {operateur_preparation.nom_complet} par l'administrateur. {commentaire}".strip()
+
         with transaction.atomic():
-            commandes_a_traiter = Commande.objects.filter(id__in=commandes_ids)
-            for commande in commandes_a_traiter:
-                try:
-                    # Si la commande est Confirmée (même si l'état est déjà clos) OU déjà en file de prépa, on permet l'affectation
-                    etat_actuel = commande.etat_actuel
-                    etat_confirm = commande.etats.filter(enum_etat__libelle='Confirmée').order_by('-date_debut').first()
-                    if not etat_confirm:
-                        commandes_erreurs_yz.append(f"{commande.id_yz} (non confirmée)")
-                        continue
-
-                    # Si l'état actuel est Confirmée, le clore; sinon, si déjà À imprimer/En préparation, on ne clôture pas
-                    if etat_actuel and etat_actuel.enum_etat.libelle == 'Confirmée':
-                        # Ne pas écraser l'opérateur de confirmation
-                        etat_actuel.terminer_etat()
-                    
-                    # Gestion réaffectation propre
-                    etat_a_imprimer_actif = commande.etats.filter(
-                        enum_etat__libelle='À imprimer', date_fin__isnull=True
-                    ).first()
-                    etat_en_prep_actif = commande.etats.filter(
-                        enum_etat__libelle='En préparation', date_fin__isnull=True
-                    ).first()
-
-                    # Si déjà en préparation
-                    if etat_en_prep_actif:
-                        # Même opérateur => idempotent, rien à faire
-                        if etat_en_prep_actif.operateur and etat_en_prep_actif.operateur_id == operateur_preparation.id:
-                            pass
-                        else:
-                            # Clore l'état en cours puis créer un nouvel état pour le nouvel opérateur
-                            try:
-                                etat_en_prep_actif.terminer_etat()
-                            except Exception:
-                                etat_en_prep_actif.date_fin = timezone.now()
-                                etat_en_prep_actif.save(update_fields=['date_fin'])
-                            from .models import EtatCommande
-                            EtatCommande.objects.create(
-                                commande=commande,
-                                enum_etat=etat_preparation,
-                                operateur=operateur_preparation,
-                                commentaire=f"Réaffectée à la préparation par {operateur_admin.nom_complet}. {commentaire}".strip(),
-                                date_debut=timezone.now()
-                            )
-                    else:
-                        # Pas encore en préparation: clore À imprimer si actif, puis créer En préparation
-                        if etat_a_imprimer_actif:
-                            try:
-                                etat_a_imprimer_actif.terminer_etat()
-                            except Exception:
-                                etat_a_imprimer_actif.date_fin = timezone.now()
-                                etat_a_imprimer_actif.save(update_fields=['date_fin'])
-                        from .models import EtatCommande
-                        EtatCommande.objects.create(
-                            commande=commande,
-                            enum_etat=etat_preparation,
-                            operateur=operateur_preparation,
-                            commentaire=f"Affectée à la préparation par {operateur_admin.nom_complet}. {commentaire}".strip(),
-                            date_debut=timezone.now()
-                        )
-                    
-                    # Créer une opération d'affectation selon le type d'opérateur
-                    if operateur_admin.type_operateur == 'SUPERVISEUR_PREPARATION':
-                        # Créer une opération d'affectation par supervision
-                        Operation.objects.create(
-                            commande=commande,
-                            type_operation='AFFECTATION_SUPERVISION',
-                            operateur=operateur_admin,
-                            conclusion=f"Commande affectée à {operateur_preparation.nom_complet} par le superviseur de préparation. {commentaire}".strip()
-                        )
-                    else:
-                        # Créer une opération d'affectation par admin
-                        Operation.objects.create(
-                            commande=commande,
-                            type_operation='AFFECTATION_ADMIN',
-                            operateur=operateur_admin,
-                            conclusion=f"Commande affectée à {operateur_preparation.nom_complet} par l'administrateur. {commentaire}".strip()
-                        )
-                    
-                    commandes_affectees_yz.append(commande.id_yz)
-                except Exception as e:
-                    commandes_erreurs_yz.append(f"{commande.id_yz} ({str(e)})")
+            # Clore les états ouverts (Confirmée, À imprimer ou En préparation) et créer En préparation
+            # sans écraser l'opérateur de confirmation. Déjà en préparation chez le même opérateur => inchangée
+            resultat = changer_etat_commandes(
+                sorted(confirmees),
+                etat_preparation,
+                operateur=operateur_preparation,
+                commentaire=lambda etat_actuel: (
+                    f"{'Réaffectée' if etat_actuel == 'En préparation' else 'Affectée'} à la préparation "
+                    f"par {operateur_admin.nom_complet}. {commentaire}"
+                ).strip()
+            )
+
+            # Une opération d'affectation (admin ou supervision) par commande affectée
+            Operation.objects.bulk_create([
+                Operation(
+                    commande_id=commande_id,
+                    type_operation=type_operation,
+                    operateur=operateur_admin,
+                    conclusion=conclusion
+                )
+                for commande_id in resultat.acceptees
+            ])
+
+        commandes_affectees_yz = [ids_yz[commande_id] for commande_id in resultat.acceptees]
+        commandes_erreurs_yz += [f"{ids_yz[commande_id]} ({motif})" for commande_id, motif in resultat.rejets.items()]
+        resultats.update(resultat.par_commande())
 
         message = f"{len(commandes_affectees_yz)} commande(s) affectée(s) avec succès à {operateur_preparation.nom_complet} pour préparation."
         if commandes_erreurs_yz:
@@ -2968,7 +2827,8 @@ def affecter_preparation_multiple(request):
         return JsonResponse({
             'success': len(commandes_erreurs_yz) == 0, 
             'message': message,
-            'commandes_affectees_ids': commandes_affectees_yz
+            'commandes_affectees_ids': commandes_affectees_yz,
+            'resultats': resultats
         })
 
     except Exception as e:
@@ -3375,3 +3235,49 @@ def commandes_livrees(request):
     }
     
     return render(request, 'commande/livrees.html', context)
+
+
+def _tache_export_accessible(request, tache_id):
+    """TacheExport si l'utilisateur a le droit de lancer ce type d'export, sinon None"""
+    tache = get_object_or_404(TacheExport, pk=tache_id)
+    return tache if peut_acceder(request.user, tache.type_export) else None
+
+
+@login_required
+def etat_export(request, tache_id):
+    """API de suivi d'un export en arrière-plan (interrogée jusqu'à ce qu'il soit terminé)"""
+    tache = _tache_export_accessible(request, tache_id)
+    if tache is None:
+        return JsonResponse({'success': False, 'error': 'Accès non autorisé à cet export'}, status=403)
+    return JsonResponse({'success': True, 'tache': etat_tache(tache)})
+
+
+@login_required
+def suivi_export(request, tache_id):
+    """Page d'attente d'un export lancé depuis un lien : télécharge le fichier dès qu'il est prêt"""
+    tache = _tache_export_accessible(request, tache_id)
+    if tache is None:
+        messages.error(request, "Accès non autorisé à cet export.")
+        return redirect('app_home')
+    return render(request, 'commande/export_suivi.html', {
+        'tache': tache,
+        'etat': etat_tache(tache),
+        'page_precedente': request.META.get('HTTP_REFERER', ''),
+    })
+
+
+@login_required
+def telecharger_export(request, tache_id):
+    """Téléchargement du fichier d'un export terminé et non expiré"""
+    tache = _tache_export_accessible(request, tache_id)
+    if tache is None:
+        return JsonResponse({'success': False, 'error': 'Accès non autorisé à cet export'}, status=403)
+    if tache.statut != 'terminee' or not tache.fichier:
+        return JsonResponse({'success': False, 'error': "L'export n'est pas encore prêt"}, status=409)
+    if tache.date_expiration and tache.date_expiration <= timezone.now():
+        return JsonResponse({'success': False, 'error': "Ce fichier d'export a expiré"}, status=410)
+    try:
+        fichier = tache.fichier.open('rb')
+    except FileNotFoundError:
+        return JsonResponse({'success': False, 'error': "Ce fichier d'export a expiré"}, status=410)
+    return FileResponse(fichier, as_attachment=True, filename=tache.nom_fichier)
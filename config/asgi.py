@@ -3,6 +3,10 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Le flux SSE de la vue 360 (parametre.dashboard_360.views.vue_360_flux) garde une
+connexion ouverte par tableau de bord : servir l'application via ce module (ex:
+uvicorn config.asgi:application) et définir VUE_360_SSE=True pour l'activer.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -78,6 +78,7 @@ class UserTypeValidationMiddleware:
             '/password_reset/', # Si vous avez des URLs de réinitialisation de mot de passe
             '/__reload__/', # Pour le middleware de rechargement automatique en développement
             '/api/csrf/', # Pour les routes CSRF
+            '/commande/exports/', # Suivi et téléchargement des exports en arrière-plan (droits vérifiés par la vue)
             # '/notifications/', # Notifications supprimées
         )
         self.universal_allowed_exact_paths = (
@@ -86,6 +87,8 @@ class UserTypeValidationMiddleware:
             '/commande/affecter-preparation-multiple',
             '/commande/affecter-livraison-multiple/',
             '/commande/affecter-livraison-multiple',
+            # Matrice de disponibilité des variantes, partagée par les interfaces d'édition de commande
+            '/article/api/disponibilite/',
         )
 
     def __call__(self, request):
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 import os
 from decouple import config
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -51,6 +52,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.humanize',
+    'django.contrib.postgres',
     
     # Applications tierces
     'rest_framework',
@@ -75,6 +77,7 @@ INSTALLED_APPS = [
     'Prepacommande',
     'Superpreparation',
     'kpis',
+    'recherche',
     
 ]
 
@@ -147,9 +150,66 @@ CACHES = {
         'OPTIONS': {
             'MAX_ENTRIES': 5000,
         }
-    }
+    },
+    # Réponses JSON des KPIs (kpis.cache) : Redis si configuré (partagé entre les workers), sinon mémoire locale
+    'kpis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': config('KPI_CACHE_REDIS_URL'),
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        },
+    } if config('KPI_CACHE_REDIS_URL', default='') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'yz-kpis',
+    },
+    # Matrices de disponibilité des variantes (article.disponibilite), lues à chaque affichage de stock.
+    # En mémoire locale, les suppressions après une écriture de stock ne touchent que le processus
+    # qui écrit : la durée de vie courte borne le retard des autres workers.
+    'disponibilite': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': config('CACHE_REDIS_URL'),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        },
+    } if config('CACHE_REDIS_URL', default='') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'yz-disponibilite',
+        'TIMEOUT': 30,
+    },
+    # Jeton de génération des tables de tarifs (article.tarifs), lu à chaque tarification de panier
+    'tarifs': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': config('CACHE_REDIS_URL'),
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        },
+    } if config('CACHE_REDIS_URL', default='') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'yz-tarifs',
+    },
 }
 
+# Âge maximal (secondes) d'une table de tarifs dans un processus, en plus de l'invalidation par génération
+TARIFS_DUREE_MAX_TABLE = config('TARIFS_DUREE_MAX_TABLE', default=60, cast=int)
+
+# Durée de vie (secondes) d'une réponse KPI en cache, en plus de l'invalidation par génération
+KPI_CACHE_TIMEOUT = config('KPI_CACHE_TIMEOUT', default=300, cast=int)
+
+# Vue 360 temps réel : flux SSE (à n'activer que sous ASGI, cf. config/asgi.py) et délai (secondes)
+# au-delà duquel une modification est considérée comme visible par toutes les transactions
+VUE_360_SSE = config('VUE_360_SSE', default=False, cast=bool)
+VUE_360_DELAI_STABILISATION = config('VUE_360_DELAI_STABILISATION', default=30, cast=int)
+
+# Planificateur des promotions (APScheduler) dans le processus web. Avec plusieurs workers, le laisser
+# désactivé et lancer un processus dédié : manage.py planificateur_promotions
+PROMOTIONS_PLANIFICATEUR = config('PROMOTIONS_PLANIFICATEUR', default=False, cast=bool)
+# Délai (secondes) avant que le planificateur prenne en compte une promotion modifiée par un autre processus
+PROMOTIONS_INTERVALLE_VERIFICATION = config('PROMOTIONS_INTERVALLE_VERIFICATION', default=30, cast=int)
+
+# Seuils d'alerte de stock par défaut (stock ≤ seuil), remplacés par article ou catégorie via SeuilStock
+STOCK_SEUILS_ALERTE = {'rupture': 0, 'faible': 10, 'a_commander': 20}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -184,6 +244,41 @@ USE_I18N = True
 
 USE_TZ = True
 
+# Configuration Celery (tâches en arrière-plan)
+# Sans broker configuré, les synchronisations Google Sheets s'exécutent dans un pool de threads du processus web
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='')
+CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default=None)
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TIMEZONE = TIME_ZONE
+# Reconstruction nocturne des tables de faits KPIs (équivalent cron: manage.py reconstruire_faits_kpis)
+CELERY_BEAT_SCHEDULE = {
+    'reconstruire-faits-kpis': {
+        'task': 'kpis.reconstruire_faits',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'cloturer-stock': {
+        'task': 'article.cloturer_stock',
+        'schedule': crontab(hour=0, minute=15),
+    },
+    'nettoyer-exports': {
+        'task': 'commande.nettoyer_exports',
+        'schedule': crontab(minute=30),
+    },
+    'expirer-synchronisations': {
+        'task': 'synchronisation.expirer_synchronisations',
+        'schedule': crontab(minute='*/10'),
+    },
+}
+
+# Nombre de configurations Google Sheets synchronisées en parallèle par le pool de threads
+SYNC_MAX_WORKERS = config('SYNC_MAX_WORKERS', default=4, cast=int)
+# Au-delà, une synchronisation toujours 'En cours' est considérée comme interrompue (worker arrêté)
+SYNC_DUREE_MAX_MINUTES = config('SYNC_DUREE_MAX_MINUTES', default=60, cast=int)
+
+# Exports écrits en parallèle par le pool de threads (sans broker Celery, voir commande.jobs)
+EXPORT_MAX_WORKERS = config('EXPORT_MAX_WORKERS', default=2, cast=int)
+
 # Logging configuration
 LOGGING = {
     'version': 1,
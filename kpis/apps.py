@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class KpisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'kpis'
+
+    def ready(self):
+        # Maintenance incrémentale des tables de faits
+        from . import signals  # noqa: F401
+        # Exports en arrière-plan (commande.jobs)
+        from . import exports  # noqa: F401
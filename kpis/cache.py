@@ -0,0 +1,200 @@
+"""
+Cache des KPIs : réponses JSON des vues (cache_kpi) et résultats des calculs
+de kpis.services (kpi_en_cache).
+
+Les valeurs sont stockées dans le cache 'kpis' (mémoire locale, ou Redis si
+KPI_CACHE_REDIS_URL est configuré), sous une clé composée de la vue (ou de la
+fonction), des paramètres GET normalisés (ou des arguments), du jour courant
+et d'un numéro de génération.
+
+Invalidation : toute modification qui change les chiffres (EtatCommande, Operation,
+Panier, total d'une commande, transitions et synchronisations par lots)
+incrémente la génération après le commit. Les anciennes entrées ne sont plus
+jamais lues et expirent d'elles-mêmes.
+
+Single-flight : quand plusieurs demandes identiques arrivent sur une entrée
+absente, une seule calcule la valeur (verrou par clé dans le processus et
+cache.add() entre processus), les autres attendent puis lisent son résultat.
+"""
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils import timezone
+
+ALIAS_CACHE_KPIS = 'kpis'
+
+CLE_GENERATION = 'kpis:generation'
+
+# Durée de vie d'une réponse en cache (filet de sécurité si une invalidation est manquée)
+DUREE_REPONSE = getattr(settings, 'KPI_CACHE_TIMEOUT', 300)
+
+# Durée maximale du calcul d'une réponse par une autre requête avant de calculer soi-même
+ATTENTE_MAX_CALCUL = 30
+INTERVALLE_ATTENTE = 0.05
+
+# Verrous de calcul par clé : [verrou, nombre de requêtes qui le détiennent ou l'attendent]
+_verrous = {}
+_verrous_guard = threading.Lock()
+
+
+def _cache():
+    return caches[ALIAS_CACHE_KPIS]
+
+
+def generation_courante():
+    """Numéro de génération courant (initialisé à 1)"""
+    cache = _cache()
+    generation = cache.get(CLE_GENERATION)
+    if generation is None:
+        cache.add(CLE_GENERATION, 1, None)
+        generation = cache.get(CLE_GENERATION, 1)
+    return generation
+
+
+def _incrementer_generation():
+    cache = _cache()
+    try:
+        cache.incr(CLE_GENERATION)
+    except ValueError:
+        # Clé absente (cache vidé ou redémarré) : toute génération postérieure convient
+        cache.add(CLE_GENERATION, 2, None)
+
+
+def invalider_cache_kpis():
+    """Rend obsolètes toutes les réponses en cache, une fois la transaction courante validée"""
+    transaction.on_commit(_incrementer_generation)
+
+
+def cle_reponse(nom_vue, request, generation):
+    """Clé de cache d'une réponse : vue + paramètres GET triés + jour + génération"""
+    parametres = sorted((cle, tuple(request.GET.getlist(cle))) for cle in request.GET)
+    empreinte = hashlib.md5(repr(parametres).encode('utf-8')).hexdigest()
+    return f'kpis:reponse:{generation}:{timezone.localdate().isoformat()}:{nom_vue}:{empreinte}'
+
+
+@contextmanager
+def _verrou_local(cle):
+    """
+    Verrou de calcul d'une clé dans le processus. L'entrée n'est retirée que
+    lorsque plus aucune requête ne le détient ni ne l'attend : une nouvelle
+    requête ne peut pas obtenir un autre verrou pendant un calcul en cours.
+    """
+    with _verrous_guard:
+        entree = _verrous.setdefault(cle, [threading.Lock(), 0])
+        entree[1] += 1
+    try:
+        with entree[0]:
+            yield
+    finally:
+        with _verrous_guard:
+            entree[1] -= 1
+            if not entree[1]:
+                del _verrous[cle]
+
+
+def _reponse_depuis_cache(valeur):
+    contenu, content_type = valeur
+    return HttpResponse(contenu, content_type=content_type)
+
+
+def _cacheable(response):
+    return (
+        response.status_code == 200
+        and not getattr(response, 'streaming', False)
+        and response.get('Content-Type', '').startswith('application/json')
+    )
+
+
+def _lire_ou_calculer(cle, calculer, vers_cache=lambda resultat: resultat, depuis_cache=lambda valeur: valeur):
+    """
+    Valeur en cache pour la clé, sinon calculée une seule fois par clé.
+
+    Args:
+        calculer: fonction sans argument qui produit le résultat
+        vers_cache: valeur stockée pour un résultat (None : résultat non mis en cache)
+        depuis_cache: résultat reconstruit depuis la valeur stockée
+    """
+    cache = _cache()
+    valeur = cache.get(cle)
+    if valeur is not None:
+        return depuis_cache(valeur)
+
+    # Un seul calcul par clé et par processus
+    with _verrou_local(cle):
+        valeur = cache.get(cle)
+        if valeur is not None:
+            return depuis_cache(valeur)
+
+        # Entre processus : le premier qui pose le verrou calcule, les autres attendent son résultat
+        cle_verrou = f'{cle}:calcul'
+        verrou_pose = cache.add(cle_verrou, True, ATTENTE_MAX_CALCUL)
+        if not verrou_pose:
+            limite = time.monotonic() + ATTENTE_MAX_CALCUL
+            while time.monotonic() < limite and cache.get(cle_verrou) is not None:
+                time.sleep(INTERVALLE_ATTENTE)
+                valeur = cache.get(cle)
+                if valeur is not None:
+                    return depuis_cache(valeur)
+            valeur = cache.get(cle)
+            if valeur is not None:
+                return depuis_cache(valeur)
+
+        try:
+            resultat = calculer()
+            valeur = vers_cache(resultat)
+            if valeur is not None:
+                cache.set(cle, valeur, DUREE_REPONSE)
+            return resultat
+        finally:
+            if verrou_pose:
+                cache.delete(cle_verrou)
+
+
+def cache_kpi(vue):
+    """
+    Décorateur des vues JSON des KPIs : réponse servie depuis le cache versionné,
+    calculée une seule fois par clé en cas de requêtes simultanées.
+
+    Seules les réponses JSON en succès (200) sont mises en cache.
+    """
+    nom_vue = f'{vue.__module__}.{vue.__name__}'
+
+    @wraps(vue)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return vue(request, *args, **kwargs)
+
+        return _lire_ou_calculer(
+            cle_reponse(nom_vue, request, generation_courante()),
+            lambda: vue(request, *args, **kwargs),
+            vers_cache=lambda response: (
+                (response.content, response['Content-Type']) if _cacheable(response) else None
+            ),
+            depuis_cache=_reponse_depuis_cache,
+        )
+
+    return wrapper
+
+
+def kpi_en_cache(fonction):
+    """
+    Décorateur des calculs de kpis.services : résultat gardé dans le cache
+    versionné, clé = fonction + arguments (dont la repr doit être stable).
+    Le calcul sans cache reste accessible par fonction.__wrapped__.
+    """
+    nom = f'{fonction.__module__}.{fonction.__qualname__}'
+
+    @wraps(fonction)
+    def wrapper(*args, **kwargs):
+        empreinte = hashlib.md5(repr((args, sorted(kwargs.items()))).encode('utf-8')).hexdigest()
+        cle = f'kpis:resultat:{generation_courante()}:{timezone.localdate().isoformat()}:{nom}:{empreinte}'
+        return _lire_ou_calculer(cle, lambda: fonction(*args, **kwargs))
+
+    return wrapper
@@ -0,0 +1,101 @@
+"""
+Exports des KPIs, construits sur les résultats de kpis.services :
+
+- performances des opérateurs de confirmation, classeur construit en
+  arrière-plan (commande.jobs) avec une feuille des métriques globales ;
+- état des commandes (CSV et Excel), une ligne par état et une ligne de total.
+"""
+from django.utils import timezone
+
+from commande.exports import Colonne, Feuille, feuille_resume
+from commande.jobs import ContenuExport, export_differe
+
+from .services import LigneEtat, performance_operateurs
+
+
+def _champ(nom):
+    return lambda operateur: getattr(operateur, nom)
+
+
+COLONNES_PERFORMANCE = [
+    Colonne('Opérateur', _champ('nom'), 25),
+    Colonne('Nom d\'utilisateur', _champ('username'), 20),
+    Colonne('Commandes Affectées', _champ('commands_affected'), 20),
+    Colonne('Commandes En Cours', _champ('commands_in_progress'), 20),
+    Colonne('Commandes Confirmées', _champ('commands_confirmed'), 22),
+    Colonne('Taux de Confirmation (%)', _champ('confirmation_rate'), 25),
+    Colonne('Panier Moyen (MAD)', _champ('average_basket'), 20, 'yz_montant'),
+    Colonne('Panier Min (MAD)', _champ('min_basket'), 18, 'yz_montant'),
+    Colonne('Panier Max (MAD)', _champ('max_basket'), 18, 'yz_montant'),
+    Colonne('Upsells (Nombre)', _champ('upsell_count'), 18),
+    Colonne('Montant Upsells (MAD)', _champ('upsell_amount'), 22, 'yz_montant'),
+    Colonne('Actions 30j', _champ('total_actions'), 15),
+    Colonne('Opérations/Commande 30j', _champ('operations_per_command_30d'), 25),
+]
+
+
+@export_differe('performance_operateurs', autorise=lambda user: user.is_authenticated)
+def export_performance_operateurs(operator_id=None):
+    operateurs, globales = performance_operateurs(operator_id)
+    date_str = timezone.localtime().strftime("%Y%m%d_%H%M%S")
+
+    if operator_id and len(operateurs) == 1:
+        # Export spécifique à un opérateur
+        username = operateurs[0].username
+        titre, filename = f"Performance {username}", f"performance_operateur_{username}_{date_str}.xlsx"
+    else:
+        titre, filename = "Performance Opérateurs", f"performance_operateurs_{date_str}.xlsx"
+
+    resume = feuille_resume([
+        ("Commandes Assignées", globales.commands_assigned),
+        ("Confirmations", globales.confirmations),
+        ("Taux de Confirmation Global (%)", globales.global_confirmation_rate),
+        ("Opérateurs Actifs", globales.active_operators),
+    ], "Métriques Globales")
+    return ContenuExport(filename, [Feuille(titre, operateurs, COLONNES_PERFORMANCE), resume], len(operateurs))
+
+
+def lignes_etats(etats):
+    """Une ligne par état suivi (commandes sans état comptées comme reçues), puis le total"""
+    compteurs = etats.compteurs
+    valeur_totale = 0
+    for ligne in etats.lignes:
+        valeur_totale += ligne.valeur_totale
+        yield ligne._replace(nombre=compteurs[ligne.cle])
+    total = etats.total
+    yield LigneEtat('TOTAL', '', total, valeur_totale, valeur_totale / total if total else 0, '', None)
+
+
+def colonnes_etats(total):
+    return [
+        Colonne('État', _champ('libelle'), 25, 'yz_libelle'),
+        Colonne('Nombre de commandes', _champ('nombre'), 20),
+        Colonne(
+            'Pourcentage',
+            lambda ligne: f"{(ligne.nombre / total * 100) if total else 0:.1f}%",
+            15,
+        ),
+        Colonne('Valeur totale (MAD)', _champ('valeur_totale'), 20, 'yz_montant'),
+        Colonne('Panier moyen (MAD)', _champ('panier_moyen'), 20, 'yz_montant'),
+        Colonne('Opérateur principal', _champ('operateur_principal'), 25),
+        Colonne('Dernière activité', _champ('derniere_activite'), 20, 'yz_date'),
+    ]
+
+
+def feuille_etats(etats):
+    return Feuille("État des Commandes", lignes_etats(etats), colonnes_etats(etats.total))
+
+
+def feuille_metriques_etats(etats):
+    stats = etats.stats_supplementaires
+    total = etats.total
+    periode = etats.periode
+    return feuille_resume([
+        ("Commandes en cours", stats['commandes_en_cours']),
+        ("Commandes complétées", stats['commandes_completees']),
+        ("Commandes problématiques", stats['commandes_problematiques']),
+        ("Taux de complétion", f"{(stats['commandes_completees'] / total * 100) if total else 0:.1f}%"),
+        ("Période d'analyse", f"Du {periode.date_debut:%d/%m/%Y} au {periode.date_fin:%d/%m/%Y}"),
+        ("Durée (jours)", periode.jours),
+        ("Généré le", timezone.localtime().strftime('%d/%m/%Y à %H:%M')),
+    ], "Métriques Globales")
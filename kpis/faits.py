@@ -0,0 +1,283 @@
+"""
+Tables de faits journalières des KPIs.
+
+Les tableaux de bord ne parcourent plus l'historique complet des commandes :
+ils lisent des agrégats par jour de commande (FaitCommandeJour, FaitArticleJour,
+FaitClientJour), dont le volume lu dépend uniquement de la période affichée.
+
+Maintenance incrémentale : chaque transition d'état ou modification d'un champ
+repris dans les faits marque le jour de la commande comme obsolète
+(JourKPIObsolete), après le commit de l'écriture. Avant de lire les faits, les
+vues recalculent uniquement ces jours, en une requête agrégée par table. La
+commande `reconstruire_faits_kpis` reconstruit l'ensemble chaque nuit et
+rattrape les écritures qui n'auraient pas été signalées.
+"""
+from datetime import date, datetime, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+
+from article.models import Article
+from commande.models import Commande, Panier
+
+from .models import FaitArticleJour, FaitClientJour, FaitCommandeJour, JourKPIObsolete
+
+TAILLE_LOT_INSERTION = 1000
+
+# Taille des tranches de la reconstruction complète
+JOURS_PAR_TRANCHE = 31
+
+# Espace de noms des verrous consultatifs par jour (pg_advisory_xact_lock(int, int))
+VERROU_FAITS_NAMESPACE = 7302
+
+
+def en_date(valeur):
+    """Ramène une date, un datetime (aware ou non) ou None à une date"""
+    if valeur is None or type(valeur) is date:
+        return valeur
+    if isinstance(valeur, datetime):
+        if timezone.is_aware(valeur):
+            valeur = timezone.localtime(valeur)
+        return valeur.date()
+    return valeur
+
+
+def marquer_jours_obsoletes(dates):
+    """
+    Marque des jours de commande comme à recalculer, au commit de la transaction
+    courante (immédiatement hors transaction).
+
+    Le marquage (un upsert) s'exécute hors de la transaction de l'écriture : la
+    ligne du jour n'est verrouillée que le temps de la requête, et non jusqu'au
+    commit de chaque écriture du jour. Un marquage perdu (arrêt du processus
+    juste après le commit) est rattrapé par la reconstruction nocturne.
+    """
+    jours = {en_date(valeur) for valeur in dates if valeur}
+    if jours:
+        transaction.on_commit(lambda: _enregistrer_marqueurs(jours))
+
+
+def _enregistrer_marqueurs(jours):
+    JourKPIObsolete.objects.bulk_create(
+        [JourKPIObsolete(date=jour) for jour in jours],
+        update_conflicts=True,
+        unique_fields=['date'],
+        update_fields=['date_marquage'],
+    )
+
+
+def _calculer_faits(filtre):
+    """
+    Construit les faits des jours sélectionnés à partir des commandes.
+
+    Args:
+        filtre: critère sur date_cmd, ex: {'date_cmd__in': [...]} ou {'date_cmd__range': (debut, fin)}
+
+    Returns:
+        tuple: (faits commandes, faits articles, faits clients) non enregistrés
+    """
+    commandes = Commande.objects.filter(**filtre).order_by()
+
+    faits_commandes = [
+        FaitCommandeJour(
+            date=ligne['date_cmd'],
+            region_id=ligne['ville__region_id'],
+            ville_id=ligne['ville_id'],
+            operateur_id=ligne['operateur_etat_courant_id'],
+            etat_id=ligne['etat_courant_id'],
+            nb_commandes=ligne['nb'],
+            ca_total=ligne['ca'] or 0,
+            ca_max=ligne['ca_max'] or 0,
+        )
+        for ligne in commandes.values(
+            'date_cmd', 'ville__region_id', 'ville_id', 'operateur_etat_courant_id', 'etat_courant_id'
+        ).annotate(nb=Count('id'), ca=Sum('total_cmd'), ca_max=Max('total_cmd'))
+    ]
+
+    faits_clients = [
+        FaitClientJour(
+            date=ligne['date_cmd'],
+            client_id=ligne['client_id'],
+            etat_id=ligne['etat_courant_id'],
+            nb_commandes=ligne['nb'],
+            ca_total=ligne['ca'] or 0,
+        )
+        for ligne in commandes.values('date_cmd', 'client_id', 'etat_courant_id').annotate(
+            nb=Count('id'), ca=Sum('total_cmd')
+        )
+    ]
+
+    filtre_paniers = {f'commande__{critere}': valeur for critere, valeur in filtre.items()}
+    faits_articles = [
+        FaitArticleJour(
+            date=ligne['commande__date_cmd'],
+            article_id=ligne['article_id'],
+            etat_id=ligne['commande__etat_courant_id'],
+            quantite=ligne['quantite'] or 0,
+            ca_total=ligne['ca'] or 0,
+            nb_lignes=ligne['nb'],
+        )
+        for ligne in Panier.objects.filter(**filtre_paniers).order_by().values(
+            'commande__date_cmd', 'article_id', 'commande__etat_courant_id'
+        ).annotate(quantite=Sum('quantite'), ca=Sum('sous_total'), nb=Count('id'))
+    ]
+
+    return faits_commandes, faits_articles, faits_clients
+
+
+def _verrouiller_jours(jours):
+    """
+    Verrou consultatif de transaction par jour (PostgreSQL), pris dans l'ordre
+    des dates : deux recalculs d'un même jour (rafraîchissement, reconstruction)
+    s'exécutent l'un après l'autre, le second relisant les commandes après le
+    commit du premier.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for jour in sorted(jours):
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [VERROU_FAITS_NAMESPACE, jour.toordinal()])
+
+
+def _remplacer_faits(critere, valeur):
+    """Supprime puis recalcule les faits des jours sélectionnés (à appeler dans une transaction)"""
+    if critere == 'range':
+        debut, fin = valeur
+        _verrouiller_jours(debut + timedelta(days=decalage) for decalage in range((fin - debut).days + 1))
+    else:
+        _verrouiller_jours(valeur)
+
+    filtre_faits = {f'date__{critere}': valeur}
+    faits_commandes, faits_articles, faits_clients = _calculer_faits({f'date_cmd__{critere}': valeur})
+
+    for modele, faits in (
+        (FaitCommandeJour, faits_commandes),
+        (FaitArticleJour, faits_articles),
+        (FaitClientJour, faits_clients),
+    ):
+        modele.objects.filter(**filtre_faits).delete()
+        modele.objects.bulk_create(faits, batch_size=TAILLE_LOT_INSERTION)
+
+    return len(faits_commandes)
+
+
+def rafraichir_jours_obsoletes():
+    """
+    Recalcule les faits des jours marqués obsolètes.
+
+    Les marqueurs sont lus puis supprimés dans une transaction courte
+    (SKIP LOCKED : deux requêtes simultanées ne prennent jamais le même jour),
+    et le calcul a lieu ensuite, sans verrou sur les marqueurs. Une écriture
+    validée pendant le calcul pose un nouveau marqueur, traité au passage
+    suivant ; le calcul d'un jour déjà en cours ailleurs attend sa fin
+    (_verrouiller_jours). En cas d'échec du calcul, les marqueurs pris sont rétablis.
+
+    Returns:
+        int: nombre de jours recalculés
+    """
+    with transaction.atomic():
+        jours = list(
+            JourKPIObsolete.objects.select_for_update(skip_locked=True).values_list('date', flat=True)
+        )
+        if not jours:
+            return 0
+        JourKPIObsolete.objects.filter(date__in=jours).delete()
+
+    try:
+        with transaction.atomic():
+            _remplacer_faits('in', jours)
+    except Exception:
+        JourKPIObsolete.objects.bulk_create([JourKPIObsolete(date=jour) for jour in jours], ignore_conflicts=True)
+        raise
+    return len(jours)
+
+
+def reconstruire_faits(debut=None, fin=None):
+    """
+    Reconstruit les faits sur une période (par défaut : tout l'historique), par tranches d'un mois.
+
+    Returns:
+        int: nombre de jours parcourus
+    """
+    historique_complet = debut is None and fin is None
+    if debut is None or fin is None:
+        bornes = Commande.objects.order_by().aggregate(premiere=Min('date_cmd'), derniere=Max('date_cmd'))
+        debut = debut or bornes['premiere']
+        fin = fin or bornes['derniere']
+
+    if historique_complet:
+        # Faits de jours qui n'ont plus aucune commande (suppressions, dates corrigées)
+        for modele in (FaitCommandeJour, FaitArticleJour, FaitClientJour):
+            faits_orphelins = modele.objects.all()
+            if debut is not None:
+                faits_orphelins = faits_orphelins.exclude(date__range=(debut, fin))
+            faits_orphelins.delete()
+
+    if debut is None or fin is None:
+        return 0
+
+    debut, fin = en_date(debut), en_date(fin)
+    tranche_debut = debut
+    while tranche_debut <= fin:
+        tranche_fin = min(tranche_debut + timedelta(days=JOURS_PAR_TRANCHE - 1), fin)
+        debut_calcul = timezone.now()
+        with transaction.atomic():
+            _remplacer_faits('range', (tranche_debut, tranche_fin))
+        # Seuls les marqueurs antérieurs au calcul sont couverts par la tranche recalculée
+        JourKPIObsolete.objects.filter(
+            date__range=(tranche_debut, tranche_fin), date_marquage__lte=debut_calcul,
+        ).delete()
+        tranche_debut = tranche_fin + timedelta(days=1)
+
+    return (fin - debut).days + 1
+
+
+def _periode(queryset, debut, fin):
+    """Filtre un queryset de faits sur [debut, fin] (dates ou datetimes)"""
+    if debut is not None:
+        queryset = queryset.filter(date__gte=en_date(debut))
+    if fin is not None:
+        queryset = queryset.filter(date__lte=en_date(fin))
+    return queryset
+
+
+def faits_commandes(debut=None, fin=None):
+    """Faits commandes de la période"""
+    return _periode(FaitCommandeJour.objects.all(), debut, fin)
+
+
+def faits_articles(debut=None, fin=None):
+    """Faits articles de la période"""
+    return _periode(FaitArticleJour.objects.all(), debut, fin)
+
+
+def faits_clients(debut=None, fin=None):
+    """Faits clients de la période"""
+    return _periode(FaitClientJour.objects.all(), debut, fin)
+
+
+def top_articles(faits, limite):
+    """
+    Articles classés par CA décroissant à partir d'un queryset de faits articles.
+
+    Returns:
+        list: instances Article annotées ca_total, quantite_vendue et nb_ventes
+    """
+    lignes = list(
+        faits.values('article_id')
+        .annotate(ca=Sum('ca_total'), quantite=Sum('quantite'), nb=Sum('nb_lignes'))
+        .order_by('-ca')[:limite]
+    )
+    articles = Article.objects.in_bulk([ligne['article_id'] for ligne in lignes])
+
+    classement = []
+    for ligne in lignes:
+        article = articles.get(ligne['article_id'])
+        if article is None:
+            continue
+        article.ca_total = ligne['ca'] or 0
+        article.quantite_vendue = ligne['quantite'] or 0
+        article.nb_ventes = ligne['nb'] or 0
+        classement.append(article)
+    return classement
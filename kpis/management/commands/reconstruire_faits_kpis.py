@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from kpis.faits import rafraichir_jours_obsoletes, reconstruire_faits
+
+
+class Command(BaseCommand):
+    help = 'Reconstruit les tables de faits journalières des KPIs à partir des commandes (à planifier chaque nuit)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--jours',
+            type=int,
+            help='Ne reconstruire que les N derniers jours (par défaut: tout l\'historique)'
+        )
+        parser.add_argument(
+            '--depuis',
+            help='Reconstruire à partir de cette date (AAAA-MM-JJ)'
+        )
+        parser.add_argument(
+            '--obsoletes',
+            action='store_true',
+            help='Recalculer uniquement les jours marqués obsolètes'
+        )
+
+    def handle(self, *args, **options):
+        if options['obsoletes']:
+            nb_jours = rafraichir_jours_obsoletes()
+            self.stdout.write(self.style.SUCCESS(f'✨ {nb_jours} jour(s) obsolète(s) recalculé(s)'))
+            return
+
+        debut = fin = None
+        if options['depuis']:
+            try:
+                debut = datetime.strptime(options['depuis'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Format de date invalide pour --depuis (attendu: AAAA-MM-JJ)')
+            fin = timezone.localdate()
+        elif options['jours']:
+            fin = timezone.localdate()
+            debut = fin - timedelta(days=options['jours'] - 1)
+
+        periode = f'du {debut} au {fin}' if debut else 'sur tout l\'historique'
+        self.stdout.write(f'🔄 Reconstruction des faits KPIs {periode}...')
+        nb_jours = reconstruire_faits(debut, fin)
+        self.stdout.write(self.style.SUCCESS(f'✨ Terminé! {nb_jours} jour(s) reconstruit(s)'))
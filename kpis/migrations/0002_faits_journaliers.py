@@ -0,0 +1,95 @@
+# Generated by Django 5.1.7 on 2025-08-25 10:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def marquer_jours_existants(apps, schema_editor):
+    """Les faits des commandes existantes seront calculés au premier chargement des tableaux de bord"""
+    Commande = apps.get_model('commande', 'Commande')
+    JourKPIObsolete = apps.get_model('kpis', 'JourKPIObsolete')
+    jours = Commande.objects.order_by().values_list('date_cmd', flat=True).distinct()
+    JourKPIObsolete.objects.bulk_create(
+        [JourKPIObsolete(date=jour) for jour in jours if jour],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('article', '0004_alter_categorie_nom_alter_genre_nom'),
+        ('client', '0001_initial'),
+        ('commande', '0007_etat_courant_denormalise'),
+        ('kpis', '0001_initial'),
+        ('parametre', '0002_region_actif'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JourKPIObsolete',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('date_marquage', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Jour KPI à recalculer',
+                'verbose_name_plural': 'Jours KPI à recalculer',
+            },
+        ),
+        migrations.CreateModel(
+            name='FaitArticleJour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantite', models.PositiveIntegerField(default=0)),
+                ('ca_total', models.FloatField(default=0)),
+                ('nb_lignes', models.PositiveIntegerField(default=0)),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='article.article')),
+                ('etat', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='commande.enumetatcmd')),
+            ],
+            options={
+                'verbose_name': 'Fait articles (jour)',
+                'verbose_name_plural': 'Faits articles (jour)',
+                'indexes': [models.Index(fields=['date', 'etat'], name='fait_art_date_etat_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FaitClientJour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('nb_commandes', models.PositiveIntegerField(default=0)),
+                ('ca_total', models.FloatField(default=0)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='client.client')),
+                ('etat', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='commande.enumetatcmd')),
+            ],
+            options={
+                'verbose_name': 'Fait clients (jour)',
+                'verbose_name_plural': 'Faits clients (jour)',
+                'indexes': [models.Index(fields=['date', 'etat'], name='fait_cli_date_etat_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FaitCommandeJour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('nb_commandes', models.PositiveIntegerField(default=0)),
+                ('ca_total', models.FloatField(default=0)),
+                ('ca_max', models.FloatField(default=0)),
+                ('etat', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='commande.enumetatcmd')),
+                ('operateur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parametre.operateur')),
+                ('region', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parametre.region')),
+                ('ville', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='parametre.ville')),
+            ],
+            options={
+                'verbose_name': 'Fait commandes (jour)',
+                'verbose_name_plural': 'Faits commandes (jour)',
+                'indexes': [models.Index(fields=['date', 'etat'], name='fait_cmd_date_etat_idx')],
+            },
+        ),
+        migrations.RunPython(marquer_jours_existants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:46
+
+from django.db import migrations, models
+
+
+def vider_faits(apps, schema_editor):
+    """Des recalculs concurrents ont pu doubler des faits : les jours concernés sont marqués pour recalcul"""
+    JourKPIObsolete = apps.get_model('kpis', 'JourKPIObsolete')
+    jours = set()
+    for nom_modele in ('FaitCommandeJour', 'FaitArticleJour', 'FaitClientJour'):
+        modele = apps.get_model('kpis', nom_modele)
+        jours.update(modele.objects.values_list('date', flat=True).distinct())
+        modele.objects.all().delete()
+    JourKPIObsolete.objects.bulk_create(
+        [JourKPIObsolete(date=jour) for jour in jours], batch_size=1000, ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('article', '0008_alertes_stock'),
+        ('client', '0003_statistiques_commandes'),
+        ('commande', '0009_taches_export'),
+        ('kpis', '0002_faits_journaliers'),
+        ('parametre', '0003_flux_modifications_compteurs'),
+    ]
+
+    operations = [
+        migrations.RunPython(vider_faits, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='faitarticlejour',
+            constraint=models.UniqueConstraint(fields=('date', 'article', 'etat'), name='fait_art_cle_unique', nulls_distinct=False),
+        ),
+        migrations.AddConstraint(
+            model_name='faitclientjour',
+            constraint=models.UniqueConstraint(fields=('date', 'client', 'etat'), name='fait_cli_cle_unique', nulls_distinct=False),
+        ),
+        migrations.AddConstraint(
+            model_name='faitcommandejour',
+            constraint=models.UniqueConstraint(fields=('date', 'region', 'ville', 'operateur', 'etat'), name='fait_cmd_cle_unique', nulls_distinct=False),
+        ),
+    ]
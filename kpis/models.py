@@ -31,3 +31,92 @@ class KPIConfiguration(models.Model):
     
     def __str__(self):
         return f"{self.nom_parametre} = {self.valeur} {self.unite}"
+
+
+class FaitCommandeJour(models.Model):
+    """
+    Agrégat journalier des commandes par (date de commande, région, ville, opérateur, état courant).
+    Alimenté par kpis.faits, jamais modifié à la main.
+    """
+    date = models.DateField()
+    region = models.ForeignKey('parametre.Region', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    ville = models.ForeignKey('parametre.Ville', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    operateur = models.ForeignKey('parametre.Operateur', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    etat = models.ForeignKey('commande.EnumEtatCmd', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    nb_commandes = models.PositiveIntegerField(default=0)
+    ca_total = models.FloatField(default=0)
+    ca_max = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = "Fait commandes (jour)"
+        verbose_name_plural = "Faits commandes (jour)"
+        indexes = [
+            models.Index(fields=['date', 'etat'], name='fait_cmd_date_etat_idx'),
+        ]
+        # Un seul fait par clé : deux recalculs concurrents d'un jour échouent au lieu de doubler les chiffres
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'region', 'ville', 'operateur', 'etat'], name='fait_cmd_cle_unique', nulls_distinct=False,
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.nb_commandes} commande(s)"
+
+
+class FaitArticleJour(models.Model):
+    """Agrégat journalier des paniers par (date de commande, article, état courant de la commande)"""
+    date = models.DateField()
+    article = models.ForeignKey('article.Article', on_delete=models.CASCADE, related_name='+')
+    etat = models.ForeignKey('commande.EnumEtatCmd', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    quantite = models.PositiveIntegerField(default=0)
+    ca_total = models.FloatField(default=0)
+    nb_lignes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Fait articles (jour)"
+        verbose_name_plural = "Faits articles (jour)"
+        indexes = [
+            models.Index(fields=['date', 'etat'], name='fait_art_date_etat_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'article', 'etat'], name='fait_art_cle_unique', nulls_distinct=False),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - article {self.article_id} (x{self.quantite})"
+
+
+class FaitClientJour(models.Model):
+    """Agrégat journalier des commandes par (date de commande, client, état courant)"""
+    date = models.DateField()
+    client = models.ForeignKey('client.Client', on_delete=models.CASCADE, related_name='+')
+    etat = models.ForeignKey('commande.EnumEtatCmd', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    nb_commandes = models.PositiveIntegerField(default=0)
+    ca_total = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = "Fait clients (jour)"
+        verbose_name_plural = "Faits clients (jour)"
+        indexes = [
+            models.Index(fields=['date', 'etat'], name='fait_cli_date_etat_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'client', 'etat'], name='fait_cli_cle_unique', nulls_distinct=False),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - client {self.client_id}"
+
+
+class JourKPIObsolete(models.Model):
+    """Jour dont les faits doivent être recalculés (marqué à chaque modification de commande)"""
+    date = models.DateField(unique=True)
+    date_marquage = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Jour KPI à recalculer"
+        verbose_name_plural = "Jours KPI à recalculer"
+
+    def __str__(self):
+        return str(self.date)
@@ -0,0 +1,404 @@
+"""
+Calculs des KPIs, indépendants des requêtes HTTP.
+
+Chaque fonction reçoit des paramètres simples (période, opérateur) et renvoie
+un résultat typé (NamedTuple). Les vues JSON et les exports lisent les mêmes
+résultats : un export ne rappelle plus une vue pour relire son JSON.
+
+Les résultats sont gardés dans le cache des KPIs (kpis.cache.kpi_en_cache),
+rendu obsolète par génération comme les réponses des vues ; le calcul sans
+cache reste accessible par fonction.__wrapped__ (mesures).
+"""
+from datetime import date, datetime, timedelta
+from typing import NamedTuple, Optional
+
+from django.db.models import Avg, Count, Max, Min, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from commande.models import Commande, EtatCommande
+from parametre.models import Operateur
+
+from .cache import kpi_en_cache
+
+# Anciennes périodes glissantes (nombre de jours avant aujourd'hui)
+PERIODES_JOURS = {'7j': 7, '30j': 30, '90j': 90, '180j': 180, '365j': 365}
+
+
+class Periode(NamedTuple):
+    libelle: str
+    date_debut: date
+    date_fin: date
+    jours: int
+
+    def en_json(self):
+        return {
+            'libelle': self.libelle,
+            'jours': self.jours,
+            'date_debut': self.date_debut.isoformat(),
+            'date_fin': self.date_fin.isoformat(),
+        }
+
+
+def _jour(valeur):
+    return datetime.strptime(valeur, '%Y-%m-%d').date()
+
+
+def resoudre_periode(period='aujourd_hui', date_debut=None, date_fin=None):
+    """
+    Période d'analyse à partir du paramètre period des KPIs :
+    'aujourd_hui', 'ce_mois', 'cette_annee', 'custom:AAAA-MM-JJ:AAAA-MM-JJ',
+    une période glissante ('7j', '30j'...), ou date_debut / date_fin explicites
+    (exports). Une période inconnue vaut les 30 derniers jours.
+
+    Raises:
+        ValueError: période personnalisée mal formée
+    """
+    aujourd_hui = timezone.localdate()
+    if period == 'aujourd_hui':
+        return Periode(period, aujourd_hui, aujourd_hui, 1)
+    if period in ('ce_mois', 'cette_annee'):
+        debut = aujourd_hui.replace(day=1) if period == 'ce_mois' else aujourd_hui.replace(month=1, day=1)
+        return Periode(period, debut, aujourd_hui, (aujourd_hui - debut).days + 1)
+    if period.startswith('custom:') or (date_debut and date_fin):
+        if period.startswith('custom:'):
+            parties = period.split(':')
+            if len(parties) != 3:
+                raise ValueError("Format de période personnalisée invalide")
+            date_debut, date_fin = parties[1], parties[2]
+        debut, fin = _jour(date_debut), _jour(date_fin)
+        return Periode(period, debut, fin, (fin - debut).days + 1)
+    jours = PERIODES_JOURS.get(period, 30)
+    return Periode(period, aujourd_hui - timedelta(days=jours), aujourd_hui, jours)
+
+
+# --- État des commandes -------------------------------------------------------
+
+# États suivis, dans l'ordre des exports, avec leur clé dans l'API
+ETATS_SUIVIS = (
+    ('Non affectée', 'non_affectee'),
+    ('Affectée', 'affectee'),
+    ('En cours de confirmation', 'en_cours_confirmation'),
+    ('Confirmée', 'confirmee'),
+    ('Erronée', 'erronnee'),
+    ('Doublon', 'doublon'),
+    ('En préparation', 'en_cours_preparation'),
+    ('Préparée', 'preparee'),
+    ('En livraison', 'en_cours_livraison'),
+    ('Livrée', 'livree'),
+    ('Retournée', 'retournee'),
+    ('Reçue', 'recue'),
+)
+
+
+class LigneEtat(NamedTuple):
+    libelle: str
+    cle: str
+    nombre: int
+    valeur_totale: float
+    panier_moyen: float
+    operateur_principal: str
+    derniere_activite: Optional[datetime]
+
+
+class EtatsCommandes(NamedTuple):
+    periode: Periode
+    # Une ligne par état suivi (ETATS_SUIVIS), même sans commande
+    lignes: tuple
+    # Commandes sans aucun état, comptées comme reçues
+    sans_etat: int
+
+    @property
+    def compteurs(self):
+        compteurs = {ligne.cle: ligne.nombre for ligne in self.lignes}
+        compteurs['recue'] += self.sans_etat
+        return compteurs
+
+    @property
+    def total(self):
+        return sum(ligne.nombre for ligne in self.lignes) + self.sans_etat
+
+    @property
+    def stats_supplementaires(self):
+        compteurs = self.compteurs
+        return {
+            'commandes_en_cours': (
+                compteurs['affectee'] + compteurs['en_cours_confirmation']
+                + compteurs['en_cours_preparation'] + compteurs['en_cours_livraison']
+            ),
+            'commandes_problematiques': compteurs['erronnee'] + compteurs['doublon'] + compteurs['retournee'],
+            'commandes_completees': compteurs['livree'],
+        }
+
+
+@kpi_en_cache
+def etats_commandes(periode):
+    """
+    Commandes par état courant entré pendant la période, avec valeur totale,
+    panier moyen, opérateur principal et dernière activité de chaque état
+    (deux requêtes groupées, plus le nombre de commandes sans état).
+    """
+    etats = EtatCommande.objects.filter(
+        date_debut__date__gte=periode.date_debut,
+        date_debut__date__lte=periode.date_fin,
+        date_fin__isnull=True,
+        enum_etat__libelle__in=[libelle for libelle, _ in ETATS_SUIVIS],
+    ).order_by()
+    par_etat = {
+        ligne['enum_etat__libelle']: ligne
+        for ligne in etats.values('enum_etat__libelle').annotate(
+            nombre=Count('commande_id'),
+            valeur_totale=Sum('commande__total_cmd'),
+            panier_moyen=Avg('commande__total_cmd'),
+            derniere_activite=Max('date_debut'),
+        )
+    }
+    # Opérateur ayant fait entrer le plus de commandes dans chaque état
+    operateurs = {}
+    for libelle, nom, _ in etats.values_list('enum_etat__libelle', 'operateur__nom').annotate(
+        nombre=Count('pk')
+    ).order_by('enum_etat__libelle', '-nombre', 'operateur__nom'):
+        operateurs.setdefault(libelle, nom)
+
+    lignes = []
+    for libelle, cle in ETATS_SUIVIS:
+        ligne = par_etat.get(libelle)
+        lignes.append(LigneEtat(
+            libelle,
+            cle,
+            ligne['nombre'] if ligne else 0,
+            float(ligne['valeur_totale'] or 0) if ligne else 0.0,
+            float(ligne['panier_moyen'] or 0) if ligne else 0.0,
+            operateurs.get(libelle) or 'N/A',
+            ligne['derniere_activite'] if ligne else None,
+        ))
+    return EtatsCommandes(periode, tuple(lignes), Commande.objects.filter(etats__isnull=True).count())
+
+
+# --- Performance des opérateurs de confirmation ------------------------------
+
+class PerformanceOperateur(NamedTuple):
+    id: int
+    nom: str
+    username: Optional[str]
+    commands_affected: int
+    commands_in_progress: int
+    commands_confirmed: int
+    confirmation_rate: float
+    average_basket: float
+    min_basket: float
+    max_basket: float
+    upsell_count: int
+    upsell_amount: float
+    # Simplifié aux 30 derniers jours
+    total_actions: int
+    operations_per_command_30d: float
+
+
+class MetriquesGlobales(NamedTuple):
+    commands_assigned: int
+    confirmations: int
+    global_confirmation_rate: float
+    active_operators: int
+
+
+class PerformanceOperateurs(NamedTuple):
+    # Triés par commandes confirmées décroissantes
+    operateurs: tuple
+    globales: MetriquesGlobales
+
+
+@kpi_en_cache
+def performance_operateurs(operator_id=None):
+    """Métriques des opérateurs de confirmation (d'un seul si operator_id), agrégées en une requête"""
+    # Date de référence pour les calculs sur 30 jours
+    date_limite_30j = timezone.now() - timedelta(days=30)
+    confirmee = Q(etats_modifies__enum_etat__libelle__iexact='Confirmée')
+
+    operateurs_query = Operateur.objects.filter(type_operateur='CONFIRMATION')
+    if operator_id:
+        operateurs_query = operateurs_query.filter(id=operator_id)
+
+    operateurs_stats = operateurs_query.annotate(
+        # --- Métriques sur l'état ACTUEL ---
+        commands_affected=Count(
+            'etats_modifies__commande',
+            filter=Q(etats_modifies__enum_etat__libelle__iexact='Affectée', etats_modifies__date_fin__isnull=True),
+            distinct=True
+        ),
+        commands_in_progress=Count(
+            'etats_modifies__commande',
+            filter=Q(etats_modifies__enum_etat__libelle__iexact='En cours de confirmation', etats_modifies__date_fin__isnull=True),
+            distinct=True
+        ),
+        # --- Métriques HISTORIQUES (tous les temps) ---
+        commands_confirmed=Count('etats_modifies__commande', filter=confirmee, distinct=True),
+        # --- Métriques FINANCIERES sur commandes confirmées ---
+        panier_moyen=Avg('etats_modifies__commande__total_cmd', filter=confirmee),
+        panier_min=Min('etats_modifies__commande__total_cmd', filter=confirmee),
+        panier_max=Max('etats_modifies__commande__total_cmd', filter=confirmee),
+        upsell_count=Count(
+            'etats_modifies__commande',
+            filter=confirmee & Q(etats_modifies__commande__is_upsell=True),
+            distinct=True
+        ),
+        upsell_amount=Sum(
+            'etats_modifies__commande__total_cmd',
+            filter=confirmee & Q(etats_modifies__commande__is_upsell=True)
+        ),
+        # --- Métriques sur les OPERATIONS (30 derniers jours) ---
+        total_actions_30j=Count(
+            'operations',
+            filter=Q(operations__date_operation__gte=date_limite_30j),
+            distinct=True
+        ),
+        commands_confirmed_30j=Count(
+            'etats_modifies__commande',
+            filter=confirmee & Q(etats_modifies__date_debut__gte=date_limite_30j),
+            distinct=True
+        ),
+    ).values(
+        'id', 'nom', 'user__username',
+        'commands_affected', 'commands_in_progress', 'commands_confirmed',
+        'panier_moyen', 'panier_min', 'panier_max',
+        'upsell_count', 'upsell_amount',
+        'total_actions_30j', 'commands_confirmed_30j'
+    )
+
+    operateurs = []
+    total_affectees = total_confirmees = 0
+    for op_stat in operateurs_stats:
+        total_traitees = op_stat['commands_affected'] + op_stat['commands_in_progress'] + op_stat['commands_confirmed']
+        taux_confirmation = (op_stat['commands_confirmed'] / total_traitees * 100) if total_traitees > 0 else 0
+        operations_par_commande_30j = (
+            op_stat['total_actions_30j'] / op_stat['commands_confirmed_30j'] if op_stat['commands_confirmed_30j'] > 0 else 0
+        )
+        operateurs.append(PerformanceOperateur(
+            id=op_stat['id'],
+            nom=op_stat['nom'],
+            username=op_stat['user__username'],
+            commands_affected=op_stat['commands_affected'],
+            commands_in_progress=op_stat['commands_in_progress'],
+            commands_confirmed=op_stat['commands_confirmed'],
+            confirmation_rate=round(taux_confirmation, 1),
+            average_basket=float(op_stat['panier_moyen'] or 0),
+            min_basket=float(op_stat['panier_min'] or 0),
+            max_basket=float(op_stat['panier_max'] or 0),
+            upsell_count=op_stat['upsell_count'],
+            upsell_amount=float(op_stat['upsell_amount'] or 0),
+            total_actions=op_stat['total_actions_30j'],
+            operations_per_command_30d=round(operations_par_commande_30j, 1),
+        ))
+        total_affectees += op_stat['commands_affected'] + op_stat['commands_in_progress']
+        total_confirmees += op_stat['commands_confirmed']
+
+    total_traitees = total_affectees + total_confirmees
+    operateurs.sort(key=lambda operateur: operateur.commands_confirmed, reverse=True)
+    return PerformanceOperateurs(tuple(operateurs), MetriquesGlobales(
+        commands_assigned=total_affectees,
+        confirmations=total_confirmees,
+        global_confirmation_rate=round((total_confirmees / total_traitees * 100) if total_traitees > 0 else 0, 1),
+        active_operators=len(operateurs),
+    ))
+
+
+# --- Temps de confirmation ------------------------------------------------------
+
+class TempsOperateur(NamedTuple):
+    id: int
+    nom: str
+    prenom: str
+    username: Optional[str]
+    # Commandes confirmées par l'opérateur (dans la période)
+    nb_confirmees: int
+    # Commandes dont le temps de confirmation a été mesuré (passage « En cours de confirmation » connu)
+    nb_mesurees: int
+    minutes_confirmation: float
+    minutes_arrivee: float
+    nb_confirmees_aujourd_hui: int
+    minutes_confirmation_aujourd_hui: float
+
+
+def _moyenne_minutes(durees):
+    return round(sum(durees, timedelta()).total_seconds() / 60 / len(durees), 1) if durees else 0
+
+
+@kpi_en_cache
+def temps_confirmation_operateurs(periode=None):
+    """
+    Temps moyens des opérateurs de confirmation, sur les commandes confirmées
+    pendant la période (toutes si None), en une lecture de l'historique :
+
+    - confirmation : du dernier passage « En cours de confirmation » à la confirmation ;
+    - arrivée : de la synchronisation (ou création) de la commande à sa confirmation.
+
+    La commande est attribuée à l'opérateur qui l'a confirmée. Tous les opérateurs
+    de confirmation figurent dans le résultat, même sans activité.
+    """
+    etats = EtatCommande.objects.filter(
+        operateur__type_operateur='CONFIRMATION',
+        enum_etat__libelle__in=['En cours de confirmation', 'Confirmée'],
+    )
+    if periode is not None:
+        etats = etats.filter(commande_id__in=etats.filter(
+            enum_etat__libelle='Confirmée',
+            date_debut__date__gte=periode.date_debut,
+            date_debut__date__lte=periode.date_fin,
+        ).values('commande_id'))
+
+    # Dernier passage de chaque commande dans chaque état (historique trié)
+    commandes = {}
+    for commande_id, libelle, operateur_id, debut, arrivee in etats.order_by(
+        'commande_id', 'date_debut', 'pk'
+    ).values_list(
+        'commande_id', 'enum_etat__libelle', 'operateur_id', 'date_debut',
+        Coalesce('commande__last_sync_date', 'commande__date_creation'),
+    ):
+        donnees = commandes.setdefault(commande_id, {'arrivee': arrivee})
+        if libelle == 'Confirmée':
+            donnees.update(confirmee=debut, operateur_id=operateur_id)
+        else:
+            donnees['en_cours'] = debut
+
+    aujourd_hui = timezone.localdate()
+    par_operateur = {}
+    for donnees in commandes.values():
+        confirmee = donnees.get('confirmee')
+        if confirmee is None or (
+            periode is not None and not periode.date_debut <= timezone.localdate(confirmee) <= periode.date_fin
+        ):
+            continue
+        mesures = par_operateur.setdefault(donnees['operateur_id'], {
+            'nb': 0, 'confirmation': [], 'arrivee': [], 'nb_jour': 0, 'confirmation_jour': [],
+        })
+        mesures['nb'] += 1
+        jour = timezone.localdate(confirmee) == aujourd_hui
+        mesures['nb_jour'] += jour
+
+        if donnees.get('en_cours') is not None:
+            duree = confirmee - donnees['en_cours']
+            if duree > timedelta(0):
+                mesures['confirmation'].append(duree)
+                if jour:
+                    mesures['confirmation_jour'].append(duree)
+        if confirmee - donnees['arrivee'] > timedelta(0):
+            mesures['arrivee'].append(confirmee - donnees['arrivee'])
+
+    resultat = []
+    for operateur_id, nom, prenom, username in Operateur.objects.filter(
+        type_operateur='CONFIRMATION'
+    ).order_by('pk').values_list('pk', 'nom', 'prenom', 'user__username'):
+        mesures = par_operateur.get(operateur_id)
+        if mesures is None:
+            resultat.append(TempsOperateur(operateur_id, nom, prenom, username, 0, 0, 0, 0, 0, 0))
+            continue
+        resultat.append(TempsOperateur(
+            operateur_id, nom, prenom, username,
+            nb_confirmees=mesures['nb'],
+            nb_mesurees=len(mesures['confirmation']),
+            minutes_confirmation=_moyenne_minutes(mesures['confirmation']),
+            minutes_arrivee=_moyenne_minutes(mesures['arrivee']),
+            nb_confirmees_aujourd_hui=mesures['nb_jour'],
+            minutes_confirmation_aujourd_hui=_moyenne_minutes(mesures['confirmation_jour']),
+        ))
+    return tuple(resultat)
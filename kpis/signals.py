@@ -0,0 +1,66 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from commande.models import Commande, EtatCommande, Operation, Panier
+from commande.signals import commandes_modifiees
+
+from .cache import invalider_cache_kpis
+from .faits import marquer_jours_obsoletes
+
+
+@receiver(commandes_modifiees)
+def marquer_jours_commandes_modifiees(sender, dates, **kwargs):
+    """Transitions d'état et écritures par lots : les faits des jours concernés sont à recalculer"""
+    marquer_jours_obsoletes(dates)
+    invalider_cache_kpis()
+
+
+# Champs de la commande repris dans les faits journaliers
+CHAMPS_FAITS = ('date_cmd', 'ville_id', 'client_id', 'total_cmd', 'etat_courant_id', 'operateur_etat_courant_id')
+
+
+@receiver(post_save, sender=Commande)
+def marquer_jour_commande(sender, instance, **kwargs):
+    """Création ou modification d'une commande : seuls les champs repris dans les faits comptent"""
+    modifies = instance.champs_modifies(CHAMPS_FAITS)
+    if not modifies:
+        return
+
+    dates = [instance.date_cmd]
+    if 'date_cmd' in modifies:
+        # Commande déplacée : l'ancien jour la compte encore
+        dates.append(getattr(instance, '_valeurs_avant_save', {}).get('date_cmd'))
+    marquer_jours_obsoletes(dates)
+    invalider_cache_kpis()
+
+
+@receiver(post_delete, sender=Commande)
+def marquer_jour_commande_supprimee(sender, instance, **kwargs):
+    marquer_jours_obsoletes([instance.date_cmd])
+    invalider_cache_kpis()
+
+
+@receiver(post_save, sender=Panier)
+@receiver(post_delete, sender=Panier)
+def marquer_jour_panier(sender, instance, **kwargs):
+    """Modification du contenu d'une commande"""
+    if Panier.commande.is_cached(instance):
+        date_cmd = instance.commande.date_cmd
+    else:
+        date_cmd = Commande.objects.filter(pk=instance.commande_id).values_list('date_cmd', flat=True).first()
+    marquer_jours_obsoletes([date_cmd])
+    invalider_cache_kpis()
+
+
+@receiver(post_save, sender=EtatCommande)
+@receiver(post_delete, sender=EtatCommande)
+def invalider_cache_etat_commande(sender, instance, **kwargs):
+    """Tout changement d'historique d'état modifie les KPIs de suivi des opérateurs"""
+    invalider_cache_kpis()
+
+
+@receiver(post_save, sender=Operation)
+@receiver(post_delete, sender=Operation)
+def invalider_cache_operation(sender, instance, **kwargs):
+    """Les opérations (appels, messages) alimentent l'historique des opérateurs"""
+    invalider_cache_kpis()
@@ -0,0 +1,9 @@
+from celery import shared_task
+
+from .faits import reconstruire_faits
+
+
+@shared_task(name='kpis.reconstruire_faits')
+def reconstruire_faits_kpis():
+    """Tâche Celery planifiée chaque nuit : reconstruction complète des tables de faits KPIs"""
+    return reconstruire_faits()
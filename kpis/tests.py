@@ -0,0 +1,272 @@
+import json
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from article.models import Article, Categorie
+from client.models import Client
+from commande.models import Commande, EnumEtatCmd, Operation, Panier
+from commande.transitions import changer_etat_commande
+from kpis import cache as cache_kpis, services
+from kpis.cache import cache_kpi
+from kpis.faits import rafraichir_jours_obsoletes, reconstruire_faits
+from kpis.models import FaitArticleJour, FaitClientJour, FaitCommandeJour, JourKPIObsolete
+from parametre.models import Operateur, Region, Ville
+
+
+class FaitsJournaliersTest(TestCase):
+
+    def setUp(self):
+        self.aujourd_hui = timezone.localdate()
+        region = Region.objects.create(nom_region='Rabat-Salé')
+        self.ville = Ville.objects.create(nom='Rabat', frais_livraison=20, frequence_livraison='Quotidienne', region=region)
+        self.client_a = Client.objects.create(nom='Alaoui', prenom='Sara', numero_tel='0611000001')
+        self.client_b = Client.objects.create(nom='Bennani', prenom='Omar', numero_tel='0611000002')
+        categorie = Categorie.objects.create(nom='SANDALES')
+        self.article = Article.objects.create(nom='Sandale Été', reference='SAN-1', prix_unitaire=200, categorie=categorie)
+
+    def _commande(self, numero, client, total, date_cmd=None):
+        # Les jours sont marqués au commit des écritures
+        with self.captureOnCommitCallbacks(execute=True):
+            commande = Commande.objects.create(
+                num_cmd=f'KPI-{numero}', id_yz=900000 + numero, client=client, ville=self.ville,
+                total_cmd=total, date_cmd=date_cmd or self.aujourd_hui,
+            )
+            Panier.objects.create(commande=commande, article=self.article, quantite=1, sous_total=total)
+            changer_etat_commande(commande, 'Livrée')
+        return commande
+
+    def test_transition_marque_le_jour_et_les_faits_suivent(self):
+        commande = self._commande(1, self.client_a, 300)
+        self._commande(2, self.client_b, 500)
+
+        self.assertTrue(JourKPIObsolete.objects.filter(date=self.aujourd_hui).exists())
+        self.assertEqual(rafraichir_jours_obsoletes(), 1)
+        self.assertFalse(JourKPIObsolete.objects.exists())
+
+        livrees = FaitCommandeJour.objects.filter(date=self.aujourd_hui, etat__libelle='Livrée')
+        self.assertEqual(livrees.aggregate(nb=Sum('nb_commandes'))['nb'], 2)
+        self.assertEqual(livrees.aggregate(ca=Sum('ca_total'))['ca'], 800)
+        self.assertEqual(FaitArticleJour.objects.get(etat__libelle='Livrée').quantite, 2)
+
+        # Une transition déplace la commande vers son nouvel état lors du recalcul suivant
+        with self.captureOnCommitCallbacks(execute=True):
+            changer_etat_commande(
+                commande, EnumEtatCmd.objects.get_or_create(libelle='Retournée', defaults={'ordre': 15})[0]
+            )
+        rafraichir_jours_obsoletes()
+        self.assertEqual(livrees.aggregate(ca=Sum('ca_total'))['ca'], 500)
+        self.assertEqual(
+            FaitClientJour.objects.get(client=self.client_a).etat.libelle, 'Retournée'
+        )
+
+    def test_marquage_selon_les_champs_modifies(self):
+        commande = self._commande(1, self.client_a, 300)
+        rafraichir_jours_obsoletes()
+        commande = Commande.objects.get(pk=commande.pk)
+
+        # Champ absent des faits : aucun jour marqué
+        commande.adresse = '12 rue des Orangers'
+        with self.captureOnCommitCallbacks(execute=True):
+            commande.save()
+        self.assertFalse(JourKPIObsolete.objects.exists())
+
+        # Date corrigée : l'ancien et le nouveau jour sont à recalculer
+        veille = self.aujourd_hui - timedelta(days=1)
+        commande.date_cmd = veille
+        with self.captureOnCommitCallbacks(execute=True):
+            commande.save()
+        self.assertEqual(set(JourKPIObsolete.objects.values_list('date', flat=True)), {self.aujourd_hui, veille})
+
+        self.assertEqual(rafraichir_jours_obsoletes(), 2)
+        self.assertFalse(FaitCommandeJour.objects.filter(date=self.aujourd_hui).exists())
+        self.assertEqual(FaitCommandeJour.objects.get(date=veille).ca_total, 300)
+
+    def test_un_seul_fait_par_cle(self):
+        self._commande(1, self.client_a, 300)
+        rafraichir_jours_obsoletes()
+        fait = FaitClientJour.objects.get(client=self.client_a)
+
+        # Un doublon (recalculs concurrents) échoue au lieu de doubler le CA du client
+        fait.pk = None
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            fait.save()
+
+    def test_reconstruction_complete(self):
+        self._commande(1, self.client_a, 300, date_cmd=self.aujourd_hui - timedelta(days=40))
+        self._commande(2, self.client_a, 200)
+        JourKPIObsolete.objects.all().delete()
+
+        self.assertEqual(reconstruire_faits(), 41)
+        self.assertEqual(FaitCommandeJour.objects.aggregate(ca=Sum('ca_total'))['ca'], 500)
+        self.assertEqual(FaitClientJour.objects.count(), 2)
+
+    def test_ventes_data_lit_les_faits(self):
+        self._commande(1, self.client_a, 300)
+        self._commande(2, self.client_a, 500)
+        user = User.objects.create_superuser('admin-kpis', 'admin@example.com', 'motdepasse')
+        self.client.force_login(user)
+
+        data = self.client.get(reverse('kpis:ventes_data')).json()
+
+        self.assertTrue(data['success'])
+        self.assertEqual(data['kpis_principaux']['ca_periode']['valeur'], 800)
+        self.assertEqual(data['kpis_principaux']['nb_commandes']['valeur'], 2)
+        self.assertEqual(data['kpis_principaux']['panier_moyen']['valeur'], 400)
+        self.assertEqual(data['kpis_secondaires']['commande_max']['valeur'], 500)
+        self.assertEqual(data['kpis_secondaires']['top_modele']['nom'], 'Sandale Été')
+        self.assertEqual(data['kpis_secondaires']['top_region']['nom'], 'Rabat-Salé')
+
+        for nom_vue in ('evolution_ca_data', 'top_modeles_data', 'performance_regions_data', 'clients_data'):
+            with self.subTest(vue=nom_vue):
+                self.assertTrue(self.client.get(reverse(f'kpis:{nom_vue}')).json()['success'])
+
+
+class CacheKPITest(TestCase):
+
+    def setUp(self):
+        caches['kpis'].clear()
+        self.factory = RequestFactory()
+        self.appels = []
+
+        @cache_kpi
+        def vue(request):
+            self.appels.append(request.GET.get('period'))
+            time.sleep(0.05)
+            return JsonResponse({'appel': len(self.appels)})
+
+        self.vue = vue
+
+    def test_reponse_servie_depuis_le_cache_par_parametres(self):
+        self.vue(self.factory.get('/kpis/', {'period': '7j', 'limit': '5'}))
+        reponse = self.vue(self.factory.get('/kpis/', {'limit': '5', 'period': '7j'}))
+        self.vue(self.factory.get('/kpis/', {'period': '30j'}))
+
+        self.assertEqual(self.appels, ['7j', '30j'])
+        self.assertEqual(json.loads(reponse.content), {'appel': 1})
+
+    def test_transition_invalide_le_cache(self):
+        client = Client.objects.create(nom='Alaoui', prenom='Sara', numero_tel='0611000009')
+        commande = Commande.objects.create(num_cmd='KPI-CACHE', id_yz=990001, client=client, total_cmd=100)
+        self.vue(self.factory.get('/kpis/'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            changer_etat_commande(commande, 'Confirmée')
+        self.vue(self.factory.get('/kpis/'))
+
+        self.assertEqual(len(self.appels), 2)
+
+    def test_requetes_simultanees_calculees_une_seule_fois(self):
+        reponses = []
+        threads = [
+            threading.Thread(target=lambda: reponses.append(json.loads(self.vue(self.factory.get('/kpis/')).content)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.appels), 1)
+        self.assertEqual(reponses, [{'appel': 1}] * 5)
+        # Aucun verrou de calcul ne reste en mémoire, y compris pour les requêtes servies par le cache
+        self.assertEqual(cache_kpis._verrous, {})
+
+    def test_operation_invalide_le_cache(self):
+        client = Client.objects.create(nom='Alaoui', prenom='Sara', numero_tel='0611000010')
+        commande = Commande.objects.create(num_cmd='KPI-OPE', id_yz=990002, client=client, total_cmd=100)
+        operateur = Operateur.objects.create(
+            user=User.objects.create_user('ope-kpis'), nom='Idrissi', prenom='Nora',
+            mail='ope@yz.ma', type_operateur='CONFIRMATION',
+        )
+        self.vue(self.factory.get('/kpis/'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Operation.objects.create(commande=commande, operateur=operateur, type_operation='APPEL', conclusion='Joint')
+        self.vue(self.factory.get('/kpis/'))
+
+        self.assertEqual(len(self.appels), 2)
+
+
+class ServicesKPITest(TestCase):
+
+    def setUp(self):
+        caches['kpis'].clear()
+        self.client_commande = Client.objects.create(nom='Alaoui', prenom='Sara', numero_tel='0611000001')
+        self.operateur = Operateur.objects.create(
+            user=User.objects.create_user('conf-kpis'), nom='Idrissi', prenom='Nora',
+            mail='conf@yz.ma', type_operateur='CONFIRMATION',
+        )
+        maintenant = timezone.now()
+        self.commandes = []
+        for numero, total in enumerate((100, 300, 200)):
+            commande = Commande.objects.create(
+                num_cmd=f'SRV-{numero}', client=self.client_commande, total_cmd=total,
+                last_sync_date=maintenant - timedelta(minutes=30),
+            )
+            changer_etat_commande(
+                commande, 'En cours de confirmation', operateur=self.operateur,
+                date_debut=maintenant - timedelta(minutes=10),
+            )
+            self.commandes.append(commande)
+        for commande in self.commandes[:2]:
+            changer_etat_commande(commande, 'Confirmée', operateur=self.operateur, date_debut=maintenant)
+        self.periode = services.resoudre_periode('aujourd_hui')
+
+    def test_etats_commandes(self):
+        etats = services.etats_commandes(self.periode)
+
+        confirmee = next(ligne for ligne in etats.lignes if ligne.cle == 'confirmee')
+        self.assertEqual((confirmee.nombre, confirmee.valeur_totale, confirmee.panier_moyen), (2, 400, 200))
+        self.assertEqual(confirmee.operateur_principal, 'Idrissi')
+        self.assertEqual(etats.compteurs['en_cours_confirmation'], 1)
+        self.assertEqual(etats.total, 3)
+        self.assertEqual(etats.stats_supplementaires['commandes_en_cours'], 1)
+
+    def test_temps_confirmation_operateurs(self):
+        temps, = services.temps_confirmation_operateurs(self.periode)
+
+        self.assertEqual((temps.nb_confirmees, temps.nb_mesurees), (2, 2))
+        self.assertEqual(temps.minutes_confirmation, 10)
+        self.assertEqual(temps.minutes_arrivee, 30)
+
+    def test_resultat_en_cache_jusqu_a_la_transition(self):
+        services.etats_commandes(self.periode)
+        with self.assertNumQueries(0):
+            services.etats_commandes(self.periode)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            changer_etat_commande(self.commandes[2], 'Confirmée', operateur=self.operateur)
+        self.assertEqual(services.etats_commandes(self.periode).compteurs['confirmee'], 3)
+
+    def test_vue_et_exports_partagent_le_calcul(self):
+        user = User.objects.create_superuser('admin-kpis', 'admin@example.com', 'motdepasse')
+        self.client.force_login(user)
+
+        data = self.client.get(reverse('kpis:vue_quantitative_data')).json()['data']
+        self.assertEqual(data['etats_commandes']['confirmee'], 2)
+        self.assertEqual(data['total_commandes'], 3)
+        self.assertEqual(data['periode']['libelle'], 'aujourd_hui')
+
+        reponse = self.client.get(reverse('kpis:export_etat_commandes_csv'))
+        lignes = b''.join(reponse.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertIn('Confirmée;2;66.7%;400.00;200.00;Idrissi;', lignes[4])
+        self.assertTrue(lignes[-1].startswith('TOTAL;3;100.0%;600.00;200.00'))
+
+        self.assertEqual(self.client.get(reverse('kpis:vue_quantitative_data'), {'period': 'custom:x'}).status_code, 400)
+
+        reponse = self.client.get(reverse('kpis:export_performance_operateurs_csv'))
+        self.assertIn('Nora Idrissi,2,10.0,30.0', reponse.content.decode('utf-8'))
+        self.assertEqual(self.client.get(reverse('kpis:export_etat_commandes_excel')).status_code, 200)
+        for nom_vue in ('performance_operateurs_data', 'operator_realtime_times_data'):
+            with self.subTest(vue=nom_vue):
+                self.assertTrue(self.client.get(reverse(f'kpis:{nom_vue}')).json()['success'])
@@ -9,7 +9,13 @@ import json
 
 from commande.models import Commande, EtatCommande, EnumEtatCmd
 from parametre.models import Region, Ville, Operateur
-from article.models import Article
+from recherche.moteur import recherche_globale
+
+URLS_RECHERCHE = {
+    'commande': lambda commande_id: reverse('operatConfirme:detail_commande', kwargs={'commande_id': commande_id}),
+    'client': lambda client_id: f'/client/detail/{client_id}/',
+    'article': lambda article_id: f'/article/detail/{article_id}/',
+}
 
 
 @login_required
@@ -41,13 +47,13 @@ def global_search_api(request):
     }
     
     try:
-        # Recherche dans les commandes (pour confirmation)
-        if category in ['all', 'commandes']:
-            results['commandes'] = search_commandes_confirmation(query, request)
-        
-        # Recherche dans les clients
-        if category in ['all', 'clients']:
-            results['clients'] = search_clients(query)
+        # Commandes, clients et articles : index de recherche, filtré selon le rôle
+        resultats_indexes, pagination = recherche_globale(
+            request, 'confirmation',
+            categories={'commandes': 'commande', 'clients': 'client', 'articles': 'article'},
+            urls=URLS_RECHERCHE,
+        )
+        results.update(resultats_indexes)
         
         # Recherche dans les régions
         if category in ['all', 'regions']:
@@ -57,10 +63,6 @@ def global_search_api(request):
         if category in ['all', 'villes']:
             results['villes'] = search_villes_confirmation(query, request)
         
-        # Recherche dans les articles
-        if category in ['all', 'articles']:
-            results['articles'] = search_articles_confirmation(query)
-        
         # Recherche dans les statistiques
         if category in ['all', 'statistiques']:
             results['statistiques'] = search_statistiques_confirmation(query)
@@ -69,6 +71,7 @@ def global_search_api(request):
             'success': True,
             'query': query,
             'results': results,
+            'pagination': pagination,
             'total_results': sum(len(v) for v in results.values())
         })
         
@@ -80,138 +83,6 @@ def global_search_api(request):
         })
 
 
-def search_commandes_confirmation(query, request=None):
-    """Recherche dans les commandes pour confirmation"""
-    commandes = []
-    
-    # Recherche par ID numérique
-    if query.isdigit():
-        try:
-            cmd = Commande.objects.get(id=int(query))
-            # Pour la recherche par ID, être plus permissif
-            commandes.append({
-                'id': cmd.id,
-                'type': 'commande',
-                'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-                'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-                'status': get_commande_status(cmd),
-                'url': reverse('operatConfirme:detail_commande', kwargs={'commande_id': cmd.id}),
-                'icon': 'fas fa-shopping-cart',
-                'priority': 1
-            })
-        except Commande.DoesNotExist:
-            pass
-    
-    # Recherche par numéro externe
-    try:
-        cmd_externe = Commande.objects.get(num_cmd__icontains=query)
-        commandes.append({
-            'id': cmd_externe.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd_externe.id} ({cmd_externe.num_cmd})',
-            'subtitle': f'Client: {cmd_externe.client.nom if cmd_externe.client else "N/A"} - {cmd_externe.total_cmd} DH',
-            'status': get_commande_status(cmd_externe),
-            'url': reverse('operatConfirme:detail_commande', kwargs={'commande_id': cmd_externe.id}),
-            'icon': 'fas fa-shopping-cart',
-            'priority': 1
-        })
-    except Commande.DoesNotExist:
-        pass
-    
-    # Recherche par client (exclure les recherches déjà faites par numéro externe)
-    commandes_client = Commande.objects.filter(
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    ).exclude(
-        num_cmd__icontains=query
-    )[:10]
-    
-    for cmd in commandes_client:
-        # Pour la recherche par client, être plus permissif
-        commandes.append({
-            'id': cmd.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-            'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-            'status': get_commande_status(cmd),
-            'url': reverse('operatConfirme:detail_commande', kwargs={'commande_id': cmd.id}),
-            'icon': 'fas fa-shopping-cart',
-            'priority': 2
-        })
-    
-    # Recherche par région/ville/ville_init (exclure les recherches déjà faites)
-    commandes_geo = Commande.objects.filter(
-        Q(ville__nom__icontains=query) |
-        Q(ville__region__nom_region__icontains=query) |
-        Q(ville_init__icontains=query)
-    ).exclude(
-        Q(num_cmd__icontains=query) |
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    )[:10]
-    
-    for cmd in commandes_geo:
-        # Pour la recherche par géographie, être plus permissif
-        ville_display = cmd.ville.nom if cmd.ville else "N/A"
-        if cmd.ville_init and cmd.ville_init != (cmd.ville.nom if cmd.ville else ""):
-            ville_display = f"{cmd.ville_init} → {ville_display}"
-        
-        commandes.append({
-            'id': cmd.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-            'subtitle': f'{ville_display} - {cmd.total_cmd} DH',
-            'status': get_commande_status(cmd),
-            'url': reverse('operatConfirme:detail_commande', kwargs={'commande_id': cmd.id}),
-            'icon': 'fas fa-shopping-cart',
-            'priority': 3
-        })
-    
-    # Dédupliquer les résultats par ID de commande
-    commandes_uniques = []
-    ids_vus = set()
-    
-    for cmd in commandes:
-        if cmd['id'] not in ids_vus:
-            commandes_uniques.append(cmd)
-            ids_vus.add(cmd['id'])
-    
-    return commandes_uniques[:10]
-
-
-def search_clients(query):
-    """Recherche dans les clients"""
-    clients = []
-    
-    from client.models import Client
-    
-    clients_match = Client.objects.filter(
-        Q(nom__icontains=query) |
-        Q(prenom__icontains=query) |
-        Q(email__icontains=query) |
-        Q(numero_tel__icontains=query)
-    )[:8]
-    
-    for client in clients_match:
-        # Compter les commandes de ce client
-        nb_commandes = Commande.objects.filter(client=client).count()
-        
-        clients.append({
-            'id': client.id,
-            'type': 'client',
-            'title': f'{client.nom} {client.prenom}',
-            'subtitle': f'{client.email} - {client.numero_tel} - {nb_commandes} commandes',
-            'status': 'Actif',
-            'url': f'/client/detail/{client.id}/',
-            'icon': 'fas fa-user',
-            'priority': 1
-        })
-    
-    return clients
-
-
 def search_regions_confirmation(query, request=None):
     """Recherche dans les régions pour confirmation"""
     regions = []
@@ -224,8 +95,7 @@ def search_regions_confirmation(query, request=None):
         # Compter les commandes à confirmer de cette région (plus inclusif)
         nb_commandes = Commande.objects.filter(
             ville__region=region,
-            etats__enum_etat__libelle__in=["Nouvelle", "Confirmée", "Annulée"],
-            etats__date_fin__isnull=True
+            etat_courant__libelle__in=["Nouvelle", "Confirmée", "Annulée"]
         ).count()
         
         regions.append({
@@ -260,8 +130,7 @@ def search_villes_confirmation(query, request=None):
         # Compter les commandes à confirmer de cette ville (plus inclusif)
         nb_commandes = Commande.objects.filter(
             ville=ville,
-            etats__enum_etat__libelle__in=["Nouvelle", "Confirmée", "Annulée"],
-            etats__date_fin__isnull=True
+            etat_courant__libelle__in=["Nouvelle", "Confirmée", "Annulée"]
         ).count()
         
         villes.append({
@@ -281,8 +150,7 @@ def search_villes_confirmation(query, request=None):
             # Compter les commandes avec cette ville initiale
             nb_commandes_init = Commande.objects.filter(
                 ville_init=ville_init,
-                etats__enum_etat__libelle__in=["Nouvelle", "Confirmée", "Annulée"],
-                etats__date_fin__isnull=True
+                etat_courant__libelle__in=["Nouvelle", "Confirmée", "Annulée"]
             ).count()
             
             villes.append({
@@ -299,31 +167,6 @@ def search_villes_confirmation(query, request=None):
     return villes
 
 
-def search_articles_confirmation(query):
-    """Recherche dans les articles pour confirmation"""
-    articles = []
-    
-    articles_match = Article.objects.filter(
-        Q(nom__icontains=query) |
-        Q(reference__icontains=query) |
-        Q(description__icontains=query)
-    )[:5]
-    
-    for article in articles_match:
-        articles.append({
-            'id': article.id,
-            'type': 'article',
-            'title': article.nom,
-            'subtitle': f'Réf: {article.reference} - Stock: {article.qte_disponible}',
-            'status': 'En stock' if article.qte_disponible > 0 else 'Rupture',
-            'url': f'/article/detail/{article.id}/',
-            'icon': 'fas fa-box',
-            'priority': 1
-        })
-    
-    return articles
-
-
 def search_statistiques_confirmation(query):
     """Recherche dans les statistiques pour confirmation"""
     statistiques = []
@@ -354,23 +197,6 @@ def search_statistiques_confirmation(query):
     return statistiques
 
 
-def is_commande_for_confirmation(commande, request=None):
-    """Vérifier si une commande est éligible pour la confirmation"""
-    etat_actuel = commande.etats.filter(date_fin__isnull=True).first()
-    if etat_actuel:
-        etats_confirmation = ["Nouvelle", "Confirmée", "Annulée", "Erronée", "Doublon"]
-        return etat_actuel.enum_etat.libelle in etats_confirmation
-    return False
-
-
-def get_commande_status(commande):
-    """Obtenir le statut actuel d'une commande"""
-    etat_actuel = commande.etats.filter(date_fin__isnull=True).first()
-    if etat_actuel:
-        return etat_actuel.enum_etat.libelle
-    return "Nouvelle"
-
-
 @login_required
 def search_suggestions_api(request):
     """API pour les suggestions de recherche - Confirmation"""
@@ -400,8 +226,7 @@ def search_suggestions_api(request):
     
     # Suggestions de commandes récentes à confirmer
     recent_commandes = Commande.objects.filter(
-        etats__enum_etat__libelle="Nouvelle",
-        etats__date_fin__isnull=True
+        etat_courant__libelle="Nouvelle"
     ).order_by('-id')[:3]
     
     for cmd in recent_commandes:
@@ -413,8 +238,7 @@ def search_suggestions_api(request):
     # Suggestions de régions avec commandes à confirmer
     active_regions = Region.objects.annotate(
         nb_commandes=Count('villes__commandes', filter=Q(
-            villes__commandes__etats__enum_etat__libelle="Nouvelle",
-            villes__commandes__etats__date_fin__isnull=True
+            villes__commandes__etat_courant__libelle="Nouvelle"
         ))
     ).filter(nb_commandes__gt=0)[:3]
     
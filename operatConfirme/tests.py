@@ -1,3 +1,51 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from article.models import Article, Categorie, Couleur, MouvementStock, Pointure, VarianteArticle
+from client.models import Client
+from commande.models import Commande, EnumEtatCmd, Operation, Panier
+from commande.transitions import changer_etat_commande
+from parametre.models import Operateur
+
+
+class ConfirmationStockTest(TestCase):
+
+    def setUp(self):
+        for ordre, libelle in enumerate(('En cours de confirmation', 'Confirmée', 'À imprimer'), start=1):
+            EnumEtatCmd.objects.get_or_create(libelle=libelle, defaults={'ordre': ordre})
+        user = User.objects.create_user('op-confirmation', password='motdepasse')
+        self.operateur = Operateur.objects.create(
+            user=user, nom='Idrissi', prenom='Salma', mail='salma@example.com', type_operateur='CONFIRMATION',
+        )
+        self.client.force_login(user)
+
+        categorie = Categorie.objects.create(nom='BASKETS')
+        noir, blanc = Couleur.objects.create(nom='Noir'), Couleur.objects.create(nom='Blanc')
+        p40 = Pointure.objects.create(pointure='40')
+        self.basket = Article.objects.create(nom='Basket', reference='BAS-1', prix_unitaire=300, categorie=categorie)
+        self.mule = Article.objects.create(nom='Mule', reference='MUL-1', prix_unitaire=200, categorie=categorie)
+        VarianteArticle.objects.create(article=self.basket, couleur=noir, pointure=p40, qte_disponible=2)
+        VarianteArticle.objects.create(article=self.basket, couleur=blanc, pointure=p40, qte_disponible=3)
+        VarianteArticle.objects.create(article=self.mule, couleur=noir, pointure=p40, qte_disponible=5)
+
+        client = Client.objects.create(nom='Kettani', prenom='Reda', numero_tel='0677000001')
+        self.commande = Commande.objects.create(num_cmd='CONF-1', client=client, total_cmd=1400)
+        Panier.objects.create(commande=self.commande, article=self.basket, quantite=4, sous_total=1200)
+        Panier.objects.create(commande=self.commande, article=self.mule, quantite=1, sous_total=200)
+        changer_etat_commande(self.commande, 'En cours de confirmation', operateur=self.operateur)
+        Operation.objects.create(
+            commande=self.commande, operateur=self.operateur, type_operation='APPEL', conclusion='Client joint',
+        )
+
+    def test_ligne_repartie_sur_plusieurs_variantes(self):
+        url = reverse('operatConfirme:confirmer_commande_ajax', args=[self.commande.pk])
+        data = self.client.post(url, {}, content_type='application/json').json()
+
+        self.assertTrue(data['success'], data.get('message'))
+        # La basket est prise sur ses deux variantes : deux mouvements, un seul détail par ligne
+        self.assertEqual(MouvementStock.objects.filter(article=self.basket).count(), 2)
+        self.assertEqual(
+            sorted((item['article'], item['ancien_stock'], item['nouveau_stock']) for item in data['details_stock']),
+            [('Basket', 5, 1), ('Mule', 5, 4)],
+        )
@@ -12,11 +12,13 @@ from django.http import JsonResponse
 import json
 from django.utils import timezone
 from commande.models import Commande, EtatCommande, EnumEtatCmd, Panier
+from commande.transitions import changer_etat_commande, changer_etat_commandes
 from datetime import datetime, timedelta
 from django.db.models import Sum
 from django.db import models, transaction
 from client.models import Client
 from article.models import Article, VarianteArticle
+from article.mouvements import LigneMouvement, creer_mouvements_stock_bulk
 import logging
 from django.urls import reverse
 from django.template.loader import render_to_string
@@ -43,36 +45,29 @@ def dashboard(request):
     today = timezone.now().date()
     week_start = today - timedelta(days=today.weekday())
     
-    # Récupérer les commandes affectées à cet opérateur
+    # Récupérer les commandes affectées à cet opérateur (état courant dénormalisé, sans jointure sur l'historique)
     commandes_affectees = Commande.objects.filter(
-        Q(etats__operateur=operateur, etats__date_fin__isnull=True, etats__enum_etat__libelle__in=['Affectée', 'En cours de confirmation']) |
-        Q(etats__date_fin__isnull=True, etats__enum_etat__libelle='Retour Confirmation')
-    ).distinct().select_related(
-        'client', 'ville', 'ville__region'
-    ).prefetch_related(
-        'etats__enum_etat', 'paniers__article'
-    ).order_by('-date_cmd', '-date_creation')
+        Q(operateur_etat_courant=operateur, etat_courant__libelle__in=['Affectée', 'En cours de confirmation']) |
+        Q(etat_courant__libelle='Retour Confirmation')
+    )
     
     # Statistiques des commandes affectées à cet opérateur
     stats = {}
     
     # Commandes en attente de confirmation (affectées mais pas encore en cours de confirmation)
     stats['commandes_en_attente'] = commandes_affectees.filter(
-        etats__enum_etat__libelle='Affectée',
-        etats__date_fin__isnull=True
+        etat_courant__libelle='Affectée'
     ).count()
     
     # Commandes en cours de confirmation
     stats['commandes_en_cours'] = commandes_affectees.filter(
-        etats__enum_etat__libelle='En cours de confirmation',
-        etats__date_fin__isnull=True
+        etat_courant__libelle='En cours de confirmation'
     ).count()
     
     # Commandes retournées par la préparation
     stats['commandes_retournees'] = Commande.objects.filter(
-        etats__enum_etat__libelle='Retour Confirmation',
-        etats__date_fin__isnull=True
-    ).distinct().count()
+        etat_courant__libelle='Retour Confirmation'
+    ).count()
     
     # Commandes confirmées par cet opérateur (toutes)
     commandes_confirmees_all = Commande.objects.filter(
@@ -293,18 +288,15 @@ def confirmer_commande_ajax(request, commande_id):
             except Exception as e:
                 print(f"⚠️ DEBUG: Erreur lors de la sauvegarde des infos de livraison: {str(e)}")
             
-            # Vérifier le stock et décrémenter les articles
+            # Vérifier le stock de toutes les lignes, puis décrémenter en un lot (tout ou rien)
             articles_decrémentes = []
             stock_insuffisant = []
+            paniers = list(commande.paniers.select_related('article'))
             
-            for panier in commande.paniers.all():
+            for panier in paniers:
                 article = panier.article
                 quantite_commandee = panier.quantite
                 
-                print(f"📦 DEBUG: Article {article.nom} (ID:{article.id})")
-                print(f"   - Stock actuel: {article.qte_disponible}")
-                print(f"   - Quantité commandée: {quantite_commandee}")
-                
                 # Vérifier si le stock est suffisant
                 if article.qte_disponible < quantite_commandee:
                     stock_insuffisant.append({
@@ -313,31 +305,28 @@ def confirmer_commande_ajax(request, commande_id):
                         'quantite_demandee': quantite_commandee
                     })
                     print(f"❌ DEBUG: Stock insuffisant pour {article.nom}")
-                else:
-                    # Décrémenter le stock via mouvements sur variantes (pas d'écriture sur Article.qte_disponible)
-                    ancien_stock = article.qte_disponible
-                    from Superpreparation.utils import creer_mouvement_stock as creer_mouvement_stock_prepa
-                    creer_mouvement_stock_prepa(
-                        article=article,
-                        quantite=quantite_commandee,
-                        type_mouvement='ajustement_neg' if quantite_commandee > 0 else 'ajustement_pos',
-                        operateur=operateur,
-                        commande=commande,
-                        commentaire=f"Décrément lors de la confirmation commande {commande.id_yz}",
-                        variante=None,
-                    )
-                    nouveau_stock = article.qte_disponible  # Propriété calculée à partir des variantes
-                    
+            
+            if not stock_insuffisant:
+                # Décrémenter le stock via mouvements sur variantes (pas d'écriture sur Article.qte_disponible)
+                creer_mouvements_stock_bulk(
+                    [LigneMouvement(panier.article_id, panier.quantite) for panier in paniers],
+                    'ajustement_neg',
+                    operateur=operateur,
+                    commande=commande,
+                    commentaire=f"Décrément lors de la confirmation commande {commande.id_yz}",
+                )
+                # Stock total de chaque article après le lot (une ligne peut toucher plusieurs variantes)
+                stocks_apres = dict(
+                    Article.objects.filter(pk__in=[panier.article_id for panier in paniers])
+                    .values_list('pk', 'stock_disponible')
+                )
+                for panier in paniers:
                     articles_decrémentes.append({
-                        'article': article.nom,
-                        'ancien_stock': ancien_stock,
-                        'nouveau_stock': nouveau_stock,
-                        'quantite_decrémententée': quantite_commandee
+                        'article': panier.article.nom,
+                        'ancien_stock': panier.article.qte_disponible,
+                        'nouveau_stock': stocks_apres.get(panier.article_id, 0),
+                        'quantite_decrémententée': panier.quantite
                     })
-                    
-                    print(f"✅ DEBUG: Stock mis à jour pour {article.nom}")
-                    print(f"   - Ancien stock: {ancien_stock}")
-                    print(f"   - Nouveau stock: {nouveau_stock}")
             
             # Si il y a des problèmes de stock, annuler la transaction
             if stock_insuffisant:
@@ -358,34 +347,24 @@ def confirmer_commande_ajax(request, commande_id):
             # Créer le nouvel état "confirmée"
             enum_confirmee = EnumEtatCmd.objects.get(libelle='Confirmée')
             
-            # Fermer l'état actuel
-            etat_actuel.date_fin = timezone.now()
-            etat_actuel.save()
+            # Fermer l'état actuel et créer le nouvel état Confirmée (historisation courte)
             print(f"🔄 DEBUG: État actuel fermé: {etat_actuel.enum_etat.libelle}")
-            
-            # Créer le nouvel état Confirmée (historisation courte)
-            nouvel_etat = EtatCommande.objects.create(
-                commande=commande,
-                enum_etat=enum_confirmee,
+            changer_etat_commande(
+                commande,
+                enum_confirmee,
                 operateur=operateur,
-                date_debut=timezone.now(),
                 commentaire=commentaire
             )
             print(f"✅ DEBUG: Nouvel état créé: Confirmée")
 
             # Immédiatement basculer en file de préparation pour les superviseurs
             try:
-                # Clore l'état Confirmée pour n'avoir qu'un état actif
-                nouvel_etat.date_fin = timezone.now()
-                nouvel_etat.save(update_fields=['date_fin'])
-
-                # Créer l'état "À imprimer" (état d'entrée pour la préparation)
+                # Clore l'état Confirmée et créer l'état "À imprimer" (état d'entrée pour la préparation)
                 enum_a_imprimer = EnumEtatCmd.objects.get(libelle='À imprimer')
-                EtatCommande.objects.create(
-                    commande=commande,
-                    enum_etat=enum_a_imprimer,
+                changer_etat_commande(
+                    commande,
+                    enum_a_imprimer,
                     # On n'assigne pas d'opérateur spécifique: visible à tous les superviseurs
-                    date_debut=timezone.now(),
                     commentaire=f"Commande reçue de la confirmation par {operateur.nom_complet}"
                 )
                 print("📨 DEBUG: État 'À imprimer' créé pour file préparation (superviseurs)")
@@ -441,16 +420,14 @@ def confirmer_commande(request, commande_id):
                 messages.error(request, "Cette commande ne vous est pas affectée.")
                 return redirect('operatConfirme:liste_commandes')
             
-            # Terminer l'état actuel
-            etat_actuel.terminer_etat(operateur)
-            
-            # Créer un nouvel état "confirmée"
+            # Terminer l'état actuel et créer un nouvel état "confirmée"
             enum_confirmee = EnumEtatCmd.objects.get(libelle='Confirmée')
-            EtatCommande.objects.create(
-                commande=commande,
-                enum_etat=enum_confirmee,
+            changer_etat_commande(
+                commande,
+                enum_confirmee,
                 operateur=operateur,
-                commentaire=request.POST.get('commentaire', '')
+                commentaire=request.POST.get('commentaire', ''),
+                operateur_cloture=operateur
             )
             
             messages.success(request, f"Commande {commande.id_yz} confirmée avec succès.")
@@ -491,16 +468,14 @@ def marquer_erronnee(request, commande_id):
                 messages.error(request, "Cette commande ne vous est pas affectée.")
                 return redirect('operatConfirme:liste_commandes')
             
-            # Terminer l'état actuel
-            etat_actuel.terminer_etat(operateur)
-            
-            # Créer un nouvel état "erronée"
+            # Terminer l'état actuel et créer un nouvel état "erronée"
             enum_erronnee = EnumEtatCmd.objects.get(libelle='Erronée')
-            EtatCommande.objects.create(
-                commande=commande,
-                enum_etat=enum_erronnee,
+            changer_etat_commande(
+                commande,
+                enum_erronnee,
                 operateur=operateur,
-                commentaire=request.POST.get('motif', '')
+                commentaire=request.POST.get('motif', ''),
+                operateur_cloture=operateur
             )
             
             messages.success(request, f"Commande {commande.id_yz} marquée comme erronée.")
@@ -882,20 +857,18 @@ def lancer_confirmations(request):
                     ).first()
                     
                     if etat_actuel:
-                        # Terminer l'état actuel
-                        etat_actuel.terminer_etat(operateur)
-                        
-                        # Créer un nouvel état "en cours de confirmation"
+                        # Terminer l'état actuel et créer un nouvel état "en cours de confirmation"
                         enum_en_cours = EnumEtatCmd.objects.get_or_create(
                             libelle='en_cours_confirmation',
                             defaults={'ordre': 2, 'couleur': '#3B82F6'}
                         )[0]
                         
-                        EtatCommande.objects.create(
-                            commande=commande,
-                            enum_etat=enum_en_cours,
+                        changer_etat_commande(
+                            commande,
+                            enum_en_cours,
                             operateur=operateur,
-                            commentaire='Processus de confirmation automatique lancé'
+                            commentaire='Processus de confirmation automatique lancé',
+                            operateur_cloture=operateur
                         )
                         
                         commandes_traitees += 1
@@ -1064,16 +1037,11 @@ def confirmer_commandes_ajax(request):
                     ).first()
                     
                     if etat_actuel:
-                        # Terminer l'état actuel
-                        etat_actuel.date_fin = timezone.now()
-                        etat_actuel.save()
-                        
-                        # Créer le nouvel état "confirmée"
-                        EtatCommande.objects.create(
-                            commande=commande,
-                            enum_etat=etat_confirmee,
+                        # Terminer l'état actuel et créer le nouvel état "confirmée"
+                        changer_etat_commande(
+                            commande,
+                            etat_confirmee,
                             operateur=operateur,
-                            date_debut=timezone.now(),
                             commentaire=f"Commande confirmée via confirmation en masse"
                         )
                         
@@ -1168,16 +1136,11 @@ def lancer_confirmation(request, commande_id):
                     'message': 'État "En cours de confirmation" non trouvé dans le système'
                 })
             
-            # Terminer l'état actuel
-            etat_actuel.date_fin = timezone.now()
-            etat_actuel.save()
-            
-            # Créer le nouvel état "En cours de confirmation"
-            EtatCommande.objects.create(
-                commande=commande,
-                enum_etat=etat_en_cours,
+            # Terminer l'état actuel et créer le nouvel état "En cours de confirmation"
+            changer_etat_commande(
+                commande,
+                etat_en_cours,
                 operateur=operateur,
-                date_debut=timezone.now(),
                 commentaire="Confirmation lancée par l'opérateur"
             )
             
@@ -1220,7 +1183,6 @@ def lancer_confirmations_masse(request):
                     'message': 'Profil d\'opérateur de confirmation non trouvé'
                 })
             
-            launched_count = 0
             redirect_url = None
             
             # État "En cours de confirmation"
@@ -1236,47 +1198,22 @@ def lancer_confirmations_masse(request):
             if len(commande_ids) == 1:
                 redirect_url = reverse('operatConfirme:modifier_commande', args=[commande_ids[0]])
 
-            for commande_id in commande_ids:
-                try:
-                    # Récupérer la commande
-                    commande = Commande.objects.get(
-                        id=commande_id,
-                        etats__operateur=operateur,
-                        etats__date_fin__isnull=True
-                    )
-                    
-                    # Récupérer l'état actuel (non terminé) de cette commande pour cet opérateur
-                    etat_actuel = commande.etats.filter(
-                        operateur=operateur,
-                        date_fin__isnull=True
-                    ).first()
-                    
-                    # Vérifier que la commande est dans l'état "Affectée"
-                    if etat_actuel and etat_actuel.enum_etat.libelle.lower() == 'affectée':
-                        # Terminer l'état actuel
-                        etat_actuel.date_fin = timezone.now()
-                        etat_actuel.save()
-                        
-                        # Créer le nouvel état "En cours de confirmation"
-                        EtatCommande.objects.create(
-                            commande=commande,
-                            enum_etat=etat_en_cours,
-                            operateur=operateur,
-                            date_debut=timezone.now(),
-                            commentaire="Confirmation lancée en masse"
-                        )
-                        
-                        launched_count += 1
-                
-                except Commande.DoesNotExist:
-                    continue  # Ignorer les commandes non trouvées
-                except Exception as e:
-                    continue  # Ignorer les erreurs individuelles
+            # Seules les commandes affectées à cet opérateur passent en cours de confirmation
+            resultat = changer_etat_commandes(
+                commande_ids,
+                etat_en_cours,
+                operateur=operateur,
+                commentaire="Confirmation lancée en masse",
+                etats_source=('Affectée',),
+                operateur_source=operateur
+            )
+            launched_count = len(resultat.modifiees)
             
             if launched_count > 0:
                 response_data = {
                     'success': True,
-                    'message': f'{launched_count} confirmation(s) lancée(s) avec succès'
+                    'message': f'{launched_count} confirmation(s) lancée(s) avec succès',
+                    'resultats': resultat.par_commande()
                 }
                 if redirect_url:
                     response_data['redirect_url'] = redirect_url
@@ -1368,16 +1305,11 @@ def annuler_commande_confirmation(request, commande_id):
                 defaults={'ordre': 70, 'couleur': '#EF4444'}
             )
             
-            # Terminer l'état actuel
-            etat_actuel.date_fin = timezone.now()
-            etat_actuel.save()
-            
-            # Créer le nouvel état "Annulée"
-            EtatCommande.objects.create(
-                commande=commande,
-                enum_etat=etat_annulee,
+            # Terminer l'état actuel et créer le nouvel état "Annulée"
+            changer_etat_commande(
+                commande,
+                etat_annulee,
                 operateur=operateur,
-                date_debut=timezone.now(),
                 commentaire=f"Commande annulée par l'opérateur de confirmation - Motif: {motif}"
             )
             
@@ -2348,19 +2280,14 @@ def api_operations_commande(request, commande_id):
 @login_required
 def api_articles_disponibles(request):
     try:
-        # Récupérer tous les articles disponibles
+        # Récupérer tous les articles disponibles (stock, couleur et pointure sont des agrégats stockés)
         articles = Article.objects.filter(
             actif=True, 
-        ).order_by('nom')
+        ).select_related('categorie').order_by('nom')
         
         # Préparer les données des articles
         articles_data = []
         for article in articles:
-            # Mettre à jour le prix actuel si nécessaire
-            if article.prix_actuel is None:
-                article.prix_actuel = article.prix_unitaire
-                article.save(update_fields=['prix_actuel'])
-            
             # S'assurer que qte_disponible est bien un entier
             stock = article.qte_disponible
             if stock is None:
@@ -2389,7 +2316,8 @@ def api_articles_disponibles(request):
                 'qte_disponible': stock,
                 'isUpsell': bool(article.isUpsell),
                 'phase': article.phase,
-                'has_promo_active': article.has_promo_active,
+                # Promotion en cours, tenue à jour par le moteur de tarification (article.promotions)
+                'has_promo_active': article.promotion_appliquee_id is not None,
                 'description': article.description or '',
                 'image_url': image_url,
             })
@@ -2568,18 +2496,18 @@ def creer_commande(request):
                 # Créer l'état initial "Affectée" directement à l'opérateur créateur
                 try:
                     etat_affectee = EnumEtatCmd.objects.get(libelle='Affectée')
-                    EtatCommande.objects.create(
-                        commande=commande,
-                        enum_etat=etat_affectee,
+                    changer_etat_commande(
+                        commande,
+                        etat_affectee,
                         operateur=operateur,
                         commentaire=f"Commande créée et auto-affectée à {operateur.nom_complet}"
                     )
                 except EnumEtatCmd.DoesNotExist:
                     try:
                         etat_initial = EnumEtatCmd.objects.get(libelle='Non affectée')
-                        EtatCommande.objects.create(
-                            commande=commande,
-                            enum_etat=etat_initial,
+                        changer_etat_commande(
+                            commande,
+                            etat_initial,
                             commentaire=f"Commande créée par {operateur.nom_complet}"
                         )
                     except EnumEtatCmd.DoesNotExist:
@@ -2834,13 +2762,13 @@ def rafraichir_articles_section(request, commande_id):
 
 @login_required
 def api_recherche_client_tel(request):
-    """API pour rechercher un client par numéro de téléphone (recherche partielle)"""
+    """API pour rechercher un client par numéro de téléphone (début ou fin du numéro)"""
     if request.method == 'GET':
         query = request.GET.get('q', '').strip()
         results = []
         if query and len(query) >= 3:
-            from client.models import Client
-            clients = Client.objects.filter(numero_tel__icontains=query).order_by('prenom', 'nom')[:10]
+            from client.telephone import rechercher_clients_par_telephone
+            clients = rechercher_clients_par_telephone(query, limite=10)
             for c in clients:
                 results.append({
                     'id': c.pk,
@@ -2967,70 +2895,53 @@ def api_recherche_article_ref(request):
 def get_article_variants(request, article_id):
     """
     Récupère toutes les variantes disponibles d'un article donné
+    (matrice de disponibilité en cache et tarifs en cache : une requête pour l'article)
     """
     try:
-        from article.models import Article, VarianteArticle
-        
-        print(f"🔍 Recherche des variantes pour l'article ID: {article_id} (type: {type(article_id)})")
+        from article.disponibilite import matrice_disponibilite
+        from article.models import Article
+        from article.tarifs import tarifs_articles
         
         # Vérifier si l'article existe et s'il est actif
-        try:
-            article = Article.objects.get(id=article_id)
-            print(f"📋 Article trouvé: {article.nom} (actif: {article.actif})")
-            
-            if not article.actif:
-                print(f"⚠️ Article {article_id} existe mais est inactif")
-                return JsonResponse({
-                    'success': False,
-                    'error': f'L\'article "{article.nom}" (ID: {article_id}) est désactivé'
-                }, status=404)
-                
-        except Article.DoesNotExist:
-            print(f"❌ Aucun article trouvé avec l'ID {article_id}")
+        article = Article.objects.filter(id=article_id).values('id', 'nom', 'reference', 'actif').first()
+        if article is None:
             return JsonResponse({
                 'success': False,
                 'error': f'Aucun article trouvé avec l\'ID {article_id}'
             }, status=404)
-            
-        print(f"✅ Article actif trouvé: {article.nom}")
-        
-        # Récupérer toutes les variantes actives de cet article
-        variantes = VarianteArticle.objects.filter(
-            article=article,
-            actif=True
-        ).select_related('couleur', 'pointure').order_by('couleur__nom', 'pointure__ordre')
+        if not article['actif']:
+            return JsonResponse({
+                'success': False,
+                'error': f'L\'article "{article["nom"]}" (ID: {article_id}) est désactivé'
+            }, status=404)
         
-        print(f"📊 Nombre de variantes trouvées: {variantes.count()}")
+        tarif = tarifs_articles([article_id])[article_id]
         
-        # Construire la liste des variantes avec leurs informations
+        # Variantes actives, couleur par couleur puis pointure par pointure
         variants_data = []
-        for variante in variantes:
-            print(f"🔸 Variante: {variante.id} - Couleur: {variante.couleur} - Pointure: {variante.pointure} - Stock: {variante.qte_disponible}")
-            
-            variant_info = {
+        for variante in matrice_disponibilite(article_id).cellules():
+            variants_data.append({
                 'id': variante.id,
-                'couleur': variante.couleur.nom if variante.couleur else None,
-                'pointure': variante.pointure.pointure if variante.pointure else None,
+                'couleur': variante.couleur,
+                'pointure': variante.pointure,
                 'taille': None,  # À adapter selon votre modèle si vous avez des tailles
                 'stock': variante.qte_disponible,
-                'prix_unitaire': float(variante.prix_unitaire),
-                'prix_actuel': float(variante.prix_actuel),
+                'prix_unitaire': float(tarif.prix_unitaire),
+                'prix_actuel': float(tarif.prix_normal),
                 'reference_variante': variante.reference_variante,
-                'est_disponible': variante.est_disponible
-            }
-            variants_data.append(variant_info)
+                'est_disponible': variante.qte_disponible > 0
+            })
         
         response_data = {
             'success': True,
             'variants': variants_data,
             'article': {
-                'id': article.id,
-                'nom': article.nom,
-                'reference': article.reference
+                'id': article['id'],
+                'nom': article['nom'],
+                'reference': article['reference']
             }
         }
         
-        print(f"📤 Réponse envoyée: {len(variants_data)} variantes")
         return JsonResponse(response_data)
         
     except Exception as e:
@@ -6,9 +6,21 @@ from django.utils import timezone
 from datetime import datetime, timedelta
 import json
 
+from commande.etats import (
+    ANNULEE, ANNULEE_SAV, CONFIRMEE, EN_COURS_LIVRAISON, EN_LIVRAISON, PREPAREE, REPORTEE, RETOURNEE,
+)
 from commande.models import Commande, EtatCommande, EnumEtatCmd
 from parametre.models import Region, Ville, Operateur
-from article.models import Article
+from recherche.moteur import recherche_globale
+
+# Commandes à livrer, en cours de livraison ou reportées
+ETATS_LIVRAISONS = [PREPAREE, CONFIRMEE, EN_COURS_LIVRAISON, EN_LIVRAISON, REPORTEE]
+# Commandes revenues ou annulées par le service après-vente
+ETATS_RETOURS = [RETOURNEE, ANNULEE, ANNULEE_SAV]
+
+URLS_RECHERCHE = {
+    'commande': lambda commande_id: f'/operateur-logistique/commande/{commande_id}/',
+}
 
 
 @login_required
@@ -40,9 +52,11 @@ def global_search_api(request):
     }
     
     try:
-        # Recherche dans les commandes (pour logistique)
-        if category in ['all', 'commandes']:
-            results['commandes'] = search_commandes_logistique(query, request)
+        # Commandes : index de recherche, filtré selon le rôle
+        resultats_indexes, pagination = recherche_globale(
+            request, 'logistique', categories={'commandes': 'commande'}, urls=URLS_RECHERCHE,
+        )
+        results.update(resultats_indexes)
         
         # Recherche dans les livraisons
         if category in ['all', 'livraisons']:
@@ -68,6 +82,7 @@ def global_search_api(request):
             'success': True,
             'query': query,
             'results': results,
+            'pagination': pagination,
             'total_results': sum(len(v) for v in results.values())
         })
         
@@ -79,107 +94,6 @@ def global_search_api(request):
         })
 
 
-def search_commandes_logistique(query, request=None):
-    """Recherche dans les commandes pour logistique"""
-    commandes = []
-    
-    # Recherche par ID numérique
-    if query.isdigit():
-        try:
-            cmd = Commande.objects.get(id=int(query))
-            # Pour la recherche par ID, être plus permissif
-            commandes.append({
-                'id': cmd.id,
-                'type': 'commande',
-                'title': f'Commande #{cmd.id}',
-                'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-                'status': get_commande_status(cmd),
-                'url': f'/operateur-logistique/commande/{cmd.id}/',
-                'icon': 'fas fa-shopping-cart',
-                'priority': 1
-            })
-        except Commande.DoesNotExist:
-            pass
-    
-    # Recherche par numéro externe
-    try:
-        cmd_externe = Commande.objects.get(num_cmd__icontains=query)
-        commandes.append({
-            'id': cmd_externe.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd_externe.id} ({cmd_externe.num_cmd})',
-            'subtitle': f'Client: {cmd_externe.client.nom if cmd_externe.client else "N/A"} - {cmd_externe.total_cmd} DH',
-            'status': get_commande_status(cmd_externe),
-            'url': f'/operateur-logistique/commande/{cmd_externe.id}/',
-            'icon': 'fas fa-shopping-cart',
-            'priority': 1
-        })
-    except Commande.DoesNotExist:
-        pass
-    
-    # Recherche par client (exclure les recherches déjà faites par numéro externe)
-    commandes_client = Commande.objects.filter(
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    ).exclude(
-        num_cmd__icontains=query
-    )[:10]
-    
-    for cmd in commandes_client:
-        # Pour la recherche par client, être plus permissif
-        commandes.append({
-            'id': cmd.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-            'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-            'status': get_commande_status(cmd),
-            'url': f'/operateur-logistique/commande/{cmd.id}/',
-            'icon': 'fas fa-shopping-cart',
-            'priority': 2
-        })
-    
-    # Recherche par région/ville/ville_init (exclure les recherches déjà faites)
-    commandes_geo = Commande.objects.filter(
-        Q(ville__nom__icontains=query) |
-        Q(ville__region__nom_region__icontains=query) |
-        Q(ville_init__icontains=query)
-    ).exclude(
-        Q(num_cmd__icontains=query) |
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    )[:10]
-    
-    for cmd in commandes_geo:
-        # Pour la recherche par géographie, être plus permissif
-        ville_display = cmd.ville.nom if cmd.ville else "N/A"
-        if cmd.ville_init and cmd.ville_init != (cmd.ville.nom if cmd.ville else ""):
-            ville_display = f"{cmd.ville_init} → {ville_display}"
-        
-        commandes.append({
-            'id': cmd.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd.id} ({cmd.num_cmd})',
-            'subtitle': f'{ville_display} - {cmd.total_cmd} DH',
-            'status': get_commande_status(cmd),
-            'url': f'/operateur-logistique/commande/{cmd.id}/',
-            'icon': 'fas fa-shopping-cart',
-            'priority': 3
-        })
-    
-    # Dédupliquer les résultats par ID de commande
-    commandes_uniques = []
-    ids_vus = set()
-    
-    for cmd in commandes:
-        if cmd['id'] not in ids_vus:
-            commandes_uniques.append(cmd)
-            ids_vus.add(cmd['id'])
-    
-    return commandes_uniques[:10]
-
-
 def search_livraisons(query, request=None):
     """Recherche dans les livraisons"""
     livraisons = []
@@ -199,8 +113,7 @@ def search_livraisons(query, request=None):
     
     # Recherche par commandes préparées (prêtes pour livraison)
     commandes_preparees = Commande.objects.filter(
-        etats__enum_etat__libelle__in=["Préparée", "En livraison", "Confirmée"],
-        etats__date_fin__isnull=True
+        etat_courant__libelle__in=ETATS_LIVRAISONS
     )[:5]
     
     for cmd in commandes_preparees:
@@ -238,8 +151,7 @@ def search_retours(query, request=None):
     
     # Recherche par commandes retournées
     commandes_retournees = Commande.objects.filter(
-        etats__enum_etat__libelle__in=["Retournée", "En SAV", "Annulée"],
-        etats__date_fin__isnull=True
+        etat_courant__libelle__in=ETATS_RETOURS
     )[:5]
     
     for cmd in commandes_retournees:
@@ -270,8 +182,7 @@ def search_regions_logistique(query, request=None):
         # Compter les commandes à livrer de cette région (plus inclusif)
         commandes_region = Commande.objects.filter(
             ville__region=region,
-            etats__enum_etat__libelle__in=["Préparée", "En livraison", "Confirmée"],
-            etats__date_fin__isnull=True
+            etat_courant__libelle__in=ETATS_LIVRAISONS
         )
         
         # Compter toutes les commandes de la région
@@ -309,8 +220,7 @@ def search_villes_logistique(query, request=None):
         # Compter les commandes à livrer de cette ville (plus inclusif)
         commandes_ville = Commande.objects.filter(
             ville=ville,
-            etats__enum_etat__libelle__in=["Préparée", "En livraison", "Confirmée"],
-            etats__date_fin__isnull=True
+            etat_courant__libelle__in=ETATS_LIVRAISONS
         )
         
         # Compter toutes les commandes de la ville
@@ -333,8 +243,7 @@ def search_villes_logistique(query, request=None):
             # Compter les commandes avec cette ville initiale
             nb_commandes_init = Commande.objects.filter(
                 ville_init=ville_init,
-                etats__enum_etat__libelle__in=["Préparée", "En livraison", "Confirmée"],
-                etats__date_fin__isnull=True
+                etat_courant__libelle__in=ETATS_LIVRAISONS
             ).count()
             
             villes.append({
@@ -381,40 +290,10 @@ def search_statistiques_logistique(query):
     return statistiques
 
 
-def is_commande_for_logistique(commande, request=None):
-    """Vérifier si une commande est éligible pour la logistique"""
-    etat_actuel = commande.etats.filter(date_fin__isnull=True).first()
-    
-    if not etat_actuel:
-        return False
-    
-    # États éligibles pour la logistique (plus inclusifs)
-    etats_logistique = [
-        "Nouvelle", "Confirmée", "Préparée", "En livraison", 
-        "Livrée", "Retournée", "En SAV", "Annulée"
-    ]
-    
-    if etat_actuel.enum_etat.libelle not in etats_logistique:
-        return False
-    
-    # Si on a accès à la requête, vérifier l'affectation à l'opérateur
-    if request and hasattr(request, 'user'):
-        # Vérifier si la commande est affectée à l'opérateur logistique actuel
-        if hasattr(commande, 'operateur_logistique') and commande.operateur_logistique:
-            return commande.operateur_logistique == request.user
-        else:
-            # Si pas d'opérateur logistique assigné, inclure dans la recherche
-            # Pour tous les états logistiques
-            return True
-    
-    return True
-
-
 def get_commande_status(commande):
-    """Obtenir le statut actuel d'une commande"""
-    etat_actuel = commande.etats.filter(date_fin__isnull=True).first()
-    if etat_actuel:
-        return etat_actuel.enum_etat.libelle
+    """Obtenir le statut actuel d'une commande (état courant dénormalisé)"""
+    if commande.etat_courant:
+        return commande.etat_courant.libelle
     return "Nouvelle"
 
 
@@ -447,8 +326,7 @@ def search_suggestions_api(request):
     
     # Suggestions de commandes prêtes pour livraison
     recent_commandes = Commande.objects.filter(
-        etats__enum_etat__libelle="Préparée",
-        etats__date_fin__isnull=True
+        etat_courant__libelle="Préparée"
     ).order_by('-id')[:3]
     
     for cmd in recent_commandes:
@@ -459,8 +337,7 @@ def search_suggestions_api(request):
     
     # Suggestions de commandes en retour
     commandes_retour = Commande.objects.filter(
-        etats__enum_etat__libelle__in=["Retournée", "En SAV"],
-        etats__date_fin__isnull=True
+        etat_courant__libelle__in=ETATS_RETOURS
     ).order_by('-id')[:3]
     
     for cmd in commandes_retour:
@@ -4,6 +4,7 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from django.utils import timezone
 from commande.models import Commande, EtatCommande, EnumEtatCmd, Envoi
+from commande.transitions import changer_etat_commande
 from django.db import transaction
 from datetime import datetime
 import json
@@ -99,7 +100,7 @@ def changer_etat_livraison(request, commande_id):
 
             # Créer le nouvel état avec le commentaire complet
             commentaire_complet = commentaire + details_supplementaires
-            EtatCommande.objects.create(
+            changer_etat_commande(
                 commande=commande,
                 enum_etat=enum_etat,
                 operateur=operateur,
@@ -1,7 +1,7 @@
 from django.shortcuts               import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib                 import messages
-from django.db.models               import Q, Sum, Max, Count
+from django.db.models               import Q, Sum, Count
 from django.core.paginator          import Paginator
 from django.http                    import JsonResponse
 from django.views.decorators.http   import require_POST
@@ -11,6 +11,8 @@ import json
 
 from parametre.models import Operateur
 from commande.models  import Commande, Envoi, EnumEtatCmd, EtatCommande, Operation
+from commande.etats import LIVREE, LIVREE_AVEC_CHANGEMENT, REPORTEE, RETOURNEE
+from commande.transitions import changer_etat_commande
 from article.models   import Article
 
 
@@ -302,7 +304,7 @@ def corriger_livraisons_partielles():
                     defaults={'ordre': 30, 'couleur': '#3B82F6'}
                 )
                 
-                EtatCommande.objects.create(
+                changer_etat_commande(
                     commande=commande_renvoi,
                     enum_etat=etat_en_preparation,
                     operateur=operateur_choisi,
@@ -564,7 +566,7 @@ def changer_etat_sav(request, commande_id):
             return JsonResponse({'success': False, 'error': 'Nouvel état non spécifié.'})
         
         # Validation des états autorisés
-        etats_autorises = ['Reportée', 'Livrée', 'Livrée avec changement', 'Retournée']
+        etats_autorises = [REPORTEE, LIVREE, LIVREE_AVEC_CHANGEMENT, RETOURNEE]
         if nouvel_etat not in etats_autorises:
             return JsonResponse({'success': False, 'error': 'État non autorisé.'})
         
@@ -592,7 +594,7 @@ def changer_etat_sav(request, commande_id):
                 commentaire_final = f"{commentaire} - Type d'annulation: {type_annulation}"
             
             # Créer le nouvel état
-            EtatCommande.objects.create(
+            changer_etat_commande(
                 commande=commande,
                 enum_etat=etat_enum,
                 operateur=operateur,
@@ -673,7 +675,7 @@ def creer_envoi(request, commande_id):
                     defaults={'ordre': 60, 'couleur': '#3B82F6'}
                 )
                 
-                EtatCommande.objects.create(
+                changer_etat_commande(
                     commande=commande,
                     enum_etat=etat_enum,
                     operateur=operateur,
@@ -801,20 +803,13 @@ def creer_commande_sav(request, commande_id):
             return JsonResponse({'success': False, 'error': 'Aucun article défectueux spécifié.'})
         
         with transaction.atomic():
-            # Générer un ID YZ unique pour la commande SAV
-            last_id_yz = Commande.objects.aggregate(
-                max_id=Max('id_yz')
-            )['max_id']
-            new_id_yz = (last_id_yz or 0) + 1
-            
-            # Créer une nouvelle commande SAV
+            # Créer une nouvelle commande SAV (ID YZ attribué par Commande.save)
             nouvelle_commande = Commande.objects.create(
                 client=commande_originale.client,
                 ville=commande_originale.ville,
                 adresse=commande_originale.adresse,
                 total_cmd=0,  # Sera recalculé
                 num_cmd=f"SAV-{commande_originale.num_cmd}",
-                id_yz=new_id_yz,
                 is_upsell=False,
                 compteur=0
             )
@@ -846,7 +841,7 @@ def creer_commande_sav(request, commande_id):
             
             # Créer l'état initial "Non affectée"
             enum_etat = EnumEtatCmd.objects.get(libelle='Non affectée')
-            EtatCommande.objects.create(
+            changer_etat_commande(
                 commande=nouvelle_commande,
                 enum_etat=enum_etat,
                 operateur=operateur,
@@ -1129,7 +1124,7 @@ def renvoyer_en_preparation(request, commande_id):
             print(f"✅ {validation_message}")
             
             # Créer le nouvel état "En préparation" avec l'opérateur affecté
-            EtatCommande.objects.create(
+            changer_etat_commande(
                 commande=commande,
                 enum_etat=etat_en_preparation,
                 operateur=operateur_preparation_original,
@@ -1442,7 +1437,7 @@ def livraison_partielle(request, commande_id):
             else:
                 commentaire_etat += f" Type de retour: Renvoi en préparation."
                 
-            EtatCommande.objects.create(
+            changer_etat_commande(
                 commande=commande,
                 enum_etat=etat_livree_partiellement,
                 operateur=operateur,
@@ -1477,20 +1472,13 @@ def livraison_partielle(request, commande_id):
             if articles_renvoyes_filtres:
                 # Gérer selon le type de retour
                 if type_retour == 'preparation':
-                    # Retour en préparation : créer une nouvelle commande
-                    # Générer un ID YZ unique pour la commande de renvoi
-                    last_id_yz = Commande.objects.aggregate(
-                        max_id=Max('id_yz')
-                    )['max_id']
-                    new_id_yz = (last_id_yz or 0) + 1
-                    
+                    # Retour en préparation : créer une nouvelle commande (ID YZ attribué par Commande.save)
                     nouvelle_commande = Commande.objects.create(
                         client=commande.client,
                         ville=commande.ville,
                         adresse=commande.adresse,
                         total_cmd=0,  # Sera recalculé
                         num_cmd=f"RENVOI-{commande.num_cmd}",
-                        id_yz=new_id_yz,
                         is_upsell=False,
                         compteur=0
                     )
@@ -1619,7 +1607,7 @@ def livraison_partielle(request, commande_id):
                         defaults={'ordre': 30, 'couleur': '#3B82F6'}
                     )
                     
-                    EtatCommande.objects.create(
+                    changer_etat_commande(
                         commande=nouvelle_commande,
                         enum_etat=etat_en_preparation,
                         operateur=operateur_preparation_original,
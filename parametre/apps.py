@@ -8,3 +8,5 @@ class ParametreConfig(AppConfig):
 
     def ready(self):
         import parametre.signals
+        # Exports en arrière-plan (commande.jobs)
+        import parametre.dashboard_360.exports
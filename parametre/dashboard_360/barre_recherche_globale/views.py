@@ -9,7 +9,12 @@ import json
 
 from commande.models import Commande, EtatCommande, EnumEtatCmd
 from parametre.models import Region, Ville, Operateur
-from article.models import Article
+from recherche.moteur import recherche_globale
+
+URLS_RECHERCHE = {
+    'commande': lambda commande_id: f'/commande/detail/{commande_id}/',
+    'article': lambda article_id: f'/article/detail/{article_id}/',
+}
 
 
 @staff_member_required
@@ -43,9 +48,11 @@ def global_search_api(request):
     }
     
     try:
-        # Recherche dans les commandes
-        if category in ['all', 'commandes']:
-            results['commandes'] = search_commandes(query)
+        # Commandes et articles : index de recherche
+        resultats_indexes, pagination = recherche_globale(
+            request, 'admin', categories={'commandes': 'commande', 'articles': 'article'}, urls=URLS_RECHERCHE,
+        )
+        results.update(resultats_indexes)
         
         # Recherche dans les opérateurs
         if category in ['all', 'operateurs']:
@@ -59,10 +66,6 @@ def global_search_api(request):
         if category in ['all', 'villes']:
             results['villes'] = search_villes(query)
         
-        # Recherche dans les articles
-        if category in ['all', 'articles']:
-            results['articles'] = search_articles(query)
-        
         # Recherche dans les statistiques
         if category in ['all', 'statistiques']:
             results['statistiques'] = search_statistiques(query)
@@ -71,6 +74,7 @@ def global_search_api(request):
             'success': True,
             'query': query,
             'results': results,
+            'pagination': pagination,
             'total_results': sum(len(v) for v in results.values())
         })
         
@@ -82,90 +86,6 @@ def global_search_api(request):
         })
 
 
-def search_commandes(query):
-    """Recherche dans les commandes"""
-    commandes = []
-    
-    # Recherche par ID
-    if query.isdigit():
-        try:
-            cmd = Commande.objects.get(id=int(query))
-            commandes.append({
-                'id': cmd.id,
-                'type': 'commande',
-                'title': f'Commande #{cmd.id}',
-                'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-                'status': get_commande_status(cmd),
-                'url': f'/commande/detail/{cmd.id}/',
-                'icon': 'fas fa-shopping-cart',
-                'priority': 1
-            })
-        except Commande.DoesNotExist:
-            pass
-    
-    # Recherche par client
-    commandes_client = Commande.objects.filter(
-        Q(client__nom__icontains=query) |
-        Q(client__prenom__icontains=query) |
-        Q(client__email__icontains=query)
-    )[:5]
-    
-    for cmd in commandes_client:
-        commandes.append({
-            'id': cmd.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd.id}',
-            'subtitle': f'Client: {cmd.client.nom if cmd.client else "N/A"} - {cmd.total_cmd} DH',
-            'status': get_commande_status(cmd),
-            'url': f'/commande/detail/{cmd.id}/',
-            'icon': 'fas fa-shopping-cart',
-            'priority': 2
-        })
-    
-    # Recherche par région/ville
-    commandes_geo = Commande.objects.filter(
-        Q(ville__nom__icontains=query) |
-        Q(ville__region__nom_region__icontains=query)
-    )[:5]
-    
-    for cmd in commandes_geo:
-        commandes.append({
-            'id': cmd.id,
-            'type': 'commande',
-            'title': f'Commande #{cmd.id}',
-            'subtitle': f'{cmd.ville.nom if cmd.ville else "N/A"} - {cmd.total_cmd} DH',
-            'status': get_commande_status(cmd),
-            'url': f'/commande/detail/{cmd.id}/',
-            'icon': 'fas fa-shopping-cart',
-            'priority': 3
-        })
-    
-    # Recherche par montant
-    if any(keyword in query.lower() for keyword in ['dh', 'montant', 'prix']):
-        try:
-            # Extraire le montant de la requête
-            import re
-            montant_match = re.search(r'(\d+)', query)
-            if montant_match:
-                montant = float(montant_match.group(1))
-                commandes_montant = Commande.objects.filter(total_cmd__gte=montant)[:3]
-                for cmd in commandes_montant:
-                    commandes.append({
-                        'id': cmd.id,
-                        'type': 'commande',
-                        'title': f'Commande #{cmd.id}',
-                        'subtitle': f'Montant: {cmd.total_cmd} DH',
-                        'status': get_commande_status(cmd),
-                        'url': f'/commande/detail/{cmd.id}/',
-                        'icon': 'fas fa-shopping-cart',
-                        'priority': 4
-                    })
-        except:
-            pass
-    
-    return commandes[:10]  # Limiter à 10 résultats
-
-
 def search_operateurs(query):
     """Recherche dans les opérateurs"""
     operateurs = []
@@ -228,8 +148,7 @@ def search_regions(query):
         # Compter les commandes de cette région
         nb_commandes = Commande.objects.filter(
             ville__region=region,
-            etats__enum_etat__libelle__in=["Confirmée", "À imprimer", "Préparée", "En préparation"],
-            etats__date_fin__isnull=True
+            etat_courant__libelle__in=["Confirmée", "À imprimer", "Préparée", "En préparation"]
         ).count()
         
         regions.append({
@@ -259,8 +178,7 @@ def search_villes(query):
         # Compter les commandes de cette ville
         nb_commandes = Commande.objects.filter(
             ville=ville,
-            etats__enum_etat__libelle__in=["Confirmée", "À imprimer", "Préparée", "En préparation"],
-            etats__date_fin__isnull=True
+            etat_courant__libelle__in=["Confirmée", "À imprimer", "Préparée", "En préparation"]
         ).count()
         
         villes.append({
@@ -277,31 +195,6 @@ def search_villes(query):
     return villes
 
 
-def search_articles(query):
-    """Recherche dans les articles"""
-    articles = []
-    
-    articles_match = Article.objects.filter(
-        Q(nom__icontains=query) |
-        Q(reference__icontains=query) |
-        Q(description__icontains=query)
-    )[:5]
-    
-    for article in articles_match:
-        articles.append({
-            'id': article.id,
-            'type': 'article',
-            'title': article.nom,
-            'subtitle': f'Réf: {article.reference} - Stock: {article.qte_disponible}',
-            'status': 'En stock' if article.qte_disponible > 0 else 'Rupture',
-            'url': f'/article/detail/{article.id}/',
-            'icon': 'fas fa-box',
-            'priority': 1
-        })
-    
-    return articles
-
-
 def search_statistiques(query):
     """Recherche dans les statistiques"""
     statistiques = []
@@ -333,14 +226,6 @@ def search_statistiques(query):
     return statistiques
 
 
-def get_commande_status(commande):
-    """Obtenir le statut actuel d'une commande"""
-    etat_actuel = commande.etats.filter(date_fin__isnull=True).first()
-    if etat_actuel:
-        return etat_actuel.enum_etat.libelle
-    return "Nouvelle"
-
-
 @staff_member_required
 @login_required
 def search_suggestions_api(request):
@@ -380,8 +265,7 @@ def search_suggestions_api(request):
     # Suggestions de régions actives
     active_regions = Region.objects.annotate(
         nb_commandes=Count('villes__commandes', filter=Q(
-            villes__commandes__etats__enum_etat__libelle__in=["Confirmée", "À imprimer", "Préparée", "En préparation"],
-            villes__commandes__etats__date_fin__isnull=True
+            villes__commandes__etat_courant__libelle__in=["Confirmée", "À imprimer", "Préparée", "En préparation"]
         ))
     ).filter(nb_commandes__gt=0)[:3]
     
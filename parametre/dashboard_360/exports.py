@@ -0,0 +1,141 @@
+"""
+Export des commandes de la vue 360 : une ligne par article du panier (une
+ligne sans article pour une commande vide), avec les jalons de l'historique.
+
+Les colonnes servent au CSV (réponse en flux) et au classeur Excel, construit
+en arrière-plan (commande.jobs) pour les gros volumes.
+"""
+from typing import NamedTuple, Optional
+
+from commande.exports import Colonne, Feuille
+from commande.jobs import ContenuExport, export_differe
+from commande.models import Commande, Panier
+
+from .views import classer_etats, couleur_pointure_panier, etats_ordonnes, filtrer_commandes_360, queryset_commandes_360
+
+TITRE_FEUILLE = "Commandes avec Paniers"
+
+
+class Ligne360(NamedTuple):
+    commande: Commande
+    jalons: dict
+    panier: Optional[Panier]
+
+
+def lignes_360(commandes):
+    """Lignes de l'export, commandes lues par lots (historique et paniers préchargés par lot)"""
+    for commande in commandes.iterator(chunk_size=500):
+        # Jalons de l'historique préchargé (l'état le plus récent de chaque jalon)
+        jalons = classer_etats(reversed(etats_ordonnes(commande)))
+        paniers = commande.paniers.all()
+        if not paniers:
+            yield Ligne360(commande, jalons, None)
+        for panier in paniers:
+            yield Ligne360(commande, jalons, panier)
+
+
+def _client(ligne, attribut):
+    return getattr(ligne.commande.client, attribut) if ligne.commande.client else "N/A"
+
+
+def _article(ligne, attribut):
+    return (getattr(ligne.panier.article, attribut) or "N/A") if ligne.panier else "N/A"
+
+
+def _libelle(ligne, jalon, defaut):
+    etat = ligne.jalons[jalon]
+    return etat.enum_etat.libelle if etat else defaut
+
+
+def _mail_operateur(ligne, jalon):
+    etat = ligne.jalons[jalon]
+    return etat.operateur.mail if etat and etat.operateur else "N/A"
+
+
+def _couleur(ligne):
+    return (couleur_pointure_panier(ligne.panier)[0] or "N/A") if ligne.panier else "N/A"
+
+
+def _pointure(ligne):
+    return (couleur_pointure_panier(ligne.panier)[1] or "N/A") if ligne.panier else "N/A"
+
+
+def _date_confirmation(ligne):
+    etat = ligne.jalons['confirmation']
+    return etat.date_debut if etat and etat.date_debut else "N/A"
+
+
+COLONNES_360 = [
+    Colonne('N°', lambda ligne: ligne.commande.num_cmd, 20),
+    Colonne('Identifiant Yoozak', lambda ligne: ligne.commande.id_yz, 20),
+    Colonne(
+        'CLIENT',
+        lambda ligne: f"{ligne.commande.client.prenom} {ligne.commande.client.nom}" if ligne.commande.client else "N/A",
+        20,
+    ),
+    Colonne('TELEPHONE', lambda ligne: _client(ligne, 'numero_tel'), 20),
+    Colonne('ADRESSE', lambda ligne: _client(ligne, 'adresse'), 20),
+    Colonne('VILLE', lambda ligne: ligne.commande.ville.nom if ligne.commande.ville else "N/A", 20),
+    Colonne(
+        'REGION',
+        lambda ligne: (
+            ligne.commande.ville.region.nom_region if ligne.commande.ville and ligne.commande.ville.region else "N/A"
+        ),
+        20,
+    ),
+    Colonne('ARTICLE NOM', lambda ligne: _article(ligne, 'nom')),
+    Colonne('ARTICLE REFERENCE', lambda ligne: _article(ligne, 'reference')),
+    Colonne('ARTICLE COULEUR', _couleur),
+    Colonne('ARTICLE POINTURE', _pointure),
+    Colonne('QUANTITE', lambda ligne: ligne.panier.quantite if ligne.panier else 0),
+    Colonne('PRIX UNITAIRE', lambda ligne: ligne.panier.article.prix_unitaire if ligne.panier else 0, 15, 'yz_montant'),
+    Colonne('SOUS TOTAL ARTICLE', lambda ligne: ligne.panier.sous_total if ligne.panier else 0, 15, 'yz_montant'),
+    Colonne('PRIX TOTAL COMMANDE (DH)', lambda ligne: ligne.commande.total_cmd, 18, 'yz_montant'),
+    Colonne('DATE COMMANDE', lambda ligne: ligne.commande.date_cmd or "N/A", 18, 'yz_jour'),
+    Colonne('CONFIRMATION', lambda ligne: _libelle(ligne, 'confirmation', "Non Confirmée"), 18),
+    Colonne('DATE CONFIRMATION', _date_confirmation, 18, 'yz_date'),
+    Colonne(
+        'OBSERVATIONS CONFIRMATION',
+        lambda ligne: ligne.jalons['confirmation'].commentaire if ligne.jalons['confirmation'] else "",
+        18,
+    ),
+    Colonne('OPERATEUR', lambda ligne: _mail_operateur(ligne, 'affectation'), 18),
+    Colonne('AGENT CONFIRMATION', lambda ligne: _mail_operateur(ligne, 'confirmation'), 18),
+    Colonne('CLIENT FIDELE', lambda ligne: "future qui seras des les tables models plustard dans le projet", 18),
+    Colonne('UPSELL', lambda ligne: "Oui" if ligne.commande.is_upsell else "Non", 18),
+    Colonne('PREPARATION', lambda ligne: _libelle(ligne, 'preparation', "Non Préparée"), 18),
+    Colonne('ETAT LIVRAISON', lambda ligne: _libelle(ligne, 'livraison', "En attente"), 18),
+    Colonne('ETAT PAIEMENT', lambda ligne: _libelle(ligne, 'paiement', "Non Payé"), 18),
+    Colonne('TARIF', lambda ligne: 0.0, 18, 'yz_montant'),
+    Colonne('RESTE A PAYER', lambda ligne: ligne.commande.total_cmd, 18, 'yz_montant'),
+    Colonne('DATE PAIEMENT', lambda ligne: "N/A", 18),
+    Colonne('PIECE RETOURNEE', lambda ligne: "Oui" if ligne.jalons['retour'] else "Non", 18),
+    Colonne(
+        'OBSERVATION LIVRAISON',
+        lambda ligne: ligne.jalons['retour'].commentaire if ligne.jalons['retour'] else "",
+        18,
+    ),
+]
+
+
+def feuille_360(search=None, date_debut=None, date_fin=None):
+    commandes = filtrer_commandes_360(queryset_commandes_360(), search, date_debut, date_fin)
+    return Feuille(TITRE_FEUILLE, lignes_360(commandes), COLONNES_360)
+
+
+def nombre_lignes_360(search=None, date_debut=None, date_fin=None):
+    """Nombre de lignes de l'export : un article par ligne, plus les commandes sans article"""
+    commandes = filtrer_commandes_360(Commande.objects.all(), search, date_debut, date_fin).order_by()
+    return (
+        Panier.objects.filter(commande__in=commandes.values('pk')).count()
+        + commandes.filter(paniers__isnull=True).count()
+    )
+
+
+@export_differe('commandes_360')
+def export_360(search=None, date_debut=None, date_fin=None):
+    return ContenuExport(
+        "export_commandes_avec_paniers_360.xlsx",
+        [feuille_360(search, date_debut, date_fin)],
+        nombre_lignes_360(search, date_debut, date_fin),
+    )
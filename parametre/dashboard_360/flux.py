@@ -0,0 +1,155 @@
+"""
+Flux de modifications et compteurs globaux de la vue 360.
+
+Au lieu de resérialiser une page complète et de recompter toutes les tables à
+chaque rafraîchissement, les tableaux de bord gardent un curseur (identifiant de
+la dernière ModificationCommande reçue) et ne demandent que les commandes
+modifiées depuis. Les écritures d'états, de paniers et de commandes alimentent
+le flux dans leur propre transaction (voir parametre.signals).
+
+Les identifiants étant attribués à l'insertion mais visibles au commit, une
+modification d'identifiant plus petit peut apparaître après une plus grande.
+Le curseur renvoyé n'avance donc que jusqu'aux modifications plus anciennes que
+DELAI_STABILISATION (à régler au-delà de la durée des plus longues transactions
+d'écriture) : les plus récentes sont renvoyées à nouveau au passage suivant
+(le client remplace simplement les lignes concernées).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from article.models import Article
+from client.models import Client
+from commande.models import Commande
+from parametre.models import CompteurGlobal, ModificationCommande, Operateur
+
+DELAI_STABILISATION = timedelta(seconds=getattr(settings, 'VUE_360_DELAI_STABILISATION', 30))
+
+# Nombre maximal de modifications lues par appel (le client rappelle tant que has_more est vrai)
+LIMITE_MODIFICATIONS = 500
+
+# Au-delà de cette durée, un compteur est recompté (rattrape les écritures en masse non signalées)
+DUREE_VALIDITE_COMPTEURS = timedelta(hours=1)
+
+COMPTEURS_GLOBAUX = {
+    'total_articles': Article,
+    'total_clients': Client,
+    'total_commandes': Commande,
+    'total_operateurs': Operateur,
+}
+COMPTEUR_PAR_MODELE = {modele: nom for nom, modele in COMPTEURS_GLOBAUX.items()}
+
+
+def enregistrer_modifications(commande_ids, type_modification):
+    """Ajoute une entrée au flux par commande modifiée (à appeler dans la transaction de l'écriture)"""
+    commande_ids = {commande_id for commande_id in commande_ids if commande_id}
+    if not commande_ids:
+        return
+    maintenant = timezone.now()
+    ModificationCommande.objects.bulk_create([
+        ModificationCommande(id_commande=commande_id, type_modification=type_modification, date_modification=maintenant)
+        for commande_id in sorted(commande_ids)
+    ], batch_size=1000)
+
+
+def curseur_courant():
+    """Curseur à partir duquel un client qui vient de charger la page doit suivre le flux"""
+    limite = timezone.now() - DELAI_STABILISATION
+    return ModificationCommande.objects.filter(
+        date_modification__lte=limite
+    ).order_by('-pk').values_list('pk', flat=True).first() or 0
+
+
+def modifications_depuis(curseur, limite=LIMITE_MODIFICATIONS):
+    """
+    Modifications postérieures au curseur.
+
+    Returns:
+        dict: ids_modifies (commandes modifiées hors suppressions, dans l'ordre du flux), ids_supprimes,
+              curseur (nouveau curseur stable), has_more (d'autres modifications restent à lire)
+    """
+    lignes = list(
+        ModificationCommande.objects.filter(pk__gt=curseur)
+        .order_by('pk')
+        .values_list('pk', 'id_commande', 'type_modification', 'date_modification')[:limite]
+    )
+
+    limite_stable = timezone.now() - DELAI_STABILISATION
+    nouveau_curseur = curseur
+    curseur_stable = True
+    ids_modifies = {}
+    ids_supprimes = set()
+    for pk, id_commande, type_modification, date_modification in lignes:
+        # Le curseur s'arrête à la première modification trop récente pour être définitive
+        if curseur_stable and date_modification <= limite_stable:
+            nouveau_curseur = pk
+        else:
+            curseur_stable = False
+        if type_modification == 'suppression':
+            ids_supprimes.add(id_commande)
+            ids_modifies.pop(id_commande, None)
+        else:
+            ids_supprimes.discard(id_commande)
+            ids_modifies[id_commande] = None
+
+    return {
+        'ids_modifies': list(ids_modifies),
+        'ids_supprimes': sorted(ids_supprimes),
+        'curseur': nouveau_curseur,
+        'has_more': len(lignes) == limite and curseur_stable,
+    }
+
+
+def purger_modifications(jours=7):
+    """Supprime les entrées du flux plus anciennes que `jours` jours"""
+    limite = timezone.now() - timedelta(days=jours)
+    return ModificationCommande.objects.filter(date_modification__lt=limite).delete()[0]
+
+
+def ajuster_compteur(modele, delta):
+    """
+    Incrémente (ou décrémente) le compteur global d'un modèle, sans le lire,
+    au commit de la transaction courante (immédiatement hors transaction).
+
+    L'UPDATE s'exécute hors de la transaction de l'écriture : la ligne du
+    compteur n'est verrouillée que le temps de la requête, et non jusqu'au
+    commit de chaque création de commande ou de chaque lot synchronisé. Un
+    ajustement perdu est rattrapé au recomptage (DUREE_VALIDITE_COMPTEURS).
+    """
+    nom = COMPTEUR_PAR_MODELE.get(modele)
+    if nom and delta:
+        transaction.on_commit(lambda: CompteurGlobal.objects.filter(nom=nom).update(valeur=F('valeur') + delta))
+
+
+def recompter_compteurs(noms=None):
+    """Recalcule des compteurs globaux par COUNT(*) (initialisation et rattrapage)"""
+    maintenant = timezone.now()
+    for nom in noms or COMPTEURS_GLOBAUX:
+        CompteurGlobal.objects.update_or_create(
+            nom=nom,
+            defaults={'valeur': COMPTEURS_GLOBAUX[nom].objects.count(), 'date_recomptage': maintenant},
+        )
+
+
+def compteurs_globaux():
+    """
+    Valeurs des compteurs globaux, en une requête.
+    Les compteurs absents ou trop anciens sont recomptés au passage.
+    """
+    compteurs = {
+        compteur.nom: compteur for compteur in CompteurGlobal.objects.filter(nom__in=COMPTEURS_GLOBAUX)
+    }
+    limite = timezone.now() - DUREE_VALIDITE_COMPTEURS
+    a_recompter = [
+        nom for nom in COMPTEURS_GLOBAUX
+        if nom not in compteurs or compteurs[nom].date_recomptage < limite
+    ]
+    if a_recompter:
+        recompter_compteurs(a_recompter)
+        compteurs.update({
+            compteur.nom: compteur for compteur in CompteurGlobal.objects.filter(nom__in=a_recompter)
+        })
+    return {nom: compteurs[nom].valeur for nom in COMPTEURS_GLOBAUX}
@@ -1,68 +1,130 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import HttpResponse, JsonResponse
-from django.db.models import Count, Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.db.models import Count, Prefetch, Q
 from django.core.paginator import Paginator
 from parametre.models import Operateur
+from parametre.dashboard_360.flux import compteurs_globaux, curseur_courant, modifications_depuis
 from article.models import Article
-from commande.models import Commande, EtatCommande, EnumEtatCmd
+from commande.models import Commande, EtatCommande, EnumEtatCmd, Panier
 from client.models import Client
-import csv
+from commande.exports import reponse_csv
+from commande.jobs import lancer_export
 import io
 import zipfile
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
 from django.utils.encoding import smart_str
 from django.utils import timezone
+import asyncio
 import json
+import time
 from datetime import datetime, timedelta
-
-@staff_member_required
-@login_required
-def page_360(request):
-    """Page 360 - Vue d'overview et exportation des données"""
-    # Statistiques générales
-    total_articles = Article.objects.count()
-    total_clients = Client.objects.count()
-    total_commandes = Commande.objects.count()
-    total_operateurs = Operateur.objects.count()
-    
-    # Récupérer toutes les commandes avec filtres et pagination - optimisé avec only()
-    commandes_360 = Commande.objects.select_related(
-        'client', 
-        'ville', 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Flux SSE de la vue 360 (déploiement ASGI uniquement), sinon le navigateur interroge l'API delta
+FLUX_SSE_ACTIF = getattr(settings, 'VUE_360_SSE', False)
+# Intervalle (secondes) entre deux lectures du flux, et durée de vie d'une connexion SSE
+INTERVALLE_FLUX = 5
+DUREE_MAX_FLUX = 300
+
+# Jalons du cycle de vie d'une commande : motif recherché dans le libellé de l'état
+JALONS_ETATS = {
+    'affectation': 'affectée',
+    'confirmation': 'confirmée',
+    'preparation': 'préparation en cours',
+    'livraison': 'livrée',
+    'paiement': 'payée',
+    'retour': 'retournée',
+}
+
+
+def queryset_commandes_360():
+    """
+    Commandes de la vue 360 avec tout ce qu'utilise prepare_commandes_data :
+    historique des états trié (opérateur et libellé joints) et paniers avec article et variante,
+    chargés en un nombre constant de requêtes quel que soit le nombre de commandes.
+    """
+    return Commande.objects.select_related(
+        'client',
+        'ville',
         'ville__region'
     ).prefetch_related(
-        'etats__enum_etat',
-        'etats__operateur', # Pour récupérer l'opérateur qui a fait l'état
-        'paniers__article' # Accéder aux articles via les paniers
+        Prefetch(
+            'etats',
+            queryset=EtatCommande.objects.select_related('enum_etat', 'operateur').order_by('date_debut', 'pk')
+        ),
+        Prefetch(
+            'paniers',
+            queryset=Panier.objects.select_related('article', 'variante__couleur', 'variante__pointure')
+        ),
     ).only(
         'id', 'num_cmd', 'id_yz', 'date_cmd', 'total_cmd', 'is_upsell',
         'client__nom', 'client__prenom', 'client__numero_tel', 'client__adresse',
         'ville__nom', 'ville__region__nom_region'
     )
-    
-    # Filtres de recherche
-    search = request.GET.get('search')
+
+
+def filtrer_commandes_360(commandes, search=None, date_debut=None, date_fin=None):
+    """Applique les filtres de recherche et de période de la vue 360"""
     if search:
-        commandes_360 = commandes_360.filter(
+        commandes = commandes.filter(
             Q(num_cmd__icontains=search) |
             Q(id_yz__icontains=search) |
             Q(client__nom__icontains=search) |
             Q(client__prenom__icontains=search) |
             Q(client__numero_tel__icontains=search)
         )
-    
-    date_debut = request.GET.get('date_debut')
     if date_debut:
-        commandes_360 = commandes_360.filter(date_cmd__gte=date_debut)
-        
-    date_fin = request.GET.get('date_fin')
+        commandes = commandes.filter(date_cmd__gte=date_debut)
     if date_fin:
-        commandes_360 = commandes_360.filter(date_cmd__lte=date_fin)
+        commandes = commandes.filter(date_cmd__lte=date_fin)
+    return commandes.order_by('-date_cmd')
+
+
+def etats_ordonnes(commande):
+    """Historique des états de la commande, du plus ancien au plus récent, lu depuis les données préchargées"""
+    return sorted(commande.etats.all(), key=lambda etat: (etat.date_debut, etat.pk))
+
+
+def classer_etats(etats):
+    """
+    Associe à chaque jalon (JALONS_ETATS) le premier état de la liste dont le libellé
+    contient son motif, sans requête supplémentaire.
+
+    Returns:
+        dict: {jalon: EtatCommande ou None}
+    """
+    jalons = dict.fromkeys(JALONS_ETATS)
+    for etat in etats:
+        libelle = etat.enum_etat.libelle.lower()
+        for jalon, motif in JALONS_ETATS.items():
+            if jalons[jalon] is None and motif in libelle:
+                jalons[jalon] = etat
+    return jalons
+
+
+def couleur_pointure_panier(panier):
+    """Couleur et pointure d'une ligne de panier, portées par sa variante"""
+    variante = panier.variante
+    couleur = variante.couleur.nom if variante and variante.couleur else None
+    pointure = variante.pointure.pointure if variante and variante.pointure else None
+    return couleur, pointure
+
+
+@staff_member_required
+@login_required
+def page_360(request):
+    """Page 360 - Vue d'overview et exportation des données"""
+    # Statistiques générales (compteurs maintenus par incréments)
+    statistiques = compteurs_globaux()
     
-    commandes_360 = commandes_360.order_by('-date_cmd')
+    # Récupérer toutes les commandes avec filtres et pagination
+    search = request.GET.get('search')
+    date_debut = request.GET.get('date_debut')
+    date_fin = request.GET.get('date_fin')
+    commandes_360 = filtrer_commandes_360(queryset_commandes_360(), search, date_debut, date_fin)
     
     # Pagination - 50 commandes par page
     paginator = Paginator(commandes_360, 50)
@@ -73,11 +135,11 @@ def page_360(request):
     data_for_template = prepare_commandes_data(page_obj)
 
     context = {
-        'total_articles': total_articles,
-        'total_clients': total_clients,
-        'total_commandes': total_commandes,
-        'total_operateurs': total_operateurs,
+        **statistiques,
         'commandes_data': data_for_template,
+        # Point de départ du flux de modifications suivi par la page
+        'curseur_modifications': curseur_courant(),
+        'flux_sse_actif': FLUX_SSE_ACTIF,
         'page_obj': page_obj,
         'search': search,
         'date_debut': date_debut,
@@ -97,33 +159,7 @@ def vue_360_realtime_data(request):
         page = request.GET.get('page', 1)
         
         # Construire la requête avec les mêmes filtres
-        commandes_360 = Commande.objects.select_related(
-            'client', 'ville', 'ville__region'
-        ).prefetch_related(
-            'etats__enum_etat', 'etats__operateur', 'paniers__article'
-        ).only(
-            'id', 'num_cmd', 'id_yz', 'date_cmd', 'total_cmd', 'is_upsell',
-            'client__nom', 'client__prenom', 'client__numero_tel', 'client__adresse',
-            'ville__nom', 'ville__region__nom_region'
-        )
-        
-        # Appliquer les filtres
-        if search:
-            commandes_360 = commandes_360.filter(
-                Q(num_cmd__icontains=search) |
-                Q(id_yz__icontains=search) |
-                Q(client__nom__icontains=search) |
-                Q(client__prenom__icontains=search) |
-                Q(client__numero_tel__icontains=search)
-            )
-        
-        if date_debut:
-            commandes_360 = commandes_360.filter(date_cmd__gte=date_debut)
-            
-        if date_fin:
-            commandes_360 = commandes_360.filter(date_cmd__lte=date_fin)
-        
-        commandes_360 = commandes_360.order_by('-date_cmd')
+        commandes_360 = filtrer_commandes_360(queryset_commandes_360(), search, date_debut, date_fin)
         
         # Pagination
         paginator = Paginator(commandes_360, 50)
@@ -132,11 +168,6 @@ def vue_360_realtime_data(request):
         # Préparer les données
         commandes_data = prepare_commandes_data(page_obj)
         
-        # Statistiques mises à jour
-        total_articles = Article.objects.count()
-        total_clients = Client.objects.count()
-        total_commandes = Commande.objects.count()
-        total_operateurs = Operateur.objects.count()
         
         return JsonResponse({
             'success': True,
@@ -150,12 +181,7 @@ def vue_360_realtime_data(request):
                 'previous_page': page_obj.previous_page_number() if page_obj.has_previous() else None,
                 'next_page': page_obj.next_page_number() if page_obj.has_next() else None,
             },
-            'statistics': {
-                'total_articles': total_articles,
-                'total_clients': total_clients,
-                'total_commandes': total_commandes,
-                'total_operateurs': total_operateurs,
-            },
+            'statistics': compteurs_globaux(),
             'filters': {
                 'search': search,
                 'date_debut': date_debut,
@@ -176,19 +202,9 @@ def vue_360_realtime_data(request):
 def vue_360_statistics_update(request):
     """API pour mettre à jour uniquement les statistiques"""
     try:
-        total_articles = Article.objects.count()
-        total_clients = Client.objects.count()
-        total_commandes = Commande.objects.count()
-        total_operateurs = Operateur.objects.count()
-        
         return JsonResponse({
             'success': True,
-            'statistics': {
-                'total_articles': total_articles,
-                'total_clients': total_clients,
-                'total_commandes': total_commandes,
-                'total_operateurs': total_operateurs,
-            },
+            'statistics': compteurs_globaux(),
             'timestamp': timezone.now().isoformat(),
         })
         
@@ -199,6 +215,115 @@ def vue_360_statistics_update(request):
             'timestamp': timezone.now().isoformat(),
         }, status=500)
 
+def _donnees_modifications(curseur, search=None, date_debut=None, date_fin=None):
+    """
+    Commandes modifiées depuis le curseur, sérialisées comme les lignes du tableau.
+    Une commande modifiée absente de commandes_data ne correspond plus aux filtres.
+    """
+    modifications = modifications_depuis(curseur)
+    commandes_data = []
+    if modifications['ids_modifies']:
+        commandes = filtrer_commandes_360(
+            queryset_commandes_360().filter(pk__in=modifications['ids_modifies']),
+            search, date_debut, date_fin
+        )
+        commandes_data = prepare_commandes_data(commandes)
+    return {
+        **modifications,
+        'commandes_data': commandes_data,
+        'statistics': compteurs_globaux(),
+    }
+
+
+def _lire_curseur(valeur):
+    try:
+        return max(int(valeur), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+@staff_member_required
+@login_required
+def vue_360_modifications(request):
+    """
+    API delta de la vue 360 : commandes modifiées depuis le curseur.
+
+    Sans curseur, renvoie le curseur courant et les statistiques (point de départ du suivi).
+    """
+    try:
+        curseur = _lire_curseur(request.GET.get('curseur'))
+        if curseur is None:
+            return JsonResponse({
+                'success': True,
+                'curseur': curseur_courant(),
+                'statistics': compteurs_globaux(),
+                'timestamp': timezone.now().isoformat(),
+            })
+
+        donnees = _donnees_modifications(
+            curseur,
+            request.GET.get('search'),
+            request.GET.get('date_debut'),
+            request.GET.get('date_fin'),
+        )
+        return JsonResponse({
+            'success': True,
+            **donnees,
+            'timestamp': timezone.now().isoformat(),
+        })
+
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'timestamp': timezone.now().isoformat(),
+        }, status=500)
+
+
+@staff_member_required
+@login_required
+async def vue_360_flux(request):
+    """
+    Flux SSE (text/event-stream) des modifications de la vue 360.
+
+    Nécessite un déploiement ASGI (voir config/asgi.py) et VUE_360_SSE=True :
+    sous WSGI la réponse serait mise en mémoire tampon jusqu'à sa fin.
+    Reprend au curseur Last-Event-ID lors d'une reconnexion automatique du navigateur.
+    """
+    if not FLUX_SSE_ACTIF:
+        return JsonResponse({'success': False, 'error': 'Flux temps réel désactivé'}, status=404)
+
+    curseur = _lire_curseur(request.headers.get('Last-Event-ID'))
+    if curseur is None:
+        curseur = _lire_curseur(request.GET.get('curseur'))
+    filtres = (request.GET.get('search'), request.GET.get('date_debut'), request.GET.get('date_fin'))
+
+    async def evenements():
+        curseur_flux = curseur if curseur is not None else await sync_to_async(curseur_courant)()
+        fin_connexion = time.monotonic() + DUREE_MAX_FLUX
+        yield f'retry: {INTERVALLE_FLUX * 1000}\n\n'
+        while time.monotonic() < fin_connexion:
+            donnees = await sync_to_async(_donnees_modifications)(curseur_flux, *filtres)
+            if donnees['ids_modifies'] or donnees['ids_supprimes']:
+                donnees['timestamp'] = timezone.now().isoformat()
+                yield (
+                    f"id: {donnees['curseur']}\n"
+                    f"event: modifications\n"
+                    f"data: {json.dumps(donnees, cls=DjangoJSONEncoder)}\n\n"
+                )
+            else:
+                # Commentaire SSE : garde la connexion ouverte à travers les proxys
+                yield ': keep-alive\n\n'
+            curseur_flux = donnees['curseur']
+            if not donnees['has_more']:
+                await asyncio.sleep(INTERVALLE_FLUX)
+
+    response = StreamingHttpResponse(evenements(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @staff_member_required
 @login_required
 def vue_360_etats_tracking(request):
@@ -393,32 +518,27 @@ def vue_360_panier_tracking(request):
         }, status=500)
 
 def prepare_commandes_data(commandes_queryset):
-    """Prépare les données des commandes pour l'affichage avec suivi des états et panier"""
+    """
+    Prépare les données des commandes pour l'affichage avec suivi des états et panier.
+
+    L'historique de chaque commande est lu une seule fois depuis les données préchargées
+    (voir queryset_commandes_360) puis classé en mémoire par jalon : aucune requête par commande.
+    """
     data_for_template = []
     for cmd in commandes_queryset:
-        # Récupérer tous les états de la commande ordonnés par date
-        etats_commande = cmd.etats.all().order_by('date_debut')
+        # Tous les états de la commande ordonnés par date
+        etats_commande = etats_ordonnes(cmd)
+        jalons = classer_etats(etats_commande)
         
         # État actuel (le plus récent)
-        etat_actuel = etats_commande.last()
-        
-        # État de confirmation
-        confirmation_info = etats_commande.filter(enum_etat__libelle__icontains='Confirmée').first()
+        etat_actuel = etats_commande[-1] if etats_commande else None
         
-        # État de préparation
-        preparation_info = etats_commande.filter(enum_etat__libelle__icontains='Préparation en cours').first()
-        
-        # État de livraison
-        etat_livraison_obj = etats_commande.filter(enum_etat__libelle__icontains='Livrée').first()
-        
-        # État de paiement
-        etat_paiement_obj = etats_commande.filter(enum_etat__libelle__icontains='Payée').first()
-        
-        # État de retour
-        piece_retournee_obj = etats_commande.filter(enum_etat__libelle__icontains='Retournée').first()
-        
-        # État d'affectation
-        operateur_assigne_obj = etats_commande.filter(enum_etat__libelle__icontains='Affectée').first()
+        confirmation_info = jalons['confirmation']
+        preparation_info = jalons['preparation']
+        etat_livraison_obj = jalons['livraison']
+        etat_paiement_obj = jalons['paiement']
+        piece_retournee_obj = jalons['retour']
+        operateur_assigne_obj = jalons['affectation']
 
         # Préparer l'historique des états
         historique_etats = []
@@ -439,18 +559,19 @@ def prepare_commandes_data(commandes_queryset):
         # Déterminer le statut du processus
         statut_processus = determine_process_status(etats_commande)
         
-        # Récupérer les données du panier en temps réel
-        paniers = cmd.paniers.all().select_related('article')
+        # Données du panier (préchargées avec article et variante)
+        paniers = cmd.paniers.all()
         articles_panier = []
         total_panier = 0
         nombre_articles = 0
         
         for panier in paniers:
+            couleur, pointure = couleur_pointure_panier(panier)
             articles_panier.append({
                 'nom': panier.article.nom,
                 'reference': panier.article.reference,
-                'couleur': panier.article.couleur,
-                'pointure': panier.article.pointure,
+                'couleur': couleur,
+                'pointure': pointure,
                 'quantite': panier.quantite,
                 'prix_unitaire': panier.article.prix_unitaire,
                 'sous_total': panier.sous_total
@@ -539,12 +660,12 @@ def calculate_duration(start_date, end_date):
         return f"{days:.1f} jours"
 
 def calculate_total_duration(etats_commande):
-    """Calcule la durée totale du processus"""
+    """Calcule la durée totale du processus (etats_commande: liste ordonnée par date)"""
     if not etats_commande:
         return "N/A"
     
-    premier_etat = etats_commande.first()
-    dernier_etat = etats_commande.last()
+    premier_etat = etats_commande[0]
+    dernier_etat = etats_commande[-1]
     
     if premier_etat and dernier_etat and premier_etat.date_debut and dernier_etat.date_debut:
         duration = dernier_etat.date_debut - premier_etat.date_debut
@@ -581,13 +702,11 @@ def get_current_step(etat_libelle):
     return 0
 
 def determine_process_status(etats_commande):
-    """Détermine le statut global du processus"""
+    """Détermine le statut global du processus (etats_commande: liste ordonnée par date)"""
     if not etats_commande:
         return "Non démarré"
     
-    dernier_etat = etats_commande.last()
-    if not dernier_etat:
-        return "Non démarré"
+    dernier_etat = etats_commande[-1]
     
     etat_libelle = dernier_etat.enum_etat.libelle.lower()
     
@@ -615,325 +734,23 @@ def determine_process_status(etats_commande):
 def export_all_data_csv(request):
     # Assurez-vous que la méthode de requête est POST
     if request.method == 'POST':
+        from .exports import feuille_360
+
         # Récupérer les filtres pour appliquer les mêmes que dans la vue
         search = request.POST.get('search') or request.GET.get('search')
         date_debut = request.POST.get('date_debut') or request.GET.get('date_debut')
         date_fin = request.POST.get('date_fin') or request.GET.get('date_fin')
-        
-        # Utiliser une réponse streaming pour de gros volumes
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="export_commandes_avec_paniers_360.csv"'
-        
-        # Utiliser un writer CSV directement sur la réponse
-        writer = csv.writer(response)
-
-        # En-têtes du CSV consolidé avec détails des paniers
-        headers = [
-            'N°', 'Identifiant Yoozak', 'CLIENT', 'TELEPHONE', 'ADRESSE', 'VILLE', 'REGION',
-            'ARTICLE NOM', 'ARTICLE REFERENCE', 'ARTICLE COULEUR', 'ARTICLE POINTURE', 
-            'QUANTITE', 'PRIX UNITAIRE', 'SOUS TOTAL ARTICLE',
-            'PRIX TOTAL COMMANDE (DH)', 'DATE COMMANDE', 'CONFIRMATION', 'DATE CONFIRMATION',
-            'OBSERVATIONS CONFIRMATION', 'OPERATEUR', 'AGENT CONFIRMATION',
-            'CLIENT FIDELE', 'UPSELL', 'PREPARATION', 'ETAT LIVRAISON',
-            'ETAT PAIEMENT', 'TARIF', 'RESTE A PAYER', 'DATE PAIEMENT', 'PIECE RETOURNEE',
-            'OBSERVATION LIVRAISON'
-        ]
-        writer.writerow(headers)
-            
-        # Traitement par batch de 1000 commandes pour éviter de surcharger la mémoire
-        batch_size = 1000
-        offset = 0
-        
-        while True:
-            # Construire la requête avec les mêmes filtres que la vue
-            commandes_query = Commande.objects.select_related(
-                'client', 
-                'ville', 
-                'ville__region'
-            ).prefetch_related(
-                'etats__enum_etat',
-                'etats__operateur',
-                'paniers__article'
-            ).only(
-                'id', 'num_cmd', 'id_yz', 'date_cmd', 'total_cmd', 'is_upsell',
-                'client__nom', 'client__prenom', 'client__numero_tel', 'client__adresse',
-                'ville__nom', 'ville__region__nom_region'
-            )
-            
-            # Appliquer les filtres
-            if search:
-                commandes_query = commandes_query.filter(
-                    Q(num_cmd__icontains=search) |
-                    Q(id_yz__icontains=search) |
-                    Q(client__nom__icontains=search) |
-                    Q(client__prenom__icontains=search) |
-                    Q(client__numero_tel__icontains=search)
-                )
-            
-            if date_debut:
-                commandes_query = commandes_query.filter(date_cmd__gte=date_debut)
-            
-            if date_fin:
-                commandes_query = commandes_query.filter(date_cmd__lte=date_fin)
-            
-            commandes_batch = commandes_query.order_by('-date_cmd')[offset:offset + batch_size]
-            
-            if not commandes_batch:
-                break
-                
-            for cmd in commandes_batch:
-                confirmation_info = cmd.etats.filter(enum_etat__libelle__icontains='Confirmée').first()
-                preparation_info = cmd.etats.filter(enum_etat__libelle__icontains='Préparation en cours').first()
-                
-                etat_livraison_obj = cmd.etats.filter(enum_etat__libelle__icontains='Livrée').first()
-                etat_paiement_obj = cmd.etats.filter(enum_etat__libelle__icontains='Payée').first()
-                piece_retournee_obj = cmd.etats.filter(enum_etat__libelle__icontains='Retournée').first()
-
-                etat_paiement = etat_paiement_obj.enum_etat.libelle if etat_paiement_obj else "Non Payé"
-                etat_livraison = etat_livraison_obj.enum_etat.libelle if etat_livraison_obj else "En attente"
-                piece_retournee = "Oui" if piece_retournee_obj else "Non"
 
-                operateur_assigne_obj = cmd.etats.filter(enum_etat__libelle__icontains='Affectée').first()
-                operateur_assigne_nom = operateur_assigne_obj.operateur.mail if operateur_assigne_obj and operateur_assigne_obj.operateur else "N/A"
-                
-                agent_confirmation_nom = confirmation_info.operateur.mail if confirmation_info and confirmation_info.operateur else "N/A"
-
-                tarif_livraison = 0.0
-                reste_a_payer = cmd.total_cmd
-                date_paiement = "N/A"
-                observation_livraison = piece_retournee_obj.commentaire if piece_retournee_obj else ""
-
-                # Informations communes à la commande
-                commande_info = [
-                    cmd.num_cmd,
-                    cmd.id_yz,
-                    f"{cmd.client.prenom} {cmd.client.nom}" if cmd.client else "N/A",
-                    cmd.client.numero_tel if cmd.client else "N/A",
-                    cmd.client.adresse if cmd.client else "N/A",
-                    cmd.ville.nom if cmd.ville else "N/A",
-                    cmd.ville.region.nom_region if cmd.ville and cmd.ville.region else "N/A",
-                ]
-                
-                # Données communes de fin
-                commande_fin_info = [
-                    cmd.total_cmd,
-                    cmd.date_cmd.strftime('%d/%m/%Y') if cmd.date_cmd else "N/A",
-                    confirmation_info.enum_etat.libelle if confirmation_info else "Non Confirmée",
-                    confirmation_info.date_debut.strftime('%d/%m/%Y %H:%M') if confirmation_info and confirmation_info.date_debut else "N/A",
-                    confirmation_info.commentaire if confirmation_info else "",
-                    operateur_assigne_nom,
-                    agent_confirmation_nom,
-                    "future qui seras des les tables models plustard dans le projet", # Client Fidèle
-                    "Oui" if cmd.is_upsell else "Non", # UPSELL
-                    preparation_info.enum_etat.libelle if preparation_info else "Non Préparée",
-                    etat_livraison,
-                    etat_paiement,
-                    tarif_livraison,
-                    reste_a_payer,
-                    date_paiement,
-                    piece_retournee,
-                    observation_livraison,
-                ]
-                
-                # Si la commande a des articles, créer une ligne par article
-                paniers = cmd.paniers.all()
-                if paniers:
-                    for panier in paniers:
-                        # Détails de l'article
-                        article_info = [
-                            panier.article.nom or "N/A",
-                            panier.article.reference or "N/A",
-                            panier.article.couleur or "N/A",
-                            panier.article.pointure or "N/A",
-                            panier.quantite,
-                            panier.article.prix_unitaire,
-                            panier.sous_total,
-                        ]
-                        
-                        # Combiner toutes les informations
-                        row_data = commande_info + article_info + commande_fin_info
-                        writer.writerow(row_data)
-                else:
-                    # Si pas d'articles, créer une ligne avec des valeurs N/A
-                    article_info = ["N/A", "N/A", "N/A", "N/A", 0, 0, 0]
-                    row_data = commande_info + article_info + commande_fin_info
-                    writer.writerow(row_data)
-
-            offset += batch_size
-
-        return response
+        # Réponse en flux : commandes lues par lots, une ligne par article du panier
+        return reponse_csv(feuille_360(search, date_debut, date_fin), "export_commandes_avec_paniers_360.csv")
     return redirect('app_admin:page_360')
 
 @staff_member_required
 @login_required
 def export_all_data_excel(request):
-    # Récupérer les filtres
-    search = request.GET.get('search')
-    date_debut = request.GET.get('date_debut')
-    date_fin = request.GET.get('date_fin')
-    
-    # Créer un fichier Excel temporaire avec streaming
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="export_commandes_avec_paniers_360.xlsx"'
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Commandes avec Paniers"
-
-    # En-têtes Excel avec style - Inclure les détails des paniers
-    headers = [
-        "N°", "Identifiant Yoozak", "CLIENT", "TELEPHONE", "ADRESSE", "VILLE", "REGION",
-        "ARTICLE NOM", "ARTICLE REFERENCE", "ARTICLE COULEUR", "ARTICLE POINTURE", 
-        "QUANTITE", "PRIX UNITAIRE", "SOUS TOTAL ARTICLE",
-        "PRIX TOTAL COMMANDE (DH)", "DATE COMMANDE", "CONFIRMATION", "DATE CONFIRMATION",
-        "OBSERVATIONS CONFIRMATION", "OPERATEUR", "AGENT CONFIRMATION",
-        "CLIENT FIDELE", "UPSELL", "PREPARATION", "ETAT LIVRAISON",
-        "ETAT PAIEMENT", "TARIF", "RESTE A PAYER", "DATE PAIEMENT", "PIECE RETOURNEE",
-        "OBSERVATION LIVRAISON"
-    ]
-    ws.append(headers)
-
-    # Style des en-têtes
-    from openpyxl.styles import Font, PatternFill
-    header_font = Font(bold=True, color='FFFFFF')
-    header_fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-    
-    for cell in ws[1]:
-        cell.font = header_font
-        cell.fill = header_fill
-
-    # Traitement par batch pour Excel aussi
-    batch_size = 500  # Plus petit pour Excel car plus lourd
-    offset = 0
-    
-    while True:
-        # Construire la requête avec les mêmes filtres que la vue
-        commandes_query = Commande.objects.select_related(
-            'client', 
-            'ville', 
-            'ville__region'
-        ).prefetch_related(
-            'etats__enum_etat', 
-            'etats__operateur', 
-            'paniers__article'
-        ).only(
-            'id', 'num_cmd', 'id_yz', 'date_cmd', 'total_cmd', 'is_upsell',
-            'client__nom', 'client__prenom', 'client__numero_tel', 'client__adresse',
-            'ville__nom', 'ville__region__nom_region'
-        )
-        
-        # Appliquer les filtres
-        if search:
-            commandes_query = commandes_query.filter(
-                Q(num_cmd__icontains=search) |
-                Q(id_yz__icontains=search) |
-                Q(client__nom__icontains=search) |
-                Q(client__prenom__icontains=search) |
-                Q(client__numero_tel__icontains=search)
-            )
-        
-        if date_debut:
-            commandes_query = commandes_query.filter(date_cmd__gte=date_debut)
-            
-        if date_fin:
-            commandes_query = commandes_query.filter(date_cmd__lte=date_fin)
-        
-        commandes_batch = commandes_query.order_by('-date_cmd')[offset:offset + batch_size]
-        
-        if not commandes_batch:
-            break
-            
-        for cmd in commandes_batch:
-            confirmation_info = cmd.etats.filter(enum_etat__libelle__icontains='Confirmée').first()
-            preparation_info = cmd.etats.filter(enum_etat__libelle__icontains='Préparation en cours').first()
-            
-            # Récupérer les informations de livraison et paiement depuis les EtatsCommande
-            etat_livraison_obj = cmd.etats.filter(enum_etat__libelle__icontains='Livrée').first()
-            etat_paiement_obj = cmd.etats.filter(enum_etat__libelle__icontains='Payée').first()
-            piece_retournee_obj = cmd.etats.filter(enum_etat__libelle__icontains='Retournée').first()
-
-            etat_paiement = etat_paiement_obj.enum_etat.libelle if etat_paiement_obj else "Non Payé"
-            etat_livraison = etat_livraison_obj.enum_etat.libelle if etat_livraison_obj else "En attente"
-            piece_retournee = "Oui" if piece_retournee_obj else "Non"
-
-            # Opérateur Assigné: Chercher l'opérateur lié à l'état 'Affectée' ou un autre état pertinent
-            operateur_assigne_obj = cmd.etats.filter(enum_etat__libelle__icontains='Affectée').first()
-            operateur_assigne_nom = operateur_assigne_obj.operateur.mail if operateur_assigne_obj and operateur_assigne_obj.operateur else "N/A"
-            
-            # Agent Confirmation: Opérateur lié à l'état 'Confirmée'
-            agent_confirmation_nom = confirmation_info.operateur.mail if confirmation_info and confirmation_info.operateur else "N/A"
-
-            tarif_livraison = 0.0
-            reste_a_payer = cmd.total_cmd
-            date_paiement = "N/A"
-            observation_livraison = piece_retournee_obj.commentaire if piece_retournee_obj else ""
-
-            # Informations communes à la commande
-            commande_info = [
-                cmd.num_cmd,
-                cmd.id_yz,
-                f"{cmd.client.prenom} {cmd.client.nom}" if cmd.client else "N/A",
-                cmd.client.numero_tel if cmd.client else "N/A",
-                cmd.client.adresse if cmd.client else "N/A",
-                cmd.ville.nom if cmd.ville else "N/A",
-                cmd.ville.region.nom_region if cmd.ville and cmd.ville.region else "N/A",
-            ]
-            
-            # Données communes de fin
-            commande_fin_info = [
-                cmd.total_cmd,
-                cmd.date_cmd.strftime('%d/%m/%Y') if cmd.date_cmd else "N/A",
-                confirmation_info.enum_etat.libelle if confirmation_info else "Non Confirmée",
-                confirmation_info.date_debut.strftime('%d/%m/%Y %H:%M') if confirmation_info and confirmation_info.date_debut else "N/A",
-                confirmation_info.commentaire if confirmation_info else "",
-                operateur_assigne_nom,
-                agent_confirmation_nom,
-                "future qui seras des les tables models plustard dans le projet", # Client Fidèle
-                "Oui" if cmd.is_upsell else "Non", # UPSELL
-                preparation_info.enum_etat.libelle if preparation_info else "Non Préparée",
-                etat_livraison,
-                etat_paiement,
-                tarif_livraison,
-                reste_a_payer,
-                date_paiement,
-                piece_retournee,
-                observation_livraison,
-            ]
-            
-            # Si la commande a des articles, créer une ligne par article
-            paniers = cmd.paniers.all()
-            if paniers:
-                for panier in paniers:
-                    # Détails de l'article
-                    article_info = [
-                        panier.article.nom or "N/A",
-                        panier.article.reference or "N/A",
-                        panier.article.couleur or "N/A",
-                        panier.article.pointure or "N/A",
-                        panier.quantite,
-                        panier.article.prix_unitaire,
-                        panier.sous_total,
-                    ]
-                    
-                    # Combiner toutes les informations
-                    row_data = commande_info + article_info + commande_fin_info
-                    ws.append(row_data)
-            else:
-                # Si pas d'articles, créer une ligne avec des valeurs N/A
-                article_info = ["N/A", "N/A", "N/A", "N/A", 0, 0, 0]
-                row_data = commande_info + article_info + commande_fin_info
-                ws.append(row_data)
-            
-        offset += batch_size
-
-    # Ajuster la largeur des colonnes
-    for i, col in enumerate(headers, 1):
-        if i <= 7:  # Colonnes de base commande
-            ws.column_dimensions[get_column_letter(i)].width = 20
-        elif i <= 14:  # Colonnes articles
-            ws.column_dimensions[get_column_letter(i)].width = 15
-        else:  # Autres colonnes
-            ws.column_dimensions[get_column_letter(i)].width = 18
-
-    wb.save(response)
-    return response 
\ No newline at end of file
+    """Classeur de la vue 360 construit en arrière-plan (export_360), suivi puis téléchargé"""
+    return lancer_export(request, 'commandes_360', {
+        'search': request.GET.get('search'),
+        'date_debut': request.GET.get('date_debut'),
+        'date_fin': request.GET.get('date_fin'),
+    })
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from parametre.dashboard_360.flux import purger_modifications, recompter_compteurs
+
+
+class Command(BaseCommand):
+    help = 'Purge le flux de modifications de la vue 360 et recompte ses compteurs globaux (à planifier chaque nuit)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--purger-jours',
+            type=int,
+            default=7,
+            help='Supprimer les modifications plus anciennes que N jours (par défaut: 7)'
+        )
+        parser.add_argument(
+            '--recompter',
+            action='store_true',
+            help='Recompter les compteurs globaux (articles, clients, commandes, opérateurs)'
+        )
+
+    def handle(self, *args, **options):
+        nb_supprimees = purger_modifications(options['purger_jours'])
+        self.stdout.write(self.style.SUCCESS(f'🧹 {nb_supprimees} modification(s) purgée(s)'))
+
+        if options['recompter']:
+            recompter_compteurs()
+            self.stdout.write(self.style.SUCCESS('✨ Compteurs globaux recomptés'))
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2025-08-26 09:42
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parametre', '0002_region_actif'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompteurGlobal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom', models.CharField(max_length=50, unique=True)),
+                ('valeur', models.BigIntegerField(default=0)),
+                ('date_recomptage', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Compteur global',
+                'verbose_name_plural': 'Compteurs globaux',
+            },
+        ),
+        migrations.CreateModel(
+            name='ModificationCommande',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('id_commande', models.BigIntegerField(db_index=True)),
+                ('type_modification', models.CharField(choices=[('etat', "Changement d'état"), ('panier', 'Modification du panier'), ('commande', 'Modification de la commande'), ('suppression', 'Suppression')], max_length=20)),
+                ('date_modification', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Modification de commande',
+                'verbose_name_plural': 'Modifications de commandes',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -255,3 +255,47 @@ class HistoriqueMotDePasse(models.Model):
     def __str__(self):
         admin_name = self.administrateur.get_full_name() if self.administrateur else "Système"
         return f"Modification MDP de {self.operateur.nom_complet} par {admin_name} le {self.date_modification.strftime('%d/%m/%Y %H:%M')}"
+
+
+class ModificationCommande(models.Model):
+    """
+    Flux des modifications de commandes (états, paniers, contenu, suppressions).
+    L'identifiant, strictement croissant, sert de curseur aux tableaux de bord temps réel
+    qui ne récupèrent que les commandes modifiées depuis leur dernier passage.
+    """
+    TYPE_MODIFICATION_CHOICES = [
+        ('etat', 'Changement d\'état'),
+        ('panier', 'Modification du panier'),
+        ('commande', 'Modification de la commande'),
+        ('suppression', 'Suppression'),
+    ]
+
+    # Pas de clé étrangère : les suppressions de commandes doivent rester dans le flux
+    id_commande = models.BigIntegerField(db_index=True)
+    type_modification = models.CharField(max_length=20, choices=TYPE_MODIFICATION_CHOICES)
+    date_modification = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = "Modification de commande"
+        verbose_name_plural = "Modifications de commandes"
+        ordering = ['id']
+
+    def __str__(self):
+        return f"#{self.pk} commande {self.id_commande} ({self.type_modification})"
+
+
+class CompteurGlobal(models.Model):
+    """
+    Compteurs globaux de la vue 360 (articles, clients, commandes, opérateurs),
+    maintenus par incréments au lieu d'un COUNT(*) à chaque rafraîchissement.
+    """
+    nom = models.CharField(max_length=50, unique=True)
+    valeur = models.BigIntegerField(default=0)
+    date_recomptage = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Compteur global"
+        verbose_name_plural = "Compteurs globaux"
+
+    def __str__(self):
+        return f"{self.nom} = {self.valeur}"
@@ -1,6 +1,11 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+from article.models import Article
+from client.models import Client
+from commande.models import Commande, Panier
+from commande.signals import commandes_modifiees, creations_en_masse
+from .dashboard_360.flux import ajuster_compteur, enregistrer_modifications
 from .models import Operateur
 
 @receiver(post_save, sender=User)
@@ -45,4 +50,64 @@ def save_operateur_profile(sender, instance, **kwargs):
         operateur.nom = instance.last_name or operateur.nom
         operateur.prenom = instance.first_name or operateur.prenom
         operateur.mail = instance.email or operateur.mail
-        operateur.save() 
\ No newline at end of file
+        operateur.save()
+
+
+# ---------------------------------------------------------------------------
+# Flux de modifications et compteurs globaux de la vue 360
+# ---------------------------------------------------------------------------
+
+@receiver(commandes_modifiees)
+def flux_commandes_modifiees(sender, commande_ids=(), **kwargs):
+    """
+    Transitions d'état et écritures par lots. Les EtatCommande écrits hors de
+    changer_etat_commande passent aussi par ce signal (via synchroniser_etats_courants).
+    """
+    enregistrer_modifications(commande_ids, 'etat')
+
+
+# Champs de la commande affichés par une ligne de la vue 360 (états et paniers ont leurs propres entrées)
+CHAMPS_VUE_360 = (
+    'num_cmd', 'id_yz', 'date_cmd', 'total_cmd', 'is_upsell', 'client_id', 'ville_id',
+    'etat_courant_id', 'operateur_etat_courant_id',
+)
+
+
+@receiver(post_save, sender=Commande)
+def flux_commande_enregistree(sender, instance, **kwargs):
+    """Création ou modification d'une commande : seuls les champs affichés par la vue 360 comptent"""
+    if instance.champs_modifies(CHAMPS_VUE_360):
+        enregistrer_modifications([instance.pk], 'commande')
+
+
+@receiver(post_delete, sender=Commande)
+def flux_commande_supprimee(sender, instance, **kwargs):
+    enregistrer_modifications([instance.pk], 'suppression')
+
+
+@receiver(post_save, sender=Panier)
+@receiver(post_delete, sender=Panier)
+def flux_panier_modifie(sender, instance, **kwargs):
+    enregistrer_modifications([instance.commande_id], 'panier')
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Commande)
+@receiver(post_save, sender=Operateur)
+def compteur_creation(sender, instance, created, **kwargs):
+    if created:
+        ajuster_compteur(sender, 1)
+
+
+@receiver(post_delete, sender=Article)
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=Commande)
+@receiver(post_delete, sender=Operateur)
+def compteur_suppression(sender, instance, **kwargs):
+    ajuster_compteur(sender, -1)
+
+
+@receiver(creations_en_masse)
+def compteur_creations_en_masse(sender, nombre, **kwargs):
+    ajuster_compteur(sender, nombre)
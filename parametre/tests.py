@@ -1,3 +1,162 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from article.models import Article, Categorie, Couleur, Pointure, VarianteArticle
+from client.models import Client
+from commande.models import Commande, Panier
+from commande.transitions import changer_etat_commande
+from parametre.dashboard_360.flux import compteurs_globaux, curseur_courant, modifications_depuis
+from parametre.dashboard_360.views import prepare_commandes_data, queryset_commandes_360
+from parametre.models import ModificationCommande, Operateur
+
+
+class Vue360RequetesTest(TestCase):
+
+    def setUp(self):
+        categorie = Categorie.objects.create(nom='BASKET')
+        self.article = Article.objects.create(nom='Basket Urbain', reference='BAS-1', prix_unitaire=300, categorie=categorie)
+        self.variante = VarianteArticle.objects.create(
+            article=self.article,
+            couleur=Couleur.objects.create(nom='Noir'),
+            pointure=Pointure.objects.create(pointure='42'),
+        )
+        self.operateur = Operateur.objects.create(
+            user=User.objects.create_user('op-360'), nom='Tazi', prenom='Nadia', mail='nadia@example.com',
+            type_operateur='CONFIRMATION',
+        )
+        self.nb_commandes = 0
+
+    def _creer_commandes(self, nombre):
+        for _ in range(nombre):
+            self.nb_commandes += 1
+            numero = self.nb_commandes
+            client = Client.objects.create(nom=f'Client{numero}', prenom='Test', numero_tel=f'0622{numero:06d}')
+            commande = Commande.objects.create(num_cmd=f'V360-{numero}', id_yz=800000 + numero, client=client, total_cmd=300)
+            Panier.objects.create(commande=commande, article=self.article, variante=self.variante, quantite=1, sous_total=300)
+            for libelle in ('Affectée', 'Confirmée', 'Livrée'):
+                changer_etat_commande(commande, libelle, operateur=self.operateur)
+
+    def _preparer_page(self):
+        page = Paginator(queryset_commandes_360().order_by('-date_cmd'), 50).get_page(1)
+        with CaptureQueriesContext(connection) as requetes:
+            donnees = prepare_commandes_data(page)
+        return donnees, len(requetes)
+
+    def test_nombre_de_requetes_constant(self):
+        self._creer_commandes(2)
+        _, requetes_petite_page = self._preparer_page()
+
+        self._creer_commandes(10)
+        donnees, requetes_grande_page = self._preparer_page()
+
+        # Commandes, états (avec libellé et opérateur) et paniers (avec article et variante)
+        self.assertEqual(requetes_petite_page, 3)
+        self.assertEqual(requetes_grande_page, 3)
+
+        ligne = donnees[0]
+        self.assertEqual(ligne['etat_actuel'], 'Livrée')
+        self.assertEqual(ligne['confirmation_status'], 'Confirmée')
+        self.assertEqual(ligne['operateur_assigne'], 'nadia@example.com')
+        self.assertEqual(ligne['etapes_completes'], 3)
+        self.assertEqual(ligne['statut_processus'], 'Livré')
+        self.assertEqual(ligne['articles_panier'][0]['couleur'], 'Noir')
+        self.assertEqual(ligne['articles_panier'][0]['pointure'], '42')
+
+    def test_polling_temps_reel_nombre_de_requetes_constant(self):
+        self.client.force_login(User.objects.create_superuser('admin-360', 'admin@example.com', 'motdepasse'))
+        url = reverse('app_admin:vue_360_realtime_data')
+        # Initialisation des compteurs globaux (recomptés une seule fois)
+        compteurs_globaux()
+
+        self._creer_commandes(2)
+        with CaptureQueriesContext(connection) as petite_page:
+            self.assertTrue(self.client.get(url).json()['success'])
+
+        self._creer_commandes(10)
+        with CaptureQueriesContext(connection) as grande_page:
+            reponse = self.client.get(url).json()
+
+        self.assertEqual(len(reponse['commandes_data']), 12)
+        self.assertEqual(len(grande_page), len(petite_page))
+
+
+class FluxModificationsVue360Test(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin-flux', 'admin@example.com', 'motdepasse'))
+        self.url = reverse('app_admin:vue_360_modifications')
+        self.client_cmd = Client.objects.create(nom='Idrissi', prenom='Karim', numero_tel='0633000001')
+
+    def _commande(self, numero):
+        return Commande.objects.create(num_cmd=f'FLUX-{numero}', id_yz=810000 + numero, client=self.client_cmd, total_cmd=200)
+
+    def test_delta_depuis_le_curseur(self):
+        curseur = self.client.get(self.url).json()['curseur']
+        commande = self._commande(1)
+        autre = self._commande(2)
+        changer_etat_commande(commande, 'Confirmée')
+        autre_id = autre.pk
+        autre.delete()
+
+        with mock.patch('parametre.dashboard_360.flux.DELAI_STABILISATION', timedelta(0)):
+            reponse = self.client.get(self.url, {'curseur': curseur}).json()
+
+        self.assertTrue(reponse['success'])
+        self.assertEqual(reponse['ids_modifies'], [commande.pk])
+        self.assertEqual(reponse['ids_supprimes'], [autre_id])
+        self.assertEqual(reponse['commandes_data'][0]['etat_actuel'], 'Confirmée')
+        self.assertGreater(reponse['curseur'], curseur)
+
+        # Rien de nouveau depuis le curseur renvoyé
+        with mock.patch('parametre.dashboard_360.flux.DELAI_STABILISATION', timedelta(0)):
+            suivante = self.client.get(self.url, {'curseur': reponse['curseur']}).json()
+        self.assertEqual(suivante['commandes_data'], [])
+        self.assertEqual(suivante['curseur'], reponse['curseur'])
+
+    def test_curseur_ne_depasse_pas_les_modifications_recentes(self):
+        curseur = curseur_courant()
+        commande = self._commande(3)
+
+        modifications = modifications_depuis(curseur)
+
+        # Modification encore récente : renvoyée, mais le curseur reste en place pour la relire
+        self.assertEqual(modifications['ids_modifies'], [commande.pk])
+        self.assertEqual(modifications['curseur'], curseur)
+        self.assertFalse(modifications['has_more'])
+
+    def test_modification_hors_vue_360_non_journalisee(self):
+        commande = self._commande(5)
+        ModificationCommande.objects.all().delete()
+
+        commande.adresse = '12 rue Allal Ben Abdellah'
+        commande.save()
+        self.assertFalse(ModificationCommande.objects.exists())
+
+        commande.total_cmd = 250
+        commande.save()
+        self.assertEqual(
+            list(ModificationCommande.objects.values_list('id_commande', 'type_modification')),
+            [(commande.pk, 'commande')],
+        )
+
+    def test_compteurs_globaux_incrementaux(self):
+        self.assertEqual(compteurs_globaux()['total_clients'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Client.objects.create(nom='Fassi', prenom='Lina', numero_tel='0633000002')
+            self._commande(4)
+            # Le compteur n'est pas verrouillé par la transaction de l'écriture : ajusté au commit
+            self.assertEqual(compteurs_globaux()['total_commandes'], 0)
+        with CaptureQueriesContext(connection) as requetes:
+            compteurs = compteurs_globaux()
 
-# Create your tests here.
+        self.assertEqual(len(requetes), 1)
+        self.assertEqual(compteurs['total_clients'], 2)
+        self.assertEqual(compteurs['total_commandes'], 1)
@@ -57,6 +57,8 @@ urlpatterns = [
     # URLs API Temps Réel Vue 360
     path('vue360/api/realtime-data/', views_360.vue_360_realtime_data, name='vue_360_realtime_data'),
     path('vue360/api/statistics-update/', views_360.vue_360_statistics_update, name='vue_360_statistics_update'),
+    path('vue360/api/modifications/', views_360.vue_360_modifications, name='vue_360_modifications'),
+    path('vue360/api/flux/', views_360.vue_360_flux, name='vue_360_flux'),
     path('vue360/api/etats-tracking/', views_360.vue_360_etats_tracking, name='vue_360_etats_tracking'),
     path('vue360/api/panier-tracking/', views_360.vue_360_panier_tracking, name='vue_360_panier_tracking'),
     
@@ -3,23 +3,25 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from django.http import JsonResponse, HttpResponse
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
-from django.db.models import Q, Count, Avg, Min, Max, Sum
+from django.db.models import Q, Count, Avg, Min, Max, Sum, OuterRef, Subquery
 from django.contrib.auth.models import User, Group
 from django.contrib import messages
 from .models import Region, Ville, Operateur, HistoriqueMotDePasse
 from article.models import Article, Couleur, Pointure, VarianteArticle
+from commande.exports import (
+    Colonne, Feuille, colonnes_commandes_consolidees, preparer_commandes, reponse_csv, reponse_excel,
+)
 from commande.models import Commande, EtatCommande, EnumEtatCmd
+from commande.repartition import PROFILS as PROFILS_REPARTITION, planifier_repartition, repartir_commandes
+from commande.transitions import changer_etat_commande
 from django.contrib.messages import success, error
 from django.views.decorators.http import require_POST
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth import update_session_auth_hash # Required for password change
-import csv
 import json
 from datetime import datetime, timedelta
+from django.urls import reverse
 from django.utils import timezone
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl.utils import get_column_letter
 
 @login_required
 def dashboard(request):
@@ -1626,7 +1628,7 @@ def sav_creer_nouvelle_commande(request, commande_id):
             
             # Créer l'état initial "Non affectée"
             enum_etat = EnumEtatCmd.objects.get(libelle='Non affectée')
-            EtatCommande.objects.create(
+            changer_etat_commande(
                 commande=nouvelle_commande,
                 enum_etat=enum_etat,
                 operateur=request.user.profil_operateur,
@@ -1665,7 +1667,7 @@ def sav_renvoyer_preparation(request, commande_id):
             
             # Créer un nouvel état "En préparation"
             enum_etat = EnumEtatCmd.objects.get(libelle='Préparation en cours')
-            EtatCommande.objects.create(
+            changer_etat_commande(
                 commande=commande,
                 enum_etat=enum_etat,
                 operateur=request.user.profil_operateur,
@@ -1697,6 +1699,21 @@ def repartition_automatique(request):
     elif export_type == 'excel_operateur' and operateur_id:
         return export_operateur_excel(request, operateur_id)
     
+    profil_repartition = request.GET.get('profil', 'logistique')
+    if profil_repartition not in PROFILS_REPARTITION:
+        profil_repartition = 'logistique'
+    
+    # Lancer la répartition (même calcul que l'aperçu affiché)
+    if request.method == 'POST':
+        plan, nb_affectees = repartir_commandes(profil_repartition)
+        if nb_affectees:
+            messages.success(request, f"{nb_affectees} commande(s) réparties entre {len(plan.affectations)} opérateur(s).")
+        else:
+            messages.info(request, "Aucune commande à répartir.")
+        if plan.en_attente:
+            messages.warning(request, f"{len(plan.en_attente)} commande(s) en attente : capacité des opérateurs atteinte.")
+        return redirect(f"{reverse('app_admin:repartition_automatique')}?profil={profil_repartition}")
+    
     # Statistiques pour les KPI
     total_commandes = Commande.objects.filter(
         etats__enum_etat__libelle__in=['Confirmée', 'À imprimer', 'Préparée']
@@ -1720,44 +1737,9 @@ def repartition_automatique(request):
         total_montant=Sum('total_cmd')
     ).order_by('-nb_commandes')
     
-    # Données de prévisualisation dynamique et intelligente
-    preview_data = {}
-    operateurs_actifs = Operateur.objects.filter(actif=True).exclude(type_operateur='ADMIN')[:5]
-    
-    # Récupérer toutes les commandes préparées avec leurs états
-    commandes_preparees = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée'
-    ).select_related(
-        'client', 'ville', 'ville__region'
-    ).prefetch_related(
-        'etats__operateur', 'etats__enum_etat'
-    ).distinct()
-    
-    for operateur in operateurs_actifs:
-        # Compter les commandes assignées à cet opérateur
-        commandes_operateur = commandes_preparees.filter(
-            etats__operateur=operateur,
-            etats__enum_etat__libelle='Préparée'
-        ).distinct()
-        
-        nb_commandes = commandes_operateur.count()
-        
-        # Récupérer les régions uniques pour cet opérateur
-        regions_operateur = commandes_operateur.values_list(
-            'ville__region__nom_region', flat=True
-        ).distinct()
-        
-        # Récupérer les détails des commandes (limité à 5 pour l'affichage)
-        commandes_details = commandes_operateur.select_related(
-            'client', 'ville', 'ville__region'
-        )[:5]
-        
-        preview_data[operateur.id] = {
-            'nom_operateur': f"{operateur.prenom} {operateur.nom}",
-            'nb_commandes': nb_commandes,
-            'regions': list(regions_operateur),
-            'commandes': list(commandes_details)
-        }
+    # Aperçu de la répartition : plan calculé en mémoire (commande.repartition), sans écriture
+    plan = planifier_repartition(profil_repartition)
+    preview_data = plan.apercu()
     
     # Historique des répartitions (simulation)
     historique_repartitions = []
@@ -1781,6 +1763,8 @@ def repartition_automatique(request):
         'operateurs_disponibles': operateurs_disponibles,
         'stats_par_region': stats_par_region,
         'preview_data': preview_data,
+        'profil_repartition': profil_repartition,
+        'commandes_en_attente': len(plan.en_attente),
         'historique_repartitions': historique_repartitions,
         'commandes_preparees_exist': commandes_preparees_exist,
         'openpyxl_available': openpyxl_available,
@@ -1868,390 +1852,68 @@ def details_region_view(request):
     return render(request, 'parametre/details_region.html', context)
 
 
+def _commandes_preparees_export(**filtres):
+    """
+    Commandes passées par l'état Préparée (filtres appliqués sur le même état),
+    annotées de l'heure de leur dernière préparation
+    """
+    derniere_preparation = EtatCommande.objects.filter(
+        commande=OuterRef('pk'), enum_etat__libelle='Préparée'
+    ).order_by('-date_debut')
+    commandes = Commande.objects.filter(
+        etats__enum_etat__libelle='Préparée', **filtres
+    ).annotate(
+        heure_preparation=Subquery(derniere_preparation.values('date_debut')[:1])
+    ).distinct()
+    return preparer_commandes(commandes)
+
+
+def _colonnes_commandes_preparees(operateur=None):
+    heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
+    colonnes = colonnes_commandes_consolidees(devise='MAD') + [
+        Colonne('Date Commande', lambda commande: commande.date_creation or "N/A", 18, 'yz_date'),
+        Colonne('Heure Préparation', lambda commande: commande.heure_preparation or "N/A", 18, 'yz_date'),
+        Colonne('Heure Exportation', lambda commande: heure_exportation, 20),
+    ]
+    if operateur:
+        nom_operateur = f"{operateur.prenom} {operateur.nom}"
+        colonnes.append(Colonne('Opérateur Assigné', lambda commande: nom_operateur, 25))
+    return colonnes
+
+
 @staff_member_required
 @login_required
 def export_region_detail_csv(request, region_name):
     """Export CSV détaillé pour une région spécifique"""
-    from commande.models import Commande
-    
-    # Récupérer les commandes PRÉPARÉES de la région
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        ville__region__nom_region=region_name
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer la réponse CSV
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
+    # Commandes PRÉPARÉES de la région
+    commandes = _commandes_preparees_export(ville__region__nom_region=region_name).order_by('-date_cmd')
     filename = f"region_{region_name.lower().replace(' ', '_')}_detail_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write('\ufeff')
-    
-    writer = csv.writer(response, delimiter=';')
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation'
-    ]
-    writer.writerow(headers)
-    
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            f"{commande.total_cmd:.2f}" if commande.total_cmd else "0.00",
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation
-        ]
-        writer.writerow(row)
-    
-    return response
-
+    return reponse_csv(Feuille(f"Région {region_name}", commandes, _colonnes_commandes_preparees()), filename)
 
 @staff_member_required
 @login_required
 def export_region_detail_excel(request, region_name):
     """Export Excel détaillé pour une région spécifique"""
-    from commande.models import Commande
-    
-    # Récupérer les commandes PRÉPARÉES de la région
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        ville__region__nom_region=region_name
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer le fichier Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Région {region_name}"
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation'
-    ]
-    
-    # Ajouter les en-têtes
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color='FFFFFF')
-        cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Traiter chaque commande
-    for row, commande in enumerate(commandes, 2):
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row_data = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            commande.total_cmd or 0,
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation
-        ]
-        
-        for col, value in enumerate(row_data, 1):
-            ws.cell(row=row, column=col, value=value)
-    
-    # Ajuster la largeur des colonnes
-    for column in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column[0].column)
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Créer la réponse
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    # Commandes PRÉPARÉES de la région
+    commandes = _commandes_preparees_export(ville__region__nom_region=region_name).order_by('-date_cmd')
     filename = f"region_{region_name.lower().replace(' ', '_')}_detail_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    wb.save(response)
-    return response
-
+    return reponse_excel([Feuille(f"Région {region_name}", commandes, _colonnes_commandes_preparees())], filename)
 
 @staff_member_required
 @login_required
 def export_villes_csv(request):
     """Export CSV pour toutes les villes"""
-    from commande.models import Commande
-    
-    # Récupérer les commandes PRÉPARÉES
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée'
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer la réponse CSV
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
+    commandes = _commandes_preparees_export().order_by('-date_cmd')
     filename = f"villes_consolidees_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write('\ufeff')
-    
-    writer = csv.writer(response, delimiter=';')
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation'
-    ]
-    writer.writerow(headers)
-    
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            f"{commande.total_cmd:.2f}" if commande.total_cmd else "0.00",
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation
-        ]
-        writer.writerow(row)
-    
-    return response
-
+    return reponse_csv(Feuille("Villes Consolidées", commandes, _colonnes_commandes_preparees()), filename)
 
 @staff_member_required
 @login_required
 def export_villes_excel(request):
     """Export Excel pour toutes les villes"""
-    from commande.models import Commande
-    
-    # Récupérer les commandes PRÉPARÉES
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée'
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer le fichier Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Villes Consolidées"
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation'
-    ]
-    
-    # Ajouter les en-têtes
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color='FFFFFF')
-        cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Traiter chaque commande
-    for row, commande in enumerate(commandes, 2):
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row_data = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            commande.total_cmd or 0,
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation
-        ]
-        
-        for col, value in enumerate(row_data, 1):
-            ws.cell(row=row, column=col, value=value)
-    
-    # Ajuster la largeur des colonnes
-    for column in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column[0].column)
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Créer la réponse
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    commandes = _commandes_preparees_export().order_by('-date_cmd')
     filename = f"villes_consolidees_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    wb.save(response)
-    return response
+    return reponse_excel([Feuille("Villes Consolidées", commandes, _colonnes_commandes_preparees())], filename)
 
 @staff_member_required
 @login_required
@@ -2590,399 +2252,53 @@ def export_combine_excel(request):
 @login_required
 def export_regions_csv(request):
     """Export CSV pour toutes les régions"""
-    from commande.models import Commande
-    
-    # Récupérer les commandes PRÉPARÉES groupées par région
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée'
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('ville__region__nom_region', '-date_cmd')
-    
-    # Créer la réponse CSV
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
+    # Commandes PRÉPARÉES groupées par région
+    commandes = _commandes_preparees_export().order_by('ville__region__nom_region', '-date_cmd')
     filename = f"regions_consolidees_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write('\ufeff')
-    
-    writer = csv.writer(response, delimiter=';')
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation'
-    ]
-    writer.writerow(headers)
-    
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            f"{commande.total_cmd:.2f}" if commande.total_cmd else "0.00",
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation
-        ]
-        writer.writerow(row)
-    
-    return response
-
+    return reponse_csv(Feuille("Régions Consolidées", commandes, _colonnes_commandes_preparees()), filename)
 
 @staff_member_required
 @login_required
 def export_regions_excel(request):
     """Export Excel pour toutes les régions"""
-    from commande.models import Commande
-    
-    # Récupérer les commandes PRÉPARÉES groupées par région
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée'
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('ville__region__nom_region', '-date_cmd')
-    
-    # Créer le fichier Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Régions Consolidées"
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation'
-    ]
-    
-    # Ajouter les en-têtes
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color='FFFFFF')
-        cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Traiter chaque commande
-    for row, commande in enumerate(commandes, 2):
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row_data = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            commande.total_cmd or 0,
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation
-        ]
-        
-        for col, value in enumerate(row_data, 1):
-            ws.cell(row=row, column=col, value=value)
-    
-    # Ajuster la largeur des colonnes
-    for column in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column[0].column)
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Créer la réponse
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    # Commandes PRÉPARÉES groupées par région
+    commandes = _commandes_preparees_export().order_by('ville__region__nom_region', '-date_cmd')
     filename = f"regions_consolidees_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    wb.save(response)
-    return response
+    return reponse_excel([Feuille("Régions Consolidées", commandes, _colonnes_commandes_preparees())], filename)
 
 @staff_member_required
 @login_required
 def export_operateur_csv(request, operateur_id):
     """Export CSV pour les commandes d'un opérateur spécifique"""
-    from commande.models import Commande
-    
-    # Récupérer l'opérateur
     try:
         operateur = Operateur.objects.get(id=operateur_id)
     except Operateur.DoesNotExist:
         return HttpResponse("Opérateur non trouvé", status=404)
-    
-    # Récupérer les commandes PRÉPARÉES assignées à cet opérateur
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        etats__operateur=operateur
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer la réponse CSV
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
-    filename = f"operateur_{operateur.prenom}_{operateur.nom}_commandes_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    # Écrire l'en-tête BOM pour Excel
-    response.write('\ufeff')
-    
-    writer = csv.writer(response, delimiter=';')
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation', 'Opérateur Assigné'
-    ]
-    writer.writerow(headers)
-    
-    # Traiter chaque commande
-    for commande in commandes:
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            f"{commande.total_cmd:.2f}" if commande.total_cmd else "0.00",
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation,
-            f"{operateur.prenom} {operateur.nom}"
-        ]
-        writer.writerow(row)
-    
-    return response
 
+    # Commandes PRÉPARÉES assignées à cet opérateur
+    commandes = _commandes_preparees_export(etats__operateur=operateur).order_by('-date_cmd')
+    filename = f"operateur_{operateur.prenom}_{operateur.nom}_commandes_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return reponse_csv(
+        Feuille(f"Opérateur {operateur.prenom} {operateur.nom}", commandes, _colonnes_commandes_preparees(operateur)),
+        filename,
+    )
 
 @staff_member_required
 @login_required
 def export_operateur_excel(request, operateur_id):
     """Export Excel pour les commandes d'un opérateur spécifique"""
-    from commande.models import Commande
-    
-    # Récupérer l'opérateur
     try:
         operateur = Operateur.objects.get(id=operateur_id)
     except Operateur.DoesNotExist:
         return HttpResponse("Opérateur non trouvé", status=404)
-    
-    # Récupérer les commandes PRÉPARÉES assignées à cet opérateur
-    commandes = Commande.objects.filter(
-        etats__enum_etat__libelle='Préparée',
-        etats__operateur=operateur
-    ).select_related(
-        'client', 
-        'ville', 
-        'ville__region'
-    ).prefetch_related(
-        'paniers__article'
-    ).distinct().order_by('-date_cmd')
-    
-    # Créer le fichier Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Opérateur {operateur.prenom} {operateur.nom}"
-    
-    # En-têtes
-    headers = [
-        'N° Commande', 'Client', 'Téléphone', 'Ville', 'Région', 
-        'Articles et Quantités', 'Prix Total (MAD)', 'Adresse', 'État', 'Date Commande',
-        'Heure Préparation', 'Heure Exportation', 'Opérateur Assigné'
-    ]
-    
-    # Ajouter les en-têtes
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color='FFFFFF')
-        cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Traiter chaque commande
-    for row, commande in enumerate(commandes, 2):
-        # Construire la liste des articles avec quantités
-        articles_list = []
-        for panier in commande.paniers.all():
-            article_info = f"{panier.article.nom}"
-            if panier.article.couleur:
-                article_info += f" {panier.article.couleur}"
-            if panier.article.pointure:
-                article_info += f" {panier.article.pointure}"
-            if panier.quantite > 1:
-                article_info += f" x{panier.quantite}"
-            articles_list.append(article_info)
-        
-        # Joindre tous les articles avec des virgules
-        articles_consolides = ", ".join(articles_list) if articles_list else "Aucun article"
-        
-        # État actuel de la commande
-        etat_actuel = commande.etat_actuel.enum_etat.libelle if commande.etat_actuel else "Non défini"
-        
-        # Trouver l'heure de préparation (dernier état "Préparée")
-        heure_preparation = None
-        for etat in commande.etats.filter(enum_etat__libelle='Préparée').order_by('-date_debut'):
-            if etat.date_debut:
-                heure_preparation = etat.date_debut.strftime('%d/%m/%Y %H:%M')
-                break
-        
-        # Heure d'exportation
-        heure_exportation = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
-        
-        # Écrire la ligne
-        row_data = [
-            commande.id_yz or commande.num_cmd,
-            f"{commande.client.prenom} {commande.client.nom}" if commande.client else "N/A",
-            commande.client.numero_tel if commande.client else "N/A",
-            commande.ville.nom if commande.ville else "N/A",
-            commande.ville.region.nom_region if commande.ville and commande.ville.region else "N/A",
-            articles_consolides,
-            commande.total_cmd or 0,
-            commande.adresse or "N/A",
-            etat_actuel,
-            commande.date_creation.strftime('%d/%m/%Y %H:%M') if commande.date_creation else "N/A",
-            heure_preparation or "N/A",
-            heure_exportation,
-            f"{operateur.prenom} {operateur.nom}"
-        ]
-        
-        for col, value in enumerate(row_data, 1):
-            ws.cell(row=row, column=col, value=value)
-    
-    # Ajuster la largeur des colonnes
-    for column in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column[0].column)
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Créer la réponse
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+    # Commandes PRÉPARÉES assignées à cet opérateur
+    commandes = _commandes_preparees_export(etats__operateur=operateur).order_by('-date_cmd')
     filename = f"operateur_{operateur.prenom}_{operateur.nom}_commandes_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    wb.save(response)
-    return response
+    return reponse_excel(
+        [Feuille(f"Opérateur {operateur.prenom} {operateur.nom}", commandes, _colonnes_commandes_preparees(operateur))],
+        filename,
+    )
 
 # ============================================================================
 # VUES POUR LA GESTION DES COULEURS ET POINTURES
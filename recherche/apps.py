@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class RechercheConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'recherche'
+    verbose_name = 'Recherche globale'
+
+    def ready(self):
+        # Maintenance incrémentale des documents de recherche
+        from . import signals  # noqa: F401
@@ -0,0 +1,193 @@
+"""
+Construction et mise à jour des documents de recherche.
+
+Chaque fonction reçoit des identifiants, recharge les objets avec leurs
+relations en quelques requêtes, puis écrit les documents par upsert
+(bulk_create avec update_conflicts).
+"""
+import re
+import unicodedata
+
+from django.db.models import Prefetch
+
+from article.models import Article
+from client.models import Client
+from commande.models import Commande, Panier
+
+from .models import DocumentRecherche
+
+TAILLE_LOT = 500
+
+CHAMPS_DOCUMENT = ['titre', 'sous_titre', 'etat', 'identifiants', 'contenu', 'date_objet', 'date_indexation']
+
+
+def normaliser(texte):
+    """Minuscules, sans accents, espaces simples"""
+    texte = unicodedata.normalize('NFKD', str(texte or ''))
+    texte = ''.join(caractere for caractere in texte if not unicodedata.combining(caractere))
+    return ' '.join(texte.lower().split())
+
+
+def _chiffres(texte):
+    return re.sub(r'\D', '', texte or '')
+
+
+def _identifiants(*valeurs):
+    valeurs = [normaliser(valeur) for valeur in valeurs if valeur not in (None, '')]
+    return f" {' '.join(valeurs)} " if valeurs else ''
+
+
+def _contenu(*valeurs):
+    return normaliser(' '.join(str(valeur) for valeur in valeurs if valeur not in (None, '')))
+
+
+def _enregistrer(documents):
+    DocumentRecherche.objects.bulk_create(
+        documents,
+        batch_size=TAILLE_LOT,
+        update_conflicts=True,
+        unique_fields=['type_objet', 'id_objet'],
+        update_fields=CHAMPS_DOCUMENT,
+    )
+
+
+def _par_lots(ids):
+    ids = sorted({pk for pk in ids if pk})
+    for debut in range(0, len(ids), TAILLE_LOT):
+        yield ids[debut:debut + TAILLE_LOT]
+
+
+def document_commande(commande):
+    client = commande.client
+    ville = commande.ville
+    region = ville.region.nom_region if ville and ville.region else ''
+    ville_affichee = ville.nom if ville else 'N/A'
+    if commande.ville_init and commande.ville_init != (ville.nom if ville else ''):
+        ville_affichee = f'{commande.ville_init} → {ville_affichee}'
+
+    termes_panier = []
+    for panier in commande.paniers.all():
+        termes_panier += [panier.article.nom, panier.article.reference]
+        variante = panier.variante
+        if variante:
+            termes_panier += [
+                variante.reference_variante,
+                variante.couleur.nom if variante.couleur else None,
+                variante.pointure.pointure if variante.pointure else None,
+            ]
+
+    return DocumentRecherche(
+        type_objet='commande',
+        id_objet=commande.pk,
+        titre=f'Commande #{commande.pk} ({commande.num_cmd})'[:255],
+        sous_titre=f'{client.nom} {client.prenom} - {ville_affichee} - {commande.total_cmd} DH'[:255],
+        etat=commande.etat_courant.libelle if commande.etat_courant else '',
+        identifiants=_identifiants(commande.pk, commande.num_cmd, commande.id_yz, _chiffres(client.numero_tel))[:255],
+        contenu=_contenu(
+            commande.pk, commande.num_cmd, commande.id_yz,
+            client.nom, client.prenom, client.numero_tel, _chiffres(client.numero_tel), client.email,
+            ville.nom if ville else None, commande.ville_init, region,
+            *termes_panier,
+        ),
+        date_objet=commande.date_creation,
+    )
+
+
+def document_client(client):
+    return DocumentRecherche(
+        type_objet='client',
+        id_objet=client.pk,
+        titre=f'{client.nom} {client.prenom}'[:255],
+        sous_titre=f'{client.email or "N/A"} - {client.numero_tel}'[:255],
+        identifiants=_identifiants(client.pk, _chiffres(client.numero_tel))[:255],
+        contenu=_contenu(client.nom, client.prenom, client.numero_tel, _chiffres(client.numero_tel), client.email),
+        date_objet=client.date_creation,
+    )
+
+
+def document_article(article):
+    termes_variantes = []
+    for variante in article.variantes.all():
+        termes_variantes += [
+            variante.reference_variante,
+            variante.couleur.nom if variante.couleur else None,
+            variante.pointure.pointure if variante.pointure else None,
+        ]
+    return DocumentRecherche(
+        type_objet='article',
+        id_objet=article.pk,
+        titre=article.nom[:255],
+        sous_titre=f'Réf: {article.reference or "N/A"}'[:255],
+        etat='actif' if article.actif else 'inactif',
+        identifiants=_identifiants(article.pk, article.reference, article.modele)[:255],
+        contenu=_contenu(
+            article.nom, article.reference, article.modele, article.categorie.nom if article.categorie else None,
+            *termes_variantes,
+        ),
+        date_objet=article.date_creation,
+    )
+
+
+def indexer_commandes(commande_ids):
+    """(Ré)indexe les commandes données (client, ville et contenu du panier compris) et leurs clients"""
+    nombre = 0
+    for lot in _par_lots(commande_ids):
+        commandes = Commande.objects.filter(pk__in=lot).select_related(
+            'client', 'ville__region', 'etat_courant'
+        ).prefetch_related(
+            Prefetch('paniers', queryset=Panier.objects.select_related(
+                'article', 'variante__couleur', 'variante__pointure'
+            ))
+        )
+        documents = [document_commande(commande) for commande in commandes]
+        # Le client est déjà chargé : son document suit les modifications faites via ses commandes
+        clients = {commande.client_id: commande.client for commande in commandes}
+        _enregistrer(documents + [document_client(client) for client in clients.values()])
+        nombre += len(documents)
+    return nombre
+
+
+def indexer_clients(client_ids):
+    """(Ré)indexe les clients donnés"""
+    nombre = 0
+    for lot in _par_lots(client_ids):
+        documents = [document_client(client) for client in Client.objects.filter(pk__in=lot)]
+        _enregistrer(documents)
+        nombre += len(documents)
+    return nombre
+
+
+def indexer_articles(article_ids):
+    """(Ré)indexe les articles donnés, avec les références, couleurs et pointures de leurs variantes"""
+    nombre = 0
+    for lot in _par_lots(article_ids):
+        articles = Article.objects.filter(pk__in=lot).select_related('categorie').prefetch_related(
+            'variantes__couleur', 'variantes__pointure'
+        )
+        documents = [document_article(article) for article in articles]
+        _enregistrer(documents)
+        nombre += len(documents)
+    return nombre
+
+
+INDEXEURS = {
+    'commande': (Commande, indexer_commandes),
+    'client': (Client, indexer_clients),
+    'article': (Article, indexer_articles),
+}
+
+
+def supprimer_documents(type_objet, ids):
+    DocumentRecherche.objects.filter(type_objet=type_objet, id_objet__in=list(ids)).delete()
+
+
+def reindexer_tout(types=None):
+    """Reconstruit l'index complet (backfill) et supprime les documents orphelins"""
+    resultats = {}
+    for type_objet in types or INDEXEURS:
+        modele, indexer = INDEXEURS[type_objet]
+        resultats[type_objet] = indexer(modele.objects.values_list('pk', flat=True))
+        DocumentRecherche.objects.filter(type_objet=type_objet).exclude(
+            id_objet__in=modele.objects.values('pk')
+        ).delete()
+    return resultats
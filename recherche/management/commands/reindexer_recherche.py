@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from recherche.indexation import INDEXEURS, reindexer_tout
+
+
+class Command(BaseCommand):
+    help = 'Reconstruit les documents de la recherche globale (à lancer après la migration initiale)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type',
+            action='append',
+            choices=list(INDEXEURS),
+            dest='types',
+            help='Ne réindexer que ce type d\'objet (répétable)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('🔄 Indexation de la recherche globale...')
+        resultats = reindexer_tout(options['types'])
+        for type_objet, nombre in resultats.items():
+            self.stdout.write(f'   {type_objet}: {nombre} document(s)')
+        self.stdout.write(self.style.SUCCESS('✨ Index de recherche à jour'))
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.7 on 2025-08-26 15:20
+
+from django.db import migrations, models
+
+
+def creer_index_trigrammes(apps, schema_editor):
+    """Index GIN trigrammes (PostgreSQL) : sous-chaînes et similarité sans parcours complet"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            # Paquet contrib absent : la recherche fonctionne sans index (voir recherche.moteur)
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS doc_recherche_contenu_trgm '
+        'ON recherche_documentrecherche USING gin (contenu gin_trgm_ops)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS doc_recherche_identifiants_trgm '
+        'ON recherche_documentrecherche USING gin (identifiants gin_trgm_ops)'
+    )
+
+
+def supprimer_index_trigrammes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS doc_recherche_contenu_trgm')
+    schema_editor.execute('DROP INDEX IF EXISTS doc_recherche_identifiants_trgm')
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentRecherche',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_objet', models.CharField(choices=[('commande', 'Commande'), ('client', 'Client'), ('article', 'Article')], max_length=20)),
+                ('id_objet', models.BigIntegerField()),
+                ('titre', models.CharField(max_length=255)),
+                ('sous_titre', models.CharField(blank=True, default='', max_length=255)),
+                ('etat', models.CharField(blank=True, default='', max_length=100)),
+                ('identifiants', models.CharField(blank=True, default='', max_length=255)),
+                ('contenu', models.TextField()),
+                ('date_objet', models.DateTimeField(blank=True, null=True)),
+                ('date_indexation', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Document de recherche',
+                'verbose_name_plural': 'Documents de recherche',
+                'indexes': [models.Index(fields=['type_objet', 'etat', '-date_objet'], name='doc_recherche_type_etat_idx')],
+                'constraints': [models.UniqueConstraint(fields=('type_objet', 'id_objet'), name='document_recherche_objet_unique')],
+            },
+        ),
+        migrations.RunPython(creer_index_trigrammes, supprimer_index_trigrammes),
+    ]
@@ -0,0 +1,41 @@
+from django.db import models
+
+
+class DocumentRecherche(models.Model):
+    """
+    Document de recherche dénormalisé (une ligne par commande, client ou article).
+
+    Le texte recherchable est normalisé (minuscules, sans accents) à l'indexation :
+    la recherche se fait par sous-chaîne sur `contenu`, accélérée sous PostgreSQL
+    par des index trigrammes (voir la migration initiale).
+    """
+    TYPE_OBJET_CHOICES = [
+        ('commande', 'Commande'),
+        ('client', 'Client'),
+        ('article', 'Article'),
+    ]
+
+    type_objet = models.CharField(max_length=20, choices=TYPE_OBJET_CHOICES)
+    id_objet = models.BigIntegerField()
+    titre = models.CharField(max_length=255)
+    sous_titre = models.CharField(max_length=255, blank=True, default='')
+    # Libellé de l'état courant (commandes), utilisé pour le filtrage par rôle
+    etat = models.CharField(max_length=100, blank=True, default='')
+    # Identifiants exacts (id, numéros, téléphone) entourés d'espaces, pour le classement
+    identifiants = models.CharField(max_length=255, blank=True, default='')
+    contenu = models.TextField()
+    date_objet = models.DateTimeField(null=True, blank=True)
+    date_indexation = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Document de recherche"
+        verbose_name_plural = "Documents de recherche"
+        constraints = [
+            models.UniqueConstraint(fields=['type_objet', 'id_objet'], name='document_recherche_objet_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['type_objet', 'etat', '-date_objet'], name='doc_recherche_type_etat_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.type_objet} #{self.id_objet} - {self.titre}"
@@ -0,0 +1,238 @@
+"""
+Moteur de la recherche globale, partagé par les barres de recherche des
+interfaces (administration, confirmation, préparation, supervision, logistique).
+
+Une requête lit uniquement DocumentRecherche :
+- PostgreSQL : sous-chaînes et similarité de mots (pg_trgm), toutes deux
+  servies par les index trigrammes, classement par pertinence ;
+- autres bases (ou PostgreSQL sans pg_trgm) : sous-chaînes (LIKE) et
+  classement simplifié.
+
+Le profil (déduit du rôle de l'utilisateur) limite les types d'objets
+visibles et, pour les commandes, les états courants accessibles.
+"""
+from functools import lru_cache
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection, connections
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from article.models import Article
+from commande import etats as etats_commande
+
+from .indexation import normaliser
+from .models import DocumentRecherche
+
+TAILLE_MIN_REQUETE = 2
+RESULTATS_PAR_PAGE = 10
+
+# Sans état courant ('') : commandes pas encore traitées, visibles de la confirmation
+ETATS_CONFIRMATION = ('',) + etats_commande.ETATS_CONFIRMATION
+ETATS_PREPARATION = etats_commande.ETATS_PREPARATION
+ETATS_LOGISTIQUE = etats_commande.ETATS_LOGISTIQUE
+
+# types : objets visibles, etats : états courants des commandes visibles (None = tous)
+PROFILS = {
+    'admin': {'types': ('commande', 'client', 'article'), 'etats': None},
+    'confirmation': {'types': ('commande', 'client', 'article'), 'etats': ETATS_CONFIRMATION},
+    'preparation': {'types': ('commande', 'article'), 'etats': ETATS_PREPARATION},
+    'supervision': {'types': ('commande', 'article'), 'etats': ETATS_PREPARATION},
+    'logistique': {'types': ('commande',), 'etats': ETATS_LOGISTIQUE},
+}
+
+PROFIL_PAR_TYPE_OPERATEUR = {
+    'ADMIN': 'admin',
+    'CONFIRMATION': 'confirmation',
+    'PREPARATION': 'preparation',
+    'SUPERVISEUR_PREPARATION': 'supervision',
+    'LOGISTIQUE': 'logistique',
+}
+
+
+def profil_utilisateur(user, defaut):
+    """Profil de recherche d'un utilisateur : rôle de son opérateur, sinon celui de l'interface"""
+    if user.is_superuser:
+        return 'admin'
+    operateur = getattr(user, 'profil_operateur', None)
+    if operateur is not None:
+        return PROFIL_PAR_TYPE_OPERATEUR.get(operateur.type_operateur, defaut)
+    return defaut
+
+
+@lru_cache(maxsize=None)
+def _pg_trgm_installe(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def _recherche_indexee():
+    """Similarité trigrammes disponible (PostgreSQL avec l'extension pg_trgm)"""
+    return connection.vendor == 'postgresql' and _pg_trgm_installe(connection.alias)
+
+
+def documents_correspondants(requete, type_objet, etats=None):
+    """
+    Documents d'un type correspondant à la requête, classés par pertinence :
+    identifiant exact, identifiant commençant par la requête, phrase exacte,
+    puis similarité (PostgreSQL) et date la plus récente.
+    """
+    requete = normaliser(requete)
+    mots = requete.split()
+    if len(requete) < TAILLE_MIN_REQUETE or not mots:
+        return DocumentRecherche.objects.none()
+
+    documents = DocumentRecherche.objects.filter(type_objet=type_objet)
+    if etats is not None:
+        documents = documents.filter(etat__in=etats)
+
+    correspondance = Q()
+    for mot in mots:
+        correspondance &= Q(contenu__contains=mot)
+    if _recherche_indexee():
+        # Tolère les fautes de frappe (seuil pg_trgm.word_similarity_threshold, 0.6 par défaut)
+        correspondance |= Q(contenu__trigram_word_similar=requete)
+    documents = documents.filter(correspondance).annotate(
+        rang=Case(
+            When(identifiants__contains=f' {requete} ', then=Value(3)),
+            When(identifiants__contains=f' {requete}', then=Value(2)),
+            When(contenu__contains=requete, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    )
+
+    if _recherche_indexee():
+        documents = documents.annotate(similarite=TrigramWordSimilarity(requete, 'contenu'))
+        return documents.order_by('-rang', '-similarite', '-date_objet')
+    return documents.order_by('-rang', '-date_objet')
+
+
+def rechercher(requete, profil, types=None, page=1, par_page=RESULTATS_PAR_PAGE, etats=None):
+    """
+    Recherche paginée par type d'objet.
+
+    Args:
+        requete: texte saisi
+        profil: clé de PROFILS
+        types: types demandés (par défaut tous ceux du profil)
+        page: numéro de page (à partir de 1), commun à tous les types
+        etats: restriction supplémentaire des états des commandes (parmi ceux du profil)
+
+    Returns:
+        dict: {type_objet: {'documents': [...], 'page': n, 'has_next': bool}}
+    """
+    config = PROFILS[profil]
+    types = [type_objet for type_objet in (types or config['types']) if type_objet in config['types']]
+    etats_profil = config['etats']
+    if etats is not None:
+        etats = [etat for etat in etats if etats_profil is None or etat in etats_profil]
+    else:
+        etats = etats_profil
+
+    try:
+        page = max(int(page or 1), 1)
+    except (TypeError, ValueError):
+        page = 1
+    debut = (page - 1) * par_page
+    resultats = {}
+    for type_objet in types:
+        documents = documents_correspondants(
+            requete, type_objet, etats=etats if type_objet == 'commande' else None
+        )
+        # Une ligne de plus que la page suffit à savoir s'il en reste, sans COUNT(*)
+        documents = list(documents[debut:debut + par_page + 1])
+        resultats[type_objet] = {
+            'documents': documents[:par_page],
+            'page': page,
+            'has_next': len(documents) > par_page,
+        }
+    return resultats
+
+
+def stocks_articles(article_ids):
+    """Stock disponible (variantes actives) de plusieurs articles, en une requête"""
+    return dict(Article.objects.filter(pk__in=article_ids).values_list('pk', 'stock_disponible'))
+
+
+def formater_resultats(resultats, urls, icones=None, types_resultat=None):
+    """
+    Convertit les documents au format attendu par les barres de recherche.
+
+    Args:
+        resultats: retour de rechercher()
+        urls: {type_objet: fonction(id_objet) -> url}
+        icones: {type_objet: classe Font Awesome}
+        types_resultat: {type_objet: valeur du champ 'type'} (par défaut le type d'objet)
+    """
+    icones = {'commande': 'fas fa-shopping-cart', 'client': 'fas fa-user', 'article': 'fas fa-box', **(icones or {})}
+    types_resultat = types_resultat or {}
+    formates = {}
+    for type_objet, resultat in resultats.items():
+        documents = resultat['documents']
+        stocks = stocks_articles([doc.id_objet for doc in documents]) if type_objet == 'article' else {}
+        items = []
+        for document in documents:
+            sous_titre = document.sous_titre
+            statut = document.etat or 'Non affectée'
+            if type_objet == 'article':
+                stock = stocks.get(document.id_objet) or 0
+                sous_titre = f'{sous_titre} - Stock: {stock}'
+                statut = 'En stock' if stock > 0 else 'Rupture'
+            elif type_objet == 'client':
+                statut = 'Actif'
+            items.append({
+                'id': document.id_objet,
+                'type': types_resultat.get(type_objet, type_objet),
+                'title': document.titre,
+                'subtitle': sous_titre,
+                'status': statut,
+                'url': urls[type_objet](document.id_objet),
+                'icon': icones[type_objet],
+                # 1 = le plus pertinent, comme les anciennes recherches
+                'priority': 4 - getattr(document, 'rang', 0),
+            })
+        formates[type_objet] = items
+    return formates
+
+
+def pagination_resultats(resultats):
+    """Informations de pagination par type, pour la réponse JSON"""
+    return {
+        type_objet: {'page': resultat['page'], 'has_next': resultat['has_next']}
+        for type_objet, resultat in resultats.items()
+    }
+
+
+def recherche_globale(request, profil_defaut, categories, urls, icones=None, types_resultat=None, etats=None):
+    """
+    Recherche indexée d'une barre de recherche globale (paramètres GET q, category, page).
+
+    Args:
+        profil_defaut: profil de l'interface, utilisé si l'utilisateur n'a pas de rôle d'opérateur
+        categories: {catégorie de la réponse: type_objet}
+
+    Returns:
+        tuple: ({catégorie: résultats formatés}, {catégorie: pagination})
+    """
+    categorie_demandee = request.GET.get('category', 'all')
+    categorie_par_type = {
+        type_objet: categorie for categorie, type_objet in categories.items()
+        if categorie_demandee in ('all', categorie)
+    }
+    if not categorie_par_type:
+        return {}, {}
+
+    resultats = rechercher(
+        request.GET.get('q', '').strip(),
+        profil_utilisateur(request.user, profil_defaut),
+        types=list(categorie_par_type),
+        page=request.GET.get('page'),
+        etats=etats,
+    )
+    formates = formater_resultats(resultats, urls, icones=icones, types_resultat=types_resultat)
+    return (
+        {categorie_par_type[type_objet]: items for type_objet, items in formates.items()},
+        {categorie_par_type[type_objet]: pagination for type_objet, pagination in pagination_resultats(resultats).items()},
+    )
+
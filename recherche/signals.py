@@ -0,0 +1,72 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from article.models import Article, VarianteArticle
+from client.models import Client
+from commande.models import Commande, Panier
+from commande.signals import commandes_modifiees, creations_en_masse
+
+from .indexation import indexer_articles, indexer_clients, indexer_commandes, supprimer_documents
+
+
+def _apres_commit(fonction, ids):
+    """Indexe après le commit : l'écriture indexée n'est pas ralentie ni annulée par l'index"""
+    ids = [pk for pk in ids if pk]
+    if ids:
+        transaction.on_commit(lambda: fonction(ids))
+
+
+@receiver(commandes_modifiees)
+def indexer_commandes_modifiees(sender, commande_ids=(), **kwargs):
+    """Transitions d'état et écritures par lots (l'état courant fait partie du document)"""
+    _apres_commit(indexer_commandes, list(commande_ids))
+
+
+# Champs de la commande repris dans son document (le client et le panier ont leurs propres signaux)
+CHAMPS_INDEXES_COMMANDE = ('num_cmd', 'id_yz', 'client_id', 'total_cmd', 'etat_courant_id', 'ville_id', 'ville_init')
+
+
+@receiver(post_save, sender=Commande)
+def indexer_commande(sender, instance, **kwargs):
+    if instance.champs_modifies(CHAMPS_INDEXES_COMMANDE):
+        _apres_commit(indexer_commandes, [instance.pk])
+
+
+@receiver(post_save, sender=Panier)
+@receiver(post_delete, sender=Panier)
+def indexer_commande_panier(sender, instance, **kwargs):
+    _apres_commit(indexer_commandes, [instance.commande_id])
+
+
+@receiver(post_save, sender=Client)
+def indexer_client(sender, instance, **kwargs):
+    """Le nom et le téléphone du client font aussi partie des documents de ses commandes"""
+    _apres_commit(indexer_clients, [instance.pk])
+    _apres_commit(indexer_commandes, list(instance.commandes.values_list('pk', flat=True)))
+
+
+@receiver(post_save, sender=Article)
+def indexer_article(sender, instance, **kwargs):
+    _apres_commit(indexer_articles, [instance.pk])
+
+
+@receiver(post_save, sender=VarianteArticle)
+@receiver(post_delete, sender=VarianteArticle)
+def indexer_article_variante(sender, instance, **kwargs):
+    _apres_commit(indexer_articles, [instance.article_id])
+
+
+@receiver(creations_en_masse)
+def indexer_creations_en_masse(sender, instances=(), **kwargs):
+    if sender is Client:
+        _apres_commit(indexer_clients, [client.pk for client in instances])
+    elif sender is Commande:
+        _apres_commit(indexer_commandes, [commande.pk for commande in instances])
+
+
+@receiver(post_delete, sender=Commande)
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=Article)
+def supprimer_document(sender, instance, **kwargs):
+    supprimer_documents(sender._meta.model_name, [instance.pk])
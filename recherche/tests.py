@@ -0,0 +1,133 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from article.models import Article, Categorie, Couleur, Pointure, VarianteArticle
+from client.models import Client
+from commande.etats import EN_COURS_LIVRAISON
+from commande.models import Commande, EnumEtatCmd, Panier
+from commande.transitions import changer_etat_commande
+from parametre.models import Operateur, Region, Ville
+from recherche.indexation import reindexer_tout
+from recherche.models import DocumentRecherche
+from recherche.moteur import rechercher
+
+
+class RechercheGlobaleTest(TestCase):
+
+    def setUp(self):
+        region = Region.objects.create(nom_region='Fès-Meknès')
+        self.ville = Ville.objects.create(nom='Fès', frais_livraison=25, frequence_livraison='Quotidienne', region=region)
+        categorie = Categorie.objects.create(nom='MOCASSINS')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article = Article.objects.create(nom='Mocassin Cuir', reference='MOC-7', prix_unitaire=450, categorie=categorie)
+            self.variante = VarianteArticle.objects.create(
+                article=self.article,
+                couleur=Couleur.objects.create(nom='Camel'),
+                pointure=Pointure.objects.create(pointure='41'),
+                qte_disponible=4,
+            )
+
+    def _commande(self, numero, nom_client, etat=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            client = Client.objects.create(nom=nom_client, prenom='Yassine', numero_tel=f'06 55 00 00 {numero:02d}')
+            commande = Commande.objects.create(
+                num_cmd=f'YZ-{numero}', id_yz=700000 + numero, client=client, ville=self.ville, total_cmd=450,
+            )
+            Panier.objects.create(commande=commande, article=self.article, variante=self.variante, quantite=1, sous_total=450)
+            if etat:
+                changer_etat_commande(commande, etat)
+        return commande
+
+    def _ids(self, resultats, type_objet='commande'):
+        return [document.id_objet for document in resultats[type_objet]['documents']]
+
+    def test_index_maintenu_par_les_signaux(self):
+        commande = self._commande(1, 'Chraïbi', etat='Confirmée')
+
+        document = DocumentRecherche.objects.get(type_objet='commande', id_objet=commande.pk)
+        self.assertEqual(document.etat, 'Confirmée')
+        self.assertIn('chraibi', document.contenu)
+        self.assertIn('camel', document.contenu)
+        self.assertTrue(DocumentRecherche.objects.filter(type_objet='client', id_objet=commande.client_id).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            commande.delete()
+        self.assertFalse(DocumentRecherche.objects.filter(type_objet='commande', id_objet=commande.pk).exists())
+
+    def test_classement_et_recherche_sans_accents(self):
+        commande = self._commande(12, 'Chraïbi')
+        autre = self._commande(3, 'Alami')
+        # L'identifiant exact passe devant les autres documents qui le contiennent
+        autre.ville_init = 'YZ-12 quartier'
+        with self.captureOnCommitCallbacks(execute=True):
+            autre.save()
+
+        self.assertEqual(self._ids(rechercher('yz-12', 'admin', types=['commande'])), [commande.pk, autre.pk])
+        self.assertEqual(self._ids(rechercher('CHRAIBI', 'admin', types=['commande'])), [commande.pk])
+        self.assertEqual(self._ids(rechercher('0655000003', 'admin', types=['commande'])), [autre.pk])
+        # Contenu du panier (article, couleur) et variantes de l'article
+        self.assertEqual(len(self._ids(rechercher('mocassin camel', 'admin', types=['commande']))), 2)
+        self.assertEqual(self._ids(rechercher('camel 41', 'admin', types=['article']), 'article'), [self.article.pk])
+
+    def test_filtrage_par_role(self):
+        confirmee = self._commande(4, 'Berrada', etat='Confirmée')
+        livree = self._commande(5, 'Berrada', etat='Livrée')
+
+        self.assertEqual(set(self._ids(rechercher('berrada', 'admin'))), {confirmee.pk, livree.pk})
+        self.assertEqual(self._ids(rechercher('berrada', 'confirmation')), [confirmee.pk])
+        self.assertEqual(set(self._ids(rechercher('berrada', 'logistique'))), {confirmee.pk, livree.pk})
+        self.assertNotIn('client', rechercher('berrada', 'logistique'))
+
+    def test_api_logistique_commande_en_livraison(self):
+        EnumEtatCmd.objects.get_or_create(libelle=EN_COURS_LIVRAISON, defaults={'ordre': 60})
+        commande = self._commande(14, 'Lahlou', etat=EN_COURS_LIVRAISON)
+        user = User.objects.create_user('op-logistique', password='motdepasse')
+        Operateur.objects.create(user=user, nom='Amrani', prenom='Karim', mail='karim@example.com', type_operateur='LOGISTIQUE')
+        self.client.force_login(user)
+
+        data = self.client.get(reverse('operatLogistic:global_search_api'), {'q': 'lahlou'}).json()
+
+        self.assertTrue(data['success'])
+        self.assertEqual([item['id'] for item in data['results']['commandes']], [commande.pk])
+        self.assertEqual(data['results']['commandes'][0]['status'], EN_COURS_LIVRAISON)
+
+    def test_pagination_sans_comptage(self):
+        for numero in range(6, 11):
+            self._commande(numero, 'Tahiri')
+        rechercher('tahiri', 'admin', types=['commande'])
+
+        with CaptureQueriesContext(connection) as requetes:
+            premiere = rechercher('tahiri', 'admin', types=['commande'], par_page=3)
+        seconde = rechercher('tahiri', 'admin', types=['commande'], page=2, par_page=3)
+
+        self.assertEqual(len(requetes), 1)
+        self.assertTrue(premiere['commande']['has_next'])
+        self.assertFalse(seconde['commande']['has_next'])
+        self.assertEqual(len(set(self._ids(premiere)) | set(self._ids(seconde))), 5)
+
+    def test_reindexation_complete(self):
+        commande = self._commande(11, 'Naciri')
+        DocumentRecherche.objects.all().delete()
+        DocumentRecherche.objects.create(type_objet='commande', id_objet=999999, titre='Orpheline', contenu='orpheline')
+
+        reindexer_tout()
+
+        self.assertTrue(DocumentRecherche.objects.filter(type_objet='commande', id_objet=commande.pk).exists())
+        self.assertFalse(DocumentRecherche.objects.filter(id_objet=999999).exists())
+
+    def test_api_confirmation(self):
+        commande = self._commande(13, 'Ouazzani', etat='Confirmée')
+        user = User.objects.create_user('op-recherche', password='motdepasse')
+        Operateur.objects.create(user=user, nom='Ouali', prenom='Hind', mail='hind@example.com', type_operateur='CONFIRMATION')
+        self.client.force_login(user)
+
+        data = self.client.get(reverse('operatConfirme:global_search_api'), {'q': 'ouazzani'}).json()
+
+        self.assertTrue(data['success'])
+        self.assertEqual([item['id'] for item in data['results']['commandes']], [commande.pk])
+        self.assertEqual(data['results']['commandes'][0]['status'], 'Confirmée')
+        self.assertEqual(data['results']['clients'][0]['id'], commande.client_id)
+        self.assertFalse(data['pagination']['commandes']['has_next'])
@@ -0,0 +1,76 @@
+/**
+ * Suivi des exports exécutés en arrière-plan
+ * Fichier : exports-differes.js
+ * Utilisation : lancer un export (la vue répond 202 avec l'état de la tâche),
+ * interroger son avancement puis télécharger le fichier (voir commande.jobs)
+ */
+
+const INTERVALLE_SUIVI_EXPORT = 2000;
+
+/**
+ * Interroge l'état d'une tâche jusqu'à la fin de l'export.
+ * @param {string} urlEtat - URL de suivi (tache.url_etat)
+ * @param {function} surProgression - appelée avec l'état à chaque lecture
+ * @returns {Promise<object>} état final de la tâche (rejetée si l'export a échoué)
+ */
+function suivreExport(urlEtat, surProgression) {
+    return new Promise((resolve, reject) => {
+        function lire() {
+            fetch(urlEtat, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success) {
+                        throw new Error(data.error || 'Export introuvable');
+                    }
+                    const tache = data.tache;
+                    if (surProgression) {
+                        surProgression(tache);
+                    }
+                    if (tache.statut === 'terminee') {
+                        resolve(tache);
+                    } else if (tache.statut === 'erreur') {
+                        reject(new Error(tache.erreur || 'Erreur lors de l\'export'));
+                    } else {
+                        setTimeout(lire, INTERVALLE_SUIVI_EXPORT);
+                    }
+                })
+                .catch(reject);
+        }
+        lire();
+    });
+}
+
+/**
+ * Lance un export en arrière-plan et télécharge le fichier une fois prêt.
+ * @param {string} url - vue qui déclenche l'export
+ * @param {function} surProgression - appelée avec l'état de la tâche pendant l'attente
+ * @returns {Promise<object>} état final de la tâche
+ */
+function lancerExportDiffere(url, surProgression) {
+    return fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.error || 'Impossible de lancer l\'export');
+            }
+            return suivreExport(data.tache.url_etat, surProgression);
+        })
+        .then(tache => {
+            window.location.href = tache.url_telechargement;
+            return tache;
+        });
+}
+
+/**
+ * Texte d'avancement d'une tâche : « 1 500 / 12 000 lignes (12 %) »
+ */
+function texteAvancementExport(tache) {
+    if (tache.statut === 'en_attente') {
+        return 'En attente de démarrage...';
+    }
+    const ecrites = tache.lignes_ecrites.toLocaleString('fr-FR');
+    if (tache.lignes_total) {
+        return `${ecrites} / ${tache.lignes_total.toLocaleString('fr-FR')} lignes (${tache.pourcentage} %)`;
+    }
+    return `${ecrites} lignes écrites`;
+}
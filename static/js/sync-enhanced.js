@@ -412,6 +412,31 @@ class SyncEnhanced {
         }
     }
 
+    // Suivre un job de synchronisation en arrière-plan (sync_all) jusqu'à sa fin
+    async followJob(statusUrl, interval = 2000) {
+        while (true) {
+            const response = await fetch(statusUrl, {
+                headers: { 'X-Requested-With': 'XMLHttpRequest' }
+            });
+            if (!response.ok) {
+                throw new Error(`Erreur HTTP: ${response.status}`);
+            }
+
+            const job = await response.json();
+            const total = job.configs.length || 1;
+            const termines = job.configs.filter(config => config.status !== 'pending').length;
+            this.updateProgress(
+                10 + Math.round(80 * termines / total),
+                `${termines}/${total} configuration(s) synchronisée(s) - ${job.processed_rows} ligne(s) traitée(s)`
+            );
+
+            if (job.finished) {
+                return job;
+            }
+            await new Promise(resolve => setTimeout(resolve, interval));
+        }
+    }
+
     getCSRFToken() {
         // Essayer plusieurs méthodes pour récupérer le token CSRF
         let token = document.querySelector('[name=csrfmiddlewaretoken]')?.value;
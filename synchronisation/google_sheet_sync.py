@@ -4,22 +4,40 @@ from google.oauth2.service_account import Credentials
 from django.conf import settings
 from django.utils import timezone
 from client.models import Client
+from client.telephone import nettoyer_telephone, telephone_canonique
 from commande.models import Commande, EtatCommande, EnumEtatCmd, Panier
+from commande.numerotation import allouer_id_yz
+from commande.signals import commandes_modifiees as signal_commandes_modifiees, creations_en_masse
+from commande.transitions import changer_etat_commande
 from parametre.models import Operateur, Ville, Region
-from synchronisation.models import SyncLog, GoogleSheetConfig
+from synchronisation.models import SyncLog, GoogleSheetConfig, SheetRowHash
+from synchronisation.sheet_reader import (
+    PREMIERE_LIGNE_DONNEES, decouper_en_lots, empreinte_ligne, feuille_tronquee, iterer_lignes, lire_entetes,
+    normaliser_ligne,
+)
 import pandas as pd
 from datetime import datetime, timedelta
+from itertools import chain
 from django.db import transaction
 from django.db.models import Q
-import re
 
 class GoogleSheetSync:
     """Classe pour gérer la synchronisation avec Google Sheets"""
     
-    def __init__(self, sheet_config, triggered_by="admin", verbose=False):
+    # Nombre de lignes traitées par lot (une transaction et un checkpoint par lot)
+    DEFAULT_BATCH_SIZE = 500
+    # Nombre de lignes déjà traitées (précédant le checkpoint) re-vérifiées à chaque synchronisation
+    DEFAULT_RESCAN_WINDOW = 1000
+
+    def __init__(self, sheet_config, triggered_by="admin", verbose=False, batch_size=None, rescan_window=None,
+                 sync_log=None):
         self.sheet_config = sheet_config
         self.triggered_by = triggered_by
         self.verbose = verbose  # Contrôle l'affichage des messages détaillés
+        self.batch_size = batch_size or self.DEFAULT_BATCH_SIZE
+        self.rescan_window = self.DEFAULT_RESCAN_WINDOW if rescan_window is None else rescan_window
+        # Log 'En cours' mis à jour au fil des lots (créé au démarrage si non fourni par le planificateur)
+        self.sync_log = sync_log
         self.records_imported = 0
         self.errors = []
         self.warnings = []
@@ -39,6 +57,8 @@ class GoogleSheetSync:
         self.existing_orders_skipped = 0  # Commandes existantes inchangées
         self.duplicate_orders_found = 0   # Commandes en double détectées
         self.protected_orders_count = 0   # Commandes protégées contre la régression d'état
+        self.rows_rescanned = 0           # Lignes déjà traitées relues pour détecter les modifications
+        self.modified_rows_resynced = 0   # Lignes déjà traitées modifiées dans la feuille puis re-synchronisées
     
     def _log(self, message, level="info"):
         """Log conditionnel selon le mode verbose"""
@@ -115,20 +135,24 @@ class GoogleSheetSync:
     @staticmethod
     def clean_phone_number(phone_str):
         """Nettoie et valide un numéro de téléphone"""
-        if not phone_str:
-            return ''
-        
-        # Convertir en string et nettoyer
-        phone = str(phone_str).strip()
-        
-        # Supprimer les caractères non numériques courants (espaces, tirets, points, parenthèses)
-        phone = re.sub(r'[\s\-\.\(\)\+]', '', phone)
-        
-        # Limiter à 30 caractères maximum (limite du modèle Client)
-        if len(phone) > 30:
-            phone = phone[:30]
-        
-        return phone
+        return nettoyer_telephone(phone_str)
+
+    @staticmethod
+    def _cle_telephone(telephone):
+        """Clé de rapprochement d'un client : forme canonique, sinon numéro brut"""
+        return telephone_canonique(telephone) or telephone
+
+    @staticmethod
+    def _get_or_create_client(telephone, defaults):
+        """get_or_create sur la forme canonique du numéro (index telephone_normalise)"""
+        canonique = telephone_canonique(telephone)
+        filtre = Q(numero_tel=telephone)
+        if canonique:
+            filtre |= Q(telephone_normalise=canonique)
+        client_obj = Client.objects.filter(filtre).order_by('pk').first()
+        if client_obj is not None:
+            return client_obj, False
+        return Client.objects.get_or_create(numero_tel=telephone, defaults=defaults)
     
     def _clean_phone_number(self, phone_str):
         """Nettoie et valide un numéro de téléphone avec logging des warnings"""
@@ -179,9 +203,9 @@ class GoogleSheetSync:
             client_nom = client_nom_prenom[0] if client_nom_prenom else ''
             client_prenom = client_nom_prenom[1] if len(client_nom_prenom) > 1 else ''
             
-            client_obj, created = Client.objects.get_or_create(
-                numero_tel=client_phone,
-                defaults={'nom': client_nom, 'prenom': client_prenom, 'adresse': data.get('Adresse', '')}
+            client_obj, created = self._get_or_create_client(
+                client_phone,
+                {'nom': client_nom, 'prenom': client_prenom, 'adresse': data.get('Adresse', '')}
             )
             # Mettre à jour les infos client si la fiche n'est pas nouvelle et des données sont dispo
             if not created:
@@ -604,100 +628,68 @@ class GoogleSheetSync:
             error_msg = f"Erreur lors de la mise à jour du client pour {existing_commande.num_cmd}: {str(e)}"
             self._log(error_msg, "error")
     
+    # Correspondance entre les statuts du fichier et les libellés des états en base
+    STATUS_MAP = {
+        'Non affectée': 'Non affectée',
+        'Affectée': 'Affectée',
+        'Erronée': 'Erronée',
+        'Doublon': 'Doublon',
+        'À confirmer': 'En cours de confirmation',
+        'En cours de confirmation': 'En cours de confirmation',
+        'Confirmée': 'Confirmée',
+        'Annulée': 'Annulée',
+        'En attente': 'En attente',
+        'Reportée': 'Reportée',
+        'Hors zone': 'Hors zone',
+        'Injoignable': 'Injoignable',
+        'Pas de réponse': 'Pas de réponse',
+        'Numéro incorrect': 'Numéro incorrect',
+        'Échoué': 'Échoué',
+        'Expédiée': 'Expédiée',
+        'En préparation': 'En préparation',
+        'En livraison': 'En livraison',
+        'Livrée': 'Livrée',
+        'Retournée': 'Retournée',
+        'Non payé': 'Non payé',
+        'Partiellement payé': 'Partiellement payé',
+        'Payé': 'Payé',
+        # Variantes possibles
+        'Erronee': 'Erronée',
+        'Errone': 'Erronée',
+        'Erroné': 'Erronée',
+        'Doublons': 'Doublon',
+        'Non affectee': 'Non affectée',
+        'Non affecté': 'Non affectée',
+        'Affecte': 'Affectée',
+        'Affecté': 'Affectée',
+        'Confirmee': 'Confirmée',
+        'Confirmé': 'Confirmée',
+        'Annulee': 'Annulée',
+        'Annulé': 'Annulée',
+        'Livree': 'Livrée',
+        'Livré': 'Livrée',
+        'Retournee': 'Retournée',
+        'Retourné': 'Retournée',
+    }
+
+    # Même correspondance indexée en minuscules pour la recherche insensible à la casse
+    STATUS_MAP_LOWER = {key.lower(): value for key, value in STATUS_MAP.items()}
+
     def _map_status(self, status):
         """Mappe les statuts du fichier aux libellés des états dans la base de données"""
-        print(f"🔄 === MAPPING STATUT ===")
-        print(f"📥 Statut reçu: '{status}'")
-        print(f"🔍 Type de statut: {type(status)}")
-        
-        status_map = {
-            'Non affectée': 'Non affectée',
-            'Affectée': 'Affectée',
-            'Erronée': 'Erronée',
-            'Doublon': 'Doublon',
-            'À confirmer': 'En cours de confirmation',
-            'En cours de confirmation': 'En cours de confirmation',
-            'Confirmée': 'Confirmée',
-            'Annulée': 'Annulée',
-            'En attente': 'En attente',
-            'Reportée': 'Reportée',
-            'Hors zone': 'Hors zone',
-            'Injoignable': 'Injoignable',
-            'Pas de réponse': 'Pas de réponse',
-            'Numéro incorrect': 'Numéro incorrect',
-            'Échoué': 'Échoué',
-            'Expédiée': 'Expédiée',
-            'En préparation': 'En préparation',
-            'En livraison': 'En livraison',
-            'Livrée': 'Livrée',
-            'Retournée': 'Retournée',
-            'Non payé': 'Non payé',
-            'Partiellement payé': 'Partiellement payé',
-            'Payé': 'Payé',
-            # Variantes possibles
-            'Erronee': 'Erronée',
-            'Errone': 'Erronée',
-            'Erroné': 'Erronée',
-            'Doublons': 'Doublon',
-            'Non affectee': 'Non affectée',
-            'Non affecté': 'Non affectée',
-            'Affecte': 'Affectée',
-            'Affecté': 'Affectée',
-            'Confirmee': 'Confirmée',
-            'Confirmé': 'Confirmée',
-            'Annulee': 'Annulée',
-            'Annulé': 'Annulée',
-            'Livree': 'Livrée',
-            'Livré': 'Livrée',
-            'Retournee': 'Retournée',
-            'Retourné': 'Retournée',
-        }
-        
-        print(f"📋 Nombre total de statuts dans le mapping: {len(status_map)}")
-        print(f"🔍 Statuts disponibles: {list(status_map.keys())}")
-        
-        # Nettoyer le statut reçu
-        print(f"🧹 === NETTOYAGE STATUT ===")
-        if status is None:
-            print(f"⚠️ Statut reçu est None")
-            cleaned_status = ''
-        else:
-            print(f"📝 Statut brut: '{status}' (longueur: {len(str(status))})")
-            cleaned_status = str(status).strip()
-            print(f"🧹 Statut après strip: '{cleaned_status}' (longueur: {len(cleaned_status)})")
-        
+        cleaned_status = str(status).strip() if status is not None else ''
+
         # Si le statut est vide ou null, retourner None pour indiquer qu'aucun changement n'est nécessaire
         if not cleaned_status:
-            print(f"❌ Statut vide ou null → None")
-            print(f"🔍 === FIN MAPPING STATUT ===\n")
             return None
-        
-        print(f"✅ Statut non vide, recherche en cours...")
-        
+
         # Chercher dans le dictionnaire (recherche exacte puis insensible à la casse)
-        print(f"🔍 === RECHERCHE EXACTE ===")
-        if cleaned_status in status_map:
-            result = status_map[cleaned_status]
-            print(f"✅ Statut trouvé exactement: '{cleaned_status}' → '{result}'")
-            print(f"🔍 === FIN MAPPING STATUT ===\n")
+        result = self.STATUS_MAP.get(cleaned_status) or self.STATUS_MAP_LOWER.get(cleaned_status.lower())
+        if result:
             return result
-        
-        print(f"❌ Recherche exacte échouée, tentative insensible à la casse...")
-        
-        # Recherche insensible à la casse
-        print(f"🔍 === RECHERCHE INSENSIBLE À LA CASSE ===")
-        for key, value in status_map.items():
-            print(f"🔍 Comparaison: '{key.lower()}' vs '{cleaned_status.lower()}'")
-            if key.lower() == cleaned_status.lower():
-                print(f"✅ Statut trouvé (insensible à la casse): '{key}' → '{value}'")
-                print(f"🔍 === FIN MAPPING STATUT ===\n")
-                return value
-        
+
         # Si aucun statut ne correspond, retourner None pour indiquer qu'un statut par défaut doit être utilisé
-        print(f"❌ Aucun statut trouvé pour '{cleaned_status}'")
-        print(f"⚠️ Utilisation du statut par défaut 'Non affectée'")
         self._log(f"Statut non reconnu: '{cleaned_status}' - utilisation du statut par défaut", "warning")
-        print(f"🔍 === FIN MAPPING STATUT ===\n")
         return None
 
     def _ensure_enum_etats_exist(self):
@@ -857,7 +849,7 @@ class GoogleSheetSync:
             # Créer le nouvel état de commande
             try:
                 self._log(f"🏗️ Création de l'EtatCommande...")
-                nouvel_etat = EtatCommande.objects.create(
+                nouvel_etat = changer_etat_commande(
                     commande=commande,
                     enum_etat=enum_etat,
                     date_debut=timezone.now(),
@@ -991,6 +983,398 @@ class GoogleSheetSync:
             'rows_to_process_next': None,  # Sera mis à jour lors de la synchronisation
         }
     
+    @staticmethod
+    def _get_order_number(data):
+        """Récupère le numéro de commande en essayant les différentes variantes d'en-tête"""
+        return data.get('N° Commande') or data.get('Numéro') or data.get('N°Commande') or data.get('Numero')
+
+    @staticmethod
+    def _split_client_name(data):
+        """Sépare la colonne Client en nom et prénom (au premier espace)"""
+        client_nom_prenom = data.get('Client', '').split(' ', 1)
+        client_nom = client_nom_prenom[0] if client_nom_prenom else ''
+        client_prenom = client_nom_prenom[1] if len(client_nom_prenom) > 1 else ''
+        return client_nom, client_prenom
+
+    def _load_reference_data(self):
+        """Charge une seule fois les états et les opérateurs utilisés par le traitement par lots"""
+        self._enum_etats = {enum_etat.libelle: enum_etat for enum_etat in EnumEtatCmd.objects.all()}
+
+        # nom_complet est une propriété : l'index est construit en mémoire (opérateurs actifs prioritaires)
+        self._operateurs = {}
+        for operateur in Operateur.objects.order_by('-actif', 'id'):
+            self._operateurs.setdefault(operateur.nom_complet.lower(), operateur)
+        self._operateurs_inconnus = set()
+
+    def _get_enum_etat(self, status_libelle):
+        """Retourne l'EnumEtatCmd du libellé, en le créant si nécessaire"""
+        enum_etat = self._enum_etats.get(status_libelle)
+        if enum_etat is None:
+            enum_etat, _ = EnumEtatCmd.objects.get_or_create(
+                libelle=status_libelle,
+                defaults={'ordre': 999, 'couleur': '#6B7280'}
+            )
+            self._enum_etats[status_libelle] = enum_etat
+        return enum_etat
+
+    def _get_operateur(self, data):
+        """Retourne l'opérateur de la ligne depuis l'index en mémoire"""
+        operator_name = data.get('Opérateur', '').strip()
+        if not operator_name:
+            return None
+        operateur = self._operateurs.get(operator_name.lower())
+        if operateur is None and operator_name not in self._operateurs_inconnus:
+            self._operateurs_inconnus.add(operator_name)
+            self.errors.append(f"Opérateur non trouvé: {operator_name}")
+        return operateur
+
+    def _merge_client_data(self, client_obj, data, adresse, clients_modifies):
+        """Reporte nom, prénom et adresse de la ligne sur le client (en mémoire)"""
+        client_nom, client_prenom = self._split_client_name(data)
+        client_updated = False
+        if client_nom and client_obj.nom != client_nom:
+            client_obj.nom = client_nom
+            client_updated = True
+        if client_prenom and client_obj.prenom != client_prenom:
+            client_obj.prenom = client_prenom
+            client_updated = True
+        if adresse and client_obj.adresse != adresse:
+            client_obj.adresse = adresse
+            client_updated = True
+        # Les clients créés dans ce lot sont insérés avec leurs valeurs finales
+        if client_updated and client_obj.pk:
+            clients_modifies[client_obj.pk] = client_obj
+
+    def _merge_command_data(self, commande, data):
+        """Reporte prix, adresse et ville de la ligne sur la commande (en mémoire)"""
+        updated = False
+        try:
+            new_price = float(data.get('Prix', 0)) or float(data.get('Total', 0))
+            if abs(float(commande.total_cmd) - new_price) > 0.01:
+                commande.total_cmd = new_price
+                updated = True
+        except (ValueError, TypeError):
+            pass
+
+        new_address = data.get('Adresse', '')
+        if new_address and commande.adresse != new_address:
+            commande.adresse = new_address
+            updated = True
+
+        new_ville_nom = data.get('Ville', '').strip()
+        if new_ville_nom and commande.ville_init != new_ville_nom:
+            commande.ville_init = new_ville_nom
+            updated = True
+
+        return updated
+
+    def _detect_modified_rows(self, worksheet, nb_colonnes, start_row):
+        """
+        Relit les rescan_window lignes précédant le checkpoint et retourne celles
+        dont l'empreinte diffère de celle enregistrée lors de leur traitement.
+        """
+        if not self.rescan_window or start_row <= PREMIERE_LIGNE_DONNEES:
+            return []
+
+        premiere_ligne = max(PREMIERE_LIGNE_DONNEES, start_row - self.rescan_window)
+        derniere_ligne = start_row - 1
+        empreintes = dict(
+            SheetRowHash.objects.filter(
+                sheet_config=self.sheet_config,
+                row_number__range=(premiere_ligne, derniere_ligne)
+            ).values_list('row_number', 'content_hash')
+        )
+
+        lignes_modifiees = []
+        for numero_ligne, valeurs in iterer_lignes(
+            worksheet, premiere_ligne, nb_colonnes, derniere_ligne=derniere_ligne, taille_page=self.batch_size
+        ):
+            self.rows_rescanned += 1
+            if empreintes.get(numero_ligne) != empreinte_ligne(valeurs):
+                lignes_modifiees.append((numero_ligne, valeurs))
+        return lignes_modifiees
+
+    def _process_batch(self, lignes, headers, avancer_checkpoint=True):
+        """
+        Traite un lot de lignes avec un nombre de requêtes indépendant de sa taille.
+
+        Les commandes, clients et opérateurs du lot sont préchargés, puis les
+        créations et mises à jour (clients, commandes, EtatCommande) sont
+        appliquées par bulk_create/bulk_update dans une seule transaction qui
+        avance aussi le checkpoint last_processed_row.
+
+        Args:
+            lignes: liste de tuples (numéro de ligne dans la feuille, valeurs de la ligne)
+            headers: en-têtes de la feuille
+            avancer_checkpoint: False pour re-synchroniser des lignes déjà traitées
+
+        Returns:
+            bool: True si le lot a été enregistré
+        """
+        stats = dict.fromkeys([
+            'records_imported', 'processed_rows', 'skipped_rows', 'new_orders_created',
+            'existing_orders_updated', 'duplicate_orders_found', 'protected_orders_count',
+        ], 0)
+        maintenant = timezone.now()
+
+        # 1. Validation des lignes
+        lignes_valides = []
+        for numero_ligne, row in lignes:
+            if not any(cell.strip() for cell in row if cell):
+                self._log(f"Ligne {numero_ligne} ignorée : ligne complètement vide")
+                stats['skipped_rows'] += 1
+                continue
+            if len(row) != len(headers):
+                self._log(f"Ligne {numero_ligne} ignorée: nombre de colonnes incorrect ({len(row)} vs {len(headers)})", "error")
+                stats['skipped_rows'] += 1
+                continue
+
+            data = dict(zip(headers, row))
+            order_number = self._get_order_number(data)
+            if not order_number or not order_number.strip():
+                self._log(f"Ligne {numero_ligne} rejetée : numéro de commande manquant ou vide", "error")
+                stats['skipped_rows'] += 1
+                continue
+
+            telephone = self._clean_phone_number(data.get('Téléphone', ''))
+            lignes_valides.append((numero_ligne, order_number, telephone, data))
+
+        # 2. Préchargement des commandes existantes et des clients du lot
+        commandes = {
+            commande.num_cmd: commande
+            for commande in Commande.objects.filter(
+                num_cmd__in={order_number for _, order_number, _, _ in lignes_valides}
+            ).select_related('client', 'etat_courant')
+        }
+        # Clients indexés par forme canonique : 0612..., +212 6 12... et 00212612... désignent le même client
+        telephones = {telephone for _, _, telephone, _ in lignes_valides}
+        clients = {}
+        for client_obj in Client.objects.filter(
+            Q(telephone_normalise__in={telephone_canonique(telephone) for telephone in telephones} - {''})
+            | Q(numero_tel__in=telephones)
+        ).order_by('pk'):
+            clients.setdefault(self._cle_telephone(client_obj.numero_tel), client_obj)
+        # Une seule instance par client pour que les modifications successives se cumulent
+        clients_par_id = {client_obj.pk: client_obj for client_obj in clients.values()}
+        for commande in commandes.values():
+            if commande.client_id in clients_par_id:
+                commande.client = clients_par_id[commande.client_id]
+            else:
+                clients_par_id[commande.client_id] = commande.client
+
+        # 3. Calcul des changements en mémoire
+        nouvelles_commandes = []
+        commandes_modifiees = {}
+        clients_nouveaux = {}
+        clients_modifies = {}
+        transitions = {}          # num_cmd -> [commande, libellé, opérateur]
+        operateurs_modifies = {}  # num_cmd -> (commande, opérateur) quand l'état est inchangé
+        derniere_ligne = None
+
+        for numero_ligne, order_number, telephone, data in lignes_valides:
+            operateur = self._get_operateur(data)
+            commande = commandes.get(order_number)
+
+            if commande is None:
+                status_from_sheet = data.get('Statut', '')
+                if not status_from_sheet or not status_from_sheet.strip():
+                    self._log(f"Statut manquant pour la commande {order_number} - la commande est rejetée", "error")
+                    stats['skipped_rows'] += 1
+                    continue
+
+                client_obj = clients.get(self._cle_telephone(telephone))
+                if client_obj is None:
+                    client_nom, client_prenom = self._split_client_name(data)
+                    client_obj = Client(
+                        numero_tel=telephone,
+                        nom=client_nom,
+                        prenom=client_prenom,
+                        adresse=data.get('Adresse', '')
+                    )
+                    # bulk_create n'appelle pas save() : formes indexées calculées ici
+                    client_obj.normaliser_telephone()
+                    clients[self._cle_telephone(telephone)] = client_obj
+                    clients_nouveaux[telephone] = client_obj
+                else:
+                    self._merge_client_data(client_obj, data, data.get('Adresse', ''), clients_modifies)
+
+                try:
+                    total_cmd_price = float(data.get('Prix', 0)) or float(data.get('Total', 0))
+                except (ValueError, TypeError):
+                    total_cmd_price = 0.0
+
+                commande = Commande(
+                    num_cmd=order_number,
+                    date_cmd=self._parse_date(data.get('Date Création', '') or data.get('Date', '')),
+                    total_cmd=total_cmd_price,
+                    adresse=data.get('Adresse', ''),
+                    client=client_obj,
+                    ville=None,
+                    ville_init=data.get('Ville', '').strip(),
+                    produit_init=data.get('Produit', '').strip() or "Produit non spécifié",
+                    origine='SYNC',
+                    last_sync_date=maintenant
+                )
+                commandes[order_number] = commande
+                nouvelles_commandes.append(commande)
+                transitions[order_number] = [commande, self._map_status(status_from_sheet) or 'Non affectée', operateur]
+                stats['new_orders_created'] += 1
+                stats['records_imported'] += 1
+            else:
+                # Commande déjà connue (en base ou plus haut dans le lot) - pas d'insertion
+                stats['duplicate_orders_found'] += 1
+
+                if self._merge_command_data(commande, data) and commande.pk:
+                    commande.last_sync_date = maintenant
+                    commandes_modifiees[commande.pk] = commande
+
+                if order_number in transitions:
+                    _, current_status, current_operateur = transitions[order_number]
+                    current_operateur_id = current_operateur.pk if current_operateur else None
+                else:
+                    current_status = commande.etat_courant.libelle if commande.etat_courant else 'Non affectée'
+                    current_operateur_id = commande.operateur_etat_courant_id
+
+                new_status = self._map_status(data.get('Statut', '')) or 'Non affectée'
+
+                # PROTECTION CONTRE LA RÉGRESSION D'ÉTATS
+                if self._is_advanced_status(current_status) and self._is_basic_status(new_status):
+                    self._log(f"Protection activée: Commande {order_number} garde l'état avancé '{current_status}' au lieu de régresser vers '{new_status}'")
+                    stats['protected_orders_count'] += 1
+                    new_status = current_status
+
+                if new_status != current_status:
+                    transitions[order_number] = [commande, new_status, operateur]
+                elif operateur and operateur.pk != current_operateur_id:
+                    # État inchangé : seul l'opérateur de l'état courant est mis à jour
+                    if order_number in transitions:
+                        transitions[order_number][2] = operateur
+                    elif commande.etat_courant_id:
+                        operateurs_modifies[order_number] = (commande, operateur)
+
+                if telephone and commande.client:
+                    self._merge_client_data(commande.client, data, data.get('Adresse', ''), clients_modifies)
+
+                stats['existing_orders_updated'] += 1
+
+            stats['processed_rows'] += 1
+            derniere_ligne = numero_ligne
+
+        # 4. Écriture du lot en une transaction
+        try:
+            with transaction.atomic():
+                if clients_nouveaux:
+                    Client.objects.bulk_create(clients_nouveaux.values())
+                    creations_en_masse.send(
+                        sender=Client, nombre=len(clients_nouveaux), instances=list(clients_nouveaux.values())
+                    )
+                if clients_modifies:
+                    for client_obj in clients_modifies.values():
+                        client_obj.date_modification = maintenant
+                    Client.objects.bulk_update(
+                        clients_modifies.values(),
+                        ['nom', 'prenom', 'adresse', 'date_modification']
+                    )
+
+                # Placer les nouvelles commandes directement dans leur état initial
+                fermetures = {}
+                for commande, status_libelle, operateur in transitions.values():
+                    commande.etat_courant = self._get_enum_etat(status_libelle)
+                    commande.date_etat_courant = maintenant
+                    commande.operateur_etat_courant = operateur
+                    if commande.pk:
+                        fermetures.setdefault(operateur, []).append(commande.pk)
+                        commandes_modifiees[commande.pk] = commande
+
+                if nouvelles_commandes:
+                    # Bloc d'ID YZ réservé en une fois (commande.numerotation)
+                    premier_id_yz = allouer_id_yz(len(nouvelles_commandes))
+                    for decalage, commande in enumerate(nouvelles_commandes):
+                        commande.id_yz = premier_id_yz + decalage
+                    Commande.objects.bulk_create(nouvelles_commandes)
+                    creations_en_masse.send(
+                        sender=Commande, nombre=len(nouvelles_commandes), instances=nouvelles_commandes
+                    )
+
+                # Clôturer les états ouverts (l'opérateur de la ligne est reporté, comme terminer_etat)
+                for operateur, commande_ids in fermetures.items():
+                    champs_cloture = {'date_fin': maintenant}
+                    if operateur:
+                        champs_cloture['operateur'] = operateur
+                    EtatCommande.objects.filter(
+                        commande_id__in=commande_ids,
+                        date_fin__isnull=True
+                    ).update(**champs_cloture)
+
+                EtatCommande.objects.bulk_create([
+                    EtatCommande(
+                        commande=commande,
+                        enum_etat=commande.etat_courant,
+                        operateur=operateur,
+                        date_debut=maintenant,
+                        commentaire="État défini lors de la synchronisation depuis Google Sheets"
+                    )
+                    for commande, _, operateur in transitions.values()
+                ])
+
+                operateurs_groupes = {}
+                for commande, operateur in operateurs_modifies.values():
+                    operateurs_groupes.setdefault(operateur, []).append(commande.pk)
+                    commande.operateur_etat_courant = operateur
+                    commandes_modifiees[commande.pk] = commande
+                for operateur, commande_ids in operateurs_groupes.items():
+                    EtatCommande.objects.filter(
+                        commande_id__in=commande_ids,
+                        date_fin__isnull=True
+                    ).update(operateur=operateur)
+
+                if commandes_modifiees:
+                    for commande in commandes_modifiees.values():
+                        commande.date_modification = maintenant
+                    Commande.objects.bulk_update(commandes_modifiees.values(), [
+                        'total_cmd', 'adresse', 'ville_init', 'last_sync_date', 'date_modification',
+                        'etat_courant', 'date_etat_courant', 'operateur_etat_courant',
+                    ])
+
+                # Jours de commande dont les faits KPI sont à recalculer
+                commandes_ecrites = list(chain(nouvelles_commandes, commandes_modifiees.values()))
+                signal_commandes_modifiees.send(
+                    sender=Commande,
+                    dates=[commande.date_cmd for commande in commandes_ecrites],
+                    commande_ids=[commande.pk for commande in commandes_ecrites],
+                )
+
+                # Empreintes de toutes les lignes lues, pour détecter leurs modifications ultérieures
+                SheetRowHash.objects.bulk_create(
+                    [
+                        SheetRowHash(
+                            sheet_config=self.sheet_config,
+                            row_number=numero_ligne,
+                            content_hash=empreinte_ligne(normaliser_ligne(row, len(headers)))
+                        )
+                        for numero_ligne, row in lignes
+                    ],
+                    update_conflicts=True,
+                    unique_fields=['sheet_config', 'row_number'],
+                    update_fields=['content_hash', 'updated_at']
+                )
+
+                # Un seul checkpoint par lot
+                if avancer_checkpoint and derniere_ligne is not None:
+                    self.sheet_config.last_processed_row = derniere_ligne
+                    self.sheet_config.save(update_fields=['last_processed_row'])
+
+        except Exception as e:
+            self._log(f"Erreur lors de l'enregistrement du lot (lignes {lignes[0][0]} à {lignes[-1][0]}): {str(e)}", "error")
+            self.skipped_rows += len(lignes)
+            # Les états éventuellement créés pendant la transaction annulée n'existent plus
+            self._enum_etats = {enum_etat.libelle: enum_etat for enum_etat in EnumEtatCmd.objects.all()}
+            return False
+
+        for compteur, valeur in stats.items():
+            setattr(self, compteur, getattr(self, compteur) + valeur)
+        return True
+
     def sync(self):
         """Synchronise les données depuis Google Sheets de manière incrémentale"""
         print(f"🚀 === DÉBUT SYNCHRONISATION GOOGLE SHEETS INCRÉMENTALE ===")
@@ -1007,6 +1391,8 @@ class GoogleSheetSync:
         self.execution_details['started_at'] = self.start_time.isoformat()
         self.execution_details['incremental_start_row'] = start_row
         
+        self._start_sync_log()
+
         # S'assurer que tous les états de base existent
         print(f"🏗️ === INITIALISATION DES ÉTATS ===")
         self._log("Initialisation des états de commande...")
@@ -1039,99 +1425,83 @@ class GoogleSheetSync:
             print(f"📊 Feuille: {worksheet.spreadsheet.title}")
             print(f"📋 Onglet: {worksheet.title}")
             
-            # Récupérer toutes les données
+            # Lire les en-têtes puis uniquement la plage utile, par fenêtres
             print(f"📥 === RÉCUPÉRATION DONNÉES ===")
-            print(f"⏳ Récupération de toutes les données...")
-            all_data = worksheet.get_all_values()
-            print(f"✅ Données récupérées")
-            
-            if not all_data:
+            headers = lire_entetes(worksheet)
+
+            if not headers:
                 error_msg = "❌ Aucune donnée trouvée dans la feuille"
                 print(error_msg)
                 self.errors.append("Aucune donnée trouvée dans la feuille")
                 self.end_time = timezone.now()
                 self._log_sync('error')
                 return False
-                
-            # Extraire les en-têtes et les données
-            headers = all_data[0]
-            rows = all_data[1:]
-            
-            print(f"📊 === ANALYSE DONNÉES ===")
-            print(f"📋 En-têtes détectés ({len(headers)} colonnes): {headers}")
-            print(f"📊 Nombre total de lignes: {len(all_data)}")
-            print(f"📊 Lignes de données: {len(rows)}")
-            print(f"📊 Ligne d'en-têtes: 1")
-            
-            # Vérifier si la synchronisation incrémentale est possible
-            if start_row > 1:
-                if start_row > len(all_data):
-                    print(f"⚠️ ATTENTION: La ligne de départ ({start_row}) dépasse le nombre total de lignes ({len(all_data)})")
-                    print(f"🔄 Réinitialisation de la synchronisation depuis le début")
-                    start_row = 1
+
+            nb_colonnes = len(headers)
+            print(f"📋 En-têtes détectés ({nb_colonnes} colonnes): {headers}")
+
+            # Feuille raccourcie depuis la dernière synchronisation : le point de reprise n'est plus valable
+            if start_row > PREMIERE_LIGNE_DONNEES:
+                empreinte_reprise = SheetRowHash.objects.filter(
+                    sheet_config=self.sheet_config, row_number=start_row - 1
+                ).values_list('content_hash', flat=True).first()
+                if feuille_tronquee(worksheet, start_row - 1, nb_colonnes, empreinte_reprise):
+                    self._log(f"La dernière ligne traitée ({start_row - 1}) n'existe plus dans la feuille : "
+                              "reprise depuis le début", "warning")
+                    start_row = PREMIERE_LIGNE_DONNEES
                     self.sheet_config.last_processed_row = 0
                     self.sheet_config.save(update_fields=['last_processed_row'])
-                else:
-                    print(f"✅ Synchronisation incrémentale: traitement des lignes {start_row} à {len(all_data)}")
+
+            if start_row > PREMIERE_LIGNE_DONNEES:
+                print(f"✅ Synchronisation incrémentale: lecture à partir de la ligne {start_row}")
             else:
                 print(f"🔄 Première synchronisation: traitement de toutes les lignes")
-            
-            # Filtrer les lignes à traiter selon la synchronisation incrémentale
-            rows_to_process = rows[start_row - 1:] if start_row > 1 else rows
-            print(f"📊 Lignes à traiter: {len(rows_to_process)} (sur {len(rows)} total)")
-            
-            # Afficher les premiers en-têtes pour vérification
-            if rows_to_process:
-                print(f"🔍 Première ligne de données à traiter: {dict(zip(headers, rows_to_process[0]))}")
-                if len(rows_to_process) > 1:
-                    print(f"🔍 Deuxième ligne de données à traiter: {dict(zip(headers, rows_to_process[1]))}")
-            
-            # Enregistrer les statistiques
-            self.total_rows = len(all_data)
+
             self.execution_details['headers'] = headers
-            self.execution_details['total_rows'] = len(all_data)
-            self.execution_details['data_rows'] = len(rows)
-            self.execution_details['rows_to_process'] = len(rows_to_process)
             self.execution_details['incremental_start_row'] = start_row
-            
-            print(f"🚀 === DÉBUT TRAITEMENT LIGNES ===")
-            print(f"📈 Total lignes à traiter: {len(rows_to_process)}")
-            
-            # Traiter chaque ligne
-            for i, row in enumerate(rows_to_process, start_row + 1):  # Commencer à start_row + 1 car start_row est 1-indexed
-                print(f"\n📝 === TRAITEMENT LIGNE {i} ===")
-                
-                # Vérifier si la ligne est vide
-                if not any(cell.strip() for cell in row if cell):
-                    print(f"⚠️ Ligne {i} ignorée: ligne complètement vide")
-                    self._log(f"Ligne {i} ignorée : ligne complètement vide")
-                    self.skipped_rows += 1
-                    continue
-                    
-                if len(row) == len(headers):  # Vérifier que la ligne a le bon nombre de colonnes
-                    print(f"✅ Ligne {i} valide: {len(row)} colonnes vs {len(headers)} en-têtes")
-                    print(f"🔍 Aperçu: {dict(zip(headers[:3], row[:3]))}...")
-                    
-                    success = self.process_row(row, headers)
-                    if success:
-                        print(f"✅ Ligne {i} traitée avec succès")
-                        self._log(f"Ligne {i} traitée avec succès")
-                        self.processed_rows += 1
-                        
-                        # Mettre à jour la dernière ligne traitée pour la synchronisation incrémentale
-                        self.sheet_config.last_processed_row = i
-                        self.sheet_config.save(update_fields=['last_processed_row'])
-                        print(f"📍 Dernière ligne traitée mise à jour: {i}")
-                    else:
-                        print(f"❌ Échec traitement ligne {i}")
-                        self._log(f"Échec traitement ligne {i}")
-                        self.skipped_rows += 1
-                else:
-                    error_msg = f"❌ Ligne {i} ignorée: nombre de colonnes incorrect ({len(row)} vs {len(headers)})"
-                    print(error_msg)
-                    self._log(error_msg, "error")
-                    self.skipped_rows += 1
-            
+            self.execution_details['batch_size'] = self.batch_size
+            self.execution_details['rescan_window'] = self.rescan_window
+
+            self._load_reference_data()
+
+            # Re-synchroniser les lignes déjà traitées dont le contenu a changé dans la feuille
+            lignes_modifiees = self._detect_modified_rows(worksheet, nb_colonnes, start_row)
+            if lignes_modifiees:
+                self._log(f"{len(lignes_modifiees)} ligne(s) déjà traitée(s) modifiée(s) dans la feuille")
+            for lot in decouper_en_lots(lignes_modifiees, self.batch_size):
+                if self._process_batch(lot, headers, avancer_checkpoint=False):
+                    self.modified_rows_resynced += len(lot)
+                self._update_sync_progress()
+
+            self._log(f"Lecture des nouvelles lignes par lots de {self.batch_size} lignes")
+
+            # Traiter les nouvelles lignes par lots (une transaction et un checkpoint par lot).
+            # Au premier lot en échec, la lecture s'arrête : le checkpoint reste sur la dernière
+            # ligne enregistrée et les lignes du lot sont reprises à la synchronisation suivante.
+            rows_to_process = 0
+            derniere_ligne_lue = start_row - 1
+            nouvelles_lignes = iterer_lignes(worksheet, start_row, nb_colonnes, taille_page=self.batch_size)
+            for lot in decouper_en_lots(nouvelles_lignes, self.batch_size):
+                rows_to_process += len(lot)
+                derniere_ligne_lue = lot[-1][0]
+                lot_enregistre = self._process_batch(lot, headers)
+                self._update_sync_progress()
+                if not lot_enregistre:
+                    self._log(f"Synchronisation interrompue au lot lignes {lot[0][0]} à {lot[-1][0]} : "
+                              f"reprise à la ligne {self.sheet_config.next_sync_start_row}", "warning")
+                    break
+                self._log(f"Lot lignes {lot[0][0]} à {lot[-1][0]} enregistré - "
+                          f"dernière ligne traitée: {self.sheet_config.last_processed_row}")
+
+            self._log(f"Lignes lues: {rows_to_process} nouvelles, {self.rows_rescanned} re-vérifiées")
+
+            # Enregistrer les statistiques
+            self.total_rows = max(derniere_ligne_lue, self.sheet_config.last_processed_row)
+            self.execution_details['total_rows'] = self.total_rows
+            self.execution_details['rows_to_process'] = rows_to_process
+            self.execution_details['rows_rescanned'] = self.rows_rescanned
+            self.execution_details['modified_rows_resynced'] = self.modified_rows_resynced
+
             # Marquer la fin de la synchronisation
             self.end_time = timezone.now()
             
@@ -1143,7 +1513,7 @@ class GoogleSheetSync:
                 'processed_rows': self.processed_rows,
                 'skipped_rows': self.skipped_rows,
                 'records_imported': self.records_imported,
-                'success_rate': (self.processed_rows / len(rows_to_process) * 100) if rows_to_process else 0,
+                'success_rate': (self.processed_rows / (rows_to_process + len(lignes_modifiees)) * 100) if (rows_to_process or lignes_modifiees) else 0,
                 'errors_count': len(self.errors),
                 'final_processed_row': self.sheet_config.last_processed_row,
                 
@@ -1173,6 +1543,8 @@ class GoogleSheetSync:
                 notification_parts.append(f"➖ {self.existing_orders_skipped} commandes existantes inchangées")
             if self.protected_orders_count > 0:
                 notification_parts.append(f"🛡️ {self.protected_orders_count} commandes protégées contre la régression d'état")
+            if self.modified_rows_resynced > 0:
+                notification_parts.append(f"✏️ {self.modified_rows_resynced} lignes modifiées re-synchronisées")
             
             # Message par défaut si rien ne s'est passé
             if not notification_parts:
@@ -1203,31 +1575,56 @@ class GoogleSheetSync:
             self._log_sync('error')
             return False
     
+    def _sync_stats(self):
+        """Compteurs de la synchronisation, tels qu'enregistrés dans SyncLog"""
+        return {
+            'records_imported': self.records_imported,
+            'total_rows': self.total_rows,
+            'processed_rows': self.processed_rows,
+            'skipped_rows': self.skipped_rows,
+            'new_orders_created': self.new_orders_created,
+            'existing_orders_updated': self.existing_orders_updated,
+            'existing_orders_skipped': self.existing_orders_skipped,
+            'duplicate_orders_found': self.duplicate_orders_found,
+            'protected_orders_count': self.protected_orders_count,
+        }
+
+    def _start_sync_log(self):
+        """Crée (ou reprend, pour un job planifié) le log 'En cours' alimenté au fil des lots"""
+        if self.sync_log is None:
+            self.sync_log = SyncLog.objects.create(
+                status='pending',
+                sheet_config=self.sheet_config,
+                triggered_by=self.triggered_by,
+                start_time=self.start_time,
+            )
+        else:
+            SyncLog.objects.filter(pk=self.sync_log.pk).update(status='pending', start_time=self.start_time)
+
+    def _update_sync_progress(self):
+        """Publie l'avancement dans le log en cours (écrit hors de la transaction des lots)"""
+        if self.sync_log is not None:
+            SyncLog.objects.filter(pk=self.sync_log.pk).update(**self._sync_stats())
+
     def _log_sync(self, status):
-        """Enregistre un log de synchronisation avec statistiques détaillées"""
-        SyncLog.objects.create(
-            status=status,
-            records_imported=self.records_imported,
-            errors='\n'.join(self.errors) if self.errors else None,
-            sheet_config=self.sheet_config,
-            triggered_by=self.triggered_by,
-            
-            # Champs détaillés existants
-            start_time=self.start_time,
-            end_time=self.end_time,
-            total_rows=self.total_rows,
-            processed_rows=self.processed_rows,
-            skipped_rows=self.skipped_rows,
-            sheet_title=self.sheet_title,
-            execution_details=self.execution_details,
-            
-            # Nouvelles statistiques détaillées
-            new_orders_created=self.new_orders_created,
-            existing_orders_updated=self.existing_orders_updated,
-            existing_orders_skipped=self.existing_orders_skipped,
-            duplicate_orders_found=self.duplicate_orders_found,
-            protected_orders_count=self.protected_orders_count,
-        )
+        """Enregistre le log de synchronisation final avec statistiques détaillées"""
+        fields = {
+            'status': status,
+            'errors': '\n'.join(self.errors) if self.errors else None,
+            'sheet_config': self.sheet_config,
+            'triggered_by': self.triggered_by,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'sheet_title': self.sheet_title,
+            'execution_details': self.execution_details,
+            **self._sync_stats(),
+        }
+        if self.sync_log is None:
+            self.sync_log = SyncLog.objects.create(**fields)
+        else:
+            for field, value in fields.items():
+                setattr(self.sync_log, field, value)
+            self.sync_log.save()
 
 # --- Configuration for Google Sheets API ---
 # In a production setting, use environment variables or Django settings for credentials.
@@ -1316,9 +1713,9 @@ def sync_google_sheet_data(config_id):
                     client_nom = client_nom_parts[-1] if client_nom_parts else ''
                     client_prenom = ' '.join(client_nom_parts[:-1]) if len(client_nom_parts) > 1 else client_full_name # Fallback if only one word
 
-                    client, created_client = Client.objects.get_or_create(
-                        numero_tel=client_tel,
-                        defaults={
+                    client, created_client = GoogleSheetSync._get_or_create_client(
+                        client_tel,
+                        {
                             'nom': client_nom,
                             'prenom': client_prenom,
                             'adresse': adresse, # Use address from CSV
@@ -0,0 +1,242 @@
+"""
+Exécution des synchronisations Google Sheets en arrière-plan.
+
+Les configurations sont synchronisées en parallèle par Celery quand un broker
+est configuré (CELERY_BROKER_URL), sinon par un pool de threads du processus
+web. Chaque synchronisation s'exécute sous un verrou propre à sa configuration,
+pour que deux déclenchements ne traitent jamais les mêmes lignes en même temps,
+et publie son avancement dans le SyncLog créé au lancement du job.
+
+Un SyncLog resté 'En cours' au-delà de SYNC_DUREE_MAX_MINUTES (worker tué,
+redémarrage du processus web) est passé en erreur par etat_job et par la
+tâche planifiée expirer_synchronisations : le suivi du job se termine toujours.
+"""
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .google_sheet_sync import GoogleSheetSync
+from .models import GoogleSheetConfig, SyncLog
+
+logger = logging.getLogger(__name__)
+
+# Espace de noms des verrous consultatifs PostgreSQL de la synchronisation (pg_try_advisory_lock(int, int))
+VERROU_SYNC_NAMESPACE = 7301
+
+# Durée de vie du verrou de repli en cache, au cas où le processus serait tué sans le libérer
+DUREE_VERROU_CACHE = 60 * 60
+
+MESSAGE_SYNC_EN_COURS = "Une synchronisation de cette configuration est déjà en cours"
+
+MESSAGE_SYNC_INTERROMPUE = "Synchronisation interrompue (aucun résultat dans le délai imparti)"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+@contextmanager
+def verrou_synchronisation(config_id):
+    """
+    Verrou exclusif et non bloquant sur une configuration.
+
+    Verrou consultatif de session sous PostgreSQL (libéré automatiquement si la
+    connexion tombe), cache.add() sur les autres bases.
+
+    Yields:
+        bool: True si le verrou a été obtenu
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [VERROU_SYNC_NAMESPACE, config_id])
+            acquis = cursor.fetchone()[0]
+        try:
+            yield acquis
+        finally:
+            if acquis:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [VERROU_SYNC_NAMESPACE, config_id])
+    else:
+        cle = f'synchronisation:verrou:{config_id}'
+        acquis = cache.add(cle, True, DUREE_VERROU_CACHE)
+        try:
+            yield acquis
+        finally:
+            if acquis:
+                cache.delete(cle)
+
+
+def executer_synchronisation(config_id, triggered_by='admin', sync_log_id=None):
+    """
+    Synchronise une configuration sous verrou.
+
+    Args:
+        config_id: identifiant de la GoogleSheetConfig
+        triggered_by: utilisateur à l'origine du déclenchement
+        sync_log_id: SyncLog 'En cours' créé au lancement du job, alimenté pendant la synchronisation
+
+    Returns:
+        SyncLog: le log de la synchronisation (statut 'skipped' si le verrou était déjà pris)
+    """
+    sync_log = SyncLog.objects.filter(pk=sync_log_id).first() if sync_log_id else None
+
+    config = GoogleSheetConfig.objects.filter(pk=config_id, is_active=True).first()
+    if config is None:
+        if sync_log:
+            _terminer_log(sync_log, 'error', "Configuration introuvable ou inactive")
+        return sync_log
+
+    with verrou_synchronisation(config_id) as acquis:
+        if not acquis:
+            if sync_log is None:
+                sync_log = SyncLog(sheet_config=config, triggered_by=triggered_by)
+            _terminer_log(sync_log, 'skipped', MESSAGE_SYNC_EN_COURS)
+            return sync_log
+
+        syncer = GoogleSheetSync(config, triggered_by=triggered_by, sync_log=sync_log)
+        syncer.sync()
+        return syncer.sync_log
+
+
+def _terminer_log(sync_log, status, message):
+    """Clôture un log sans synchronisation"""
+    maintenant = timezone.now()
+    sync_log.status = status
+    sync_log.errors = message
+    sync_log.start_time = sync_log.start_time or maintenant
+    sync_log.end_time = maintenant
+    sync_log.save()
+
+
+def _executer_dans_thread(config_id, triggered_by, sync_log_id):
+    """Point d'entrée du pool de threads : chaque thread utilise puis ferme sa propre connexion"""
+    try:
+        executer_synchronisation(config_id, triggered_by, sync_log_id)
+    except Exception as e:
+        logger.exception("Erreur lors de la synchronisation de la configuration %s", config_id)
+        SyncLog.objects.filter(pk=sync_log_id, status='pending').update(
+            status='error', errors=f"Erreur de synchronisation: {str(e)}", end_time=timezone.now()
+        )
+    finally:
+        connection.close()
+
+
+def _get_executor():
+    """Pool de threads partagé du processus (créé à la première utilisation)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'SYNC_MAX_WORKERS', 4),
+                thread_name_prefix='sync-gsheet'
+            )
+        return _executor
+
+
+def celery_disponible():
+    """Celery n'est utilisé que si un broker est configuré"""
+    return bool(getattr(settings, 'CELERY_BROKER_URL', ''))
+
+
+def lancer_synchronisations(configs, triggered_by='admin'):
+    """
+    Planifie la synchronisation de plusieurs configurations et rend la main immédiatement.
+
+    Un SyncLog 'En cours' est créé par configuration et rattaché au job, ce qui
+    permet de suivre l'avancement avant même le démarrage des workers.
+
+    Returns:
+        str: identifiant du job
+    """
+    job_id = uuid.uuid4().hex
+    taches = []
+    for config in configs:
+        sync_log = SyncLog.objects.create(
+            status='pending',
+            sheet_config=config,
+            triggered_by=triggered_by,
+            job_id=job_id,
+        )
+        taches.append((config.pk, sync_log.pk))
+
+    def demarrer():
+        for config_id, sync_log_id in taches:
+            if celery_disponible():
+                from .tasks import synchroniser_config
+                synchroniser_config.delay(config_id, triggered_by, sync_log_id)
+            else:
+                _get_executor().submit(_executer_dans_thread, config_id, triggered_by, sync_log_id)
+
+    # Ne démarrer les workers qu'une fois les logs visibles par leurs connexions
+    transaction.on_commit(demarrer)
+    return job_id
+
+
+def expirer_synchronisations(logs=None):
+    """
+    Passe en erreur les SyncLog 'En cours' plus anciens que SYNC_DUREE_MAX_MINUTES.
+
+    Args:
+        logs: queryset de SyncLog à examiner (par défaut : tous)
+
+    Returns:
+        int: nombre de logs passés en erreur
+    """
+    maintenant = timezone.now()
+    limite = maintenant - timedelta(minutes=getattr(settings, 'SYNC_DUREE_MAX_MINUTES', 60))
+    logs = SyncLog.objects.all() if logs is None else logs
+    return logs.filter(status='pending', sync_date__lt=limite).update(
+        status='error', errors=MESSAGE_SYNC_INTERROMPUE, end_time=maintenant
+    )
+
+
+def etat_job(job_id):
+    """
+    Résume l'avancement d'un job à partir de ses SyncLog.
+
+    Returns:
+        dict | None: None si le job est inconnu
+    """
+    expirer_synchronisations(SyncLog.objects.filter(job_id=job_id))
+    logs = list(SyncLog.objects.filter(job_id=job_id).select_related('sheet_config').order_by('pk'))
+    if not logs:
+        return None
+
+    totaux = dict.fromkeys([
+        'processed_rows', 'new_orders_created', 'existing_orders_updated', 'existing_orders_skipped',
+        'duplicate_orders_found', 'protected_orders_count',
+    ], 0)
+    erreurs = []
+    for log in logs:
+        for compteur in totaux:
+            totaux[compteur] += getattr(log, compteur) or 0
+        if log.errors and log.status != 'pending':
+            erreurs.extend(f"{log.sheet_config.sheet_name}: {erreur}" for erreur in log.errors.split('\n'))
+
+    termine = all(log.status != 'pending' for log in logs)
+    return {
+        'job_id': job_id,
+        'finished': termine,
+        'success': termine and all(log.status in ('success', 'partial', 'skipped') for log in logs),
+        'configs': [
+            {
+                'config_id': log.sheet_config_id,
+                'sheet_name': log.sheet_config.sheet_name,
+                'log_id': log.pk,
+                'status': log.status,
+                'status_display': log.get_status_display(),
+                'processed_rows': log.processed_rows or 0,
+                'new_orders_created': log.new_orders_created,
+            }
+            for log in logs
+        ],
+        'errors': erreurs,
+        **totaux,
+    }
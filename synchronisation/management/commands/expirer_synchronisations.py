@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from synchronisation.jobs import expirer_synchronisations
+
+
+class Command(BaseCommand):
+    help = 'Marque en erreur les synchronisations restées en cours au-delà de SYNC_DUREE_MAX_MINUTES'
+
+    def handle(self, *args, **options):
+        nombre = expirer_synchronisations()
+        self.stdout.write(self.style.SUCCESS(f'🧹 {nombre} synchronisation(s) interrompue(s) clôturée(s)'))
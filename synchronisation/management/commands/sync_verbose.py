@@ -18,6 +18,18 @@ class Command(BaseCommand):
             default='admin',
             help='Nom de l\'utilisateur qui déclenche la synchronisation (défaut: admin)'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=GoogleSheetSync.DEFAULT_BATCH_SIZE,
+            help=f'Nombre de lignes traitées par transaction (défaut: {GoogleSheetSync.DEFAULT_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--rescan-window',
+            type=int,
+            default=GoogleSheetSync.DEFAULT_RESCAN_WINDOW,
+            help=f'Nombre de lignes déjà traitées re-vérifiées pour détecter les modifications, 0 pour désactiver (défaut: {GoogleSheetSync.DEFAULT_RESCAN_WINDOW})'
+        )
 
     def handle(self, *args, **options):
         config_id = options['config_id']
@@ -32,7 +44,10 @@ class Command(BaseCommand):
             )
             
             # Créer une instance de synchronisation en mode verbose
-            syncer = GoogleSheetSync(config, triggered_by=triggered_by, verbose=True)
+            syncer = GoogleSheetSync(
+                config, triggered_by=triggered_by, verbose=True, batch_size=options['batch_size'],
+                rescan_window=options['rescan_window']
+            )
             success = syncer.sync()
             
             if success:
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2025-08-25 10:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('synchronisation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SheetRowHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row_number', models.PositiveIntegerField(verbose_name='Numéro de ligne')),
+                ('content_hash', models.CharField(max_length=40, verbose_name='Empreinte du contenu')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Dernière mise à jour')),
+                ('sheet_config', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='row_hashes', to='synchronisation.googlesheetconfig')),
+            ],
+            options={
+                'verbose_name': 'Empreinte de ligne',
+                'verbose_name_plural': 'Empreintes de lignes',
+                'constraints': [models.UniqueConstraint(fields=('sheet_config', 'row_number'), name='empreinte_unique_par_ligne')],
+            },
+        ),
+    ]
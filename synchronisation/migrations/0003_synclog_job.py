@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2025-08-26 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('synchronisation', '0002_empreintes_lignes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='synclog',
+            name='job_id',
+            field=models.CharField(blank=True, db_index=True, max_length=32, null=True, verbose_name='Identifiant du job'),
+        ),
+        migrations.AlterField(
+            model_name='synclog',
+            name='status',
+            field=models.CharField(choices=[('success', 'Succès'), ('error', 'Erreur'), ('partial', 'Partiel'), ('pending', 'En cours'), ('skipped', 'Ignorée')], max_length=10, verbose_name='Statut'),
+        ),
+    ]
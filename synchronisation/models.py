@@ -52,6 +52,8 @@ class SyncLog(models.Model):
         ('success', 'Succès'),
         ('error', 'Erreur'),
         ('partial', 'Partiel'),
+        ('pending', 'En cours'),
+        ('skipped', 'Ignorée'),
     ]
     
     sync_date = models.DateTimeField(auto_now_add=True, verbose_name="Date de synchronisation")
@@ -60,6 +62,7 @@ class SyncLog(models.Model):
     errors = models.TextField(blank=True, null=True, verbose_name="Erreurs")
     sheet_config = models.ForeignKey(GoogleSheetConfig, on_delete=models.CASCADE, related_name='sync_logs')
     triggered_by = models.CharField(max_length=100, verbose_name="Déclenché par")
+    job_id = models.CharField(max_length=32, blank=True, null=True, db_index=True, verbose_name="Identifiant du job")
     
     # Nouveaux champs pour les détails d'exécution
     start_time = models.DateTimeField(null=True, blank=True, verbose_name="Heure de début")
@@ -128,3 +131,21 @@ class SyncLog(models.Model):
         verbose_name = "Log de synchronisation"
         verbose_name_plural = "Logs de synchronisation"
         ordering = ['-sync_date']
+
+
+class SheetRowHash(models.Model):
+    """Empreinte du contenu de chaque ligne déjà synchronisée, pour détecter les lignes modifiées dans la feuille"""
+    sheet_config = models.ForeignKey(GoogleSheetConfig, on_delete=models.CASCADE, related_name='row_hashes')
+    row_number = models.PositiveIntegerField(verbose_name="Numéro de ligne")
+    content_hash = models.CharField(max_length=40, verbose_name="Empreinte du contenu")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Dernière mise à jour")
+
+    def __str__(self):
+        return f"{self.sheet_config.sheet_name} - ligne {self.row_number}"
+
+    class Meta:
+        verbose_name = "Empreinte de ligne"
+        verbose_name_plural = "Empreintes de lignes"
+        constraints = [
+            models.UniqueConstraint(fields=['sheet_config', 'row_number'], name='empreinte_unique_par_ligne'),
+        ]
@@ -0,0 +1,107 @@
+"""
+Lecture incrémentale des feuilles Google Sheets.
+
+Au lieu de télécharger toute la feuille avec get_all_values(), on lit la ligne
+d'en-têtes puis uniquement la plage utile (A{début}:{dernière colonne}{fin}) par
+fenêtres successives, exposées sous forme de générateur, jusqu'à la dernière
+ligne de la grille (row_count, connu sans appel supplémentaire). Chaque ligne
+peut être résumée par une empreinte de contenu afin de détecter les lignes déjà
+traitées qui ont été modifiées dans la feuille.
+"""
+import hashlib
+
+from gspread.utils import rowcol_to_a1
+
+# Nombre de lignes demandées à l'API Google Sheets par appel
+DEFAULT_PAGE_SIZE = 500
+
+# Première ligne de données (la ligne 1 contient les en-têtes)
+PREMIERE_LIGNE_DONNEES = 2
+
+
+def lire_entetes(worksheet):
+    """Retourne la ligne d'en-têtes de la feuille"""
+    return worksheet.row_values(1)
+
+
+def normaliser_ligne(valeurs, nb_colonnes):
+    """Complète ou tronque une ligne à nb_colonnes cellules (l'API omet les cellules vides finales)"""
+    valeurs = ['' if valeur is None else str(valeur) for valeur in valeurs[:nb_colonnes]]
+    return valeurs + [''] * (nb_colonnes - len(valeurs))
+
+
+def empreinte_ligne(valeurs):
+    """Empreinte SHA-1 du contenu d'une ligne normalisée"""
+    contenu = '\x1f'.join(valeur.strip() for valeur in valeurs)
+    return hashlib.sha1(contenu.encode('utf-8')).hexdigest()
+
+
+def feuille_tronquee(worksheet, derniere_ligne_traitee, nb_colonnes, empreinte_connue=None):
+    """
+    True si la feuille ne contient plus la dernière ligne traitée (lignes
+    supprimées, ou feuille vidée puis remplie à nouveau) : le point de reprise
+    n'est alors plus valable.
+
+    Args:
+        empreinte_connue: empreinte de la ligne lors de son traitement ; une ligne
+            déjà vide à ce moment-là ne signale pas une feuille raccourcie
+    """
+    if derniere_ligne_traitee < PREMIERE_LIGNE_DONNEES:
+        return False
+    nb_lignes = getattr(worksheet, 'row_count', None)
+    if nb_lignes is not None and nb_lignes < derniere_ligne_traitee:
+        return True
+    valeurs = normaliser_ligne(worksheet.row_values(derniere_ligne_traitee), nb_colonnes)
+    if any(valeur.strip() for valeur in valeurs):
+        return False
+    return empreinte_connue != empreinte_ligne(valeurs)
+
+
+def iterer_lignes(worksheet, premiere_ligne, nb_colonnes, derniere_ligne=None, taille_page=DEFAULT_PAGE_SIZE):
+    """
+    Parcourt les lignes de la feuille par fenêtres de taille_page lignes.
+
+    Args:
+        worksheet: feuille gspread (ou objet exposant get_values(plage))
+        premiere_ligne: numéro (1-indexé) de la première ligne à lire
+        nb_colonnes: nombre de colonnes à lire (celui des en-têtes)
+        derniere_ligne: dernière ligne à lire incluse (par défaut: row_count de la feuille)
+        taille_page: nombre de lignes demandées par appel
+
+    Yields:
+        tuple: (numéro de ligne dans la feuille, valeurs normalisées à nb_colonnes)
+    """
+    premiere_ligne = max(premiere_ligne, PREMIERE_LIGNE_DONNEES)
+    debut = premiere_ligne
+    if derniere_ligne is None:
+        derniere_ligne = getattr(worksheet, 'row_count', None)
+
+    while derniere_ligne is None or debut <= derniere_ligne:
+        fin = debut + taille_page - 1
+        if derniere_ligne is not None:
+            fin = min(fin, derniere_ligne)
+
+        plage = f"{rowcol_to_a1(debut, 1)}:{rowcol_to_a1(fin, nb_colonnes)}"
+        page = worksheet.get_values(plage)
+
+        # L'API omet les lignes vides finales : une fenêtre vide peut précéder d'autres données tant que
+        # la dernière ligne n'est pas atteinte. Sans dernière ligne connue, elle marque la fin des données.
+        if not page and derniere_ligne is None:
+            return
+
+        for decalage, valeurs in enumerate(page):
+            yield debut + decalage, normaliser_ligne(valeurs, nb_colonnes)
+
+        debut = fin + 1
+
+
+def decouper_en_lots(lignes, taille_lot):
+    """Regroupe un itérable de lignes en listes de taille_lot éléments"""
+    lot = []
+    for ligne in lignes:
+        lot.append(ligne)
+        if len(lot) >= taille_lot:
+            yield lot
+            lot = []
+    if lot:
+        yield lot
@@ -0,0 +1,16 @@
+from celery import shared_task
+
+from .jobs import executer_synchronisation, expirer_synchronisations
+
+
+@shared_task(name='synchronisation.synchroniser_config')
+def synchroniser_config(config_id, triggered_by='admin', sync_log_id=None):
+    """Tâche Celery : synchronise une configuration Google Sheets sous verrou"""
+    sync_log = executer_synchronisation(config_id, triggered_by, sync_log_id)
+    return sync_log.pk if sync_log else None
+
+
+@shared_task(name='synchronisation.expirer_synchronisations')
+def expirer_synchronisations_interrompues():
+    """Tâche Celery planifiée : passe en erreur les synchronisations abandonnées"""
+    return expirer_synchronisations()
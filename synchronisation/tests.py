@@ -1,3 +1,223 @@
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
+from gspread.utils import a1_to_rowcol
+
+from commande.models import Commande
+from synchronisation.google_sheet_sync import GoogleSheetSync
+from synchronisation.jobs import (
+    MESSAGE_SYNC_INTERROMPUE, etat_job, executer_synchronisation, lancer_synchronisations, verrou_synchronisation,
+)
+from synchronisation.models import GoogleSheetConfig, SheetRowHash, SyncLog
+from synchronisation.sheet_reader import iterer_lignes
+
+
+class FakeWorksheet:
+    """Feuille locale qui imite les réponses de l'API Google Sheets (lignes et cellules vides finales omises)"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.title = 'Commandes'
+        self.spreadsheet = mock.Mock(title='Feuille de test')
+        self.ranges_requested = []
+
+    @property
+    def row_count(self):
+        """Taille de la grille : lignes vides comprises"""
+        return len(self.rows)
+
+    def row_values(self, row):
+        return self._trim(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def get_values(self, range_name):
+        self.ranges_requested.append(range_name)
+        debut, fin = range_name.split(':')
+        ligne_debut, col_debut = a1_to_rowcol(debut)
+        ligne_fin, col_fin = a1_to_rowcol(fin)
+        page = [self._trim(row[col_debut - 1:col_fin]) for row in self.rows[ligne_debut - 1:ligne_fin]]
+        while page and not page[-1]:
+            page.pop()
+        return page
+
+    @staticmethod
+    def _trim(row):
+        row = list(row)
+        while row and row[-1] == '':
+            row.pop()
+        return row
+
+
+HEADERS = ['N° Commande', 'Date', 'Client', 'Téléphone', 'Adresse', 'Ville', 'Produit', 'Prix', 'Statut']
+
+
+def ligne(numero, statut='Non affectée'):
+    return [f'SYNC-{numero}', '01/02/2025', f'Nom{numero} Prenom', f'0611{numero:06d}', f'Adresse {numero}', 'Rabat', 'Produit', '199', statut]
+
+
+class SheetReaderTest(TestCase):
+
+    def test_lecture_par_fenetres_depuis_la_ligne_de_depart(self):
+        worksheet = FakeWorksheet([HEADERS] + [ligne(i) for i in range(1, 8)] + [['SYNC-X', '', '', '', '', '', '', '', '']])
+
+        lignes = list(iterer_lignes(worksheet, 5, len(HEADERS), taille_page=2))
+
+        self.assertEqual([numero for numero, _ in lignes], [5, 6, 7, 8, 9])
+        self.assertEqual(worksheet.ranges_requested, ['A5:I6', 'A7:I8', 'A9:I9'])
+        # Les cellules vides finales omises par l'API sont complétées
+        self.assertEqual(lignes[-1][1], ['SYNC-X'] + [''] * 8)
+
+    def test_lecture_au_dela_d_une_fenetre_vide(self):
+        vide = [''] * len(HEADERS)
+        worksheet = FakeWorksheet([HEADERS, ligne(1)] + [vide] * 4 + [ligne(2)])
+
+        lignes = list(iterer_lignes(worksheet, 2, len(HEADERS), taille_page=2))
+
+        # La fenêtre A4:I5 est vide, la lecture continue jusqu'à row_count
+        self.assertEqual([numero for numero, valeurs in lignes if valeurs[0]], [2, 7])
+        self.assertEqual(worksheet.ranges_requested, ['A2:I3', 'A4:I5', 'A6:I7'])
+
+
+class IncrementalSyncTest(TestCase):
+
+    def setUp(self):
+        self.config = GoogleSheetConfig.objects.create(sheet_url='fake-sheet', sheet_name='Commandes')
+
+    def _sync(self, worksheet, **kwargs):
+        syncer = GoogleSheetSync(self.config, **kwargs)
+        with mock.patch.object(syncer, 'authenticate', return_value=object()), \
+                mock.patch.object(syncer, 'get_sheet', return_value=worksheet), \
+                mock.patch('builtins.print'):
+            self.assertTrue(syncer.sync())
+        self.config.refresh_from_db()
+        return syncer
+
+    def test_seules_les_nouvelles_lignes_sont_lues(self):
+        rows = [HEADERS] + [ligne(i) for i in range(1, 6)]
+        self._sync(FakeWorksheet(rows), batch_size=2)
+        self.assertEqual(self.config.last_processed_row, 6)
+        self.assertEqual(Commande.objects.count(), 5)
+
+        rows.append(ligne(6))
+        worksheet = FakeWorksheet(rows)
+        syncer = self._sync(worksheet, batch_size=2, rescan_window=0)
+
+        self.assertEqual(worksheet.ranges_requested, ['A7:I7'])
+        self.assertEqual(syncer.new_orders_created, 1)
+        self.assertEqual(self.config.last_processed_row, 7)
+        self.assertTrue(Commande.objects.filter(num_cmd='SYNC-6').exists())
+        self.assertEqual(SheetRowHash.objects.filter(sheet_config=self.config).count(), 6)
+
+    def test_lot_en_echec_arrete_la_lecture(self):
+        rows = [HEADERS] + [ligne(i) for i in range(1, 7)]
+        traiter_lot = GoogleSheetSync._process_batch
+
+        def echec_second_lot(syncer, lot, headers, **kwargs):
+            if lot[0][0] == 4:
+                return False
+            return traiter_lot(syncer, lot, headers, **kwargs)
+
+        with mock.patch.object(GoogleSheetSync, '_process_batch', autospec=True, side_effect=echec_second_lot) as lots:
+            self._sync(FakeWorksheet(rows), batch_size=2)
+
+        # Le troisième lot n'est pas traité : le checkpoint reste avant les lignes en échec
+        self.assertEqual(lots.call_count, 2)
+        self.assertEqual(self.config.last_processed_row, 3)
+        self.assertEqual(Commande.objects.count(), 2)
+
+        syncer = self._sync(FakeWorksheet(rows), batch_size=2, rescan_window=0)
+        self.assertEqual(syncer.new_orders_created, 4)
+        self.assertEqual(self.config.last_processed_row, 7)
+
+    def test_feuille_raccourcie_reprend_depuis_le_debut(self):
+        self._sync(FakeWorksheet([HEADERS] + [ligne(i) for i in range(1, 6)]))
+        self.assertEqual(self.config.last_processed_row, 6)
+
+        # Feuille vidée puis remplie avec moins de lignes que le point de reprise (la grille garde sa taille)
+        vide = [''] * len(HEADERS)
+        syncer = self._sync(FakeWorksheet([HEADERS] + [ligne(i) for i in range(10, 12)] + [vide] * 4), rescan_window=0)
+
+        self.assertEqual(syncer.new_orders_created, 2)
+        self.assertEqual(self.config.last_processed_row, 3)
+        self.assertTrue(Commande.objects.filter(num_cmd='SYNC-11').exists())
+
+    def test_ligne_deja_traitee_modifiee_est_resynchronisee(self):
+        rows = [HEADERS] + [ligne(i) for i in range(1, 6)]
+        self._sync(FakeWorksheet(rows))
+
+        rows[2] = ligne(2, statut='Confirmée')
+        syncer = self._sync(FakeWorksheet(rows), rescan_window=10)
+
+        self.assertEqual(syncer.rows_rescanned, 5)
+        self.assertEqual(syncer.modified_rows_resynced, 1)
+        self.assertEqual(syncer.new_orders_created, 0)
+        self.assertEqual(self.config.last_processed_row, 6)
+        commande = Commande.objects.get(num_cmd='SYNC-2')
+        self.assertEqual(commande.etat_courant.libelle, 'Confirmée')
+        self.assertEqual(commande.etats.count(), 2)
+
+
+class SyncJobTest(TestCase):
+
+    def setUp(self):
+        self.configs = [
+            GoogleSheetConfig.objects.create(sheet_url=f'fake-sheet-{i}', sheet_name=f'Commandes {i}')
+            for i in range(2)
+        ]
+
+    def test_lancement_rend_la_main_avec_un_job_id(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            job_id = lancer_synchronisations(self.configs, triggered_by='admin')
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(SyncLog.objects.filter(job_id=job_id, status='pending').count(), 2)
+        etat = etat_job(job_id)
+        self.assertFalse(etat['finished'])
+        self.assertEqual([config['sheet_name'] for config in etat['configs']], ['Commandes 0', 'Commandes 1'])
+
+    def test_log_abandonne_expire(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            job_id = lancer_synchronisations(self.configs, triggered_by='admin')
+        # Worker arrêté : le premier log n'a jamais été clôturé
+        abandonne = SyncLog.objects.filter(job_id=job_id).order_by('pk').first()
+        SyncLog.objects.filter(pk=abandonne.pk).update(sync_date=timezone.now() - timedelta(minutes=61))
+        SyncLog.objects.filter(job_id=job_id).exclude(pk=abandonne.pk).update(status='success')
+
+        etat = etat_job(job_id)
+
+        self.assertTrue(etat['finished'])
+        self.assertFalse(etat['success'])
+        self.assertEqual(etat['configs'][0]['status'], 'error')
+        self.assertEqual(etat['errors'], [f'Commandes 0: {MESSAGE_SYNC_INTERROMPUE}'])
+
+    def test_verrou_empeche_deux_synchronisations_simultanees(self):
+        config = self.configs[0]
+        verrou_pris = threading.Event()
+        liberer = threading.Event()
+
+        def tenir_verrou():
+            try:
+                with verrou_synchronisation(config.pk) as acquis:
+                    self.assertTrue(acquis)
+                    verrou_pris.set()
+                    liberer.wait(5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=tenir_verrou)
+        thread.start()
+        verrou_pris.wait(5)
+        try:
+            with mock.patch.object(GoogleSheetSync, 'sync') as sync:
+                sync_log = executer_synchronisation(config.pk, triggered_by='admin')
+            sync.assert_not_called()
+            self.assertEqual(sync_log.status, 'skipped')
+        finally:
+            liberer.set()
+            thread.join()
 
-# Create your tests here.
+        with verrou_synchronisation(config.pk) as acquis:
+            self.assertTrue(acquis)
@@ -1,9 +1,12 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.http import JsonResponse
 from .models import GoogleSheetConfig, SyncLog
 from .google_sheet_sync import GoogleSheetSync
+from .sheet_reader import lire_entetes
+from .jobs import MESSAGE_SYNC_EN_COURS, etat_job, lancer_synchronisations, verrou_synchronisation
 from django.utils import timezone
 from .forms import GoogleSheetConfigForm
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
@@ -48,9 +51,24 @@ def sync_now(request, config_id):
     """Déclenche une synchronisation manuelle avec vérifications en arrière-plan"""
     config = get_object_or_404(GoogleSheetConfig, pk=config_id, is_active=True)
     
-    # Créer une instance de synchronisation et l'exécuter (mode verbose pour diagnostiquer)
-    syncer = GoogleSheetSync(config, triggered_by=request.user.username, verbose=True)
-    success = syncer.sync()
+    # Créer une instance de synchronisation et l'exécuter (mode verbose pour diagnostiquer),
+    # sous le même verrou que les synchronisations en arrière-plan
+    with verrou_synchronisation(config.pk) as acquis:
+        if not acquis:
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return JsonResponse({
+                    'success': False,
+                    'sync_summary': MESSAGE_SYNC_EN_COURS,
+                    'notification_type': 'info',
+                    'notification_message': MESSAGE_SYNC_EN_COURS,
+                    'errors': [MESSAGE_SYNC_EN_COURS],
+                    'timestamp': timezone.now().strftime('%d/%m/%Y %H:%M:%S')
+                })
+            messages.info(request, MESSAGE_SYNC_EN_COURS)
+            return redirect('synchronisation:dashboard')
+
+        syncer = GoogleSheetSync(config, triggered_by=request.user.username, verbose=True)
+        success = syncer.sync()
     
     # Préparer le message de notification détaillé
     sync_summary = syncer.execution_details.get('sync_summary', 'Résumé non disponible')
@@ -104,53 +122,40 @@ def sync_now(request, config_id):
 @login_required
 @user_passes_test(is_admin)
 def sync_all(request):
-    """Déclenche la synchronisation de toutes les configurations actives."""
-    active_configs = GoogleSheetConfig.objects.filter(is_active=True)
-    
-    total_new_orders = 0
-    total_updated_orders = 0
-    total_skipped_orders = 0
-    total_duplicate_orders = 0
-    total_protected_orders = 0
-    total_errors = 0
-    all_errors = []
-    
-    for config in active_configs:
-        syncer = GoogleSheetSync(config, triggered_by=request.user.username, verbose=False)
-        syncer.sync()
-        
-        total_new_orders += syncer.new_orders_created
-        total_updated_orders += syncer.existing_orders_updated
-        total_skipped_orders += syncer.existing_orders_skipped
-        total_duplicate_orders += syncer.duplicate_orders_found
-        total_protected_orders += syncer.protected_orders_count
-        if syncer.errors:
-            total_errors += len(syncer.errors)
-            all_errors.extend(syncer.errors)
-            
-    summary = (
-        f"{len(active_configs)} configs traitées. "
-        f"Nouvelles commandes: {total_new_orders}, "
-        f"Mises à jour: {total_updated_orders}, "
-        f"Doublons: {total_duplicate_orders}, "
-        f"Protégées: {total_protected_orders}, "
-        f"Erreurs: {total_errors}."
-    )
-    
+    """Planifie la synchronisation en parallèle de toutes les configurations actives et rend la main immédiatement."""
+    active_configs = list(GoogleSheetConfig.objects.filter(is_active=True))
+    job_id = lancer_synchronisations(active_configs, triggered_by=request.user.username)
+
     return JsonResponse({
-        'success': total_errors == 0,
-        'message': 'Toutes les synchronisations actives ont été exécutées.',
-        'sync_summary': summary,
-        'new_orders_created': total_new_orders,
-        'existing_orders_updated': total_updated_orders,
-        'existing_orders_skipped': total_skipped_orders,
-        'duplicate_orders_found': total_duplicate_orders,
-        'protected_orders_count': total_protected_orders,
-        'errors': all_errors,
+        'success': True,
+        'job_id': job_id,
+        'status_url': reverse('synchronisation:sync_job_status', args=[job_id]),
+        'message': f'{len(active_configs)} synchronisation(s) lancée(s) en arrière-plan.',
         'timestamp': timezone.now().strftime('%d/%m/%Y %H:%M:%S')
     })
 
 
+@login_required
+@user_passes_test(is_admin)
+def sync_job_status(request, job_id):
+    """Avancement d'un job de synchronisation lancé par sync_all."""
+    etat = etat_job(job_id)
+    if etat is None:
+        return JsonResponse({'success': False, 'error': 'Job de synchronisation introuvable'}, status=404)
+
+    if etat['finished']:
+        etat['sync_summary'] = (
+            f"{len(etat['configs'])} configs traitées. "
+            f"Nouvelles commandes: {etat['new_orders_created']}, "
+            f"Mises à jour: {etat['existing_orders_updated']}, "
+            f"Doublons: {etat['duplicate_orders_found']}, "
+            f"Protégées: {etat['protected_orders_count']}, "
+            f"Erreurs: {len(etat['errors'])}."
+        )
+    etat['timestamp'] = timezone.now().strftime('%d/%m/%Y %H:%M:%S')
+    return JsonResponse(etat)
+
+
 @login_required
 def config_list(request):
     """Liste des configurations de synchronisation"""
@@ -390,9 +395,9 @@ def test_connection(request, config_id):
                 worksheet = spreadsheet.worksheet(test_sheet_name)
                 
                 # Récupérer quelques informations sur la feuille
-                all_values = worksheet.get_all_values()
-                total_rows = len(all_values)
-                headers = all_values[0] if all_values else []
+                # (en-têtes et première colonne seulement, sans télécharger toute la feuille)
+                headers = lire_entetes(worksheet)
+                total_rows = len(worksheet.col_values(1))
                 
                 return JsonResponse({
                     'success': True,